@@ -5,9 +5,20 @@
 version="0.8.0"
 container_name=d2r-backend:v${version}
 
+# --shm-size: tmpfs for the scratch directories of the SOLWEIG workers (default 64m)
 docker run --rm -d \
 -v <path-to-metfiles>/met_files/dummy_metfiles/:/usr/app/src/data/met_files \
 -v <path-to-static-data>:/usr/app/src/data \
 -v <path-to-results>/:/usr/app/src/results \
--u $(id -u ${USER}):$(id -g ${USER}) --memory=128g --cpus=32 $container_name
+-u $(id -u ${USER}):$(id -g ${USER}) --memory=128g --cpus=32 --shm-size=8g $container_name
 docker logs -f $(docker ps|grep $container_name |awk '{print $1}') &> <path-to-log-file>/OUTPUT_cron_${version}.log &
+
+# alternative: keep a long-lived container with the resident SOLWEIG worker service
+# and trigger the hourly processing inside of it (replace the docker run above)
+# docker run --rm -d --name d2r-backend-service \
+# -v <path-to-metfiles>/met_files/dummy_metfiles/:/usr/app/src/data/met_files \
+# -v <path-to-static-data>:/usr/app/src/data \
+# -v <path-to-results>/:/usr/app/src/results \
+# -u $(id -u ${USER}):$(id -g ${USER}) --memory=128g --cpus=32 --shm-size=8g \
+# --entrypoint python $container_name umep_wrapper/solweig_service.py serve
+# docker exec d2r-backend-service ./process_next_timestep.sh /usr/app/src/results/metfiles &>> <path-to-log-file>/OUTPUT_cron_${version}.log
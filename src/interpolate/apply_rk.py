@@ -11,6 +11,7 @@ import numpy as np
 import pandas as pd
 from krige import KrigeBiomet
 from regress import RegressionModelling
+from utils.product_encoding import get_encoding
 
 # SETTINGS
 # ========
@@ -20,6 +21,11 @@ N_STATIONS = 50  # Minimum number of stations for interpolation.
 R2_THRES = 0.50  # Minimum R2 score for regression.
 RESCORR = False  # Whether to apply residual correction.
 VARS = ["air_temperature", "relative_humidity"]  # The geoJSON variables to interpolate.
+# Storage encodings of the final GeoTIFFs (int16/uint16 with a scale of 0.01).
+ENCODINGS = {
+    "air_temperature": get_encoding("TA"),
+    "relative_humidity": get_encoding("RH"),
+}
 
 
 def _calc_scores(station_data: pd.DataFrame, pred: dict, var: str) -> dict:
@@ -201,7 +207,7 @@ def interpolate_biomet(
             scores = {}
             for var in vars:
                 savefile = str(savedir / fnames_out[var])
-                utils.create_geotiff(savefile, **output[var])
+                utils.create_geotiff(savefile, **output[var], encoding=ENCODINGS[var])
                 scores[var] = _calc_scores(data, output, var)
 
             output_meta["qc"] = int(
@@ -260,7 +266,7 @@ def interpolate_biomet(
 
             # Create the final GeoTIFFs.
             savefile = str(savedir / fnames_out[var])
-            utils.create_geotiff(savefile, **output[var])
+            utils.create_geotiff(savefile, **output[var], encoding=ENCODINGS[var])
 
     else:
         logging.critical(f"Covmodel fit failed (worfklow path: {wpath}).")
@@ -4,8 +4,8 @@ Helper functions for D2R's interpolation module.
 Functions:
 - correct_invalid_rh(rh: np.ndarray) -> np.ndarray:
     Apply sanity corrections to the RH predictions.
-- create_geotiff(savepath: str, arr: np.ndarray, geoTF: list, epsg: int, ndv=-9999):
-    Write a numpy array to a compressed GeoTIFF file.
+- create_geotiff(savepath: str, arr: np.ndarray, geoTF: list, epsg: int, ndv=-9999, encoding=None):
+    Write a numpy array to a compressed GeoTIFF file, optionally with a product encoding.
 - create_json(savepath: str, data: dict):
     Write a dictionary to a JSON file.
 - evaluate(true: np.ndarray, test: np.ndarray) -> dict:
@@ -25,6 +25,7 @@ import pandas as pd
 from osgeo import gdal
 from scipy.stats import pearsonr
 from sklearn import metrics
+from utils.product_encoding import write_band
 
 # We call gdal.UseExceptions() to raise exceptions instead of
 # returning error codes like None. See here: https://gdal.org/api/python_gotchas.html
@@ -47,6 +48,8 @@ def create_geotiff(savepath: str, **kwargs):
     crs = kwargs["crs"]
     geoTF = kwargs["geoTF"]
     ndv = kwargs.get("ndv", -9999)
+    # storage encoding of a published product, see utils/product_encoding.py
+    encoding = kwargs.get("encoding")
 
     driver = gdal.GetDriverByName("GTiff")
 
@@ -55,7 +58,7 @@ def create_geotiff(savepath: str, **kwargs):
         xsize=arr.shape[2],
         ysize=arr.shape[1],
         bands=arr.shape[0],
-        eType=gdal.GDT_Float32,
+        eType=gdal.GDT_Float32 if encoding is None else encoding.gdal_dtype,
         options=["COMPRESS=DEFLATE", "BIGTIFF=IF_NEEDED"],
     )
     gtiff.SetGeoTransform(geoTF)
@@ -64,6 +67,9 @@ def create_geotiff(savepath: str, **kwargs):
     try:
         for i in range(arr.shape[0]):
             band = gtiff.GetRasterBand(i + 1)
+            if encoding is not None:
+                write_band(band, arr[i, ...], encoding, nodata=ndv)
+                continue
             band.WriteArray(arr[i, ...].astype(np.float32))
             band.SetNoDataValue(ndv)
     except:
@@ -16,6 +16,7 @@ from osgeo import gdal
 libPath = "../../utils"
 if not libPath in sys.path:
     sys.path.append(libPath)
+from utils.product_encoding import read_band
 from utils.save_raster import saveraster
 
 if __name__ == "__main__":
@@ -26,7 +27,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     src = gdal.Open(args.file, gdal.GA_ReadOnly)
-    dst = np.nan_to_num(src.ReadAsArray(), nan=args.ndv)
+    # the interpolation results are stored encoded, see utils/product_encoding.py
+    dst = np.nan_to_num(read_band(src.GetRasterBand(1)), nan=args.ndv)
 
     output_location = args.file.split(".")[0] + "_ndv.tif"
 
@@ -138,44 +138,64 @@ python utils/load_metfile.py --input=${metfile_location} \
 metfile_forcing="${savedir}/metfile_${proc_path}_${year}-${month}-${day}_${hour}00.txt"
 
 
-python umep_wrapper/solweig_multi_processing.py --data_path=/usr/app/src/data \
-    --dsm_folder=3m/DTM+masked_DSM_tiles_3m/DTM+DSM_3m_tiles_1000+200 \
-    --dtm_folder=3m/DTM_tiles_3m/DTM_3m_tiles_1000+200 \
-    --met_file=${metfile_forcing} \
-    --cdsm_folder=3m/canopy_DSM_3m/canopy_DSM_3m_tiles_1000+200 \
-    --preprocess_data_path=/usr/app/src/data/3m/SOLWEIG_prepare_3m/SOLWEIG_prepare_3m_1000+200 \
-    --lc_folder=3m/land_cover_3m/lc_3m_tiles_1000+200 \
-    --output_path=${resultdir} \
+# the decoded static inputs are used for tiles that were built into the store with
+# umep_wrapper/static_store.py, all other tiles read the compressed rasters
+# Note: --night_mode (umep_wrapper/nocturnal.py) stays off until its Tmrt has been
+# validated against full SOLWEIG runs with the harness of nocturnal.py
+solweig_args=(
+    --data_path=/usr/app/src/data
+    --dsm_folder=3m/DTM+masked_DSM_tiles_3m/DTM+DSM_3m_tiles_1000+200
+    --dtm_folder=3m/DTM_tiles_3m/DTM_3m_tiles_1000+200
+    --met_file=${metfile_forcing}
+    --cdsm_folder=3m/canopy_DSM_3m/canopy_DSM_3m_tiles_1000+200
+    --preprocess_data_path=/usr/app/src/data/3m/SOLWEIG_prepare_3m/SOLWEIG_prepare_3m_1000+200
+    --lc_folder=3m/land_cover_3m/lc_3m_tiles_1000+200
+    --output_path=${resultdir}
+    --static_store=/usr/app/src/data/3m/static_store_3m_1000+200
+    --mosaic_path=${resultdir}/SOLWEIG_3m_1000+200/mosaic
     --proj_lib=/usr/share/proj
+)
+
+# use the resident SOLWEIG worker service if it was started within the container,
+# otherwise (or if nothing listens on a socket left behind by a killed service)
+# spawn a new process pool for this hour
+solweig_service_socket=${SOLWEIG_SERVICE_SOCKET:-/tmp/solweig_service.sock}
+solweig_status=3  # SERVICE_UNAVAILABLE of solweig_service.py
+if [ -S "$solweig_service_socket" ]; then
+  python umep_wrapper/solweig_service.py submit --socket=${solweig_service_socket} \
+    "${solweig_args[@]}"
+  solweig_status=$?
+fi
+if [ $solweig_status -eq 3 ]; then
+  echo "INFO: SOLWEIG service unavailable, running a new process pool"
+  python umep_wrapper/solweig_multi_processing.py "${solweig_args[@]}"
+fi
 
 
-# remove all temporary folders created during the SOLWEIG run
-rm -r /usr/app/UMEP-processing-fork/temp*
-
-# rename tile-wise SOLWEIG results, since they all have the same name, create mosaic cannot read them properly all together
-for f in ${resultdir}/SOLWEIG_3m_1000+200/temp_tiles/*/Tmrt_"$year"_"$doy"_"$hour"00*.tif
-do
-    DIR=$(dirname "$f")
-    FILE=$(basename "$f")
-    FOLDER=$(basename $(basename $(dirname "$f")))
-    # F_NEW="${FOLDER}_${FILE}"
-    suffix=$(echo ${FILE} | cut -d "_" -f 4)
-    F_NEW="${FOLDER}_Tmrt_${RESOLUTION}_${PIPELINE_VERSION}_${year}_${doy_long}_${suffix}"
-    echo "mv ${f} ${DIR}/${F_NEW}"
-    mv $f "${DIR}/${F_NEW}"
-done
-# Note: SOLWEIG sets NoDataValue to -9999, for the following processing we use -32768 as NDV
+# the workers write their intermediate files to private scratch directories on
+# /dev/shm, which are removed by the run (also those of killed workers, see
+# umep_wrapper/scratch.py). SOLWEIG of the UMEP fork only takes the svfs.zip and
+# unpacks it into temporary folders next to its own sources, which cannot be
+# redirected to the scratch and are removed here.
+rm -rf /usr/app/UMEP-processing-fork/temp*
 
-# run mosaicing on tmp_dir and create mosaiced file in specific output directory
-# "Usage: create_mosaic.sh [tiledir] [savename] [size] [overlap] [portion]"
-bash ./utils/create_mosaic.sh ${resultdir}/SOLWEIG_3m_1000+200/temp_tiles/ /${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif 1000 200 *Tmrt_${RESOLUTION}_${PIPELINE_VERSION}_"$year"_"$doy_long"_"$hour"00*.tif
+# the workers wrote the core windows of their tiles directly into the city-wide
+# mosaic (see umep_wrapper/mosaic_writer.py), it is cropped to the city boundaries
+# and stored as GeoTIFF (input of the indices) and as COG in one pass
+# Note: SOLWEIG sets NoDataValue to -9999, the mosaic uses -32768 as NDV
+city_boundary=utils/DO_ADMIN_EPSG25832.geojson
+mask_cache=/usr/app/src/data/3m/city_mask_3m  # rasterized boundary per grid
+filename_tmrt=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
+python umep_wrapper/postprocess.py --boundary=${city_boundary} \
+  --mask_cache=${mask_cache} \
+  --product MRT ${resultdir}/SOLWEIG_3m_1000+200/mosaic/Tmrt_"$year"_"$doy"_"$hour"00.bsq \
+    ${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif \
+    ${filename_tmrt}
 
 if false; then
     # remove all intermediate files
     # Note: placeholder for hour because our SOLWEIG runs consider two hours, one warm-up and one
     # requested hour. So we have to remove both created Tmrt files to clean up.
-    # Thought: It would be nice to recycle already calculated Tmrt maps for a tile for the next
-    # hour, but this requires internal changes within the SOLWEIG module, which we avoid.
     for f in ${resultdir}/SOLWEIG_3m_1000+200/temp_tiles/*/*Tmrt_"$year"_"$doy"_*00*.tif
     do
         rm $f
@@ -184,14 +204,6 @@ else
     echo "INFO: keeping intermediate files .."
 fi
 
-# crop rasters to city boundaries
-# MRT raster
-filename_tmrt=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-filename_tmrt_crop=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_crop.tif
-bash ./utils/apply_cutline.sh $filename_tmrt $filename_tmrt_crop utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-rm $filename_tmrt
-mv $filename_tmrt_crop $filename_tmrt
-
 # ---- ALIGN NWP RASTERS ----
 # if processing path was defined to use ICON NWP data in the beginning
 
@@ -232,21 +244,8 @@ if [ $proc_path == "3.0" ]; then
   echo "INFO: air temp raster is at ${ta_raster_file_name}"
   python utils/convert_K_to_C.py -i ${ta_raster_file_name} -o ${ta_raster_file_name}
 
-  # and crop to city boundaries
-
-  # nwp t_2m raster
-  filename_tair=${ta_raster_file_name}
-  filename_tair_crop=${file_location}/nwp-${timestamp}-band${band}-t_2m_crop.tif
-  bash ./utils/apply_cutline.sh $filename_tair $filename_tair_crop utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-  rm $filename_tair
-  mv $filename_tair_crop $filename_tair
-
-  # nwp relhum_2m raster
-  filename_rh=${rh_raster_file_name}
-  filename_rh_crop=${file_location}/nwp-${timestamp}-band${band}-relhum_2m_crop.tif
-  bash ./utils/apply_cutline.sh $filename_rh $filename_rh_crop utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-  rm $filename_rh
-  mv $filename_rh_crop $filename_rh
+  # the aligned rasters share the grid of the cropped MRT raster, they are masked
+  # to the city boundaries when their COGs are written
 fi
 # ---- END ALIGNMENT ----
 
@@ -257,78 +256,53 @@ fi
 python umep_wrapper/calculate_tc_indices.py \
   --index="UTCI" \
   --metfile=${metfile_forcing} \
-  --input_tmrt=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif \
+  --input_tmrt=${filename_tmrt} \
   --output_dir=${resultdir}/UTCI \
+  --class_output_dir=${resultdir}/UTCI_CLASS \
   --input_tair=${ta_raster_file_name} \
   --input_rh=${rh_raster_file_name} \
 
 python umep_wrapper/calculate_tc_indices.py \
   --index="PET" \
   --metfile=${metfile_forcing} \
-  --input_tmrt=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif \
+  --input_tmrt=${filename_tmrt} \
   --output_dir=${resultdir}/PET \
+  --class_output_dir=${resultdir}/PET_CLASS \
   --input_tair=${ta_raster_file_name} \
   --input_rh=${rh_raster_file_name} \
 
 
-# crop rasters to city boundaries
-# UTCI value raster
-filename_umep=${resultdir}/UTCI/DO_UTCI_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-filename_crop=${resultdir}/UTCI/DO_UTCI_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_crop.tif
-bash ./utils/apply_cutline.sh $filename_umep $filename_crop utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-rm $filename_umep
-mv $filename_crop $filename_umep
-
-# UTCI classified raster (shift to UTCI_CLASS dir)
-filename_umep_class=${resultdir}/UTCI/DO_UTCI-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-filename_crop_class=${resultdir}/UTCI/DO_UTCI-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_crop.tif
-filename_umep_class_new=${resultdir}/UTCI_CLASS/DO_UTCI-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-bash ./utils/apply_cutline.sh $filename_umep_class $filename_crop_class utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-rm $filename_umep_class
-mv $filename_crop_class $filename_umep_class_new
-
-# PET value raster
-filename_pet=${resultdir}/PET/DO_PET_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-filename_crop=${resultdir}/PET/DO_PET_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_crop.tif
-bash ./utils/apply_cutline.sh $filename_pet $filename_crop utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-rm $filename_pet
-mv $filename_crop $filename_pet
-
-# PET classified raster (shift to PET_CLASS dir)
-filename_pet_class=${resultdir}/PET/DO_PET-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-filename_crop_class=${resultdir}/PET/DO_PET-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_crop.tif
-filename_pet_class_new=${resultdir}/PET_CLASS/DO_PET-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
-bash ./utils/apply_cutline.sh $filename_pet_class $filename_crop_class utils/DO_ADMIN_EPSG25832.geojson -crop_to_cutline
-rm $filename_pet_class
-mv $filename_crop_class $filename_pet_class_new
-
-
-# create COG (LZW compression is used as default)
-# UTCI values
-filename_cog=${resultdir}/UTCI/DO_UTCI_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG $filename_umep $filename_cog
-# UTCI classes, use different resampling method here
-filename_cog_class=${resultdir}/UTCI_CLASS/DO_UTCI-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG -co RESAMPLING=NEAREST $filename_umep_class_new $filename_cog_class
-
-# PET values
-filename_cog=${resultdir}/PET/DO_PET_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG $filename_pet $filename_cog
-# PET classes, use different resampling method here
-filename_cog_class=${resultdir}/PET_CLASS/DO_PET-class_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG -co RESAMPLING=NEAREST $filename_pet_class_new $filename_cog_class
-
-# t_2m
-filename_cog=${resultdir}/TA/DO_TA_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG $ta_raster_file_name $filename_cog
+# crop all products to the city boundaries and create the COGs (LZW compression) in a
+# single pass, the classes use nearest neighbour resampling for the overviews
+# Note: the cropped index GeoTIFFs replace the uncropped ones, TA and RH are left as is
+# the XYZ web map tiles of the dashboard (UTCI, UTCI-class) are rendered from the
+# same arrays, only changed tiles are written; set tile_dir empty to skip them
+tile_dir=${resultdir}/tiles
+suffix=${year}_${doy_long}_${hour}_${PIPELINE_VERSION}
+products=""
+for index in UTCI PET; do
+  products+=" --product ${index} ${resultdir}/${index}/DO_${index}_${suffix}.tif"
+  products+=" ${resultdir}/${index}/DO_${index}_${suffix}_cog.tif"
+  products+=" ${resultdir}/${index}/DO_${index}_${suffix}.tif"
+  products+=" --product ${index}-class ${resultdir}/${index}_CLASS/DO_${index}-class_${suffix}.tif"
+  products+=" ${resultdir}/${index}_CLASS/DO_${index}-class_${suffix}_cog.tif"
+  products+=" ${resultdir}/${index}_CLASS/DO_${index}-class_${suffix}.tif"
+done
+python umep_wrapper/postprocess.py --boundary=${city_boundary} \
+  --mask_cache=${mask_cache} ${products} ${tile_dir:+--tile_dir=${tile_dir}} \
+  --product TA ${ta_raster_file_name} ${resultdir}/TA/DO_TA_${suffix}_cog.tif \
+  --product RH ${rh_raster_file_name} ${resultdir}/RH/DO_RH_${suffix}_cog.tif
+
+# append the hour to the datacube archive, which serves point and area time series
+# without opening a COG per hour (see umep_wrapper/datacube.py)
+datacube=${resultdir}/datacube/DO_datacube_${PIPELINE_VERSION}.zarr
+cube_products=""
+for var in MRT UTCI PET TA RH; do
+  cube_products+=" --product ${var} ${resultdir}/${var}/DO_${var}_${suffix}_cog.tif"
+done
+python umep_wrapper/datacube.py --cube=${datacube} \
+  --time=${year}_${doy_long}_${hour} ${cube_products}
+
 # add entry to data sources log (source: either DWD or DWD+Stat)
 echo "DO;TA;${year};${doy_long};${hour};${PIPELINE_VERSION};${proc_path};" >> ${resultdir}/TA/ta_data_sources.log
-# relhum_2m
-filename_cog=${resultdir}/RH/DO_RH_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG $rh_raster_file_name $filename_cog
-# add entry to data sources log (source: either DWD or DWD+Stat)
 echo "DO;RH;${year};${doy_long};${hour};${PIPELINE_VERSION};${proc_path};" >> ${resultdir}/RH/rh_data_sources.log
-
-# MRT
-filename_cog=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}_cog.tif
-gdal_translate -of COG $filename_tmrt $filename_cog
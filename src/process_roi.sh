@@ -0,0 +1,85 @@
+#!/bin/bash
+
+# this version has to match the one of process_next_timestep.sh
+PIPELINE_VERSION="v0.8.0"
+
+if [ "$1" == "--help" ] || [ $# -lt 7 ]; then
+  echo "Usage: process_roi.sh [roi] [metfile] [year] [doy] [hour] [tair] [rh]"
+  echo
+  echo "Recomputes Tmrt, UTCI and PET within a region of interest (e.g. a festival area)"
+  echo "and patches them into the existing city-wide rasters of the hour."
+  echo
+  echo "Arguments:"
+  echo "  roi: GeoJSON file or bounding box 'xmin,ymin,xmax,ymax' in EPSG:25832"
+  echo "  metfile: The SOLWEIG metfile of the hour, e.g. as written by process_next_timestep.sh"
+  echo "  year: The year of the hour"
+  echo "  doy: The day of year of the hour, with leading zeros (e.g. 093)"
+  echo "  hour: The hour (e.g. 07)"
+  echo "  tair: The air temperature raster of the hour (in C)"
+  echo "  rh: The relative humidity raster of the hour"
+  exit 0
+fi
+
+roi=$1
+metfile_forcing=$2
+year=$3
+doy_long=$4
+doy=${doy_long#${doy_long%%[1-9]*}}  # without leading zero
+hour=$5
+ta_raster_file_name=$6
+rh_raster_file_name=$7
+resultdir="/usr/app/src/results"
+
+# recompute the tiles within the ROI, the workers write them into the mosaic of the hour
+python umep_wrapper/solweig_multi_processing.py --data_path=/usr/app/src/data \
+    --dsm_folder=3m/DTM+masked_DSM_tiles_3m/DTM+DSM_3m_tiles_1000+200 \
+    --dtm_folder=3m/DTM_tiles_3m/DTM_3m_tiles_1000+200 \
+    --met_file=${metfile_forcing} \
+    --cdsm_folder=3m/canopy_DSM_3m/canopy_DSM_3m_tiles_1000+200 \
+    --preprocess_data_path=/usr/app/src/data/3m/SOLWEIG_prepare_3m/SOLWEIG_prepare_3m_1000+200 \
+    --lc_folder=3m/land_cover_3m/lc_3m_tiles_1000+200 \
+    --output_path=${resultdir} \
+    --static_store=/usr/app/src/data/3m/static_store_3m_1000+200 \
+    --mosaic_path=${resultdir}/SOLWEIG_3m_1000+200/mosaic \
+    --roi=${roi} \
+    --proj_lib=/usr/share/proj || exit 1
+
+# patch the city-wide (cropped) MRT raster within the ROI
+filename_tmrt=${resultdir}/MRT/DO_MRT_${year}_${doy_long}_${hour}_${PIPELINE_VERSION}.tif
+python umep_wrapper/roi.py --roi=${roi} \
+  --source=${resultdir}/SOLWEIG_3m_1000+200/mosaic/Tmrt_"$year"_"$doy"_"$hour"00.bsq \
+  --target=${filename_tmrt} || exit 1
+
+# recalculate the thermal comfort indices within the ROI
+for index in UTCI PET; do
+  python umep_wrapper/calculate_tc_indices.py \
+    --index=${index} \
+    --metfile=${metfile_forcing} \
+    --input_tmrt=${filename_tmrt} \
+    --output_dir=${resultdir}/${index} \
+    --class_output_dir=${resultdir}/${index}_CLASS \
+    --input_tair=${ta_raster_file_name} \
+    --input_rh=${rh_raster_file_name} \
+    --roi=${roi} || exit 1
+done
+
+# refresh the published COGs and the changed web map tiles of the patched rasters
+suffix=${year}_${doy_long}_${hour}_${PIPELINE_VERSION}
+python umep_wrapper/postprocess.py --boundary=utils/DO_ADMIN_EPSG25832.geojson \
+  --mask_cache=/usr/app/src/data/3m/city_mask_3m \
+  --tile_dir=${resultdir}/tiles \
+  --product MRT ${filename_tmrt} ${resultdir}/MRT/DO_MRT_${suffix}_cog.tif \
+  --product UTCI ${resultdir}/UTCI/DO_UTCI_${suffix}.tif ${resultdir}/UTCI/DO_UTCI_${suffix}_cog.tif \
+  --product UTCI-class ${resultdir}/UTCI_CLASS/DO_UTCI-class_${suffix}.tif \
+    ${resultdir}/UTCI_CLASS/DO_UTCI-class_${suffix}_cog.tif \
+  --product PET ${resultdir}/PET/DO_PET_${suffix}.tif ${resultdir}/PET/DO_PET_${suffix}_cog.tif \
+  --product PET-class ${resultdir}/PET_CLASS/DO_PET-class_${suffix}.tif \
+    ${resultdir}/PET_CLASS/DO_PET-class_${suffix}_cog.tif || exit 1
+
+# replace the hour in the datacube archive
+python umep_wrapper/datacube.py \
+  --cube=${resultdir}/datacube/DO_datacube_${PIPELINE_VERSION}.zarr \
+  --time=${year}_${doy_long}_${hour} \
+  --product MRT ${resultdir}/MRT/DO_MRT_${suffix}_cog.tif \
+  --product UTCI ${resultdir}/UTCI/DO_UTCI_${suffix}_cog.tif \
+  --product PET ${resultdir}/PET/DO_PET_${suffix}_cog.tif || exit 1
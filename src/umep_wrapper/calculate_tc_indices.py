@@ -15,8 +15,11 @@ from thermal_comfort import pet_static, utci_approx
 libPath = "../../utils"
 if not libPath in sys.path:
     sys.path.append(libPath)
+from utils.product_encoding import get_encoding, read_band
 from utils.save_raster import saveraster
 
+from umep_wrapper.roi import get_roi_window, rasterize_roi, read_roi, write_window
+
 gdal.UseExceptions()
 
 # A 'default person' given by the DWD
@@ -100,11 +103,16 @@ def calculate_index_for_file(
     output_dir: str,
     input_wind: str = None,
     also_save_class_raster: bool = True,
+    roi: str = None,
+    class_output_dir: str = None,
 ):
     """
     Calculates Index maps for a single Tmrt file, matching wind field file and a given
     weather data file
 
+    If a region of interest is given, the index is only calculated within the ROI
+    and patched into the existing index maps of the hour (see roi.py).
+
     Args:
         index (str): 'PET' or 'UTCI'
         input_tmrt (str): path to input directory containing tmrt raster
@@ -114,6 +122,9 @@ def calculate_index_for_file(
         output_dir (str): path to directory where to save results to
         input_wind (str): path to input directory containing wind speed raster
         also_save_class_raster (bool): whether to also save raster as classified raster
+        roi (str): GeoJSON file or bounding box 'xmin,ymin,xmax,ymax' (optional)
+        class_output_dir (str): directory of the classified raster, defaults to
+            output_dir (optional)
     """
     print("calculate_index_for_file")
     df = pd.read_csv(metfile, sep=" ")
@@ -135,7 +146,18 @@ def calculate_index_for_file(
     selected_entry = entry.iloc[0]
 
     raster = gdal.Open(input_tmrt, gdal.GA_ReadOnly)
-    tmrt_raster = raster.ReadAsArray()  # read(1)
+    window = None
+    roi_mask = None
+    if roi is not None:
+        geometry = read_roi(roi, raster.GetProjection())
+        window = get_roi_window(geometry, raster)
+        if window is None:
+            print(f"ROI {roi} is outside of {input_tmrt}, nothing to do.")
+            return
+        roi_mask = rasterize_roi(
+            geometry, raster.GetGeoTransform(), raster.GetProjection(), window
+        )
+    tmrt_raster = _read_raster(input_tmrt, window)
 
     # replace NO_DATA_VALUE with nan
     tmrt_raster[tmrt_raster == NO_DATA_VALUE] = np.nan
@@ -145,7 +167,7 @@ def calculate_index_for_file(
 
     # read raster data
     if input_tair is not None:
-        tair_raster = gdal.Open(input_tair, gdal.GA_ReadOnly).ReadAsArray()
+        tair_raster = _read_raster(input_tair, window)
         tair_raster[tair_raster == NO_DATA_VALUE] = np.nan
     else:
         tair_raster = np.ones((rows, cols)) * selected_entry["Tair"]
@@ -155,14 +177,14 @@ def calculate_index_for_file(
         )
 
     if input_rh is not None:
-        rh_raster = gdal.Open(input_rh, gdal.GA_ReadOnly).ReadAsArray()
+        rh_raster = _read_raster(input_rh, window)
         rh_raster = np.clip(rh_raster, 0, 100)
         rh_raster[rh_raster == NO_DATA_VALUE] = np.nan
     else:
         rh_raster = np.ones((rows, cols)) * selected_entry["RH"]
 
     if input_wind is not None:
-        windspeed_10m_raster = gdal.Open(input_wind, gdal.GA_ReadOnly).ReadAsArray()
+        windspeed_10m_raster = _read_raster(input_wind, window)
     else:
         windspeed_10m_raster = np.ones((rows, cols)) * selected_entry["U"]
 
@@ -205,16 +227,32 @@ def calculate_index_for_file(
     thermal_comfort_index[np.isnan(thermal_comfort_index)] = NO_DATA_VALUE
 
     _save_output(
-        thermal_comfort_index, index, input_tmrt, output_dir, also_save_class_raster
+        thermal_comfort_index,
+        index,
+        input_tmrt,
+        output_dir,
+        also_save_class_raster,
+        window,
+        class_output_dir,
+        roi_mask,
     )
 
 
+def _read_raster(input_filepath: str, window: tuple = None) -> np.ndarray:
+    """Reads the decoded first band of a raster, optionally only a window of it."""
+    band = gdal.Open(input_filepath, gdal.GA_ReadOnly).GetRasterBand(1)
+    return read_band(band, window)
+
+
 def _save_output(
     thermal_comfort_index: np.array,
     index: str,
     input_filepath: str,
     output_dir: str,
     also_save_class_raster: bool,
+    window: tuple = None,
+    class_output_dir: str = None,
+    roi_mask: np.ndarray = None,
 ):
     """
     Save a raster to a filepath matching the given input filepath.
@@ -225,6 +263,14 @@ def _save_output(
         input_filepath (str): path to input reference raster, i.e tmrt raster
         output_dir (str): path to directory where to save results to
         also_save_class_raster (bool): whether to also save raster as classified raster
+        window (tuple): xoff, yoff, xsize, ysize of the ROI, the existing rasters
+            are patched within this window (optional)
+        class_output_dir (str): directory of the classified raster (optional)
+        roi_mask (ndarray): pixels of the window within the ROI, only these are
+            patched (optional, see roi.rasterize_roi)
+
+    Raises:
+        FileNotFoundError: thrown if a raster to patch does not exist
     """
 
     # get georeference
@@ -248,7 +294,16 @@ def _save_output(
 
     output_location = os.path.join(dirname, output_file_name)
 
-    saveraster(gdal_tmrt_map, output_location, thermal_comfort_index)
+    if window is not None:
+        _patch_output(output_location, thermal_comfort_index, window, roi_mask)
+    else:
+        saveraster(
+            gdal_tmrt_map,
+            output_location,
+            thermal_comfort_index,
+            nodata=NO_DATA_VALUE,
+            encoding=get_encoding(variable),
+        )
 
     print(f"Saved {index} map at: {output_location}")
 
@@ -267,12 +322,40 @@ def _save_output(
         # derive output filename from basename
         output_file_name = "DO_" + variable + "-class_" + file_suffix + ".tif"
 
-        output_location = os.path.join(dirname, output_file_name)
+        if class_output_dir is not None and window is None:
+            os.makedirs(class_output_dir, exist_ok=True)
+        output_location = os.path.join(class_output_dir or dirname, output_file_name)
 
-        saveraster(gdal_tmrt_map, output_location, thermal_comfort_index_class)
+        if window is not None:
+            _patch_output(
+                output_location, thermal_comfort_index_class, window, roi_mask
+            )
+        else:
+            saveraster(
+                gdal_tmrt_map,
+                output_location,
+                thermal_comfort_index_class,
+                nodata=NO_DATA_VALUE,
+                encoding=get_encoding(variable + "-class"),
+            )
         print(f"Saved {index}-class map at: {output_location}")
 
 
+def _patch_output(
+    output_location: str, values: np.ndarray, window: tuple, mask: np.ndarray = None
+) -> None:
+    """
+    Patches the window (within the mask) of an existing index map, NO_DATA_VALUE is
+    not written.
+    """
+    if not os.path.exists(output_location):
+        raise FileNotFoundError(
+            f"{output_location} does not exist, run the whole city for this hour first."
+        )
+    values = np.where(values == NO_DATA_VALUE, np.nan, values.astype(float))
+    write_window(output_location, values, window, mask)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--index", help='Choose from ["PET", "UTCI"].')
@@ -284,6 +367,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "--output_dir", help="Full path to output directory to store the result."
     )
+    parser.add_argument(
+        "--class_output_dir",
+        help="Full path to output directory of the classified result (optional).",
+    )
+    parser.add_argument(
+        "--roi",
+        help="GeoJSON file or bounding box 'xmin,ymin,xmax,ymax', patches the "
+        "existing maps of the hour within the region of interest (optional).",
+    )
 
     args = vars(parser.parse_args())
 
@@ -297,4 +389,6 @@ if __name__ == "__main__":
         input_wind=args["input_wind"],
         metfile=args["metfile"],
         output_dir=args["output_dir"],
+        roi=args["roi"],
+        class_output_dir=args["class_output_dir"],
     )
@@ -0,0 +1,176 @@
+"""
+This file holds the cache of the rasterized city boundary.
+
+Every published product is masked with the city boundary and cropped to it (see
+postprocess.py). The boundary is rasterized once per target grid and stored
+bit-packed, keyed by the geotransform, the shape, the CRS and a hash of the
+boundary file, e.g. for the 3 m Dortmund grid:
+
+    <cache_dir>/city_mask_<key>.npz
+
+Masking and cropping a product then reduces to reading the crop window and a
+NumPy indexing operation with the cached mask.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+from osgeo import gdal
+
+from umep_wrapper.roi import get_roi_window, rasterize_roi, read_roi
+
+gdal.UseExceptions()
+
+# has to be increased if the rasterization changes, invalidates cached masks
+MASK_CACHE_VERSION = 1
+
+
+def _hash_file(path: str) -> str:
+    """SHA-256 of the content of a file."""
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_mask_key(
+    boundary: str,
+    geotransform: tuple[float, ...],
+    width: int,
+    height: int,
+    projection: str,
+) -> str:
+    """
+    Get the cache key of the mask of a boundary on a grid.
+
+    Args:
+        boundary (str): path to the GeoJSON file of the city boundary
+        geotransform (tuple): geotransform of the grid
+        width (int): width of the grid in pixels
+        height (int): height of the grid in pixels
+        projection (str): WKT of the grid CRS
+
+    Returns:
+        hex digest identifying the mask
+    """
+    key = hashlib.sha256()
+    key.update(str(MASK_CACHE_VERSION).encode())
+    key.update(_hash_file(boundary).encode())
+    key.update(repr(tuple(float(value) for value in geotransform)).encode())
+    key.update(f"{width}x{height}".encode())
+    key.update(projection.encode())
+    return key.hexdigest()[:32]
+
+
+def rasterize_boundary(
+    boundary: str,
+    geotransform: tuple[float, ...],
+    width: int,
+    height: int,
+    projection: str,
+) -> tuple[np.ndarray, tuple[int, int, int, int]]:
+    """
+    Rasterize the city boundary on a grid.
+
+    As with gdalwarp -cutline, a pixel is within the city if its center is.
+
+    Args:
+        boundary (str): path to the GeoJSON file of the city boundary
+        geotransform (tuple): geotransform of the grid
+        width (int): width of the grid in pixels
+        height (int): height of the grid in pixels
+        projection (str): WKT of the grid CRS
+
+    Returns:
+        the mask within the crop window and xoff, yoff, xsize, ysize of the window
+
+    Raises:
+        ValueError: thrown if the boundary does not intersect the grid
+    """
+    # the grid without bands, only its extent is needed
+    dataset = gdal.GetDriverByName("MEM").Create("", width, height, 0)
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(projection)
+
+    geometry = read_roi(boundary, projection)
+    window = get_roi_window(geometry, dataset)
+    if window is None:
+        raise ValueError(f"City boundary {boundary} does not intersect the raster.")
+    return rasterize_roi(geometry, geotransform, projection, window), window
+
+
+def save_mask(path: str, mask: np.ndarray, window: tuple[int, int, int, int]) -> None:
+    """
+    Store a mask bit-packed, readers never see a partial file.
+
+    Args:
+        path (str): path of the .npz file
+        mask (ndarray): boolean mask within the crop window
+        window (tuple): xoff, yoff, xsize, ysize of the crop window
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        packed=np.packbits(mask, axis=None),
+        shape=np.array(mask.shape),
+        window=np.array(window),
+    )
+    os.replace(tmp_path, path)
+
+
+def load_mask(path: str) -> tuple[np.ndarray, tuple[int, int, int, int]]:
+    """
+    Load a bit-packed mask, see save_mask.
+
+    Args:
+        path (str): path of the .npz file
+
+    Returns:
+        the mask within the crop window and xoff, yoff, xsize, ysize of the window
+    """
+    with np.load(path) as data:
+        shape = tuple(int(value) for value in data["shape"])
+        mask = np.unpackbits(data["packed"], count=shape[0] * shape[1])
+        window = tuple(int(value) for value in data["window"])
+    return mask.reshape(shape).astype(bool), window
+
+
+@lru_cache(maxsize=None)
+def get_city_mask(
+    boundary: str,
+    geotransform: tuple[float, ...],
+    width: int,
+    height: int,
+    projection: str,
+    cache_dir: str = None,
+) -> tuple[np.ndarray, tuple[int, int, int, int]]:
+    """
+    Get the mask of the city boundary on a grid, rasterized once per grid.
+
+    Args:
+        boundary (str): path to the GeoJSON file of the city boundary
+        geotransform (tuple): geotransform of the grid
+        width (int): width of the grid in pixels
+        height (int): height of the grid in pixels
+        projection (str): WKT of the grid CRS
+        cache_dir (str): folder of the cached masks, only cached within the
+            process if not given (optional)
+
+    Returns:
+        the read-only mask within the crop window and xoff, yoff, xsize, ysize of
+        the window
+    """
+    grid = (boundary, geotransform, width, height, projection)
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, f"city_mask_{get_mask_key(*grid)}.npz")
+
+    if cache_file is not None and os.path.exists(cache_file):
+        mask, window = load_mask(cache_file)
+    else:
+        mask, window = rasterize_boundary(*grid)
+        if cache_file is not None:
+            save_mask(cache_file, mask, window)
+    mask.flags.writeable = False
+    return mask, window
@@ -0,0 +1,614 @@
+"""
+This file holds the hourly datacube archive of the published products.
+
+Besides the per-hour COGs, the hourly MRT, UTCI, PET, TA and RH rasters are
+appended to a datacube, so a time series at a point or within a small area is a
+handful of chunk reads instead of opening a COG per hour. The cube is a Zarr
+(version 2) store with a contiguous hourly time axis, chunked by
+DEFAULT_CHUNKS (time, y, x), e.g. a week of UTCI at a point reads 7 chunks:
+
+    <cube>.zarr/.zgroup, .zattrs, .zmetadata    CRS, geotransform
+    <cube>.zarr/time, y, x                      coordinates (CF conventions)
+    <cube>.zarr/UTCI/<t>.<y>.<x>                zlib compressed chunks
+
+The values are stored with the encodings of the products (see
+utils/product_encoding.py), i.e. scale_factor and _FillValue are decoded by
+xarray.open_zarr. Chunks without any value, e.g. outside of the city, are not
+written. The store is written with NumPy and zlib only:
+
+    python umep_wrapper/datacube.py --cube=<results>/datacube/DO_datacube.zarr \\
+        --time=2024_150_12 --product MRT <MRT COG> --product UTCI <UTCI COG> ...
+
+Hours are appended in any order after the first hour of the cube, an hour which
+is appended again (e.g. after a ROI patch) is overwritten. An append reads and
+rewrites the chunks of its day, so appends (and creating the cube) are serialized
+by a lock file next to the cube ('<cube>.zarr.lock'): concurrent appends, e.g. a
+ROI patch next to the hourly run, wait for each other instead of losing an hour.
+The first hour of the cube is the first appended hour, earlier hours (e.g. a
+backfill) are skipped with a warning by append_products and need a new cube.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+from osgeo import gdal
+
+from utils.product_encoding import get_encoding, read_band
+
+gdal.UseExceptions()
+
+CUBE_VARIABLES = ["MRT", "UTCI", "PET", "TA", "RH"]
+# time (hours), y and x (pixels) of a chunk
+DEFAULT_CHUNKS = (24, 128, 128)
+# hours of a chunk of the time coordinate
+TIME_CHUNK = 24 * 365
+LOCK_SUFFIX = ".lock"
+EPOCH = datetime(1970, 1, 1)
+TIME_UNITS = "hours since 1970-01-01 00:00:00"
+TIME_FORMAT = "%Y_%j_%H"
+COMPRESSION_LEVEL = 1
+
+
+def _write_atomic(path: str, content: bytes) -> None:
+    """Writes a file, readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path: str, content: dict) -> None:
+    """Writes a Zarr metadata file."""
+    _write_atomic(path, json.dumps(content, indent=2).encode())
+
+
+def _read_json(path: str) -> dict:
+    """Reads a Zarr metadata file."""
+    with open(path) as file:
+        return json.load(file)
+
+
+@contextmanager
+def _locked(path: str):
+    """Holds an exclusive lock of a datacube, also across processes."""
+    with open(path.rstrip(os.sep) + LOCK_SUFFIX, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _to_hours(time: datetime) -> int:
+    """Hours since EPOCH of a full hour."""
+    if (time.minute, time.second, time.microsecond) != (0, 0, 0):
+        raise ValueError(f"{time} is not a full hour.")
+    return int((time - EPOCH) // timedelta(hours=1))
+
+
+class Datacube:
+    """
+    Append-only hourly datacube of the published products, see module docstring.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open an existing datacube.
+
+        Args:
+            path (str): path of the Zarr store
+
+        Raises:
+            FileNotFoundError: thrown if the datacube does not exist
+        """
+        self.path = path
+        attrs = _read_json(os.path.join(path, ".zattrs"))
+        self.geotransform = tuple(attrs["geotransform"])
+        self.projection = attrs["crs_wkt"]
+        self.variables = attrs["variables"]
+        self.start = attrs["time_start"]
+        time_meta = _read_json(os.path.join(path, "time", ".zarray"))
+        self.n_times = time_meta["shape"][0]
+        self.time_chunk = time_meta["chunks"][0]
+        meta = _read_json(os.path.join(path, self.variables[0], ".zarray"))
+        _, self.height, self.width = meta["shape"]
+        self.chunks = tuple(meta["chunks"])
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        start: datetime,
+        geotransform: tuple[float, ...],
+        width: int,
+        height: int,
+        projection: str,
+        variables: list[str] = None,
+        chunks: tuple[int, int, int] = DEFAULT_CHUNKS,
+    ) -> "Datacube":
+        """
+        Create an empty datacube.
+
+        Args:
+            path (str): path of the Zarr store
+            start (datetime): first hour of the cube (UTC)
+            geotransform (tuple): geotransform of the product grid
+            width (int): width of the grid in pixels
+            height (int): height of the grid in pixels
+            projection (str): WKT of the grid CRS
+            variables (list): products of the cube, CUBE_VARIABLES if not given
+            chunks (tuple): chunk size in hours, rows and columns (optional)
+
+        Returns:
+            the datacube
+
+        Raises:
+            FileExistsError: thrown if the datacube exists
+            ValueError: thrown if a product has no encoding
+        """
+        variables = variables or CUBE_VARIABLES
+        for variable in variables:
+            if get_encoding(variable) is None:
+                raise ValueError(f"Product {variable} has no encoding.")
+        os.makedirs(path)
+        _write_json(os.path.join(path, ".zgroup"), {"zarr_format": 2})
+        _write_json(
+            os.path.join(path, ".zattrs"),
+            {
+                "crs_wkt": projection,
+                "geotransform": list(geotransform),
+                "variables": variables,
+                "time_start": _to_hours(start),
+            },
+        )
+
+        # pixel centers as coordinates, in a single chunk
+        x = geotransform[0] + (np.arange(width) + 0.5) * geotransform[1]
+        y = geotransform[3] + (np.arange(height) + 0.5) * geotransform[5]
+        for name, values in (("x", x), ("y", y)):
+            os.makedirs(os.path.join(path, name))
+            cls._write_meta(path, name, values.shape, values.shape, "<f8", None)
+            _write_json(
+                os.path.join(path, name, ".zattrs"),
+                {"_ARRAY_DIMENSIONS": [name], "units": "m"},
+            )
+            cls._write_chunk(os.path.join(path, name, "0"), values.astype("<f8"))
+
+        os.makedirs(os.path.join(path, "time"))
+        cls._write_meta(path, "time", (0,), (TIME_CHUNK,), "<i8", None)
+        _write_json(
+            os.path.join(path, "time", ".zattrs"),
+            {
+                "_ARRAY_DIMENSIONS": ["time"],
+                "units": TIME_UNITS,
+                "calendar": "proleptic_gregorian",
+            },
+        )
+
+        for variable in variables:
+            encoding = get_encoding(variable)
+            os.makedirs(os.path.join(path, variable))
+            cls._write_meta(
+                path,
+                variable,
+                (0, height, width),
+                chunks,
+                np.dtype(encoding.dtype).str,
+                encoding.nodata,
+            )
+            attrs = {"_ARRAY_DIMENSIONS": ["time", "y", "x"]}
+            if encoding.scale != 1.0 or encoding.offset != 0.0:
+                attrs.update(scale_factor=encoding.scale, add_offset=encoding.offset)
+            _write_json(os.path.join(path, variable, ".zattrs"), attrs)
+
+        cube = cls(path)
+        cube._consolidate()
+        return cube
+
+    @staticmethod
+    def _write_meta(
+        path: str,
+        name: str,
+        shape: tuple[int, ...],
+        chunks: tuple[int, ...],
+        dtype: str,
+        fill_value: float | None,
+    ) -> None:
+        """Writes the .zarray of an array."""
+        _write_json(
+            os.path.join(path, name, ".zarray"),
+            {
+                "zarr_format": 2,
+                "shape": list(shape),
+                "chunks": list(chunks),
+                "dtype": dtype,
+                "compressor": {"id": "zlib", "level": COMPRESSION_LEVEL},
+                "fill_value": fill_value,
+                "order": "C",
+                "filters": None,
+                "dimension_separator": ".",
+            },
+        )
+
+    @staticmethod
+    def _write_chunk(path: str, values: np.ndarray) -> None:
+        """Writes a zlib compressed chunk."""
+        content = zlib.compress(
+            np.ascontiguousarray(values).tobytes(), COMPRESSION_LEVEL
+        )
+        _write_atomic(path, content)
+
+    def _read_chunk(
+        self, variable: str, key: tuple[int, int, int]
+    ) -> np.ndarray | None:
+        """Reads a chunk of a product, None if it was not written."""
+        path = os.path.join(self.path, variable, ".".join(map(str, key)))
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            content = zlib.decompress(file.read())
+        dtype = np.dtype(get_encoding(variable).dtype).newbyteorder("<")
+        return np.frombuffer(content, dtype).reshape(self.chunks).copy()
+
+    def _consolidate(self) -> None:
+        """Writes the consolidated metadata of all arrays (.zmetadata)."""
+        metadata = {}
+        for name in [""] + ["time", "y", "x"] + self.variables:
+            for file_name in (".zgroup", ".zarray", ".zattrs"):
+                key = f"{name}/{file_name}" if name else file_name
+                if os.path.exists(os.path.join(self.path, key)):
+                    metadata[key] = _read_json(os.path.join(self.path, key))
+        _write_json(
+            os.path.join(self.path, ".zmetadata"),
+            {"zarr_consolidated_format": 1, "metadata": metadata},
+        )
+
+    def _spatial_chunks(self):
+        """Yields chunk row, chunk column and the pixel window of every chunk."""
+        _, cy, cx = self.chunks
+        for iy in range(0, -(-self.height // cy)):
+            for ix in range(0, -(-self.width // cx)):
+                y0, x0 = iy * cy, ix * cx
+                yield iy, ix, (
+                    x0,
+                    y0,
+                    min(x0 + cx, self.width),
+                    min(y0 + cy, self.height),
+                )
+
+    @property
+    def times(self) -> list[datetime]:
+        """The hours of the cube."""
+        return [self.get_time(index) for index in range(self.n_times)]
+
+    def get_time(self, index: int) -> datetime:
+        """Returns the hour of a time index."""
+        return EPOCH + timedelta(hours=self.start + index)
+
+    def get_time_index(self, time: datetime) -> int:
+        """Returns the time index of an hour, negative if before the cube."""
+        return _to_hours(time) - self.start
+
+    def append(
+        self, time: datetime, products: dict[str, np.ndarray], n_jobs: int = None
+    ) -> int:
+        """
+        Write the products of an hour, replacing the hour if it exists.
+
+        Products missing for the hour read as NoData. The chunks of the hour are
+        read and rewritten under the lock of the cube.
+
+        Args:
+            time (datetime): the hour (UTC)
+            products (dict): maps product name to its values on the cube grid,
+                NaN as NoData
+            n_jobs (int): number of threads compressing the chunks (optional)
+
+        Returns:
+            the time index of the hour
+
+        Raises:
+            ValueError: thrown if the hour is before the cube or a product does
+                not fit the cube
+        """
+        index = self.get_time_index(time)
+        if index < 0:
+            raise ValueError(f"{time} is before the first hour of the datacube.")
+        for variable, values in products.items():
+            if variable not in self.variables:
+                raise ValueError(f"Product {variable} is not part of the datacube.")
+            if values.shape != (self.height, self.width):
+                raise ValueError(
+                    f"Product {variable} has shape {values.shape}, the datacube "
+                    f"({self.height}, {self.width})."
+                )
+
+        with _locked(self.path):
+            self._write_chunks(index, products, n_jobs)
+            # the metadata is extended after the chunks are written
+            self._extend(index + 1)
+        return index
+
+    def _write_chunks(
+        self, index: int, products: dict[str, np.ndarray], n_jobs: int = None
+    ) -> None:
+        """Writes the chunks of the products of a time index, see append."""
+        chunk_t, offset = divmod(index, self.chunks[0])
+        tasks = []
+        for variable, values in products.items():
+            encoding = get_encoding(variable)
+            stored = encoding.encode(values)
+            for iy, ix, (x0, y0, x1, y1) in self._spatial_chunks():
+                tasks.append(
+                    (variable, encoding, (chunk_t, iy, ix), stored[y0:y1, x0:x1])
+                )
+
+        def write_chunk(task):
+            variable, encoding, key, block = task
+            path = os.path.join(self.path, variable, ".".join(map(str, key)))
+            chunk = self._read_chunk(variable, key)
+            if chunk is None:
+                if np.all(block == encoding.nodata):
+                    return
+                chunk = np.full(self.chunks, encoding.nodata, block.dtype)
+            chunk[offset] = encoding.nodata
+            chunk[offset, : block.shape[0], : block.shape[1]] = block
+            self._write_chunk(path, chunk.astype(chunk.dtype.newbyteorder("<")))
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(write_chunk, tasks))
+
+    def _extend(self, n_times: int) -> None:
+        """
+        Extends the time axis of all arrays to n_times hours, unless another
+        process has already extended it further. Called with the lock held.
+        """
+        time_meta = _read_json(os.path.join(self.path, "time", ".zarray"))
+        self.n_times = time_meta["shape"][0]
+        if n_times <= self.n_times:
+            return
+        ct = self.time_chunk
+        for chunk_t in range(self.n_times // ct, (n_times - 1) // ct + 1):
+            hours = self.start + chunk_t * ct + np.arange(ct)
+            self._write_chunk(
+                os.path.join(self.path, "time", str(chunk_t)), hours.astype("<i8")
+            )
+        self._write_meta(self.path, "time", (n_times,), (ct,), "<i8", None)
+        for variable in self.variables:
+            encoding = get_encoding(variable)
+            self._write_meta(
+                self.path,
+                variable,
+                (n_times, self.height, self.width),
+                self.chunks,
+                np.dtype(encoding.dtype).str,
+                encoding.nodata,
+            )
+        self.n_times = n_times
+        self._consolidate()
+
+    def read(
+        self,
+        variable: str,
+        window: tuple[int, int, int, int] = None,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> tuple[list[datetime], np.ndarray]:
+        """
+        Read the time series of a product within a pixel window.
+
+        Args:
+            variable (str): the product, e.g. 'UTCI'
+            window (tuple): xoff, yoff, xsize, ysize of the window, the whole
+                grid if not given (optional)
+            start (datetime): first hour, inclusive (optional)
+            end (datetime): last hour, inclusive (optional)
+
+        Returns:
+            the hours and the Float32 values (time, y, x) with NaN as NoData
+
+        Raises:
+            ValueError: thrown if the product is not part of the datacube
+        """
+        if variable not in self.variables:
+            raise ValueError(f"Product {variable} is not part of the datacube.")
+        xoff, yoff, xsize, ysize = window or (0, 0, self.width, self.height)
+        t0 = 0 if start is None else max(self.get_time_index(start), 0)
+        t1 = self.n_times if end is None else self.get_time_index(end) + 1
+        t1 = max(min(t1, self.n_times), t0)
+
+        encoding = get_encoding(variable)
+        stored = np.full((t1 - t0, ysize, xsize), encoding.nodata, encoding.dtype)
+        ct, cy, cx = self.chunks
+        for chunk_t in range(t0 // ct, -(-t1 // ct)):
+            for iy in range(yoff // cy, -(-(yoff + ysize) // cy)):
+                for ix in range(xoff // cx, -(-(xoff + xsize) // cx)):
+                    chunk = self._read_chunk(variable, (chunk_t, iy, ix))
+                    if chunk is None:
+                        continue
+                    # intersection of the chunk and the requested block
+                    ta, tb = max(t0, chunk_t * ct), min(t1, (chunk_t + 1) * ct)
+                    ya, yb = max(yoff, iy * cy), min(yoff + ysize, (iy + 1) * cy)
+                    xa, xb = max(xoff, ix * cx), min(xoff + xsize, (ix + 1) * cx)
+                    stored[
+                        ta - t0 : tb - t0, ya - yoff : yb - yoff, xa - xoff : xb - xoff
+                    ] = chunk[
+                        ta - chunk_t * ct : tb - chunk_t * ct,
+                        ya - iy * cy : yb - iy * cy,
+                        xa - ix * cx : xb - ix * cx,
+                    ]
+        return [self.get_time(index) for index in range(t0, t1)], encoding.decode(
+            stored
+        )
+
+    def get_pixel(self, x: float, y: float) -> tuple[int, int]:
+        """
+        Returns the column and row of the pixel of a coordinate in the cube CRS.
+
+        Raises:
+            ValueError: thrown if the coordinate is outside of the grid
+        """
+        column = int(np.floor((x - self.geotransform[0]) / self.geotransform[1]))
+        row = int(np.floor((y - self.geotransform[3]) / self.geotransform[5]))
+        if not (0 <= column < self.width and 0 <= row < self.height):
+            raise ValueError(f"({x}, {y}) is outside of the datacube.")
+        return column, row
+
+    def point_series(
+        self,
+        variable: str,
+        x: float,
+        y: float,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> tuple[list[datetime], np.ndarray]:
+        """
+        Read the time series of a product at a point.
+
+        Args:
+            variable (str): the product, e.g. 'UTCI'
+            x (float): x coordinate in the cube CRS (EPSG:25832)
+            y (float): y coordinate in the cube CRS (EPSG:25832)
+            start (datetime): first hour, inclusive (optional)
+            end (datetime): last hour, inclusive (optional)
+
+        Returns:
+            the hours and the values, NaN as NoData
+        """
+        column, row = self.get_pixel(x, y)
+        times, values = self.read(variable, (column, row, 1, 1), start, end)
+        return times, values[:, 0, 0]
+
+    def area_series(
+        self,
+        variable: str,
+        bbox: tuple[float, float, float, float],
+        start: datetime = None,
+        end: datetime = None,
+    ) -> tuple[list[datetime], np.ndarray]:
+        """
+        Read the time series of a product within an area, e.g. for the hourly mean
+        np.nanmean(values, axis=(1, 2)).
+
+        Args:
+            variable (str): the product, e.g. 'UTCI'
+            bbox (tuple): xmin, ymin, xmax, ymax in the cube CRS (EPSG:25832)
+            start (datetime): first hour, inclusive (optional)
+            end (datetime): last hour, inclusive (optional)
+
+        Returns:
+            the hours and the values (time, y, x) of the pixels within the area,
+            NaN as NoData
+
+        Raises:
+            ValueError: thrown if no pixel center is within the area
+        """
+        xmin, ymin, xmax, ymax = bbox
+        x0, xres, _, y0, _, yres = self.geotransform
+        # pixels whose center is within the area
+        column0 = max(int(np.ceil((xmin - x0) / xres - 0.5)), 0)
+        column1 = min(int(np.floor((xmax - x0) / xres - 0.5)), self.width - 1)
+        row0 = max(int(np.ceil((ymax - y0) / yres - 0.5)), 0)
+        row1 = min(int(np.floor((ymin - y0) / yres - 0.5)), self.height - 1)
+        if column1 < column0 or row1 < row0:
+            raise ValueError(f"No pixel of the datacube is within {bbox}.")
+        window = (column0, row0, column1 - column0 + 1, row1 - row0 + 1)
+        return self.read(variable, window, start, end)
+
+
+def get_datacube(
+    path: str,
+    start: datetime,
+    geotransform: tuple[float, ...],
+    width: int,
+    height: int,
+    projection: str,
+) -> Datacube:
+    """Open a datacube, create it if it does not exist, see Datacube.create."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _locked(path):
+        if not os.path.exists(os.path.join(path, ".zgroup")):
+            return Datacube.create(path, start, geotransform, width, height, projection)
+    return Datacube(path)
+
+
+def append_products(
+    path: str, time: datetime, products: dict[str, str], n_jobs: int = None
+) -> int | None:
+    """
+    Append the published rasters of an hour to a datacube.
+
+    Hours before the first hour of the datacube are skipped with a warning, so a
+    backfill does not fail the pipeline after the products are published.
+
+    Args:
+        path (str): path of the Zarr store, created if it does not exist
+        time (datetime): the hour (UTC)
+        products (dict): maps product name to its raster, e.g. the COG
+        n_jobs (int): number of threads compressing the chunks (optional)
+
+    Returns:
+        the time index of the hour, None if the hour is before the datacube
+
+    Raises:
+        ValueError: thrown if the rasters do not share the grid of the datacube
+    """
+    arrays = {}
+    cube = None
+    for variable, raster in products.items():
+        dataset = gdal.Open(raster, gdal.GA_ReadOnly)
+        grid = (
+            dataset.GetGeoTransform(),
+            dataset.RasterXSize,
+            dataset.RasterYSize,
+            dataset.GetProjection(),
+        )
+        cube = cube or get_datacube(path, time, *grid)
+        if (tuple(grid[0]), grid[1], grid[2]) != (
+            cube.geotransform,
+            cube.width,
+            cube.height,
+        ):
+            raise ValueError(f"{raster} does not share the grid of datacube {path}.")
+        if cube.get_time_index(time) < 0:
+            print(
+                f"Warning: {time} is before the first hour {cube.get_time(0)} of "
+                f"datacube {path}, skipped."
+            )
+            return None
+        arrays[variable] = read_band(dataset.GetRasterBand(1))
+    return cube.append(time, arrays, n_jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Append the products of an hour to the hourly datacube."
+    )
+    parser.add_argument("--cube", type=str, required=True, help="Path of the datacube")
+    parser.add_argument(
+        "--time",
+        type=lambda value: datetime.strptime(value, TIME_FORMAT),
+        required=True,
+        help="Hour of the products (UTC), e.g. 2024_150_12 (year, doy, hour)",
+    )
+    parser.add_argument(
+        "--product",
+        nargs=2,
+        action="append",
+        required=True,
+        metavar=("NAME", "RASTER"),
+        help=f"Product ({', '.join(CUBE_VARIABLES)}) and its raster, repeatable",
+    )
+    parser.add_argument(
+        "--n_jobs", type=int, default=None, help="Number of threads (optional)"
+    )
+    args = parser.parse_args()
+
+    append_products(args.cube, args.time, dict(args.product), args.n_jobs)
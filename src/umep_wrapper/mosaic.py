@@ -0,0 +1,178 @@
+"""
+This file holds the mosaicking of finished tile outputs.
+
+The SOLWEIG workers write their Tmrt tiles directly into the mosaics of the hour
+(see mosaic_writer.py). All other tile outputs, e.g. the SVFs, wall rasters or
+Tmrt tiles of earlier runs, are mosaicked afterwards in a single process: the
+core window of every tile (the tile without half of the overlap on each inner
+side) is read by a thread pool and copied into the city-wide raster, which is
+written once as GeoTIFF. The tiles keep the original file names of SOLWEIG
+within their tile folders, e.g.
+
+    python umep_wrapper/mosaic.py --data_path=/usr/app/src/data \\
+        --dsm_folder=<DSM tiles> --cdsm_folder=<CDSM tiles> \\
+        --tile_dir=<results>/SOLWEIG_3m_1000+200/temp_tiles \\
+        --pattern="Tmrt_2024_150_1200*.tif" --output=<mosaic>.tif
+
+This replaces create_mosaic.sh (a gdal_translate process per tile and a
+gdalwarp over all VRTs).
+"""
+
+import argparse
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from umep_wrapper.mosaic_writer import (
+    MOSAIC_DTYPE,
+    MOSAIC_NODATA,
+    get_core_window,
+    get_mosaic_grid,
+)
+from umep_wrapper.tile_catalog import tile_id_from_filename
+
+gdal.UseExceptions()
+
+GTIFF_OPTIONS = ["TILED=YES", "COMPRESS=LZW", "NUM_THREADS=ALL_CPUS"]
+
+
+def find_tile_files(tile_dir: str, pattern: str) -> dict[str, str]:
+    """
+    Find the output file of every tile, e.g. in the SOLWEIG temp_tiles folder.
+
+    Args:
+        tile_dir (str): folder with a subfolder 'y_x' per tile, or the tile files
+            themselves, named '*_y_x.tif'
+        pattern (str): glob pattern of the file names, e.g. 'Tmrt_2024_150_1200*.tif'
+
+    Returns:
+        dict mapping tile id 'y_x' to its file, the newest one if several match
+    """
+    tile_files = {}
+    for path in glob.glob(os.path.join(tile_dir, "*", pattern)):
+        tile_id = os.path.basename(os.path.dirname(path))
+        if tile_id not in tile_files or os.path.getmtime(path) > os.path.getmtime(
+            tile_files[tile_id]
+        ):
+            tile_files[tile_id] = path
+    if not tile_files:
+        for path in glob.glob(os.path.join(tile_dir, pattern)):
+            tile_files[tile_id_from_filename(path)] = path
+    return tile_files
+
+
+def _read_core_window(
+    path: str, window: tuple[int, int, int, int], core: tuple[int, int, int, int]
+) -> np.ndarray:
+    """Reads the core window of a tile, its NoData is converted to MOSAIC_NODATA."""
+    band = gdal.Open(path, gdal.GA_ReadOnly).GetRasterBand(1)
+    x0, y0, x1, y1 = core
+    values = band.ReadAsArray(x0 - window[0], y0 - window[1], x1 - x0, y1 - y0)
+    values = values.astype(MOSAIC_DTYPE)
+    if band.GetNoDataValue() is not None:
+        values[values == band.GetNoDataValue()] = MOSAIC_NODATA
+    values[np.isnan(values)] = MOSAIC_NODATA
+    return values
+
+
+def mosaic_tiles(
+    args: dict, tile_files: dict[str, str], output: str, n_jobs: int = None
+) -> list[str]:
+    """
+    Mosaic the core windows of the tiles into a city-wide GeoTIFF.
+
+    The whole mosaic is held in memory, e.g. about 250 MB for Dortmund at 3 m.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        tile_files (dict): maps tile id 'y_x' to its file, see find_tile_files
+        output (str): path of the mosaic
+        n_jobs (int): number of threads reading the tiles (optional)
+
+    Returns:
+        sorted list of the tile ids without file, which are NoData in the mosaic
+
+    Raises:
+        ValueError: thrown if a tile is not part of the tile catalog
+    """
+    grid = get_mosaic_grid(args)
+    records = grid["records"]
+    unknown = sorted(set(tile_files) - set(records))
+    if unknown:
+        raise ValueError(f"Tiles {unknown} are not part of the tile catalog.")
+
+    mosaic = np.full((grid["height"], grid["width"]), MOSAIC_NODATA, MOSAIC_DTYPE)
+
+    def copy_tile(tile_id: str):
+        record = records[tile_id]
+        window = (record.xoff, record.yoff, record.xsize, record.ysize)
+        core = get_core_window(window, grid["overlap"], grid["width"], grid["height"])
+        x0, y0, x1, y1 = core
+        # the core windows do not overlap, so the threads write disjoint slices
+        mosaic[y0:y1, x0:x1] = _read_core_window(tile_files[tile_id], window, core)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(copy_tile, sorted(tile_files)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_output = f"{output}.{os.getpid()}.tmp"
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        tmp_output,
+        grid["width"],
+        grid["height"],
+        1,
+        gdal.GDT_Float32,
+        options=GTIFF_OPTIONS,
+    )
+    dataset.SetGeoTransform(grid["geotransform"])
+    dataset.SetProjection(grid["projection"])
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(MOSAIC_NODATA)
+    band.WriteArray(mosaic)
+    dataset = None
+    os.replace(tmp_output, output)
+
+    missing = sorted(set(records) - set(tile_files))
+    if missing:
+        print(f"WARNING: {len(missing)} tiles without file, e.g. {missing[0]}")
+    return missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Mosaic the core windows of tile outputs into a city-wide raster."
+    )
+    parser.add_argument(
+        "--data_path", type=str, required=True, help="Path to data directory"
+    )
+    parser.add_argument(
+        "--dsm_folder", type=str, required=True, help="DSM tile folder (tile grid)"
+    )
+    parser.add_argument(
+        "--cdsm_folder", type=str, required=True, help="CDSM tile folder (tile grid)"
+    )
+    parser.add_argument(
+        "--tile_dir",
+        type=str,
+        required=True,
+        help="Folder with a subfolder per tile, e.g. SOLWEIG's temp_tiles",
+    )
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        required=True,
+        help="Glob pattern of the tile files, e.g. 'Tmrt_2024_150_1200*.tif'",
+    )
+    parser.add_argument("--output", type=str, required=True, help="Mosaic path")
+    parser.add_argument(
+        "--n_jobs", type=int, default=None, help="Number of threads (optional)"
+    )
+    args_dict = vars(parser.parse_args())
+
+    tile_files = find_tile_files(args_dict["tile_dir"], args_dict["pattern"])
+    if not tile_files:
+        parser.error(f"No files matching {args_dict['pattern']}")
+    mosaic_tiles(args_dict, tile_files, args_dict["output"], args_dict["n_jobs"])
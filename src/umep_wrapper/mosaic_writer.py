@@ -0,0 +1,252 @@
+"""
+This file holds the direct mosaicking of the SOLWEIG tiles.
+
+Before the tiles are dispatched, a city-wide raster is allocated for every
+requested hour, filled with NoData. Every worker writes the core window of its
+tile (the tile without half of the overlap on each inner side) into these
+rasters right after SOLWEIG finished. The core windows of neighbouring tiles
+touch but do not overlap, so the mosaics are complete as soon as the last tile
+finished, without renaming the tiles and without create_mosaic.sh.
+
+The mosaics are raw ENVI rasters (<name>.bsq and <name>.hdr), which GDAL reads
+like GeoTIFFs. Workers write into them via numpy.memmap: only the bytes of their
+own window are written, so no locking is needed. (GDAL would read-modify-write
+whole blocks or scanlines, which neighbouring workers share.)
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from umep_wrapper.tile_catalog import get_catalog
+from umep_wrapper.tiling import get_tiling
+
+gdal.UseExceptions()
+
+MOSAIC_GRID_FILE = "mosaic.json"
+MOSAIC_SUFFIX = ".bsq"
+MOSAIC_NODATA = -32768
+MOSAIC_DTYPE = np.float32
+
+
+def get_mosaic_name(hour: tuple[int, int, int]) -> str:
+    """Returns the mosaic name of a model hour, the prefix of its Tmrt tile files."""
+    year, doy, hour_of_day = hour
+    return f"Tmrt_{year}_{doy}_{hour_of_day:02d}00"
+
+
+def get_mosaic_hours(model_hours: list[tuple[int, int, int]]) -> list[tuple]:
+    """Returns the model hours to mosaic, i.e. all but the warm-up hour."""
+    return model_hours[1:] if len(model_hours) > 1 else model_hours
+
+
+def get_core_window(
+    window: tuple[int, int, int, int], overlap: int, width: int, height: int
+) -> tuple[int, int, int, int]:
+    """
+    Get the core window of a tile within the mosaic grid.
+
+    The first half of the overlap belongs to the left (upper) tile, the second half
+    to the right (lower) tile. Borders of the mosaic are kept entirely.
+
+    Args:
+        window (tuple): xoff, yoff, xsize, ysize of the tile within the grid
+        overlap (int): tile overlap in pixels
+        width (int): width of the grid in pixels
+        height (int): height of the grid in pixels
+
+    Returns:
+        x0, y0, x1, y1 of the core window within the grid (end exclusive)
+    """
+    xoff, yoff, xsize, ysize = window
+    half = overlap // 2
+    x0 = xoff + half if xoff > 0 else xoff
+    y0 = yoff + half if yoff > 0 else yoff
+    x1 = xoff + xsize - (overlap - half) if xoff + xsize < width else width
+    y1 = yoff + ysize - (overlap - half) if yoff + ysize < height else height
+    return x0, y0, x1, y1
+
+
+def get_mosaic_grid(args: dict) -> dict:
+    """
+    Get the city-wide grid of the tiles of the given run arguments.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+
+    Returns:
+        dict with the tile records, the overlap, width, height, geotransform and
+        projection of the grid
+    """
+    records = get_catalog(args)
+    tiling = get_tiling(args)
+    first = next(iter(records.values()))
+    return {
+        "records": records,
+        "overlap": tiling.overlap,
+        "width": max(record.xoff + record.xsize for record in records.values()),
+        "height": max(record.yoff + record.ysize for record in records.values()),
+        "geotransform": [
+            min(record.xmin for record in records.values()),
+            tiling.resolution,
+            0,
+            max(record.ymax for record in records.values()),
+            0,
+            -tiling.resolution,
+        ],
+        "projection": gdal.Open(first.dsm, gdal.GA_ReadOnly).GetProjection(),
+    }
+
+
+def _create_mosaic(
+    mosaic_file: str,
+    width: int,
+    height: int,
+    geotransform: list[float],
+    projection: str,
+    replace: bool,
+) -> bool:
+    """
+    Allocate a mosaic filled with NoData, without exposing a partial file.
+
+    Args:
+        mosaic_file (str): path of the mosaic
+        width (int): width of the grid in pixels
+        height (int): height of the grid in pixels
+        geotransform (list): geotransform of the grid
+        projection (str): projection of the grid
+        replace (bool): whether to replace an existing mosaic
+
+    Returns:
+        whether this call allocated the mosaic, False if another host did
+    """
+    base = os.path.splitext(mosaic_file)[0]
+    tmp_base = f"{base}.{os.getpid()}"
+    dataset = gdal.GetDriverByName("ENVI").Create(
+        tmp_base + MOSAIC_SUFFIX, width, height, 1, gdal.GDT_Float32
+    )
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(projection)
+    dataset.GetRasterBand(1).SetNoDataValue(MOSAIC_NODATA)
+    dataset.GetRasterBand(1).Fill(MOSAIC_NODATA)
+    dataset = None
+
+    # the headers of concurrent hosts are identical
+    os.replace(tmp_base + ".hdr", base + ".hdr")
+    if replace:
+        os.replace(tmp_base + MOSAIC_SUFFIX, mosaic_file)
+        return True
+    try:
+        # only the first host allocates the mosaic, later hosts keep its content
+        os.link(tmp_base + MOSAIC_SUFFIX, mosaic_file)
+        allocated = True
+    except FileExistsError:
+        allocated = False
+    os.remove(tmp_base + MOSAIC_SUFFIX)
+    return allocated
+
+
+def create_mosaics(
+    args: dict, mosaic_path: str, hours: list[tuple], rerun: bool = False
+) -> list[str]:
+    """
+    Allocate the city-wide mosaics of the given hours.
+
+    Existing mosaics are kept (e.g. when a run continues after failed tiles),
+    unless the run is recomputed. Newly allocated mosaics lack the windows of
+    tiles which completed before, so the caller has to recompute these tiles.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        mosaic_path (str): folder of the mosaics
+        hours (list): (year, doy, hour) of the hours to mosaic
+        rerun (bool): whether to replace existing mosaics
+
+    Returns:
+        list of the names of the mosaics allocated by this call
+    """
+    grid = get_mosaic_grid(args)
+    os.makedirs(mosaic_path, exist_ok=True)
+    names = [get_mosaic_name(hour) for hour in hours]
+    allocated = []
+    for name in names:
+        mosaic_file = os.path.join(mosaic_path, name + MOSAIC_SUFFIX)
+        if os.path.exists(mosaic_file) and not rerun:
+            continue
+        if _create_mosaic(
+            mosaic_file,
+            grid["width"],
+            grid["height"],
+            grid["geotransform"],
+            grid["projection"],
+            rerun,
+        ):
+            allocated.append(name)
+
+    grid_file = os.path.join(mosaic_path, MOSAIC_GRID_FILE)
+    tmp_file = f"{grid_file}.{os.getpid()}"
+    with open(tmp_file, "w") as file:
+        json.dump(
+            {
+                "width": grid["width"],
+                "height": grid["height"],
+                "overlap": grid["overlap"],
+                "mosaics": names,
+            },
+            file,
+            indent=1,
+        )
+    os.replace(tmp_file, grid_file)
+    return allocated
+
+
+def write_core_windows(
+    mosaic_path: str,
+    window: tuple[int, int, int, int],
+    output_dir: str,
+) -> list[str]:
+    """
+    Write the core window of the Tmrt files of a tile into the mosaics.
+
+    Args:
+        mosaic_path (str): folder of the mosaics, see create_mosaics
+        window (tuple): xoff, yoff, xsize, ysize of the tile within the grid
+        output_dir (str): SOLWEIG output folder of the tile
+
+    Returns:
+        list of the mosaics the tile was written to
+    """
+    with open(os.path.join(mosaic_path, MOSAIC_GRID_FILE), "r") as file:
+        grid = json.load(file)
+    x0, y0, x1, y1 = get_core_window(
+        window, grid["overlap"], grid["width"], grid["height"]
+    )
+
+    written = []
+    for name in grid["mosaics"]:
+        # SOLWEIG appends D (day) or N (night) to the file name, files of earlier
+        # runs of the same hour may be left in the folder
+        tile_files = glob.glob(os.path.join(output_dir, f"{name}*.tif"))
+        if not tile_files:
+            continue
+        tile_file = max(tile_files, key=os.path.getmtime)
+
+        band = gdal.Open(tile_file, gdal.GA_ReadOnly).GetRasterBand(1)
+        values = band.ReadAsArray(x0 - window[0], y0 - window[1], x1 - x0, y1 - y0)
+        if band.GetNoDataValue() is not None:
+            values = np.where(values == band.GetNoDataValue(), MOSAIC_NODATA, values)
+
+        mosaic = np.memmap(
+            os.path.join(mosaic_path, name + MOSAIC_SUFFIX),
+            dtype=MOSAIC_DTYPE,
+            mode="r+",
+            shape=(grid["height"], grid["width"]),
+        )
+        mosaic[y0:y1, x0:x1] = values
+        mosaic.flush()
+        del mosaic
+        written.append(name)
+    return written
@@ -0,0 +1,459 @@
+"""
+This file holds the nocturnal fast path of the SOLWEIG tile runs.
+
+While the sun is below the horizon, SOLWEIG sets all shortwave fluxes to zero and
+the ground and wall temperatures to air temperature. Tmrt then only depends on
+the longwave fluxes of the sky, the walls, the vegetation and the ground, weighted
+by the precomputed sky view factors. These are computed here with vectorized NumPy
+for all pixels of a tile, instead of running the shadow and radiation machinery
+of SOLWEIG. At night the walls are at air temperature, so the wall height and
+aspect only enter through the SVFs.
+
+The fluxes follow the night branch of SOLWEIG (Jonsson et al. 2006 for Ldown,
+Lside_veg_v2015a for the side fluxes), with the following simplifications:
+- clear sky emissivity (Prata 1996), no cloudiness correction
+- outgoing longwave radiation of the ground at air temperature, without ground
+  view factors and without the ground temperature wave delay after sunset
+
+Use the validation harness (python umep_wrapper/nocturnal.py --config_file=...)
+to compare the fast path against full SOLWEIG runs for a night-time metfile. The
+pipeline scripts do not pass --night_mode until such a validation is documented.
+"""
+
+import argparse
+import os
+import shutil
+import time
+import zipfile
+
+import numpy as np
+from osgeo import gdal, osr
+
+from utils.save_raster import saveraster
+
+gdal.UseExceptions()
+
+# Stefan-Boltzmann constant as used by SOLWEIG
+SBC = 5.67051e-8
+# SOLWEIG computes the sun position in the middle of the hour before the timestamp
+HOUR_SHIFT = 0.5
+# NoData value of the SOLWEIG output rasters
+SOLWEIG_NODATA = -9999.0
+# angular factors (Fup, Fside) of a standing (POSTURE 0) and a sitting person
+ANGULAR_FACTORS = {0: (0.06, 0.22), 1: (0.166666, 0.166666)}
+SVF_DIRECTIONS = ["N", "E", "S", "W"]
+# total weight of the hemisphere in the view weighting of SOLWEIG (Lvikt_veg)
+VIKTTOT = 4.4897
+
+
+def get_sun_elevation(
+    lat: float, lon: float, year: int, doy: int, hour: float
+) -> float:
+    """
+    Get the sun elevation with the NOAA general solar position equations.
+
+    Args:
+        lat (float): latitude in degrees
+        lon (float): longitude in degrees (east positive)
+        year (int): year (UTC)
+        doy (int): day of the year (UTC)
+        hour (float): decimal hour (UTC)
+
+    Returns:
+        the sun elevation in degrees
+    """
+    days = 366 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 365
+    gamma = 2 * np.pi / days * (doy - 1 + (hour - 12) / 24)
+    eqtime = 229.18 * (
+        0.000075
+        + 0.001868 * np.cos(gamma)
+        - 0.032077 * np.sin(gamma)
+        - 0.014615 * np.cos(2 * gamma)
+        - 0.040849 * np.sin(2 * gamma)
+    )
+    decl = (
+        0.006918
+        - 0.399912 * np.cos(gamma)
+        + 0.070257 * np.sin(gamma)
+        - 0.006758 * np.cos(2 * gamma)
+        + 0.000907 * np.sin(2 * gamma)
+        - 0.002697 * np.cos(3 * gamma)
+        + 0.00148 * np.sin(3 * gamma)
+    )
+    # true solar time in minutes and hour angle
+    true_solar_time = hour * 60 + eqtime + 4 * lon
+    hour_angle = np.radians(true_solar_time / 4 - 180)
+
+    lat_rad = np.radians(lat)
+    cos_zenith = np.sin(lat_rad) * np.sin(decl) + np.cos(lat_rad) * np.cos(
+        decl
+    ) * np.cos(hour_angle)
+    return float(90 - np.degrees(np.arccos(np.clip(cos_zenith, -1, 1))))
+
+
+def get_tile_location(raster_path: str) -> tuple[float, float]:
+    """
+    Get the geographic location of the center of a raster.
+
+    Args:
+        raster_path (str): path of the raster
+
+    Returns:
+        tuple of latitude and longitude in degrees
+    """
+    ds = gdal.Open(raster_path)
+    xmin, xres, _, ymax, _, yres = ds.GetGeoTransform()
+    x = xmin + xres * ds.RasterXSize / 2
+    y = ymax + yres * ds.RasterYSize / 2
+
+    src = osr.SpatialReference()
+    src.ImportFromWkt(ds.GetProjection())
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(4326)
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    lon, lat, _ = osr.CoordinateTransformation(src, dst).TransformPoint(x, y)
+    return lat, lon
+
+
+def read_met_rows(met_file: str) -> list[dict[str, float]]:
+    """
+    Read the rows of a UMEP metfile.
+
+    Args:
+        met_file (str): path to the metfile
+
+    Returns:
+        list of dicts mapping the column names to the values of a row
+    """
+    with open(met_file, "r") as file:
+        header = file.readline().split()
+        return [
+            dict(zip(header, map(float, line.split()))) for line in file if line.strip()
+        ]
+
+
+def is_night(met_rows: list[dict[str, float]], lat: float, lon: float) -> bool:
+    """
+    Check whether the sun is below the horizon for all rows of a metfile.
+
+    Args:
+        met_rows (list): rows of the metfile, see read_met_rows
+        lat (float): latitude of the tile in degrees
+        lon (float): longitude of the tile in degrees
+
+    Returns:
+        True if SOLWEIG would model all rows as night
+    """
+    for row in met_rows:
+        hour = row["it"] + row["imin"] / 60 - HOUR_SHIFT
+        elevation = get_sun_elevation(lat, lon, int(row["iy"]), int(row["id"]), hour)
+        if elevation > 0:
+            return False
+    return True
+
+
+def get_sky_emissivity(ta: float, rh: float) -> float:
+    """
+    Get the clear sky emissivity (Prata 1996), as used by SOLWEIG.
+
+    Args:
+        ta (float): air temperature in degree Celsius
+        rh (float): relative humidity in percent
+
+    Returns:
+        the sky emissivity
+    """
+    ea = 6.107 * 10 ** ((7.5 * ta) / (237.3 + ta)) * (rh / 100.0)
+    msteg = 46.54 * (ea / (ta + 273.15))
+    return 1 - (1 + msteg) * np.exp(-np.sqrt(1.2 + 3.0 * msteg))
+
+
+def read_svfs(svf_zip: str) -> dict[str, np.ndarray]:
+    """
+    Read the sky view factors of a tile from its SVF archive.
+
+    Missing vegetation SVFs (tiles without CDSM) are set to 1.
+
+    Args:
+        svf_zip (str): path of the svfs.zip of the tile
+
+    Returns:
+        dict mapping the SVF names (e.g. 'svf', 'svfEveg') to arrays
+    """
+    with zipfile.ZipFile(svf_zip, "r") as file:
+        names = set(file.namelist())
+    svfs = {}
+    for direction in [""] + SVF_DIRECTIONS:
+        name = f"svf{direction}"
+        svfs[name] = gdal.Open(f"/vsizip/{svf_zip}/{name}.tif").ReadAsArray()
+        for suffix in ["veg", "aveg"]:
+            member = f"{name}{suffix}.tif"
+            svfs[name + suffix] = (
+                gdal.Open(f"/vsizip/{svf_zip}/{member}").ReadAsArray()
+                if member in names
+                else np.ones_like(svfs[name])
+            )
+    return svfs
+
+
+def _longwave_down(
+    svf: np.ndarray,
+    svfveg: np.ndarray,
+    svfaveg: np.ndarray,
+    esky: float,
+    ewall: float,
+    ta4: float,
+) -> np.ndarray:
+    """Incoming longwave radiation of SOLWEIG with walls at air temperature."""
+    return (
+        (svf + svfveg - 1) * esky * ta4
+        + (2 - svfveg - svfaveg) * ewall * ta4
+        + (svfaveg - svf) * ewall * ta4
+        + (2 - svf - svfveg) * (1 - ewall) * esky * ta4
+    )
+
+
+def _view_weight(svf: np.ndarray) -> np.ndarray:
+    """Polynomial view weighting of SOLWEIG for vertical surfaces."""
+    return (
+        63.227 * svf**6
+        - 161.51 * svf**5
+        + 156.91 * svf**4
+        - 70.424 * svf**3
+        + 16.773 * svf**2
+        - 0.4863 * svf
+    )
+
+
+def _longwave_side(
+    svf: np.ndarray,
+    svfveg: np.ndarray,
+    svfaveg: np.ndarray,
+    ldown: np.ndarray,
+    lup: float,
+    esky: float,
+    ewall: float,
+    ta4: float,
+) -> np.ndarray:
+    """Longwave radiation from one cardinal direction at night (Lside_veg)."""
+    svfvegbu = svfveg + svf - 1
+    viktwall = (VIKTTOT - _view_weight(svf)) / VIKTTOT - (
+        VIKTTOT - _view_weight(svfaveg)
+    ) / VIKTTOT
+    viktsky = _view_weight(svfvegbu) / VIKTTOT
+    viktrefl = (VIKTTOT - _view_weight(svfvegbu)) / VIKTTOT
+    viktveg = viktrefl - viktwall
+
+    lsky = svfvegbu * esky * ta4 * viktsky * 0.5
+    lwall = ewall * ta4 * viktwall * 0.5
+    lveg = ewall * ta4 * viktveg * 0.5
+    lground = lup * 0.5
+    lrefl = (ldown + lup) * viktrefl * (1 - ewall) * 0.5
+    return lsky + lwall + lveg + lground + lrefl
+
+
+def calculate_night_tmrt(
+    svfs: dict[str, np.ndarray], ta: float, rh: float, config: dict
+) -> np.ndarray:
+    """
+    Calculate the longwave-only Tmrt of a tile for a night hour.
+
+    Args:
+        svfs (dict): sky view factors of the tile, see read_svfs
+        ta (float): air temperature in degree Celsius
+        rh (float): relative humidity in percent
+        config (dict): SOLWEIG configuration (ABS_L, EMIS_WALLS, EMIS_GROUND,
+            POSTURE)
+
+    Returns:
+        array of Tmrt in degree Celsius
+    """
+    esky = get_sky_emissivity(ta, rh)
+    ewall = float(config["EMIS_WALLS"])
+    abs_l = float(config["ABS_L"])
+    f_up, f_side = ANGULAR_FACTORS[int(config.get("POSTURE", 0))]
+    ta4 = SBC * (ta + 273.15) ** 4
+
+    # ground at air temperature
+    lup = float(config["EMIS_GROUND"]) * ta4
+    ldown = _longwave_down(
+        svfs["svf"], svfs["svfveg"], svfs["svfaveg"], esky, ewall, ta4
+    )
+
+    lside = np.zeros_like(ldown)
+    for direction in SVF_DIRECTIONS:
+        name = f"svf{direction}"
+        lside += _longwave_side(
+            svfs[name],
+            svfs[name + "veg"],
+            svfs[name + "aveg"],
+            ldown,
+            lup,
+            esky,
+            ewall,
+            ta4,
+        )
+
+    absorbed = abs_l * ((ldown + lup) * f_up + lside * f_side)
+    return np.sqrt(np.sqrt(absorbed / (abs_l * SBC))) - 273.2
+
+
+def get_tmrt_filename(row: dict[str, float]) -> str:
+    """Returns the SOLWEIG file name of the night Tmrt of a metfile row."""
+    return (
+        f"Tmrt_{int(row['iy'])}_{int(row['id'])}_"
+        f"{int(row['it']):02d}{int(row['imin']):02d}N.tif"
+    )
+
+
+def run_nocturnal(config: dict) -> tuple[dict, float]:
+    """
+    Calculate the night Tmrt for all rows of the metfile of a SOLWEIG config.
+
+    The output files are named and located like the ones of SOLWEIG, including
+    Tmrt_average.tif.
+
+    Args:
+        config (dict): SOLWEIG configuration of the tile
+
+    Returns:
+        tuple of the output dict and the runtime, like run_solweig
+    """
+    start_time = time.time()
+
+    dsm = gdal.Open(config["INPUT_DSM"])
+    dsm_array = dsm.GetRasterBand(1).ReadAsArray()
+    dsm_nodata = dsm.GetRasterBand(1).GetNoDataValue()
+    invalid = ~np.isfinite(dsm_array)
+    if dsm_nodata is not None:
+        invalid |= dsm_array == dsm_nodata
+
+    svfs = read_svfs(config["INPUT_SVF"])
+    os.makedirs(config["OUTPUT_DIR"], exist_ok=True)
+
+    tmrt_sum = np.zeros(dsm_array.shape)
+    met_rows = read_met_rows(config["INPUTMET"])
+    for row in met_rows:
+        tmrt = calculate_night_tmrt(svfs, row["Tair"], row["RH"], config)
+        tmrt_sum += tmrt
+        saveraster(
+            dsm,
+            os.path.join(config["OUTPUT_DIR"], get_tmrt_filename(row)),
+            np.where(invalid, SOLWEIG_NODATA, tmrt),
+            nodata=SOLWEIG_NODATA,
+        )
+    saveraster(
+        dsm,
+        os.path.join(config["OUTPUT_DIR"], "Tmrt_average.tif"),
+        np.where(invalid, SOLWEIG_NODATA, tmrt_sum / len(met_rows)),
+        nodata=SOLWEIG_NODATA,
+    )
+
+    return {"OUTPUT_DIR": config["OUTPUT_DIR"]}, time.time() - start_time
+
+
+def is_night_config(config: dict) -> bool:
+    """
+    Check whether all hours of a SOLWEIG config can take the nocturnal fast path.
+
+    Args:
+        config (dict): SOLWEIG configuration of the tile
+
+    Returns:
+        True if the sun is below the horizon for all rows of the metfile
+    """
+    lat, lon = get_tile_location(config["INPUT_DSM"])
+    return is_night(read_met_rows(config["INPUTMET"]), lat, lon)
+
+
+def compare_tmrt(reference_path: str, estimate_path: str) -> dict[str, float]:
+    """
+    Compare the Tmrt of the fast path with the one of a full SOLWEIG run.
+
+    Args:
+        reference_path (str): Tmrt raster of the full SOLWEIG run
+        estimate_path (str): Tmrt raster of the nocturnal fast path
+
+    Returns:
+        dict with bias, root mean square error and maximum absolute error in K
+    """
+    reference = gdal.Open(reference_path).ReadAsArray()
+    estimate = gdal.Open(estimate_path).ReadAsArray()
+    valid = (reference != SOLWEIG_NODATA) & (estimate != SOLWEIG_NODATA)
+    difference = estimate[valid] - reference[valid]
+    return {
+        "bias": float(np.mean(difference)),
+        "rmse": float(np.sqrt(np.mean(difference**2))),
+        "max_abs": float(np.max(np.abs(difference))),
+        "pixels": int(valid.sum()),
+    }
+
+
+def validate_tile(config: dict, output_dir: str) -> dict[str, dict[str, float]]:
+    """
+    Run full SOLWEIG and the nocturnal fast path for the same config and compare
+    the Tmrt of all hours.
+
+    Args:
+        config (dict): SOLWEIG configuration with a night-time metfile
+        output_dir (str): folder for the outputs of both runs
+
+    Returns:
+        dict mapping the Tmrt file names to the comparison, see compare_tmrt
+    """
+    # imported here, so the fast path does not depend on the UMEP fork
+    from umep_wrapper.run_solweig_model import run_solweig
+
+    solweig_dir = os.path.join(output_dir, "solweig")
+    nocturnal_dir = os.path.join(output_dir, "nocturnal")
+    for folder in [solweig_dir, nocturnal_dir]:
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+
+    run_solweig(config={**config, "OUTPUT_DIR": solweig_dir})
+    run_nocturnal({**config, "OUTPUT_DIR": nocturnal_dir})
+
+    filenames = [get_tmrt_filename(row) for row in read_met_rows(config["INPUTMET"])]
+    return {
+        filename: compare_tmrt(
+            os.path.join(solweig_dir, filename), os.path.join(nocturnal_dir, filename)
+        )
+        for filename in filenames + ["Tmrt_average.tif"]
+    }
+
+
+if __name__ == "__main__":
+    # validation harness: compare the fast path with full SOLWEIG runs
+    from umep_wrapper.run_solweig_model import load_solweig_config
+
+    parser = argparse.ArgumentParser(
+        description="Validate the nocturnal Tmrt against full SOLWEIG runs."
+    )
+    parser.add_argument(
+        "--config_file",
+        type=str,
+        nargs="+",
+        required=True,
+        help="SOLWEIG configs of tiles (see --write_config), with night-time metfile",
+    )
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--proj_lib", type=str, default=None)
+    args_dict = vars(parser.parse_args())
+
+    if args_dict["proj_lib"] is not None:
+        os.environ["PROJ_LIB"] = os.path.abspath(args_dict["proj_lib"])
+
+    print("config;file;bias;rmse;max_abs;pixels")
+    for config_file in args_dict["config_file"]:
+        config = load_solweig_config(config_file)
+        if not is_night_config(config):
+            print(f"Skipping {config_file}, the sun is above the horizon.")
+            continue
+        tile_output_dir = os.path.join(
+            args_dict["output_dir"], os.path.splitext(os.path.basename(config_file))[0]
+        )
+        for filename, stats in validate_tile(config, tile_output_dir).items():
+            print(
+                f"{config_file};{filename};{stats['bias']:.3f};{stats['rmse']:.3f};"
+                f"{stats['max_abs']:.3f};{stats['pixels']}"
+            )
@@ -0,0 +1,258 @@
+"""
+This file holds the post-processing of the published raster products.
+
+Every product (MRT, UTCI, UTCI-class, PET, PET-class, TA, RH) is read once,
+masked with the city boundary, cropped to it and written directly as Cloud
+Optimized GeoTIFF (COG). Optionally the cropped GeoTIFF is written as well, e.g.
+the MRT raster, which the index calculation and the ROI patching use. Both are
+stored with the compact encoding of the product (see utils/product_encoding.py).
+
+This replaces apply_cutline.sh (a full gdalwarp per product), the rm/mv of the
+cropped files and the separate gdal_translate -of COG per product:
+
+    python umep_wrapper/postprocess.py --boundary=utils/DO_ADMIN_EPSG25832.geojson \\
+        --product UTCI <source> <cog> [<cropped GeoTIFF>] \\
+        --product UTCI-class <source> <cog> [<cropped GeoTIFF>] ...
+
+The boundary is rasterized once per grid (see city_mask.py) and the products are
+processed concurrently on a thread pool (GDAL releases the GIL while
+decoding/encoding).
+
+With --tile_dir, the XYZ web map tiles of the dashboard products are rendered from
+the cropped arrays afterwards, without reading the COGs again (see web_tiles.py).
+"""
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+import numpy as np
+from osgeo import gdal
+
+from umep_wrapper.city_mask import get_city_mask
+from umep_wrapper.web_tiles import DEFAULT_ZOOMS, TILE_FORMATS, render_tiles
+from utils.product_encoding import Encoding, get_encoding, read_band, write_band
+
+gdal.UseExceptions()
+
+NO_DATA_VALUE = -32768.0
+# encoding of products without an own encoding, see product_encoding.py
+FLOAT_ENCODING = Encoding("float32", nodata=NO_DATA_VALUE)
+COG_OPTIONS = ["COMPRESS=LZW"]
+GTIFF_OPTIONS = ["COMPRESS=LZW", "TILED=YES"]
+# products served by the dashboard
+TILE_PRODUCTS = ["UTCI", "UTCI-class"]
+
+
+@dataclass(frozen=True)
+class Product:
+    """A raster product to mask, crop and publish as COG."""
+
+    name: str
+    source: str
+    cog: str
+    target: str | None = None
+
+    @property
+    def resampling(self) -> str:
+        """Resampling of the COG overviews, classes must not be averaged."""
+        return "NEAREST" if self.name.endswith("-class") else "CUBIC"
+
+    @property
+    def encoding(self) -> Encoding:
+        """Storage encoding of the product, e.g. int16 for temperatures."""
+        return get_encoding(self.name) or FLOAT_ENCODING
+
+
+def _write_dataset(
+    values: np.ndarray, geotransform: list[float], projection: str, encoding: Encoding
+) -> gdal.Dataset:
+    """Returns an in-memory dataset of the encoded values to copy into the outputs."""
+    dataset = gdal.GetDriverByName("MEM").Create(
+        "", values.shape[1], values.shape[0], 1, encoding.gdal_dtype
+    )
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(projection)
+    write_band(dataset.GetRasterBand(1), values, encoding)
+    return dataset
+
+
+def _copy_atomic(driver: str, dataset: gdal.Dataset, path: str, options: list):
+    """Writes a copy of the dataset, readers never see a partial file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    gdal.GetDriverByName(driver).CreateCopy(tmp_path, dataset, options=options)
+    os.replace(tmp_path, path)
+
+
+def _postprocess(
+    product: Product, boundary: str, mask_cache: str = None
+) -> tuple[np.ndarray, list[float], str]:
+    """Masks, crops and writes a product, returns the cropped values and grid."""
+    dataset = gdal.Open(product.source, gdal.GA_ReadOnly)
+    geotransform = dataset.GetGeoTransform()
+    projection = dataset.GetProjection()
+    mask, (xoff, yoff, xsize, ysize) = get_city_mask(
+        boundary,
+        tuple(geotransform),
+        dataset.RasterXSize,
+        dataset.RasterYSize,
+        projection,
+        mask_cache,
+    )
+    values = read_band(dataset.GetRasterBand(1), (xoff, yoff, xsize, ysize))
+    # rasters without NoData metadata use the NoData value of the pipeline
+    values[values == NO_DATA_VALUE] = np.nan
+    values[~mask] = np.nan
+    dataset = None
+
+    ulx, xres, xskew, uly, yskew, yres = geotransform
+    geotransform = [ulx + xoff * xres, xres, xskew, uly + yoff * yres, yskew, yres]
+    cropped = _write_dataset(values, geotransform, projection, product.encoding)
+    # the source may be the target, it was read completely at this point
+    if product.target is not None:
+        _copy_atomic("GTiff", cropped, product.target, GTIFF_OPTIONS)
+    _copy_atomic(
+        "COG", cropped, product.cog, COG_OPTIONS + [f"RESAMPLING={product.resampling}"]
+    )
+    print(f"Saved {product.name} COG at: {product.cog}")
+    return values, geotransform, projection
+
+
+def postprocess_product(
+    product: Product, boundary: str, mask_cache: str = None
+) -> Product:
+    """
+    Mask and crop a product to the city boundary and write it as COG.
+
+    Args:
+        product (Product): the product to process
+        boundary (str): path to the GeoJSON file of the city boundary
+        mask_cache (str): folder of the cached city masks (optional)
+
+    Returns:
+        the processed product
+    """
+    _postprocess(product, boundary, mask_cache)
+    return product
+
+
+def postprocess_products(
+    products: list[Product],
+    boundary: str,
+    n_jobs: int = None,
+    mask_cache: str = None,
+    tile_dir: str = None,
+    tile_products: list[str] = None,
+    tile_zooms: list[int] = None,
+    tile_format: str = "png",
+) -> list[Product]:
+    """
+    Post-process the products concurrently.
+
+    Args:
+        products (list): the products to process
+        boundary (str): path to the GeoJSON file of the city boundary
+        n_jobs (int): number of threads, defaults to one per product (optional)
+        mask_cache (str): folder of the cached city masks (optional)
+        tile_dir (str): folder of the XYZ web map tiles, not rendered if not
+            given (optional)
+        tile_products (list): products to render, TILE_PRODUCTS if not given
+            (optional)
+        tile_zooms (list): zoom levels of the tiles (optional)
+        tile_format (str): 'png' or 'webp' (optional)
+
+    Returns:
+        the processed products
+    """
+    tile_products = tile_products or TILE_PRODUCTS
+
+    def process(product: Product):
+        result = _postprocess(product, boundary, mask_cache)
+        # only the arrays to render are kept in memory
+        if tile_dir is not None and product.name in tile_products:
+            return result
+        return None
+
+    with ThreadPoolExecutor(max_workers=n_jobs or len(products) or 1) as executor:
+        results = list(executor.map(process, products))
+
+    if tile_dir is not None:
+        with Pool() as pool:
+            for product, result in zip(products, results):
+                if result is not None:
+                    render_tiles(
+                        product.name, *result, tile_dir, pool, tile_zooms, tile_format
+                    )
+    return products
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Mask and crop raster products to the city and write them as COG."
+    )
+    parser.add_argument(
+        "--boundary",
+        type=str,
+        required=True,
+        help="GeoJSON file of the city boundary",
+    )
+    parser.add_argument(
+        "--product",
+        nargs="+",
+        action="append",
+        required=True,
+        metavar="NAME SOURCE COG [TARGET]",
+        help="Product name (e.g. UTCI or UTCI-class), source raster, COG output and "
+        "optionally the cropped GeoTIFF output, which may be the source",
+    )
+    parser.add_argument(
+        "--n_jobs", type=int, default=None, help="Number of threads (optional)"
+    )
+    parser.add_argument(
+        "--mask_cache",
+        type=str,
+        default=None,
+        help="Folder of the cached city masks, rasterized per grid (optional)",
+    )
+    parser.add_argument(
+        "--tile_dir",
+        type=str,
+        default=None,
+        help="Folder of the pre-rendered XYZ web map tiles (optional)",
+    )
+    parser.add_argument(
+        "--tile_products",
+        nargs="+",
+        default=TILE_PRODUCTS,
+        help=f"Products to render as tiles, defaults to {' '.join(TILE_PRODUCTS)}",
+    )
+    parser.add_argument(
+        "--tile_zooms",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ZOOMS,
+        help="Zoom levels of the tiles",
+    )
+    parser.add_argument(
+        "--tile_format", choices=TILE_FORMATS, default="png", help="Tile format"
+    )
+    args_dict = vars(parser.parse_args())
+
+    products = []
+    for values in args_dict["product"]:
+        if len(values) not in (3, 4):
+            parser.error(f"--product expects NAME SOURCE COG [TARGET], got {values}")
+        products.append(Product(*values))
+    postprocess_products(
+        products,
+        args_dict["boundary"],
+        args_dict["n_jobs"],
+        args_dict["mask_cache"],
+        args_dict["tile_dir"],
+        args_dict["tile_products"],
+        args_dict["tile_zooms"],
+        args_dict["tile_format"],
+    )
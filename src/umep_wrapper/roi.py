@@ -0,0 +1,274 @@
+"""
+This file holds the partial recomputation of a region of interest (ROI).
+
+For events (e.g. a festival area) a fresh Tmrt/UTCI is only needed for a district.
+The ROI is given as GeoJSON file (any CRS) or as bounding box
+'xmin,ymin,xmax,ymax' in the CRS of the tiles. Only the tiles whose core window
+(see mosaic_writer.py) intersects the ROI are recomputed, their results are
+patched into the existing city-wide rasters of the hour:
+
+    python umep_wrapper/solweig_multi_processing.py <arguments of the hour> \\
+        --roi=<roi> --mosaic_path=<mosaic folder>
+    python umep_wrapper/roi.py --roi=<roi> --source=<mosaic folder>/Tmrt_*.bsq \\
+        --target=<city-wide Tmrt GeoTIFF>
+    python umep_wrapper/calculate_tc_indices.py <arguments of the hour> --roi=<roi>
+
+Pixels outside the ROI and NoData pixels of the target (e.g. outside the city
+boundary) are not changed: the ROI is rasterized within its bounding box (a pixel
+is within the ROI if its center is), only the pixels within the polygon are
+written. See process_roi.sh for the whole sequence.
+"""
+
+import argparse
+import os
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from umep_wrapper.mosaic_writer import get_core_window
+from utils.product_encoding import get_band_encoding, read_band, write_band
+
+gdal.UseExceptions()
+
+
+def read_roi(roi: str, projection: str) -> ogr.Geometry:
+    """
+    Read the ROI in the CRS of the given projection.
+
+    Args:
+        roi (str): path to a GeoJSON file or bounding box 'xmin,ymin,xmax,ymax'
+        projection (str): WKT of the target CRS, e.g. of the DSM tiles
+
+    Returns:
+        the (multi)polygon of the ROI
+
+    Raises:
+        ValueError: thrown if the ROI is neither a file nor a bounding box
+    """
+    if not os.path.isfile(roi):
+        try:
+            xmin, ymin, xmax, ymax = (float(value) for value in roi.split(","))
+        except ValueError:
+            raise ValueError(
+                f"ROI {roi} is neither a file nor a bounding box xmin,ymin,xmax,ymax."
+            )
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]:
+            ring.AddPoint_2D(x, y)
+        ring.CloseRings()
+        geometry = ogr.Geometry(ogr.wkbPolygon)
+        geometry.AddGeometry(ring)
+        return geometry
+
+    layer = ogr.Open(roi).GetLayer()
+    geometry = ogr.Geometry(ogr.wkbMultiPolygon)
+    for feature in layer:
+        geometry = geometry.Union(feature.GetGeometryRef())
+
+    source_srs = layer.GetSpatialRef()
+    if source_srs is not None and projection:
+        target_srs = osr.SpatialReference(wkt=projection)
+        # GeoJSON coordinates are always lon/lat (x/y) ordered
+        source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if not source_srs.IsSame(target_srs):
+            geometry.Transform(osr.CoordinateTransformation(source_srs, target_srs))
+    return geometry
+
+
+def _bounds_geometry(xmin: float, ymin: float, xmax: float, ymax: float):
+    """Returns the polygon of the given bounds."""
+    return ogr.CreateGeometryFromWkt(
+        f"POLYGON(({xmin} {ymin},{xmax} {ymin},{xmax} {ymax},{xmin} {ymax},"
+        f"{xmin} {ymin}))"
+    )
+
+
+def select_roi_tiles(records: dict, geometry: ogr.Geometry, overlap: int) -> list[str]:
+    """
+    Select the tiles whose core window intersects the ROI.
+
+    Args:
+        records (dict): tile catalog, maps tile id 'y_x' to its TileRecord
+        geometry (Geometry): ROI in the CRS of the tiles, see read_roi
+        overlap (int): tile overlap in pixels
+
+    Returns:
+        sorted list of the selected tile ids
+    """
+    width = max(record.xoff + record.xsize for record in records.values())
+    height = max(record.yoff + record.ysize for record in records.values())
+    selected = []
+    for tile_id, record in records.items():
+        xres = (record.xmax - record.xmin) / record.xsize
+        yres = (record.ymax - record.ymin) / record.ysize
+        x0, y0, x1, y1 = get_core_window(
+            (record.xoff, record.yoff, record.xsize, record.ysize),
+            overlap,
+            width,
+            height,
+        )
+        core = _bounds_geometry(
+            record.xmin + (x0 - record.xoff) * xres,
+            record.ymax - (y1 - record.yoff) * yres,
+            record.xmin + (x1 - record.xoff) * xres,
+            record.ymax - (y0 - record.yoff) * yres,
+        )
+        if core.Intersects(geometry):
+            selected.append(tile_id)
+    return sorted(selected)
+
+
+def get_roi_window(
+    geometry: ogr.Geometry, dataset: gdal.Dataset
+) -> tuple[int, int, int, int] | None:
+    """
+    Get the pixel window of the bounding box of the ROI within a raster.
+
+    Args:
+        geometry (Geometry): ROI in the CRS of the raster, see read_roi
+        dataset (Dataset): the raster
+
+    Returns:
+        xoff, yoff, xsize, ysize of the window, None if the ROI is outside
+    """
+    ulx, xres, _, uly, _, yres = dataset.GetGeoTransform()
+    xmin, xmax, ymin, ymax = geometry.GetEnvelope()
+    x0 = max(int(np.floor((xmin - ulx) / xres)), 0)
+    x1 = min(int(np.ceil((xmax - ulx) / xres)), dataset.RasterXSize)
+    y0 = max(int(np.floor((ymax - uly) / yres)), 0)
+    y1 = min(int(np.ceil((ymin - uly) / yres)), dataset.RasterYSize)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def rasterize_roi(
+    geometry: ogr.Geometry,
+    geotransform: tuple[float, ...],
+    projection: str,
+    window: tuple[int, int, int, int],
+) -> np.ndarray:
+    """
+    Rasterize the ROI within a window of a grid.
+
+    As with gdalwarp -cutline, a pixel is within the ROI if its center is.
+
+    Args:
+        geometry (Geometry): ROI in the CRS of the grid, see read_roi
+        geotransform (tuple): geotransform of the grid
+        projection (str): WKT of the grid CRS
+        window (tuple): xoff, yoff, xsize, ysize of the window, see get_roi_window
+
+    Returns:
+        boolean mask of the window, True within the ROI
+    """
+    xoff, yoff, xsize, ysize = window
+    ulx, xres, _, uly, _, yres = geotransform
+    dataset = gdal.GetDriverByName("MEM").Create("", xsize, ysize, 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform([ulx + xoff * xres, xres, 0, uly + yoff * yres, 0, yres])
+    dataset.SetProjection(projection)
+
+    # the ROI in the CRS of the grid, gdal.Rasterize would not reproject it
+    layer = ogr.GetDriverByName("Memory").CreateDataSource("").CreateLayer("roi")
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(geometry)
+    layer.CreateFeature(feature)
+    gdal.RasterizeLayer(dataset, [1], layer, burn_values=[1])
+    return dataset.GetRasterBand(1).ReadAsArray() == 1
+
+
+def write_window(
+    target: str,
+    values: np.ndarray,
+    window: tuple[int, int, int, int],
+    mask: np.ndarray = None,
+) -> None:
+    """
+    Write values into a window of an existing raster, keeping its NoData pixels.
+
+    The values are stored with the encoding of the raster (see product_encoding.py).
+
+    Args:
+        target (str): path to the raster to update
+        values (ndarray): values of the window, NaN is not written
+        window (tuple): xoff, yoff, xsize, ysize of the window
+        mask (ndarray): pixels of the window to write, e.g. the ROI within its
+            bounding box (see rasterize_roi), defaults to the whole window
+    """
+    dataset = gdal.Open(target, gdal.GA_Update)
+    band = dataset.GetRasterBand(1)
+    current = read_band(band, window)
+    keep = np.isnan(values) | np.isnan(current)
+    if mask is not None:
+        keep |= ~mask
+    write_band(
+        band,
+        np.where(keep, current, values),
+        get_band_encoding(band),
+        xoff=window[0],
+        yoff=window[1],
+    )
+    dataset = None
+
+
+def patch_raster(roi: str, source: str, target: str) -> bool:
+    """
+    Patch the ROI of a city-wide raster with the recomputed values of a mosaic.
+
+    Both rasters have the same resolution, but may differ in their extent (e.g.
+    the target was cropped to the city boundary).
+
+    Args:
+        roi (str): path to a GeoJSON file or bounding box 'xmin,ymin,xmax,ymax'
+        source (str): raster with the recomputed values, e.g. the mosaic
+        target (str): city-wide raster to patch
+
+    Returns:
+        whether the ROI intersects the target
+    """
+    target_dataset = gdal.Open(target, gdal.GA_ReadOnly)
+    projection = target_dataset.GetProjection()
+    geometry = read_roi(roi, projection)
+    window = get_roi_window(geometry, target_dataset)
+    if window is None:
+        return False
+    geotransform = target_dataset.GetGeoTransform()
+    target_ulx, xres, _, target_uly, _, yres = geotransform
+    target_dataset = None
+
+    source_band = gdal.Open(source, gdal.GA_ReadOnly).GetRasterBand(1)
+    source_ulx, _, _, source_uly, _, _ = source_band.GetDataset().GetGeoTransform()
+    xoff = int(round((target_ulx - source_ulx) / xres)) + window[0]
+    yoff = int(round((target_uly - source_uly) / yres)) + window[1]
+    values = read_band(source_band, (xoff, yoff, window[2], window[3]))
+
+    write_window(
+        target,
+        values,
+        window,
+        rasterize_roi(geometry, geotransform, projection, window),
+    )
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Patch the ROI of a city-wide raster with recomputed values."
+    )
+    parser.add_argument(
+        "--roi",
+        type=str,
+        required=True,
+        help="GeoJSON file or bounding box 'xmin,ymin,xmax,ymax' in the raster CRS",
+    )
+    parser.add_argument(
+        "--source", type=str, required=True, help="Raster with recomputed values"
+    )
+    parser.add_argument(
+        "--target", type=str, required=True, help="City-wide raster to patch"
+    )
+    args_dict = vars(parser.parse_args())
+
+    if not patch_raster(args_dict["roi"], args_dict["source"], args_dict["target"]):
+        print(f"ROI {args_dict['roi']} is outside of {args_dict['target']}")
@@ -16,6 +16,9 @@ logger = logging.getLogger(__name__)
 FORMAT = "[%(filename)s:%(lineno)s - %(funcName)20s()  %(name)s ] %(message)s"
 logger.setLevel(logging.WARNING)
 
+# initialized algorithm instance, kept alive for the lifetime of a worker process
+_solweig_algorithm = None
+
 
 def main(args_dict: dict):
     """
@@ -62,33 +65,62 @@ def main(args_dict: dict):
     )
 
 
+def get_solweig_algorithm() -> ProcessingSOLWEIGAlgorithm:
+    """returns the initialized SOLWEIG algorithm of the current process
+
+    The algorithm is created and initialized on the first call only, so long-lived
+    worker processes do not pay the setup costs for every tile.
+
+    Returns:
+        an initialized ProcessingSOLWEIGAlgorithm
+    """
+    global _solweig_algorithm
+    if _solweig_algorithm is None:
+        _solweig_algorithm = ProcessingSOLWEIGAlgorithm()
+        _solweig_algorithm.initAlgorithm()
+    return _solweig_algorithm
+
+
 def run_solweig(
-    config_file: str,
+    config_file: str = None,
     met_file_path: str = None,
     svfs_path: str = None,
     cdsm_path: str = None,
     out_dir: str = None,
+    algo: ProcessingSOLWEIGAlgorithm = None,
+    config: dict = None,
 ):
     """
     Args:
-        config_file: path to solweig configuration file
+        config_file: path to solweig configuration file, ignored if config is given
         met_file_path: path to metfile
         svfs_path: path to svf zip folder
         cdsm_path: path to CDSM file
         out_dir: path to where the results should be output
+        algo: already initialized algorithm to reuse, a new one is created if None
+        config: solweig configuration dictionary, avoids reading a config file
 
     Returns: paths to results, OUTPUT_CDSM and OUTPUT_POINTFILE
 
+    Raises:
+        ValueError: thrown if neither config_file nor config is given
     """
 
     logger.info("solweig start")
     start_time = time.time()
 
     # RUN
-    algo = ProcessingSOLWEIGAlgorithm()
-    algo.initAlgorithm()
-
-    solweig_config = load_solweig_config(config_file)
+    if algo is None:
+        algo = ProcessingSOLWEIGAlgorithm()
+        algo.initAlgorithm()
+
+    if config is not None:
+        # copy, so the overrides below do not leak into the caller's dict
+        solweig_config = dict(config)
+    elif config_file is not None:
+        solweig_config = load_solweig_config(config_file)
+    else:
+        raise ValueError("Either a config file or a config dict is required.")
 
     # overwrite existing default paths
     if met_file_path is not None:
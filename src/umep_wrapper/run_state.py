@@ -0,0 +1,136 @@
+"""
+This file holds the run-state database of the SOLWEIG tile runs.
+
+For every run (identified by the content of its metfile and the arguments which
+change its results) the state of every tile is recorded in a SQLite database in
+the SOLWEIG process folder as soon as the tile finished. A re-invoked run, e.g.
+after a crash of a worker or an OOM kill, only recomputes the tiles which did not
+complete yet. Outputs shared by all tiles which are allocated anew (the mosaics,
+see mosaic_writer.py) lack the windows of the completed tiles, the state of the
+run is reset then.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+RUN_STATE_FILE = "run_state.sqlite"
+# number of most recent runs kept in the database
+KEEP_RUNS = 48
+# arguments which change the results of a run, host-local paths (mount points of
+# the data and output folders, PROJ, scratch, store, queue or mosaics) must not be
+# part of the key, all hosts of a run share it (see work_queue.py); whether the
+# tiles are written into mosaics is part of it (see get_run_key)
+RESULT_ARGS = (
+    "dsm_folder",
+    "cdsm_folder",
+    "dtm_folder",
+    "lc_folder",
+    "roi",
+    "forecast",
+    "night_mode",
+)
+
+
+def get_run_key(met_file: str, args: dict) -> str:
+    """
+    Get the key of a run from the content of its metfile and the arguments which
+    change its results (RESULT_ARGS and whether mosaics are written), the tile
+    folders relative to the data path.
+
+    Args:
+        met_file (str): path to the metfile of the run
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+
+    Returns:
+        hex digest identifying the run
+    """
+    sha = hashlib.sha256()
+    with open(met_file, "rb") as file:
+        sha.update(file.read())
+    relevant = {k: args.get(k) for k in RESULT_ARGS}
+    relevant["mosaic"] = args.get("mosaic_path") is not None
+    # a GeoJSON ROI is identified by its content, not its path
+    if relevant["roi"] is not None and os.path.isfile(relevant["roi"]):
+        with open(relevant["roi"], "rb") as file:
+            relevant["roi"] = hashlib.sha256(file.read()).hexdigest()
+    sha.update(json.dumps(relevant, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+class RunState:
+    """
+    Completion state of the tiles of a run.
+    """
+
+    def __init__(self, db_path: str, run_key: str, keep_runs: int = KEEP_RUNS):
+        """
+        Args:
+            db_path (str): path of the SQLite database
+            run_key (str): key of the run, see get_run_key
+            keep_runs (int): number of most recent runs kept in the database
+        """
+        self.db_path = db_path
+        self.run_key = run_key
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (run_key TEXT, tile_id TEXT, "
+                "status TEXT, attempts INTEGER, error TEXT, updated REAL, "
+                "PRIMARY KEY (run_key, tile_id))"
+            )
+            # forget old runs
+            conn.execute(
+                "DELETE FROM tiles WHERE run_key NOT IN (SELECT run_key FROM tiles "
+                "GROUP BY run_key ORDER BY MAX(updated) DESC LIMIT ?)",
+                (keep_runs,),
+            )
+
+    def reset(self) -> None:
+        """Forget the state of the tiles of this run, e.g. after lost outputs."""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DELETE FROM tiles WHERE run_key = ?", (self.run_key,))
+
+    def get_completed(self) -> set[str]:
+        """Returns the ids of the tiles which completed in this run."""
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT tile_id FROM tiles WHERE run_key = ? AND status = 'done'",
+                (self.run_key,),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_failed(self) -> dict[str, str]:
+        """Returns the ids of the failed tiles of this run and their errors."""
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT tile_id, error FROM tiles WHERE run_key = ? "
+                "AND status = 'failed'",
+                (self.run_key,),
+            ).fetchall()
+        return dict(rows)
+
+    def update(self, tile_id: str, result) -> None:
+        """
+        Record the result of a tile.
+
+        Args:
+            tile_id (str): tile id 'y_x'
+            result: result of the tile, an exception marks the tile as failed
+        """
+        failed = isinstance(result, Exception)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO tiles VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (run_key, tile_id) DO UPDATE SET status = excluded.status, "
+                "attempts = attempts + 1, error = excluded.error, "
+                "updated = excluded.updated",
+                (
+                    self.run_key,
+                    tile_id,
+                    "failed" if failed else "done",
+                    repr(result) if failed else None,
+                    time.time(),
+                ),
+            )
@@ -0,0 +1,174 @@
+"""
+This file holds the private scratch directories of the SOLWEIG workers.
+
+Every worker process gets its own scratch directory, on tmpfs (/dev/shm) if
+available, so the intermediate files of concurrent tiles (temp files of Python and
+GDAL) neither contend on one folder nor hit the disk. The directory is used
+as TMPDIR of Python and as CPL_TMPDIR of GDAL, is emptied after every tile and
+removed when the worker exits. Workers which do not exit regularly (e.g. after
+pool.terminate() on a tile timeout) leave their directory behind, so the parent
+removes the directories of dead workers before and after the pool runs (see
+remove_stale_scratch). The directory names carry the host and pid namespace of
+the worker, so runs on other hosts or containers sharing the scratch root are
+never mistaken for dead workers.
+
+The SOLWEIG algorithm of the UMEP fork is not redirected: its only SVF input is
+the path of the svfs.zip (INPUT_SVF), which it unpacks into temp folders next to
+its own sources, whatever the path of the archive (hence the writable
+UMEP-processing-fork folder of the backend image). Unpacking the archive into
+the tile scratch beforehand would not be used by the fork, so these folders are
+removed after the run (see process_next_timestep.sh).
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+
+from osgeo import gdal
+
+# tmpfs mounts preferred for scratch directories, in this order
+SCRATCH_ROOTS = ("/dev/shm",)
+SCRATCH_PREFIX = "solweig_"
+
+# scratch directory of the current process, keyed by its pid
+_worker_scratch = {}
+
+
+def get_host_marker() -> str:
+    """
+    Get the marker of the host and pid namespace of the current process.
+
+    Pids are only comparable within one pid namespace, so the marker combines the
+    host name with the inode of the pid namespace (if /proc is available).
+
+    Returns:
+        marker without underscores, e.g. 'node1-4026531836'
+    """
+    marker = socket.gethostname().replace("_", "-")
+    try:
+        marker += f"-{os.stat('/proc/self/ns/pid').st_ino}"
+    except OSError:
+        pass
+    return marker
+
+
+def get_scratch_prefix() -> str:
+    """Get the name prefix of the scratch directories of this host, without pid."""
+    return f"{SCRATCH_PREFIX}{get_host_marker()}_"
+
+
+def get_scratch_root(scratch_root: str = None) -> str:
+    """
+    Get the folder to create the scratch directories in.
+
+    Args:
+        scratch_root (str): preferred folder, defaults to the first writable tmpfs
+            of SCRATCH_ROOTS or the system temp folder
+
+    Returns:
+        path of the folder
+    """
+    if scratch_root is not None:
+        return scratch_root
+    for root in SCRATCH_ROOTS:
+        if os.path.isdir(root) and os.access(root, os.W_OK):
+            return root
+    return tempfile.gettempdir()
+
+
+def get_worker_scratch(scratch_root: str = None) -> str:
+    """
+    Get the scratch directory of the current worker process.
+
+    The directory is created on first use, registered as temp folder of Python
+    and GDAL and removed when the process exits.
+
+    Args:
+        scratch_root (str): folder to create the directory in, see get_scratch_root
+
+    Returns:
+        path of the scratch directory
+    """
+    pid = os.getpid()
+    # forked workers inherit the cache of their parent
+    if pid not in _worker_scratch:
+        scratch_dir = tempfile.mkdtemp(
+            prefix=f"{get_scratch_prefix()}{pid}_", dir=get_scratch_root(scratch_root)
+        )
+        os.environ["TMPDIR"] = scratch_dir
+        tempfile.tempdir = scratch_dir
+        gdal.SetConfigOption("CPL_TMPDIR", scratch_dir)
+        # runs on the regular exit of pool workers, unlike atexit handlers
+        Finalize(
+            None,
+            shutil.rmtree,
+            args=(scratch_dir,),
+            kwargs={"ignore_errors": True},
+            exitpriority=10,
+        )
+        _worker_scratch.clear()
+        _worker_scratch[pid] = scratch_dir
+    return _worker_scratch[pid]
+
+
+def _is_alive(pid: int) -> bool:
+    """Check whether a process with the given pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists, but belongs to another user
+        return True
+    return True
+
+
+def remove_stale_scratch(scratch_root: str = None) -> int:
+    """
+    Remove the scratch directories of worker processes which no longer exist.
+
+    Only directories of the current host and pid namespace are considered, the
+    pids of other hosts or containers sharing the scratch root cannot be checked.
+
+    Args:
+        scratch_root (str): folder of the scratch directories, see get_scratch_root
+
+    Returns:
+        number of removed directories
+    """
+    root = get_scratch_root(scratch_root)
+    if not os.path.isdir(root):
+        return 0
+    prefix = get_scratch_prefix()
+    removed = 0
+    for name in os.listdir(root):
+        pid = name[len(prefix) :].split("_")[0]
+        if not name.startswith(prefix) or not pid.isdigit():
+            continue
+        if not _is_alive(int(pid)):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            removed += 1
+    return removed
+
+
+@contextmanager
+def tile_scratch(tile_id: str, scratch_root: str = None):
+    """
+    Provide a scratch directory for a single tile, removed afterwards.
+
+    Args:
+        tile_id (str): tile id 'y_x'
+        scratch_root (str): folder to create the worker directory in
+
+    Yields:
+        path of the scratch directory of the tile
+    """
+    tile_dir = os.path.join(get_worker_scratch(scratch_root), tile_id)
+    os.makedirs(tile_dir, exist_ok=True)
+    try:
+        yield tile_dir
+    finally:
+        shutil.rmtree(tile_dir, ignore_errors=True)
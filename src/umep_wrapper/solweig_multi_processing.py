@@ -4,24 +4,54 @@ It  requires precalculated files of SkyViewFactor and Wall aspect/height to be a
 """
 
 import argparse
-import glob
 import logging
 import os
 import signal
 import sys
-from functools import partial
+from functools import lru_cache, partial
 from logging.handlers import QueueHandler, QueueListener
 from multiprocessing import Pool, Queue
 
-import numpy as np
 import psutil
+import yaml
 from jinja2 import Environment, FileSystemLoader
 from osgeo import gdal
 
-from umep_wrapper.run_solweig_model import run_solweig
+from umep_wrapper.mosaic_writer import (
+    create_mosaics,
+    get_mosaic_hours,
+    write_core_windows,
+)
+from umep_wrapper.nocturnal import is_night_config, run_nocturnal
+from umep_wrapper.roi import read_roi, select_roi_tiles
+from umep_wrapper.run_solweig_model import get_solweig_algorithm, run_solweig
+from umep_wrapper.run_state import RUN_STATE_FILE, RunState, get_run_key
+from umep_wrapper.scratch import remove_stale_scratch, tile_scratch
+from umep_wrapper.static_store import get_static_store
+from umep_wrapper.tile_catalog import get_catalog
+from umep_wrapper.tile_scheduler import (
+    RUNTIME_HISTORY_FILE,
+    AdaptiveTileScheduler,
+    load_runtime_history,
+    order_longest_first,
+    update_runtime_history,
+)
+from umep_wrapper.tiling import check_tilings, get_tiling
+from umep_wrapper.tracing import get_trace_path, reset_trace, trace_stage
+from umep_wrapper.work_queue import (
+    DEFAULT_LEASE,
+    LEASE_MARGIN,
+    get_work_queue,
+    get_worker_id,
+)
+from utils.load_metfile import read_metfile_hours
 
 gdal.UseExceptions()
 
+package_dir = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.normpath(os.path.join(package_dir, "config_templates"))
+SOLWEIG_TEMPLATE = "solweig_parameter_template.yaml"
+
 
 # https://stackoverflow.com/a/34964369
 def worker_init(q: Queue) -> None:
@@ -64,39 +94,66 @@ def logger_init(log_file_path: str) -> tuple[QueueListener, Queue]:
     return ql, q
 
 
-def main(args: dict[str, str]) -> None:
+def collect_tiles(args: dict[str, str]) -> dict[str, dict]:
     """
-    Run SOLWEIG with the given settings for multiple tiles in parallel.
+    Collect the matching surface model tiles for every non-empty DSM tile from the
+    tile catalog. If args['roi'] is set, only the tiles within the region of interest
+    are collected (see roi.py).
 
     Args:
         args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
-    """
 
-    data_dict = {}
+    Returns:
+        dict mapping tile id 'y_x' to the respective surface model tiles
+    """
 
-    normalized_dsm_path = os.path.normpath(
-        os.path.join(args["data_path"], args["dsm_folder"], "*")
-    )
+    catalog = get_catalog(args)
+    roi_tiles = None
+    if args.get("roi") is not None:
+        # only the tiles within the region of interest are recomputed
+        first = next(iter(catalog.values()))
+        roi_tiles = select_roi_tiles(
+            catalog,
+            read_roi(args["roi"], gdal.Open(first.dsm).GetProjection()),
+            get_tiling(args).overlap,
+        )
+        print(f"Selected {len(roi_tiles)} tiles within the ROI {args['roi']}")
 
-    normalized_cdsm_path = os.path.normpath(
-        os.path.join(args["data_path"], args["cdsm_folder"], "*")
-    )
+    data_dict = {}
+    for y_x, record in catalog.items():
+        if roi_tiles is not None and y_x not in roi_tiles:
+            continue
+        # tiles outside the city's borders (fully masked) are flagged in the catalog
+        if record.is_empty:
+            logging.info("skip;%s;-1;-1;-1;-1;%d", y_x, os.getpid())
+            continue
+        data_dict[y_x] = {
+            "dsm": os.path.basename(record.dsm),
+            "cdsm": os.path.basename(record.cdsm),
+            "dtm": os.path.basename(record.dtm),
+            # since land cover is optional, lc-path is not build during rendering
+            # but here, so add full path to data_dict
+            "lc_path": record.lc,
+            "valid_fraction": record.valid_fraction,
+            # location within the city grid, for the mosaics (see mosaic_writer.py)
+            "window": (record.xoff, record.yoff, record.xsize, record.ysize),
+        }
 
-    normalized_dtm_path = os.path.normpath(
-        os.path.join(args["data_path"], args["dtm_folder"], "*")
-    )
+    return data_dict
 
-    normalized_lc_path = ""
-    if args["lc_folder"] is not None:
-        normalized_lc_path = os.path.join(args["data_path"], args["lc_folder"], "*")
 
-    package_dir = os.path.dirname(os.path.abspath(__file__))
-    template_path = os.path.normpath(os.path.join(package_dir, "config_templates"))
+def get_process_folder(args: dict[str, str]) -> tuple[str, str, str]:
+    """
+    Derive the SOLWEIG process folder from the tiling of the DSM folder and create it.
 
-    normalized_metfile_path = os.path.normpath(args["met_file"])
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
 
-    resolution = args["dsm_folder"].split("_")[-3]
-    size = args["dsm_folder"].split("_")[-1]
+    Returns:
+        tuple of process folder name, process folder path and log file path
+    """
+    tiling = get_tiling(args)
+    resolution, size = tiling.resolution_label, tiling.size_label
 
     solweig_process_folder = f"SOLWEIG_{resolution}_{size}"
     solweig_process_path = os.path.normpath(
@@ -108,6 +165,137 @@ def main(args: dict[str, str]) -> None:
     log_file_path = os.path.join(
         solweig_process_path, f"solweig_processing_{resolution}_{size}_log.log"
     )
+    return solweig_process_folder, solweig_process_path, log_file_path
+
+
+def get_history_path(args: dict[str, str], solweig_process_path: str) -> str:
+    """
+    Get the path of the runtime history of the run.
+
+    Forecast runs model many hours per tile, so they keep their own history.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        solweig_process_path (str): location of folder for SOLWEIG output
+
+    Returns:
+        path to the runtime history json file
+    """
+    prefix = "forecast_" if args.get("forecast", False) else ""
+    return os.path.join(solweig_process_path, prefix + RUNTIME_HISTORY_FILE)
+
+
+def get_pending_tiles(
+    args: dict, data_dict: dict[str, dict], run_state: RunState
+) -> dict[str, dict]:
+    """
+    Remove the tiles which already completed in a previous invocation of the run.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        data_dict (dict): maps tile id 'y_x' to the respective surface model tiles
+        run_state (RunState): run-state database of the run
+
+    Returns:
+        data_dict without the completed tiles, unless args['rerun'] is set
+    """
+    if args.get("rerun", False):
+        return data_dict
+    completed = run_state.get_completed()
+    if completed:
+        print(f"Skipping {len(completed & data_dict.keys())} completed tiles")
+    return {k: v for k, v in data_dict.items() if k not in completed}
+
+
+def dispatch_tiles(
+    pool: Pool,
+    scheduler: AdaptiveTileScheduler,
+    func,
+    args: dict,
+    data_dict: dict[str, dict],
+    run_state: RunState,
+    history_path: str,
+    reset: bool = False,
+) -> dict:
+    """
+    Enqueue the pending tiles of a run and compute the tiles pulled from the queue.
+
+    With a shared work queue (args['work_queue']) several hosts run this for the
+    same run, every tile is computed by one of them.
+
+    Args:
+        pool (Pool): process pool of this host
+        scheduler (AdaptiveTileScheduler): scheduler admitting the tiles to the pool
+        func: picklable function called with a single (tile id, tile data) item
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        data_dict (dict): maps tile id 'y_x' to the respective surface model tiles
+        run_state (RunState): run-state database of the run
+        history_path (str): path to the runtime history json file
+        reset (bool): whether to recompute the completed tiles as well, e.g. when
+            the mosaics were allocated anew
+
+    Returns:
+        dict mapping the ids of the tiles computed on this host to their results
+    """
+    # a claim expires once the claiming host counted an attempt of the tile as
+    # timed out, it is renewed when the tile is retried
+    lease = (args.get("tile_timeout") or DEFAULT_LEASE) + LEASE_MARGIN
+    work_queue = get_work_queue(args.get("work_queue"), lease)
+    worker_id = get_worker_id()
+    if reset:
+        print("Outputs of the run were allocated anew, recomputing all tiles")
+        run_state.reset()
+        work_queue.reset(run_state.run_key)
+    # submit the slowest tiles first, based on the runtimes of previous runs
+    tiles = order_longest_first(
+        get_pending_tiles(args, data_dict, run_state),
+        load_runtime_history(history_path),
+        ["solweig"],
+    )
+    if tiles and not work_queue.put(run_state.run_key, [k for k, _ in tiles]):
+        print("Tiles of this run are already enqueued or done, pulling from the queue")
+
+    def on_result(tile_id: str, result) -> None:
+        run_state.update(tile_id, result)
+        if not work_queue.complete(
+            run_state.run_key, tile_id, worker_id, failed=isinstance(result, Exception)
+        ):
+            print(f"Claim of tile {tile_id} was taken over by another host")
+
+    def on_retry(tile_id: str) -> None:
+        work_queue.renew(run_state.run_key, tile_id, worker_id)
+
+    return scheduler.map(
+        pool,
+        func,
+        work_queue.iter_tiles(run_state.run_key, data_dict, worker_id),
+        retries=args.get("retries", 0),
+        timeout=args.get("tile_timeout"),
+        on_result=on_result,
+        on_retry=on_retry,
+    )
+
+
+def main(args: dict[str, str]) -> list[str]:
+    """
+    Run SOLWEIG with the given settings for multiple tiles in parallel.
+
+    Tiles which completed in a previous invocation with the same metfile are
+    skipped, failed tiles are retried up to args['retries'] times. Timed out
+    tiles and tiles left when all workers hang are listed as failed.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+
+    Returns:
+        list of the ids of the failed tiles
+    """
+
+    normalized_metfile_path = os.path.normpath(args["met_file"])
+
+    solweig_process_folder, solweig_process_path, log_file_path = get_process_folder(
+        args
+    )
 
     # setup logger
     logging.basicConfig(
@@ -119,44 +307,28 @@ def main(args: dict[str, str]) -> None:
     )
     runtime_logger = logging.getLogger("runtime_logger")
     runtime_logger.info("step;tile;runtime;cpu;vmem;vmem_all;pid")
+    reset_trace(solweig_process_path)
 
-    dsm_files = sorted(glob.glob(normalized_dsm_path))
-    cdsm_files = sorted(glob.glob(normalized_cdsm_path))
-    dtm_files = sorted(glob.glob(normalized_dtm_path))
-    if args["lc_folder"] is not None:
-        lc_files = sorted(glob.glob(normalized_lc_path))
-
-    # extract filenames for further processing
-    for dsm_file in dsm_files:
-        if ".tif" not in dsm_file:
-            continue
-        dsm_file = os.path.normpath(dsm_file)
-        dsm_file = dsm_file.split(os.sep)[-1]
-        # DSM file naming pattern: DO_DTM+DSM_mosaic_<reso>_<y>_<x>.tif
-        yx_coords = dsm_file.split(".")[0].split("_")[-2:]
-        y_x = yx_coords[0] + "_" + yx_coords[1]
-
-        matching_cdsm = [s for s in cdsm_files if y_x in s]
-        assert len(matching_cdsm) == 1
-        matching_cdsm = matching_cdsm[0].split(os.sep)[-1]
-
-        matching_dtm = [s for s in dtm_files if y_x in s]
-        assert len(matching_dtm) == 1
-        matching_dtm = matching_dtm[0].split(os.sep)[-1]
-
-        data_dict[y_x] = {
-            "dsm": dsm_file,
-            "cdsm": matching_cdsm,
-            "dtm": matching_dtm,
-            "lc_path": None,
-        }
+    run_state = RunState(
+        os.path.join(solweig_process_path, RUN_STATE_FILE),
+        get_run_key(normalized_metfile_path, args),
+    )
+    data_dict = collect_tiles(args)
 
-        if args["lc_folder"] is not None:
-            matching_lc = [s for s in lc_files if y_x in s]
-            assert len(matching_lc) == 1
-            # since land cover is optional, lc-path is not build during rendering
-            # but here, so add full path to data_dict
-            data_dict[y_x]["lc_path"] = matching_lc[0]
+    model_hours = read_metfile_hours(normalized_metfile_path)
+    print(
+        f"Modelling {len(model_hours)} hours per tile "
+        f"(incl. warm-up), from {model_hours[0]} to {model_hours[-1]}"
+    )
+    # new mosaics lack the windows of tiles completed in a previous invocation
+    new_mosaics = []
+    if args.get("mosaic_path") is not None:
+        new_mosaics = create_mosaics(
+            args,
+            args["mosaic_path"],
+            get_mosaic_hours(model_hours),
+            rerun=args.get("rerun", False),
+        )
 
     print(
         f"Memory usage: \n"
@@ -172,7 +344,7 @@ def main(args: dict[str, str]) -> None:
     func = partial(
         process_tile,
         args,
-        template_path,
+        TEMPLATE_PATH,
         normalized_metfile_path,
         solweig_process_folder,
         solweig_process_path,
@@ -181,20 +353,130 @@ def main(args: dict[str, str]) -> None:
 
     signal.signal(signal.SIGTERM, lambda signum, stack_frame: sys.exit(1))
     # maxtasksprchild set to one to contain memory issue: https://stackoverflow.com/a/54975030
-    with Pool(processes=32, initializer=worker_init, initargs=[q]) as pool:
-        result = pool.map_async(func, data_dict.items())
-        try:
-            _ = result.get()
-        except Exception as e:
-            print(f"Failed with {e}")
+    # concurrency follows the cgroup limits and the measured memory per tile
+    scheduler = AdaptiveTileScheduler(max_processes=args.get("max_processes"))
+    print(
+        f"Scheduling tiles on up to {scheduler.processes} processes "
+        f"(memory limit: {scheduler.memory_limit / 1024**3:.1f} GiB)"
+    )
+    # scratch directories of workers of previous runs which were killed
+    remove_stale_scratch(args.get("scratch_root"))
+    with Pool(
+        processes=scheduler.processes, initializer=worker_init, initargs=[q]
+    ) as pool:
+        history_path = get_history_path(args, solweig_process_path)
+        results = dispatch_tiles(
+            pool,
+            scheduler,
+            func,
+            args,
+            data_dict,
+            run_state,
+            history_path,
+            reset=bool(new_mosaics),
+        )
         # from https://superfastpython.com/multiprocessing-pool-map_async/
-        # close the process pool
-        pool.close()
+        if scheduler.hung:
+            # workers of timed out tiles still hang, so do not wait for them
+            pool.terminate()
+        else:
+            # close the process pool
+            pool.close()
         # wait for all tasks to complete and processes to close
         pool.join()
+    # terminated workers do not remove their scratch directories
+    remove_stale_scratch(args.get("scratch_root"))
 
     q_listener.stop()
 
+    update_runtime_history(history_path, log_file_path)
+
+    failed = sorted(k for k, v in results.items() if isinstance(v, Exception))
+    if failed:
+        print(f"Failed tiles: {', '.join(failed)}, re-run to compute only these.")
+    return failed
+
+
+@lru_cache(maxsize=None)
+def get_template_environment(template_path: str) -> Environment:
+    """
+    Load the jinja environment for the given template folder once per process.
+
+    Args:
+        template_path (str): folder which contains the SOLWEIG parameter templates
+
+    Returns:
+        jinja Environment, which also caches the compiled templates
+    """
+    return Environment(
+        loader=FileSystemLoader(template_path), trim_blocks=True, lstrip_blocks=True
+    )
+
+
+@lru_cache(maxsize=None)
+def get_base_config(template_path: str, template_name: str = SOLWEIG_TEMPLATE) -> dict:
+    """
+    Parse the tile independent SOLWEIG parameters of a template once per process.
+
+    The tile specific entries are rendered empty and have to be set by the caller,
+    see build_tile_config.
+
+    Args:
+        template_path (str): folder which contains the SOLWEIG parameter templates
+        template_name (str): file name of the template
+
+    Returns:
+        the base configuration dictionary, must not be modified
+    """
+    template = get_template_environment(template_path).get_template(template_name)
+    return yaml.safe_load(os.path.expandvars(template.render()))
+
+
+def build_tile_config(
+    base_config: dict,
+    args: dict,
+    normalized_metfile_path: str,
+    solweig_process_folder: str,
+    k_v_pair: tuple[str, dict],
+) -> dict:
+    """
+    Create the SOLWEIG configuration of a tile from the base configuration.
+
+    The paths follow the ones of solweig_parameter_template.yaml.
+
+    Args:
+        base_config (dict): tile independent parameters, see get_base_config
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        normalized_metfile_path (str): absolute path to metfile
+        solweig_process_folder (str): folder for SOLWEIG output
+        k_v_pair (tuple): maps tile id 'y_x' to the respective surface model tiles
+
+    Returns:
+        the configuration dictionary of the tile
+    """
+    k, v = k_v_pair[0], k_v_pair[1]
+    data_path = args["data_path"]
+    preprocess_data_path = args["preprocess_data_path"]
+
+    overrides = {
+        "INPUT_DSM": os.path.join(data_path, args["dsm_folder"], v["dsm"]),
+        "INPUT_SVF": os.path.join(preprocess_data_path, k, "svfs.zip"),
+        "INPUT_CDSM": os.path.join(data_path, args["cdsm_folder"], v["cdsm"]),
+        "INPUT_HEIGHT": os.path.join(preprocess_data_path, k, f"wall_height_{k}.tif"),
+        "INPUT_ASPECT": os.path.join(preprocess_data_path, k, f"wall_aspect_{k}.tif"),
+        # the algorithm expects the string 'None' if no land cover is given
+        "INPUT_LC": v["lc_path"] if v["lc_path"] is not None else "None",
+        "INPUT_DEM": os.path.join(data_path, args["dtm_folder"], v["dtm"]),
+        "INPUTMET": normalized_metfile_path,
+        "OUTPUT_DIR": os.path.join(
+            args["output_path"], solweig_process_folder, "temp_tiles", k
+        ),
+    }
+    return {
+        **base_config,
+        **{key: os.path.expandvars(value) for key, value in overrides.items()},
+    }
+
 
 def process_tile(
     args: dict,
@@ -203,10 +485,29 @@ def process_tile(
     solweig_process_folder: str,
     solweig_process_path: str,
     k_v_pair: tuple[str, dict],
+    algo=None,
 ):
     """
     Run SOLWEIG for a single tile.
 
+    The configuration is handed to SOLWEIG in memory. If args['write_config'] is
+    set, it is additionally written to the tile folder for debugging and auditing.
+
+    If args['static_store'] is set, the decoded static inputs of the store are
+    used instead of the compressed rasters (see static_store.py).
+
+    The stage is traced to the trace file of the host (see tracing.py).
+
+    Intermediate files are written to a private scratch directory of the worker
+    (on tmpfs if available, see scratch.py), which is emptied after the tile.
+
+    If args['night_mode'] is set and the sun is below the horizon for all hours,
+    the longwave-only Tmrt of the nocturnal fast path is calculated instead of
+    running SOLWEIG (see nocturnal.py).
+
+    If args['mosaic_path'] is set, the core window of the Tmrt of the requested
+    hour(s) is written into the city-wide mosaics (see mosaic_writer.py).
+
     Args:
         args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
         template_path (str): folder which contains the SOLWEIG parameter templates
@@ -214,69 +515,62 @@ def process_tile(
         solweig_process_folder (str): folder for SOLWEIG output
         solweig_process_folder (str): location of folder for SOLWEIG output
         k_v_pair (tuple): maps tile id 'y_x' to the respective surface model tiles
+        algo (ProcessingSOLWEIGAlgorithm): initialized algorithm to reuse (optional)
     """
 
     os.environ["PROJ_LIB"] = args["proj_lib"]
 
-    k, v = k_v_pair[0], k_v_pair[1]
+    k = k_v_pair[0]
 
-    env = Environment(
-        loader=FileSystemLoader(template_path), trim_blocks=True, lstrip_blocks=True
+    # 1: create tile config from the cached template parameters
+    config = build_tile_config(
+        get_base_config(template_path),
+        args,
+        normalized_metfile_path,
+        solweig_process_folder,
+        k_v_pair,
     )
-
-    # 1: collect data for tile
-    data = {
-        "data_path": args["data_path"],
-        "dsm_folder": args["dsm_folder"],
-        "cdsm_folder": args["cdsm_folder"],
-        "dtm_folder": args["dtm_folder"],
-        "preprocess_data_path": args["preprocess_data_path"],
-        "output_path": args["output_path"],
-        "dsm_file": v["dsm"],
-        "cdsm_file": v["cdsm"],
-        "dtm_file": v["dtm"],
-        "lc_path": v["lc_path"],
-        "y_x": k,
-        "met_file_path": normalized_metfile_path,
-        "solweig_process_folder": solweig_process_folder,
-    }
-
-    # check if dsm is outside the city's borders (whether the tile was fully masked)
-    cdsm_path = os.path.join(data["data_path"], data["cdsm_folder"], data["cdsm_file"])
-    cdsm_tiff = gdal.Open(cdsm_path, gdal.GA_ReadOnly).ReadAsArray()
-
-    cdsm_values = np.asarray(cdsm_tiff)
-    if (cdsm_values == np.zeros(cdsm_values.shape)).all():
-        logging.info("skip;%s;-1;-1;-1;-1;%d", k, os.getpid())
-        return
-
-    # create output path for process results
-    tile_output_path = os.path.normpath(os.path.join(solweig_process_path, k))
-    if not os.path.exists(tile_output_path):
-        os.mkdir(tile_output_path)
-
-    # run solweig calculation with config
-    # a: read config file template
-    template = env.get_template("solweig_parameter_template.yaml")
-    config_file = os.path.join(tile_output_path, f"solweig_parameter_{k}.yaml")
-    # b: write tile specific data in template to create individual config file
-    with open(config_file, "w") as file:
-        file.write(template.render(data))
-    # c: run solweig algorithm
-    output_file, runtime = run_solweig(config_file)
+    # read the decoded static inputs, if the tile is current in the store
+    if args.get("static_store") is not None:
+        config.update(get_static_store(args["static_store"]).get_inputs(k))
+
+    # night hours take the longwave-only fast path
+    night = args.get("night_mode", False) and is_night_config(config)
+
+    # 2: optionally write the config file for debugging
+    if args.get("write_config", False):
+        tile_output_path = os.path.normpath(os.path.join(solweig_process_path, k))
+        if not os.path.exists(tile_output_path):
+            os.mkdir(tile_output_path)
+        config_file = os.path.join(tile_output_path, f"solweig_parameter_{k}.yaml")
+        with open(config_file, "w") as file:
+            yaml.safe_dump(config, file, sort_keys=False)
+
+    # 3: run solweig algorithm, intermediate files go to the scratch of the worker
+    step = "nocturnal" if night else "solweig"
+    if not night:
+        algo = algo if algo is not None else get_solweig_algorithm()
+    with trace_stage(get_trace_path(solweig_process_path), step, k), tile_scratch(
+        k, args.get("scratch_root")
+    ):
+        if night:
+            output_file, runtime = run_nocturnal(config)
+        else:
+            output_file, runtime = run_solweig(config=config, algo=algo)
+
+    # 4: write the core window of the tile into the city-wide mosaics
+    if args.get("mosaic_path") is not None:
+        with trace_stage(get_trace_path(solweig_process_path), "mosaic", k):
+            write_core_windows(
+                args["mosaic_path"], k_v_pair[1]["window"], config["OUTPUT_DIR"]
+            )
 
     logging.info(
-        f"solweig;{k};{round(runtime,4)};{psutil.cpu_percent()};"
+        f"{step};{k};{round(runtime,4)};{psutil.cpu_percent()};"
         f"{psutil.virtual_memory().percent};{psutil.virtual_memory()};{os.getpid()}"
     )
 
-    print(f"solweig calc successful, output is: {output_file}")
-    print(
-        f"Memory usage: \n"
-        f"cpu [%]: {psutil.cpu_percent()}\n"
-        f"vmem [%]:{psutil.virtual_memory().percent}\n"  # percentage of used RAM
-        f"vmem: {psutil.virtual_memory()}"
-    )  # physical memory usage
+    print(f"{step} calc successful, output is: {output_file}")
 
 
 def check_paths(
@@ -336,28 +630,23 @@ def check_paths(
     if not os.path.isdir(output_path):
         raise FileNotFoundError(f"Output path {output_path} does not exist.")
 
-    # check matching
-    # DSM folder format: DO_DTM+DSM_mosaic_<reso>_tiles_<size>+<overlap>
-    dsm_resolution = dsm_folder.split("_")[-3]
-    # DTM folder format: DO_DTM_mosaic_<reso>_bilinear_<size>+<overlap>
-    dtm_resolution = dtm_folder.split("_")[-3]
-    if dsm_resolution != dtm_resolution:
-        raise RuntimeError(
-            f"Resolutions of DSM and DTM do not match: "
-            f"{dsm_resolution} (DSM) vs. {dtm_resolution} (DTM)"
-        )
+    # check matching of resolution, size and overlap
+    check_tilings(
+        data_path,
+        {"DSM": dsm_folder, "CDSM": cdsm_folder, "DTM": dtm_folder, "LC": lc_folder},
+    )
 
-    dsm_size = dsm_folder.split("_")[-1]
-    dtm_size = dtm_folder.split("_")[-1]
-    if dsm_size != dtm_size:
-        raise RuntimeError(
-            f"Sizes of DSM and DTM do not match: {dsm_size} (DSM) vs. {dtm_size}(DTM)"
-        )
 
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """
+    Add the SOLWEIG run arguments to the given parser.
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+    Args:
+        parser (ArgumentParser): parser to extend
 
+    Returns:
+        the extended parser
+    """
     parser.add_argument(
         "--proj_lib",
         type=str,
@@ -407,6 +696,99 @@ if __name__ == "__main__":
     parser.add_argument(
         "--output_path", type=str, required=True, help="Path to output folder"
     )
+    parser.add_argument(
+        "--tile_catalog",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to the tile catalog, defaults to a catalog per tile folders next to the DSM folder",
+    )
+    parser.add_argument(
+        "--max_processes",
+        type=int,
+        required=False,
+        default=None,
+        help="Upper bound of parallel tiles, defaults to the CPU limit of the container",
+    )
+    parser.add_argument(
+        "--write_config",
+        action="store_true",
+        help="Write the SOLWEIG configuration of every tile to its folder (debugging)",
+    )
+    parser.add_argument(
+        "--scratch_root",
+        type=str,
+        required=False,
+        default=None,
+        help="Folder for the scratch directories of the workers, defaults to /dev/shm",
+    )
+    parser.add_argument(
+        "--work_queue",
+        type=str,
+        required=False,
+        default=None,
+        help="Queue shared by the hosts of a run: sqlite:///<path> or "
+        "redis://<host>:<port>/<db>, defaults to a single host",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of retries of a failed tile",
+    )
+    parser.add_argument(
+        "--tile_timeout",
+        type=float,
+        required=False,
+        default=3600,
+        help="Seconds after which a tile counts as failed (e.g. killed worker), "
+        "timed out tiles are not retried before the next invocation",
+    )
+    parser.add_argument(
+        "--rerun",
+        action="store_true",
+        help="Recompute all tiles, also the ones completed in a previous invocation",
+    )
+    parser.add_argument(
+        "--static_store",
+        type=str,
+        required=False,
+        default=None,
+        help="Folder of the decoded static inputs, see static_store.py",
+    )
+    parser.add_argument(
+        "--night_mode",
+        action="store_true",
+        help="Calculate longwave-only Tmrt while the sun is below the horizon",
+    )
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Forecast mode: model all hours of a multi-hour metfile "
+        "(see utils/load_metfile.py --forecast_hours) in one run per tile",
+    )
+    parser.add_argument(
+        "--mosaic_path",
+        type=str,
+        required=False,
+        default=None,
+        help="Folder of the city-wide Tmrt mosaics, the tiles are written into "
+        "directly (see mosaic_writer.py)",
+    )
+    parser.add_argument(
+        "--roi",
+        type=str,
+        required=False,
+        default=None,
+        help="Only recompute the tiles within a region of interest: GeoJSON file or "
+        "bounding box 'xmin,ymin,xmax,ymax' in the CRS of the tiles (see roi.py)",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = add_arguments(argparse.ArgumentParser())
 
     args_dict = vars(parser.parse_args())
 
@@ -425,4 +807,8 @@ if __name__ == "__main__":
         args_dict["output_path"],
     )
 
-    main(args_dict)
+    if not args_dict["forecast"] and len(read_metfile_hours(args_dict["met_file"])) > 2:
+        print("Metfile holds more than two hours, consider running with --forecast.")
+
+    if main(args_dict):
+        sys.exit(1)
@@ -2,73 +2,30 @@
 This file conducts the solweig pipeline, so preprocessing and solweig calls,
 for all tiles in a given dataset. Preprocessing consists of wall height and aspect raster
 creation for given DSM files and sky view factor calculation for the given DSM files.
+All three run as stages of the stage graph (see stage_graph.py), stages with unchanged
+inputs are skipped.
 """
 
 import argparse
-import glob
 import logging
 import os
-import signal
-import sys
-from functools import partial
-from logging.handlers import QueueHandler, QueueListener
-from multiprocessing import Pool, Queue
 
-import numpy as np
 import psutil
-from jinja2 import Environment, FileSystemLoader
 from osgeo import gdal
 
-from umep_wrapper.run_solweig_model import run_solweig
-from umep_wrapper.run_solweig_prepare import (
-    run_svf_calculator,
-    run_wall_height_aspect_calculator,
+from umep_wrapper.solweig_multi_processing import TEMPLATE_PATH, get_process_folder
+from umep_wrapper.stage_graph import (
+    SOLWEIG_STAGE,
+    SVF_STAGE,
+    WALL_STAGE,
+    run_stage_graph,
 )
+from umep_wrapper.tile_catalog import get_catalog
+from umep_wrapper.tiling import check_tilings
 
 gdal.UseExceptions()
 
 
-# https://stackoverflow.com/a/34964369
-def worker_init(q: Queue) -> None:
-    """
-    Initialize worker and queue handler
-
-    Args:
-        q (Queue): a queue object to initialize the queue handler
-    """
-
-    # all records from worker processes go to qh and then into q
-    qh = QueueHandler(q)
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    logger.addHandler(qh)
-
-
-def logger_init(log_file_path: str) -> tuple[QueueListener, Queue]:
-    """
-    Initialize queue logging
-
-    Args:
-        log_file_path (str): path to logging output file
-    """
-
-    q = Queue()
-    # this is the handler for all log records
-    handler = logging.FileHandler(log_file_path)
-    handler.setFormatter(logging.Formatter("%(asctime)s;%(msecs)d;%(message)s"))
-
-    # ql gets records from the queue and sends them to the handler
-    ql = QueueListener(q, handler)
-    ql.start()
-
-    logger = logging.getLogger("runtime_logger")
-    logger.setLevel(logging.INFO)
-    # add the handler to the logger so records from this process are handled
-    logger.addHandler(handler)
-
-    return ql, q
-
-
 def main(args: dict[str, str]) -> None:
     """
     Run SOLWEIG with the given settings for multiple tiles in parallel.
@@ -77,41 +34,8 @@ def main(args: dict[str, str]) -> None:
         args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
     """
 
-    data_dict = {}
-
-    normalized_dsm_path = os.path.normpath(
-        os.path.join(args["data_path"], args["dsm_folder"], "*")
-    )
-
-    normalized_cdsm_path = os.path.normpath(
-        os.path.join(args["data_path"], args["cdsm_folder"], "*")
-    )
-
-    normalized_dtm_path = os.path.normpath(
-        os.path.join(args["data_path"], args["dtm_folder"], "*")
-    )
-
-    normalized_lc_path = ""
-    if args["lc_folder"] is not None:
-        normalized_lc_path = os.path.join(args["data_path"], args["lc_folder"], "*")
-
-    template_path = os.path.normpath(os.path.join(os.getcwd(), "config_templates"))
-    print(template_path)
-
-    normalized_metfile_path = os.path.normpath(args["met_file"])
-
-    resolution = args["dsm_folder"].split("_")[-3]
-    size = args["dsm_folder"].split("_")[-1]
-
-    solweig_process_folder = f"SOLWEIG_{resolution}_{size}"
-    solweig_process_path = os.path.normpath(
-        os.path.join(args["output_path"], solweig_process_folder)
-    )
-    if not os.path.exists(solweig_process_path):
-        os.mkdir(solweig_process_path)
-
-    log_file_path = os.path.join(
-        solweig_process_path, f"solweig_processing_{resolution}_{size}_log.log"
+    solweig_process_folder, solweig_process_path, log_file_path = get_process_folder(
+        args
     )
 
     # setup logger
@@ -125,43 +49,22 @@ def main(args: dict[str, str]) -> None:
     runtime_logger = logging.getLogger("runtime_logger")
     runtime_logger.info("step;tile;runtime;cpu;vmem;vmem_all;pid")
 
-    dsm_files = sorted(glob.glob(normalized_dsm_path))
-    cdsm_files = sorted(glob.glob(normalized_cdsm_path))
-    dtm_files = sorted(glob.glob(normalized_dtm_path))
-    if args["lc_folder"] is not None:
-        lc_files = sorted(glob.glob(normalized_lc_path))
-
     # extract filenames for further processing
-    for dsm_file in dsm_files:
-        if ".tif" not in dsm_file:
+    data_dict = {}
+    for y_x, record in get_catalog(args).items():
+        # tiles outside the city's borders (fully masked) are flagged in the catalog
+        if record.is_empty:
+            logging.info("skip;%s;-1;-1;-1;-1;%d", y_x, os.getpid())
             continue
-        dsm_file = os.path.normpath(dsm_file)
-        dsm_file = dsm_file.split(os.sep)[-1]
-        # DSM file naming pattern: DO_DTM+DSM_mosaic_<reso>_<y>_<x>.tif
-        yx_coords = dsm_file.split(".")[0].split("_")[-2:]
-        y_x = yx_coords[0] + "_" + yx_coords[1]
-
-        matching_cdsm = [s for s in cdsm_files if y_x in s]
-        assert len(matching_cdsm) == 1
-        matching_cdsm = matching_cdsm[0].split(os.sep)[-1]
-
-        matching_dtm = [s for s in dtm_files if y_x in s]
-        assert len(matching_dtm) == 1
-        matching_dtm = matching_dtm[0].split(os.sep)[-1]
-
         data_dict[y_x] = {
-            "dsm": dsm_file,
-            "cdsm": matching_cdsm,
-            "dtm": matching_dtm,
-            "lc_path": None,
-        }
-
-        if args["lc_folder"] is not None:
-            matching_lc = [s for s in lc_files if y_x in s]
-            assert len(matching_lc) == 1
+            "dsm": os.path.basename(record.dsm),
+            "cdsm": os.path.basename(record.cdsm),
+            "dtm": os.path.basename(record.dtm),
             # since land cover is optional, lc-path is not build during rendering
             # but here, so add full path to data_dict
-            data_dict[y_x]["lc_path"] = matching_lc[0]
+            "lc_path": record.lc,
+            "valid_fraction": record.valid_fraction,
+        }
 
     print(
         f"Memory usage: \n"
@@ -170,170 +73,17 @@ def main(args: dict[str, str]) -> None:
         f"vmem: {psutil.virtual_memory()}"
     )  # physical memory usage
 
-    # execute solweig and required preprocesses for each tile (k= yx coordinates)
-    # for k, v in data_dict.items():
-    q_listener, q = logger_init(log_file_path)
-
-    func = partial(
-        process_tile,
+    # execute the stages for each tile (k= yx coordinates), unchanged stages are skipped
+    run_stage_graph(
         args,
-        template_path,
-        normalized_metfile_path,
+        [WALL_STAGE, SVF_STAGE, SOLWEIG_STAGE],
+        TEMPLATE_PATH,
         solweig_process_folder,
         solweig_process_path,
-        #    runtime_logger,
-    )
-
-    signal.signal(signal.SIGTERM, lambda signum, stack_frame: sys.exit(1))
-    # maxtasksprchild set to one to contain memory issue: https://stackoverflow.com/a/54975030
-    with Pool(processes=64, initializer=worker_init, initargs=[q]) as pool:
-        result = pool.map_async(func, data_dict.items())
-        try:
-            _ = result.get()
-        except Exception as e:
-            print(f"Failed with {e}")
-        # from https://superfastpython.com/multiprocessing-pool-map_async/
-        # close the process pool
-        pool.close()
-        # wait for all tasks to complete and processes to close
-        pool.join()
-
-    q_listener.stop()
-
-
-def process_tile(
-    args: dict,
-    template_path: str,
-    normalized_metfile_path: str,
-    solweig_process_folder: str,
-    solweig_process_path: str,
-    k_v_pair: tuple[str, dict],
-):
-    """
-    Run SOLWEIG for a single tile.
-
-    Args:
-        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
-        template_path (str): folder which contains the SOLWEIG parameter templates
-        normalized_metfile_path (str): absolute path to metfile
-        solweig_process_folder (str): folder for SOLWEIG output
-        solweig_process_folder (str): location of folder for SOLWEIG output
-        k_v_pair (tuple): maps tile id 'y_x' to the respective surface model tiles
-    """
-
-    os.environ["PROJ_LIB"] = args["proj_lib"]
-
-    k, v = k_v_pair[0], k_v_pair[1]
-
-    env = Environment(
-        loader=FileSystemLoader(template_path), trim_blocks=True, lstrip_blocks=True
-    )
-
-    # 1: collect data for tile
-    data = {
-        "data_path": args["data_path"],
-        "dsm_folder": args["dsm_folder"],
-        "cdsm_folder": args["cdsm_folder"],
-        "dtm_folder": args["dtm_folder"],
-        "preprocess_data_path": args["preprocess_data_path"],
-        "output_path": args["output_path"],
-        "dsm_file": v["dsm"],
-        "cdsm_file": v["cdsm"],
-        "dtm_file": v["dtm"],
-        "lc_path": v["lc_path"],
-        "y_x": k,
-        "met_file_path": normalized_metfile_path,
-        "solweig_process_folder": solweig_process_folder,
-    }
-
-    # check if dsm is outside the city's borders (whether the tile was fully masked)
-    cdsm_path = os.path.join(data["data_path"], data["cdsm_folder"], data["cdsm_file"])
-    cdsm_tiff = gdal.Open(cdsm_path, gdal.GA_ReadOnly).ReadAsArray()
-
-    cdsm_values = np.asarray(cdsm_tiff)
-    if (cdsm_values == np.zeros(cdsm_values.shape)).all():
-        logging.info("skip;%s;-1;-1;-1;-1;%d", k, os.getpid())
-        return
-
-    # create output path for process results
-    tile_output_path = os.path.normpath(os.path.join(solweig_process_path, k))
-    if not os.path.exists(tile_output_path):
-        os.mkdir(tile_output_path)
-
-    # 2: run wall_calc
-    # 2.a: read config file template
-    template = env.get_template("wall_parameter_template.yaml")
-    config_file = os.path.join(tile_output_path, f"wall_parameter_{k}.yaml")
-    # 2.b: write tile specific data in template to create individual config file
-    with open(config_file, "w") as file:
-        file.write(template.render(data))
-    # 2.c: run wall height and aspect algorithm
-    output_file, runtime = run_wall_height_aspect_calculator(config_file)
-
-    logging.info(
-        f"wall;{k};{round(runtime,4)};{psutil.cpu_percent()};"
-        f"{psutil.virtual_memory().percent};{psutil.virtual_memory()};{os.getpid()}"
-    )
-
-    print(f"Wall calc successful, output is: {output_file}")
-    print(
-        f"Memory usage: \n"
-        f"cpu [%]: {psutil.cpu_percent()}\n"
-        f"vmem [%]:{psutil.virtual_memory().percent}\n"  # percentage of used RAM
-        f"vmem: {psutil.virtual_memory()}"
-    )  # physical memory usage
-
-    # 3: run svf calculation with config
-    # 3.a: read config file template
-    template = env.get_template("svf_parameter_template.yaml")
-    config_file = os.path.join(tile_output_path, f"svf_parameter_{k}.yaml")
-    # 3.b: write tile specific data in template to create individual config file
-    with open(config_file, "w") as file:
-        file.write(template.render(data))
-    # 3.c: run svf algorithm
-    output_file, runtime = run_svf_calculator(config_file)
-
-    logging.info(
-        f"svf;{k};{round(runtime,4)};{psutil.cpu_percent()};"
-        f"{psutil.virtual_memory().percent};{psutil.virtual_memory()};{os.getpid()}"
+        data_dict,
+        log_file_path,
     )
 
-    print(f"svf calc successful, output is: {output_file}")
-    print(
-        f"Memory usage: \n"
-        f"cpu [%]: {psutil.cpu_percent()}\n"
-        f"vmem [%]:{psutil.virtual_memory().percent}\n"  # percentage of used RAM
-        f"vmem: {psutil.virtual_memory()}"
-    )  # physical memory usage
-
-    # do the same for solweig
-    # since solweig relies on met data and this is updated every x timesteps,
-    # solweig should be run separately on the long run
-    # for timing the runtime it might make sense to run it in this pipeline
-
-    # 4: run solweig calculation with config
-    # 4.a: read config file template
-    template = env.get_template("solweig_pipeline_parameter_template.yaml")
-    config_file = os.path.join(tile_output_path, f"solweig_parameter_{k}.yaml")
-    # 4.b: write tile specific data in template to create individual config file
-    with open(config_file, "w") as file:
-        file.write(template.render(data))
-    # 4.c: run solweig algorithm
-    output_file, runtime = run_solweig(config_file)
-
-    logging.info(
-        f"solweig;{k};{round(runtime,4)};{psutil.cpu_percent()};"
-        f"{psutil.virtual_memory().percent};{psutil.virtual_memory()};{os.getpid()}"
-    )
-
-    print(f"solweig calc successful, output is: {output_file}")
-    print(
-        f"Memory usage: \n"
-        f"cpu [%]: {psutil.cpu_percent()}\n"
-        f"vmem [%]:{psutil.virtual_memory().percent}\n"  # percentage of used RAM
-        f"vmem: {psutil.virtual_memory()}"
-    )  # physical memory usage
-
 
 def check_paths(
     data_path: str,
@@ -392,23 +142,10 @@ def check_paths(
     if not os.path.isdir(output_path):
         raise FileNotFoundError(f"Output path {output_path} does not exist.")
 
-    # check matching
-    # DSM folder format: DO_DTM+DSM_mosaic_<reso>_tiles_<size>+<overlap>
-    dsm_resolution = dsm_folder.split("_")[-3]
-    # DTM folder format: DO_DTM_mosaic_<reso>_bilinear_<size>+<overlap>
-    dtm_resolution = dtm_folder.split("_")[-3]
-    if dsm_resolution != dtm_resolution:
-        raise RuntimeError(
-            f"Resolutions of DSM and DTM do not match: "
-            f"{dsm_resolution} (DSM) vs. {dtm_resolution} (DTM)"
-        )
-
-    dsm_size = dsm_folder.split("_")[-1]
-    dtm_size = dtm_folder.split("_")[-1]
-    if dsm_size != dtm_size:
-        raise RuntimeError(
-            f"Sizes of DSM and DTM do not match: {dsm_size} (DSM) vs. {dtm_size}(DTM)"
-        )
+    # check matching of resolution, size and overlap
+    check_tilings(
+        data_path, {"DSM": dsm_folder, "CDSM": cdsm_folder, "DTM": dtm_folder}
+    )
 
 
 if __name__ == "__main__":
@@ -463,6 +200,20 @@ if __name__ == "__main__":
     parser.add_argument(
         "--output_path", type=str, required=True, help="Path to output folder"
     )
+    parser.add_argument(
+        "--tile_catalog",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to the tile catalog, defaults to a catalog per tile folders next to the DSM folder",
+    )
+    parser.add_argument(
+        "--max_processes",
+        type=int,
+        required=False,
+        default=None,
+        help="Upper bound of parallel tiles, defaults to the CPU limit of the container",
+    )
 
     args_dict = vars(parser.parse_args())
 
@@ -0,0 +1,390 @@
+"""
+This file provides a resident SOLWEIG worker service.
+
+The service is started once (e.g. by the container) and keeps a pool of worker
+processes alive. Every worker imports the UMEP modules, initializes the SOLWEIG
+algorithm and loads the parameter templates only once. Hourly jobs of the form
+"run tile set X with metfile Y" are submitted over a local unix socket, so an
+hourly run no longer pays interpreter, import and GDAL/PROJ startup costs per tile.
+
+Only the user running the service can submit jobs: the socket is created with
+mode 0600 and connections are authenticated with a key, taken from the
+environment variable SOLWEIG_SERVICE_AUTHKEY if set (e.g. a docker secret) or
+generated per service start and written to <socket>.key with mode 0600.
+
+Usage:
+    python umep_wrapper/solweig_service.py serve --socket=/tmp/solweig_service.sock
+    python umep_wrapper/solweig_service.py submit --socket=/tmp/solweig_service.sock \\
+        <arguments of solweig_multi_processing.py>
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import Pool, Queue
+from multiprocessing.connection import Client, Listener
+
+from osgeo import gdal, osr
+
+from umep_wrapper.mosaic_writer import create_mosaics, get_mosaic_hours
+from umep_wrapper.run_solweig_model import get_solweig_algorithm
+from umep_wrapper.run_state import RUN_STATE_FILE, RunState, get_run_key
+from umep_wrapper.scratch import remove_stale_scratch
+from umep_wrapper.solweig_multi_processing import (
+    TEMPLATE_PATH,
+    add_arguments,
+    check_paths,
+    collect_tiles,
+    dispatch_tiles,
+    get_base_config,
+    get_history_path,
+    get_process_folder,
+    process_tile,
+)
+from umep_wrapper.tile_scheduler import (
+    AdaptiveTileScheduler,
+    update_runtime_history,
+)
+from umep_wrapper.tracing import reset_trace
+from utils.load_metfile import read_metfile_hours
+
+gdal.UseExceptions()
+
+DEFAULT_SOCKET = "/tmp/solweig_service.sock"
+# exit code of submit if no service listens on the socket, e.g. a socket left
+# behind by a killed service, the caller falls back to solweig_multi_processing.py
+SERVICE_UNAVAILABLE = 3
+# environment variable of the key authenticating the submitting processes, if
+# unset the service generates a key and writes it next to the socket
+AUTHKEY_ENV = "SOLWEIG_SERVICE_AUTHKEY"
+AUTHKEY_SUFFIX = ".key"
+
+
+def get_authkey(socket_path: str, create: bool = False) -> bytes:
+    """
+    Get the key authenticating the connections to the service.
+
+    Args:
+        socket_path (str): path of the unix socket of the service
+        create (bool): whether to generate a new key file (on service start),
+            unless the key is set in the environment
+
+    Returns:
+        the key
+
+    Raises:
+        FileNotFoundError: thrown if neither the environment nor a key file of a
+            running service provide the key
+    """
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode()
+    key_path = socket_path + AUTHKEY_SUFFIX
+    if not create:
+        with open(key_path, "rb") as file:
+            return file.read()
+    authkey = os.urandom(32)
+    if os.path.exists(key_path):
+        os.remove(key_path)
+    # readable by the user of the service only
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(authkey)
+    return authkey
+
+
+def service_worker_init(q: Queue, proj_lib: str) -> None:
+    """
+    Initialize a resident worker: queue logging, PROJ, templates and SOLWEIG.
+
+    Args:
+        q (Queue): a queue object to initialize the queue handler
+        proj_lib (str): path to folder that contains proj.db
+    """
+    qh = QueueHandler(q)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(qh)
+
+    if proj_lib is not None:
+        os.environ["PROJ_LIB"] = proj_lib
+
+    # load the PROJ database once, so the first tile does not pay for it
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(25832)
+
+    # parse the template parameters and initialize the algorithm of this worker
+    get_base_config(TEMPLATE_PATH)
+    get_solweig_algorithm()
+
+
+def _run_warm_tile(
+    args: dict,
+    normalized_metfile_path: str,
+    solweig_process_folder: str,
+    solweig_process_path: str,
+    k_v_pair: tuple[str, dict],
+):
+    """
+    Run SOLWEIG for a single tile with the warm algorithm of the worker.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        normalized_metfile_path (str): absolute path to metfile
+        solweig_process_folder (str): folder for SOLWEIG output
+        solweig_process_path (str): location of folder for SOLWEIG output
+        k_v_pair (tuple): maps tile id 'y_x' to the respective surface model tiles
+    """
+    return process_tile(
+        args,
+        TEMPLATE_PATH,
+        normalized_metfile_path,
+        solweig_process_folder,
+        solweig_process_path,
+        k_v_pair,
+        algo=get_solweig_algorithm(),
+    )
+
+
+def run_job(pool: Pool, scheduler: AdaptiveTileScheduler, q: Queue, job: dict) -> dict:
+    """
+    Run SOLWEIG for the tile set of a job on the resident pool.
+
+    Args:
+        pool (Pool): pool of initialized workers
+        scheduler (AdaptiveTileScheduler): scheduler admitting the tiles to the pool
+        q (Queue): queue the workers send their log records to
+        job (dict): job with the SOLWEIG run arguments ('args') and an optional
+            list of tile ids ('tiles'), all tiles are processed if not given
+
+    Returns:
+        dict with the job status, number of processed tiles and runtime
+    """
+    start_time = time.time()
+    args = job["args"]
+
+    check_paths(
+        args["data_path"],
+        args["dsm_folder"],
+        args["cdsm_folder"],
+        args["dtm_folder"],
+        args["lc_folder"],
+        args["met_file"],
+        args["preprocess_data_path"],
+        args["output_path"],
+    )
+
+    solweig_process_folder, solweig_process_path, log_file_path = get_process_folder(
+        args
+    )
+
+    # route the worker records of this job into the log file of the run
+    handler = logging.FileHandler(log_file_path, mode="w")
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s;%(msecs)d;%(message)s", datefmt="%H:%M:%S")
+    )
+    handler.handle(
+        logging.makeLogRecord({"msg": "step;tile;runtime;cpu;vmem;vmem_all;pid"})
+    )
+    q_listener = QueueListener(q, handler)
+    q_listener.start()
+    reset_trace(solweig_process_path)
+
+    # scratch directories of workers which were killed, e.g. by the OOM killer
+    remove_stale_scratch(args.get("scratch_root"))
+
+    met_file = os.path.normpath(args["met_file"])
+    run_state = RunState(
+        os.path.join(solweig_process_path, RUN_STATE_FILE),
+        get_run_key(met_file, args),
+    )
+    data_dict = collect_tiles(args)
+    # new mosaics lack the windows of tiles completed in a previous invocation
+    new_mosaics = []
+    if args.get("mosaic_path") is not None:
+        new_mosaics = create_mosaics(
+            args,
+            args["mosaic_path"],
+            get_mosaic_hours(read_metfile_hours(met_file)),
+            rerun=args.get("rerun", False),
+        )
+    if job.get("tiles") is not None:
+        data_dict = {k: v for k, v in data_dict.items() if k in set(job["tiles"])}
+
+    func = partial(
+        _run_warm_tile,
+        args,
+        met_file,
+        solweig_process_folder,
+        solweig_process_path,
+    )
+
+    history_path = get_history_path(args, solweig_process_path)
+    try:
+        results = dispatch_tiles(
+            pool,
+            scheduler,
+            func,
+            args,
+            data_dict,
+            run_state,
+            history_path,
+            reset=bool(new_mosaics),
+        )
+    finally:
+        q_listener.stop()
+        handler.close()
+    update_runtime_history(history_path, log_file_path)
+
+    failed = sorted(k for k, v in results.items() if isinstance(v, Exception))
+    status = "failed" if failed else "ok"
+    message = f"failed tiles: {', '.join(failed)}" if failed else ""
+
+    return {
+        "status": status,
+        "message": message,
+        "tiles": len(results),
+        "runtime": round(time.time() - start_time, 4),
+    }
+
+
+def _start_pool(processes: int, q: Queue, proj_lib: str) -> Pool:
+    """Starts the resident pool of initialized workers."""
+    return Pool(
+        processes=processes, initializer=service_worker_init, initargs=[q, proj_lib]
+    )
+
+
+def serve(socket_path: str, processes: int = None, proj_lib: str = None) -> None:
+    """
+    Start the resident pool and process submitted jobs one after another.
+
+    Args:
+        socket_path (str): path of the unix socket to listen on
+        processes (int): number of resident worker processes, defaults to the CPU
+            limit of the container
+        proj_lib (str): path to folder that contains proj.db
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    q = Queue()
+    signal.signal(signal.SIGTERM, lambda signum, stack_frame: sys.exit(0))
+
+    # the scheduler is kept alive as well, so the measured tile memory is reused
+    scheduler = AdaptiveTileScheduler(max_processes=processes)
+    processes = scheduler.processes
+
+    pool = _start_pool(processes, q, proj_lib)
+    authkey = get_authkey(socket_path, create=True)
+    with Listener(socket_path, family="AF_UNIX", authkey=authkey) as listener:
+        # other users may neither connect nor submit jobs
+        os.chmod(socket_path, 0o600)
+        print(f"SOLWEIG service listening on {socket_path} with {processes} workers")
+        try:
+            while True:
+                with listener.accept() as conn:
+                    job = conn.recv()
+                    if job.get("command") == "shutdown":
+                        conn.send({"status": "ok", "message": "shutdown"})
+                        break
+                    # a failing (or malformed) job must not stop the service
+                    try:
+                        print(f"Received job for metfile {job['args']['met_file']}")
+                        result = run_job(pool, scheduler, q, job)
+                    except Exception as e:
+                        print(f"Job failed: {e!r}")
+                        result = {"status": "failed", "message": repr(e)}
+                    conn.send(result)
+                # workers of timed out tiles still hang and occupy their slots
+                if scheduler.hung:
+                    print(f"Recycling the pool, {len(scheduler.hung)} workers hang")
+                    pool.terminate()
+                    pool.join()
+                    pool = _start_pool(processes, q, proj_lib)
+                    scheduler.recycle()
+        finally:
+            if scheduler.hung:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+            # the socket itself is removed by the listener
+            if os.path.exists(socket_path + AUTHKEY_SUFFIX):
+                os.remove(socket_path + AUTHKEY_SUFFIX)
+
+
+def submit(socket_path: str, job: dict) -> dict:
+    """
+    Submit a job to a running service and wait for its result.
+
+    Args:
+        socket_path (str): path of the unix socket of the service
+        job (dict): job to run, see run_job
+
+    Returns:
+        the result dict sent by the service
+
+    Raises:
+        ConnectionRefusedError: thrown if no service listens on the socket
+        FileNotFoundError: thrown if the socket or the key file does not exist
+        PermissionError: thrown if the service runs as another user
+    """
+    authkey = get_authkey(socket_path)
+    with Client(socket_path, family="AF_UNIX", authkey=authkey) as conn:
+        conn.send(job)
+        return conn.recv()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start the worker service")
+    serve_parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET)
+    serve_parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of resident workers, defaults to the CPU limit of the container",
+    )
+    serve_parser.add_argument(
+        "--proj_lib", type=str, default=os.environ.get("PROJ_LIB")
+    )
+
+    submit_parser = add_arguments(
+        subparsers.add_parser("submit", help="Submit a tile set to the service")
+    )
+    submit_parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET)
+    submit_parser.add_argument(
+        "--tiles", type=str, nargs="+", default=None, help="Tile ids 'y_x' to run"
+    )
+
+    subparsers.add_parser("shutdown", help="Stop the worker service").add_argument(
+        "--socket", type=str, default=DEFAULT_SOCKET
+    )
+
+    args_dict = vars(parser.parse_args())
+
+    match args_dict.pop("command"):
+        case "serve":
+            serve(args_dict["socket"], args_dict["processes"], args_dict["proj_lib"])
+        case "submit":
+            socket_path = args_dict.pop("socket")
+            tiles = args_dict.pop("tiles")
+            if args_dict["proj_lib"] is not None:
+                args_dict["proj_lib"] = os.path.abspath(args_dict["proj_lib"])
+            try:
+                result = submit(socket_path, {"args": args_dict, "tiles": tiles})
+            except (ConnectionRefusedError, FileNotFoundError, PermissionError) as e:
+                print(f"SOLWEIG service unavailable at {socket_path}: {e!r}")
+                sys.exit(SERVICE_UNAVAILABLE)
+            print(result)
+            if result["status"] != "ok":
+                sys.exit(1)
+        case "shutdown":
+            print(submit(args_dict["socket"], {"command": "shutdown"}))
@@ -0,0 +1,375 @@
+"""
+This file holds the stage graph engine of the tile processing.
+
+Wall height/aspect, SVF and SOLWEIG are declared as stages: a config template,
+the input and output files named in the rendered config and the stages they
+depend on. The engine runs the stages level by level on one process pool, so
+independent stages (e.g. wall and SVF) run in parallel across tiles and stages.
+
+Every stage records a hash of its rendered config and the content of its input
+files in the tile folder. A stage whose hash did not change and whose outputs
+exist is skipped, e.g. wall and SVF after the DSM/CDSM tiles were processed once.
+Since the outputs of a stage are inputs of its dependents, a changed DSM also
+invalidates all downstream stages.
+"""
+
+import hashlib
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+from dataclasses import dataclass
+from functools import partial
+from multiprocessing import Pool
+
+import psutil
+import yaml
+
+from umep_wrapper.solweig_multi_processing import (
+    get_template_environment,
+    logger_init,
+    worker_init,
+)
+from umep_wrapper.tile_scheduler import (
+    RUNTIME_HISTORY_FILE,
+    AdaptiveTileScheduler,
+    load_runtime_history,
+    order_longest_first,
+    update_runtime_history,
+)
+from umep_wrapper.tracing import get_trace_path, reset_trace, trace_stage
+
+# suffix of the hash record of a stage within the tile folder
+RECORD_SUFFIX = "_stage.json"
+# block size for hashing input files
+HASH_BLOCK_SIZE = 1024**2
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    Declaration of a processing stage of a tile.
+
+    The files are format strings of the rendered config entries, e.g. '{INPUT_DSM}'.
+    The runner is given as 'module:function', is imported in the worker and called
+    with the path of the rendered config file, returning (output, runtime).
+    """
+
+    name: str
+    template: str
+    runner: str
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+    depends: tuple[str, ...] = ()
+
+
+WALL_STAGE = Stage(
+    name="wall",
+    template="wall_parameter_template.yaml",
+    runner="umep_wrapper.run_solweig_prepare:run_wall_height_aspect_calculator",
+    inputs=("{INPUT}",),
+    outputs=("{OUTPUT_HEIGHT}", "{OUTPUT_ASPECT}"),
+)
+SVF_STAGE = Stage(
+    name="svf",
+    template="svf_parameter_template.yaml",
+    runner="umep_wrapper.run_solweig_prepare:run_svf_calculator",
+    inputs=("{INPUT_DSM}", "{INPUT_CDSM}", "{INPUT_TDSM}"),
+    outputs=("{OUTPUT_DIR}/svfs.zip",),
+)
+SOLWEIG_STAGE = Stage(
+    name="solweig",
+    template="solweig_pipeline_parameter_template.yaml",
+    runner="umep_wrapper.run_solweig_model:run_solweig",
+    inputs=(
+        "{INPUT_DSM}",
+        "{INPUT_CDSM}",
+        "{INPUT_DEM}",
+        "{INPUT_SVF}",
+        "{INPUT_HEIGHT}",
+        "{INPUT_ASPECT}",
+        "{INPUTMET}",
+    ),
+    outputs=("{OUTPUT_DIR}/Tmrt_average.tif",),
+    depends=("wall", "svf"),
+)
+
+
+def get_stage_levels(stages: list[Stage]) -> list[list[Stage]]:
+    """
+    Sort the stages into levels, every stage depends only on stages of lower levels.
+
+    Dependencies on stages which are not part of the given stages are assumed to
+    be computed already.
+
+    Args:
+        stages (list): stages to run
+
+    Returns:
+        list of levels, each a list of stages which can run in parallel
+
+    Raises:
+        ValueError: thrown if the dependencies of the stages form a cycle
+    """
+    names = {stage.name for stage in stages}
+    remaining = list(stages)
+    done = set()
+    levels = []
+    while remaining:
+        level = [
+            stage
+            for stage in remaining
+            if all(dep in done or dep not in names for dep in stage.depends)
+        ]
+        if not level:
+            raise ValueError(
+                f"Cyclic stage dependencies: {[stage.name for stage in remaining]}"
+            )
+        levels.append(level)
+        done.update(stage.name for stage in level)
+        remaining = [stage for stage in remaining if stage not in level]
+    return levels
+
+
+def get_template_data(args: dict, process_folder: str, k: str, v: dict) -> dict:
+    """
+    Collect the template variables of a tile.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        process_folder (str): folder for the stage outputs within args['output_path']
+        k (str): tile id 'y_x'
+        v (dict): file names of the surface model tiles
+
+    Returns:
+        dict with the variables used by the stage templates
+    """
+    met_file = args.get("met_file")
+    return {
+        "data_path": args["data_path"],
+        "dsm_folder": args["dsm_folder"],
+        "cdsm_folder": args["cdsm_folder"],
+        "dtm_folder": args.get("dtm_folder"),
+        "preprocess_data_path": args.get("preprocess_data_path"),
+        "output_path": args["output_path"],
+        "dsm_file": v["dsm"],
+        "cdsm_file": v["cdsm"],
+        "dtm_file": v.get("dtm"),
+        "lc_path": v.get("lc_path"),
+        "y_x": k,
+        "met_file_path": os.path.normpath(met_file) if met_file else None,
+        "solweig_process_folder": process_folder,
+    }
+
+
+def get_stage_files(patterns: tuple[str, ...], config: dict) -> list[str]:
+    """Returns the file paths of the given patterns for a rendered config."""
+    return [os.path.normpath(pattern.format(**config)) for pattern in patterns]
+
+
+def hash_file(path: str, memo: dict) -> str:
+    """
+    Get the sha256 of the content of a file.
+
+    Args:
+        path (str): path of the file
+        memo (dict): maps paths to [size:mtime, digest] of previous runs, the file
+            is only read again if its size or modification time changed
+
+    Returns:
+        hex digest, 'missing' for paths which are not files (e.g. 'None')
+    """
+    if not os.path.isfile(path):
+        return "missing"
+    stat = os.stat(path)
+    stat_key = f"{stat.st_size}:{stat.st_mtime_ns}"
+    if path in memo and memo[path][0] == stat_key:
+        return memo[path][1]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(HASH_BLOCK_SIZE):
+            sha.update(block)
+    memo[path] = [stat_key, sha.hexdigest()]
+    return memo[path][1]
+
+
+def get_stage_hash(stage: Stage, config_text: str, config: dict, memo: dict) -> str:
+    """
+    Get the hash of a stage of a tile over its config and its input files.
+
+    Args:
+        stage (Stage): stage to hash
+        config_text (str): rendered config of the stage
+        config (dict): parsed config of the stage
+        memo (dict): file digests of previous runs, see hash_file
+
+    Returns:
+        hex digest
+    """
+    sha = hashlib.sha256()
+    sha.update(f"{stage.name};{stage.runner}\n{config_text}".encode())
+    for path in get_stage_files(stage.inputs, config):
+        sha.update(f"{path};{hash_file(path, memo)}\n".encode())
+    return sha.hexdigest()
+
+
+def load_record(record_path: str) -> dict | None:
+    """Returns the hash record of a stage or None if the stage never finished."""
+    try:
+        with open(record_path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_record(record_path: str, record: dict) -> None:
+    """Writes the hash record of a stage, without exposing partial files."""
+    tmp_path = f"{record_path}.{os.getpid()}"
+    with open(tmp_path, "w") as file:
+        json.dump(record, file, indent=1)
+    os.replace(tmp_path, record_path)
+
+
+def run_stage(
+    args: dict,
+    template_path: str,
+    process_folder: str,
+    process_path: str,
+    item: tuple[tuple[str, str], tuple[Stage, dict]],
+):
+    """
+    Run a single stage of a tile, unless its inputs did not change.
+
+    Outputs of earlier versions without a hash record are adopted, so existing
+    preprocessing results are not recomputed.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        template_path (str): folder which contains the parameter templates
+        process_folder (str): folder for the stage outputs within args['output_path']
+        process_path (str): location of the folder for the stage outputs
+        item (tuple): ((tile id, stage name), (stage, surface model tiles))
+
+    Returns:
+        the output of the stage runner, None if the stage was skipped
+    """
+    if args.get("proj_lib") is not None:
+        os.environ["PROJ_LIB"] = args["proj_lib"]
+
+    (k, _), (stage, v) = item
+
+    # create output path for process results
+    tile_output_path = os.path.normpath(os.path.join(process_path, k))
+    os.makedirs(tile_output_path, exist_ok=True)
+
+    # 1: render the config of the stage
+    template = get_template_environment(template_path).get_template(stage.template)
+    config_text = template.render(get_template_data(args, process_folder, k, v))
+    config = yaml.safe_load(os.path.expandvars(config_text))
+
+    # 2: skip the stage if its inputs are unchanged
+    record_path = os.path.join(tile_output_path, f"{stage.name}{RECORD_SUFFIX}")
+    record = load_record(record_path)
+    memo = record["files"] if record is not None else {}
+    stage_hash = get_stage_hash(stage, config_text, config, memo)
+    outputs_exist = all(
+        os.path.exists(path) for path in get_stage_files(stage.outputs, config)
+    )
+    if outputs_exist and (record is None or record["hash"] == stage_hash):
+        print(f"{stage.name} inputs unchanged for {k}, skipping")
+        save_record(record_path, {"hash": stage_hash, "files": memo})
+        return None
+
+    # 3: write the config file and run the stage
+    config_file = os.path.join(tile_output_path, f"{stage.name}_parameter_{k}.yaml")
+    with open(config_file, "w") as file:
+        file.write(config_text)
+    module_name, function_name = stage.runner.split(":")
+    runner = getattr(importlib.import_module(module_name), function_name)
+    with trace_stage(get_trace_path(process_path), stage.name, k):
+        output, runtime = runner(config_file)
+
+    logging.info(
+        f"{stage.name};{k};{round(runtime,4)};{psutil.cpu_percent()};"
+        f"{psutil.virtual_memory().percent};{psutil.virtual_memory()};{os.getpid()}"
+    )
+    print(f"{stage.name} calc successful, output is: {output}")
+
+    # record the hash only after a successful run
+    save_record(record_path, {"hash": stage_hash, "files": memo})
+    return output
+
+
+def run_stage_graph(
+    args: dict,
+    stages: list[Stage],
+    template_path: str,
+    process_folder: str,
+    process_path: str,
+    data_dict: dict[str, dict],
+    log_file_path: str,
+) -> dict:
+    """
+    Run the given stages for all tiles in parallel.
+
+    Stages of a tile are skipped if a stage they depend on failed for that tile.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        stages (list): stages to run
+        template_path (str): folder which contains the parameter templates
+        process_folder (str): folder for the stage outputs within args['output_path']
+        process_path (str): location of the folder for the stage outputs
+        data_dict (dict): maps tile id 'y_x' to the respective surface model tiles
+        log_file_path (str): path to the runtime log of the run
+
+    Returns:
+        dict mapping (tile id, stage name) to the stage results or raised exceptions
+    """
+    q_listener, q = logger_init(log_file_path)
+    reset_trace(process_path)
+
+    func = partial(run_stage, args, template_path, process_folder, process_path)
+
+    signal.signal(signal.SIGTERM, lambda signum, stack_frame: sys.exit(1))
+    # concurrency follows the cgroup limits and the measured memory per tile
+    scheduler = AdaptiveTileScheduler(max_processes=args.get("max_processes"))
+    print(
+        f"Scheduling tiles on up to {scheduler.processes} processes "
+        f"(memory limit: {scheduler.memory_limit / 1024**3:.1f} GiB)"
+    )
+
+    history_path = os.path.join(process_path, RUNTIME_HISTORY_FILE)
+    history = load_runtime_history(history_path)
+    results = {}
+    with Pool(
+        processes=scheduler.processes, initializer=worker_init, initargs=[q]
+    ) as pool:
+        for level in get_stage_levels(stages):
+            # submit the slowest stages and tiles first
+            level = sorted(
+                level,
+                key=lambda stage: sum(history.get(stage.name, {}).values()),
+                reverse=True,
+            )
+            items = [
+                ((k, stage.name), (stage, v))
+                for stage in level
+                for k, v in order_longest_first(data_dict, history, [stage.name])
+                if not any(
+                    isinstance(results.get((k, dep)), Exception)
+                    for dep in stage.depends
+                )
+            ]
+            results.update(scheduler.map(pool, func, items))
+        # from https://superfastpython.com/multiprocessing-pool-map_async/
+        pool.close()
+        pool.join()
+
+    q_listener.stop()
+
+    update_runtime_history(history_path, log_file_path)
+    return results
@@ -0,0 +1,333 @@
+"""
+This file holds the store of decoded static SOLWEIG inputs.
+
+The static rasters of a tile (DSM, CDSM, DTM, land cover, wall height/aspect) are
+decoded once from their compressed GeoTIFFs into uncompressed .npy files. Every
+.npy file is accompanied by a small raw VRT, which describes the file to GDAL, so
+SOLWEIG reads the uncompressed data without LZW/DEFLATE decoding and all workers
+share the pages of the files in the page cache. Python consumers get zero-copy
+views of the same files via np.load(mmap_mode="r"), see StaticStore.load_arrays.
+
+The SVF archive is repacked with uncompressed members (ZIP_STORED), since SOLWEIG
+expects the SVFs as zip archive.
+
+Usage:
+    python umep_wrapper/static_store.py --static_store=<store folder> \\
+        <arguments of tile_catalog.py>
+"""
+
+import argparse
+import json
+import os
+import zipfile
+from functools import lru_cache
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
+
+import numpy as np
+from osgeo import gdal
+
+from umep_wrapper.tile_catalog import TileRecord, get_catalog
+
+gdal.UseExceptions()
+
+MANIFEST_FILE = "manifest.json"
+# raster layers of a tile record and their SOLWEIG config key
+STORE_LAYERS = {
+    "dsm": "INPUT_DSM",
+    "cdsm": "INPUT_CDSM",
+    "dtm": "INPUT_DEM",
+    "lc": "INPUT_LC",
+    "wall_height": "INPUT_HEIGHT",
+    "wall_aspect": "INPUT_ASPECT",
+}
+
+
+def _stat(path: str) -> str:
+    """Size and modification time of a file, used to detect changes."""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def write_raw_raster(src_path: str, npy_path: str) -> str:
+    """
+    Decode a raster into an uncompressed .npy file and describe it with a raw VRT.
+
+    Args:
+        src_path (str): path of the (compressed) source raster
+        npy_path (str): path of the .npy file to write
+
+    Returns:
+        path of the VRT, which can be opened by GDAL like the source raster
+    """
+    ds = gdal.Open(src_path)
+    band = ds.GetRasterBand(1)
+    # little endian and C order, so GDAL can read the file row by row
+    array = band.ReadAsArray()
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+    np.save(npy_path, array)
+    offset = np.load(npy_path, mmap_mode="r").offset
+
+    nodata = band.GetNoDataValue()
+    nodata_xml = f"<NoDataValue>{nodata!r}</NoDataValue>" if nodata is not None else ""
+    geotransform = ", ".join(repr(value) for value in ds.GetGeoTransform())
+    vrt = (
+        f'<VRTDataset rasterXSize="{ds.RasterXSize}" rasterYSize="{ds.RasterYSize}">\n'
+        f"  <SRS>{escape(ds.GetProjection())}</SRS>\n"
+        f"  <GeoTransform>{geotransform}</GeoTransform>\n"
+        f'  <VRTRasterBand dataType="{gdal.GetDataTypeName(band.DataType)}" '
+        f'band="1" subClass="VRTRawRasterBand">\n'
+        f"    {nodata_xml}\n"
+        f'    <SourceFilename relativetoVRT="1">{os.path.basename(npy_path)}'
+        f"</SourceFilename>\n"
+        f"    <ImageOffset>{offset}</ImageOffset>\n"
+        f"    <PixelOffset>{array.itemsize}</PixelOffset>\n"
+        f"    <LineOffset>{array.itemsize * array.shape[1]}</LineOffset>\n"
+        f"    <ByteOrder>LSB</ByteOrder>\n"
+        f"  </VRTRasterBand>\n"
+        f"</VRTDataset>\n"
+    )
+    ds = None
+
+    vrt_path = os.path.splitext(npy_path)[0] + ".vrt"
+    with open(vrt_path, "w") as file:
+        file.write(vrt)
+    return vrt_path
+
+
+def repack_svfs(src_path: str, dst_path: str) -> str:
+    """
+    Repack an SVF archive with uncompressed GeoTIFFs as uncompressed members.
+
+    Args:
+        src_path (str): path of the svfs.zip of the preprocessing
+        dst_path (str): path of the repacked archive
+
+    Returns:
+        dst_path
+    """
+    tmp_path = f"{dst_path}.tmp"
+    with zipfile.ZipFile(src_path, "r") as src, zipfile.ZipFile(
+        tmp_path, "w", compression=zipfile.ZIP_STORED
+    ) as dst:
+        for name in src.namelist():
+            member = f"/vsizip/{src_path}/{name}"
+            if name.endswith(".tif"):
+                # decompress the raster itself as well
+                mem_path = f"/vsimem/{os.getpid()}_{name}"
+                gdal.Translate(mem_path, member, creationOptions=["COMPRESS=NONE"])
+                dst.writestr(name, _read_vsimem(mem_path))
+                gdal.Unlink(mem_path)
+            else:
+                dst.writestr(name, src.read(name))
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def _read_vsimem(path: str) -> bytes:
+    """Reads a file of GDAL's in-memory file system."""
+    handle = gdal.VSIFOpenL(path, "rb")
+    try:
+        gdal.VSIFSeekL(handle, 0, 2)
+        size = gdal.VSIFTellL(handle)
+        gdal.VSIFSeekL(handle, 0, 0)
+        return bytes(gdal.VSIFReadL(1, size, handle))
+    finally:
+        gdal.VSIFCloseL(handle)
+
+
+class StaticStore:
+    """
+    Decoded static inputs of all tiles, one folder per tile id.
+    """
+
+    def __init__(self, store_path: str):
+        """
+        Args:
+            store_path (str): folder of the store
+        """
+        self.store_path = store_path
+
+    def get_tile_dir(self, tile_id: str) -> str:
+        """Returns the folder of a tile within the store."""
+        return os.path.join(self.store_path, tile_id)
+
+    def load_manifest(self, tile_id: str) -> dict | None:
+        """Returns the manifest of a tile or None if the tile is not stored."""
+        manifest_path = os.path.join(self.get_tile_dir(tile_id), MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r") as file:
+            return json.load(file)
+
+    def is_current(self, tile_id: str) -> bool:
+        """
+        Check whether a tile is stored and its sources did not change since.
+
+        Args:
+            tile_id (str): tile id 'y_x'
+
+        Returns:
+            True if the stored inputs of the tile can be used
+        """
+        manifest = self.load_manifest(tile_id)
+        if manifest is None:
+            return False
+        try:
+            return all(
+                _stat(entry["source"]) == entry["stat"] for entry in manifest.values()
+            )
+        except OSError:
+            return False
+
+    def build_tile(self, record: TileRecord) -> dict:
+        """
+        Decode the static inputs of a tile into the store.
+
+        Args:
+            record (TileRecord): catalog record of the tile
+
+        Returns:
+            the manifest of the tile
+        """
+        tile_dir = self.get_tile_dir(record.tile_id)
+        os.makedirs(tile_dir, exist_ok=True)
+        # remove the manifest first, so an interrupted build is not used
+        manifest_path = os.path.join(tile_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        manifest = {}
+        for layer in STORE_LAYERS:
+            source = getattr(record, layer)
+            if source is None or not os.path.exists(source):
+                continue
+            path = write_raw_raster(source, os.path.join(tile_dir, f"{layer}.npy"))
+            manifest[layer] = {"source": source, "stat": _stat(source), "path": path}
+
+        if record.svf is not None and os.path.exists(record.svf):
+            path = repack_svfs(record.svf, os.path.join(tile_dir, "svfs.zip"))
+            manifest["svf"] = {
+                "source": record.svf,
+                "stat": _stat(record.svf),
+                "path": path,
+            }
+
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+        return manifest
+
+    def get_inputs(self, tile_id: str) -> dict[str, str]:
+        """
+        Get the SOLWEIG config entries pointing to the stored inputs of a tile.
+
+        Args:
+            tile_id (str): tile id 'y_x'
+
+        Returns:
+            dict mapping SOLWEIG config keys to the stored inputs, empty if the tile
+            is not (or no longer) current in the store
+        """
+        if not self.is_current(tile_id):
+            return {}
+        inputs = {}
+        for layer, entry in self.load_manifest(tile_id).items():
+            key = "INPUT_SVF" if layer == "svf" else STORE_LAYERS[layer]
+            inputs[key] = entry["path"]
+        return inputs
+
+    def load_arrays(self, tile_id: str) -> dict[str, np.ndarray]:
+        """
+        Get read-only, zero-copy views of the stored rasters of a tile.
+
+        Args:
+            tile_id (str): tile id 'y_x'
+
+        Returns:
+            dict mapping the layer names (e.g. 'dsm') to memory-mapped arrays
+        """
+        manifest = self.load_manifest(tile_id) or {}
+        return {
+            layer: np.load(os.path.splitext(entry["path"])[0] + ".npy", mmap_mode="r")
+            for layer, entry in manifest.items()
+            if layer != "svf"
+        }
+
+
+@lru_cache(maxsize=None)
+def get_static_store(store_path: str) -> StaticStore:
+    """Returns the store of the given folder, once per process."""
+    return StaticStore(store_path)
+
+
+def _build_tile(store_path: str, record: TileRecord) -> str:
+    """Builds a single tile of the store, used by the process pool."""
+    get_static_store(store_path).build_tile(record)
+    return record.tile_id
+
+
+def build_store(
+    args: dict[str, str], store_path: str, processes: int = None, rebuild: bool = False
+) -> list[str]:
+    """
+    Decode the static inputs of all non-empty tiles of the catalog into the store.
+
+    Tiles whose sources did not change since the last build are skipped.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        store_path (str): folder of the store
+        processes (int): number of parallel processes
+        rebuild (bool): whether to rebuild all tiles in any case
+
+    Returns:
+        list of the (re)built tile ids
+    """
+    store = get_static_store(store_path)
+    records = [
+        record
+        for record in get_catalog(args).values()
+        if not record.is_empty and (rebuild or not store.is_current(record.tile_id))
+    ]
+
+    with Pool(processes=processes) as pool:
+        built = list(
+            pool.starmap(_build_tile, [(store_path, record) for record in records])
+        )
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Decode the static SOLWEIG inputs into uncompressed files."
+    )
+    parser.add_argument(
+        "--static_store", type=str, required=True, help="Folder of the store"
+    )
+    parser.add_argument(
+        "--data_path", type=str, required=True, help="The path to the data folders"
+    )
+    parser.add_argument("--dsm_folder", type=str, required=True)
+    parser.add_argument("--cdsm_folder", type=str, required=True)
+    parser.add_argument("--dtm_folder", type=str, default=None)
+    parser.add_argument("--lc_folder", type=str, default=None)
+    parser.add_argument(
+        "--preprocess_data_path",
+        type=str,
+        default=None,
+        help="Path to the data folders containing preprocessed data (Wall aspect/height, SVF)",
+    )
+    parser.add_argument("--tile_catalog", type=str, default=None)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Rebuild even if nothing changed"
+    )
+
+    args_dict = vars(parser.parse_args())
+    built = build_store(
+        args_dict,
+        args_dict["static_store"],
+        processes=args_dict["processes"],
+        rebuild=args_dict["rebuild"],
+    )
+    print(f"Decoded the static inputs of {len(built)} tiles.")
@@ -0,0 +1,470 @@
+"""
+This file holds the tile catalog of the static SOLWEIG input data.
+
+The catalog is a SQLite database that records for every tile the paths of the
+DSM, CDSM, DTM, land cover, SVF and wall rasters, its window within the city grid,
+its bounds and a content hash of its inputs. It is built once from the static data
+and only rebuilt when the static data changes, so the orchestration scripts do not
+have to glob and match the tile folders on every run.
+
+Every combination of tile folders and preprocess path has its own catalog (e.g.
+SOLWEIG prepare runs and the hourly runs), so they do not invalidate each other. A
+rebuilt catalog replaces the previous one atomically, readers on other hosts keep
+reading the previous file.
+
+The catalog also serves as skip index: tiles which are fully masked (outside the
+city) are flagged once, so they are never dispatched to the pool, and the share of
+valid pixels per tile is kept to estimate the work of a tile.
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import sqlite3
+from dataclasses import astuple, dataclass, fields
+
+import numpy as np
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+CATALOG_SUFFIX = "_catalog.sqlite"
+# increase when the catalog content changes, so existing catalogs are rebuilt
+CATALOG_VERSION = 3
+
+
+@dataclass
+class TileRecord:
+    """Static inputs and location of a single tile."""
+
+    tile_id: str
+    dsm: str
+    cdsm: str
+    dtm: str = None
+    lc: str = None
+    svf: str = None
+    wall_height: str = None
+    wall_aspect: str = None
+    xoff: int = None
+    yoff: int = None
+    xsize: int = None
+    ysize: int = None
+    xmin: float = None
+    ymin: float = None
+    xmax: float = None
+    ymax: float = None
+    content_hash: str = None
+    stat_key: str = None
+    is_empty: bool = None
+    valid_fraction: float = None
+
+
+def tile_id_from_filename(file_path: str) -> str:
+    """
+    Extract the tile id from a tile filename.
+
+    Tile file naming pattern: <prefix>_<y>_<x>.tif, e.g. DO_DTM+DSM_mosaic_3m_1_11.tif
+
+    Args:
+        file_path (str): path to the tile file
+
+    Returns:
+        tile id 'y_x'
+    """
+    yx_coords = os.path.basename(file_path).split(".")[0].split("_")[-2:]
+    return yx_coords[0] + "_" + yx_coords[1]
+
+
+def index_folder(folder: str) -> dict[str, str]:
+    """
+    Map the tile ids of all tif files in a folder to their paths.
+
+    Args:
+        folder (str): tile folder
+
+    Returns:
+        dict mapping tile id 'y_x' to the absolute file path
+
+    Raises:
+        RuntimeError: thrown if a tile id occurs more than once
+    """
+    tiles = {}
+    for file_path in sorted(glob.glob(os.path.join(folder, "*.tif"))):
+        tile_id = tile_id_from_filename(file_path)
+        if tile_id in tiles:
+            raise RuntimeError(f"Tile {tile_id} occurs more than once in {folder}.")
+        tiles[tile_id] = os.path.normpath(file_path)
+    return tiles
+
+
+def get_catalog_path(args: dict[str, str]) -> str:
+    """
+    Returns the default catalog location, next to the DSM tile folder.
+
+    The name contains a key of the tile folders and the preprocess path, e.g.
+    '<dsm folder>_<key>_catalog.sqlite'.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+
+    Returns:
+        path of the SQLite catalog
+    """
+    folders = _get_folders(
+        args["data_path"],
+        args["dsm_folder"],
+        args["cdsm_folder"],
+        args.get("dtm_folder"),
+        args.get("lc_folder"),
+    )
+    inputs = list(folders.values()) + [args.get("preprocess_data_path")]
+    key = hashlib.sha256(repr(inputs).encode()).hexdigest()[:12]
+    return f"{folders['dsm']}_{key}{CATALOG_SUFFIX}"
+
+
+def _file_stat_key(paths: list[str]) -> str:
+    """Size and modification time of the given files, used to detect changes."""
+    key = []
+    for path in paths:
+        if path is None:
+            continue
+        stat = os.stat(path)
+        key.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    return ";".join(key)
+
+
+def _content_hash(paths: list[str]) -> str:
+    """Hash of the contents of the given files."""
+    sha = hashlib.sha256()
+    for path in paths:
+        if path is None:
+            continue
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024**2), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_tile_coverage(dsm_path: str, cdsm_path: str) -> tuple[bool, float]:
+    """
+    Check whether a tile was fully masked and how many of its pixels are valid.
+
+    A tile is empty, if its CDSM is zero everywhere (the tile lays outside the
+    city's borders). Valid pixels are those of the DSM, which are neither NoData
+    nor masked (zero).
+
+    Args:
+        dsm_path (str): path to the DSM tile
+        cdsm_path (str): path to the CDSM tile
+
+    Returns:
+        tuple of the empty flag and the valid pixel fraction (0-1)
+    """
+    cdsm_values = gdal.Open(cdsm_path, gdal.GA_ReadOnly).ReadAsArray()
+    if not np.any(cdsm_values):
+        return True, 0.0
+
+    dsm_band = gdal.Open(dsm_path, gdal.GA_ReadOnly).GetRasterBand(1)
+    dsm_values = dsm_band.ReadAsArray()
+    valid = np.isfinite(dsm_values) & (dsm_values != 0)
+    if dsm_band.GetNoDataValue() is not None:
+        valid &= dsm_values != dsm_band.GetNoDataValue()
+    valid_fraction = float(np.count_nonzero(valid)) / valid.size
+    return valid_fraction == 0.0, valid_fraction
+
+
+def get_signature(folders: list[str], preprocess_data_path: str = None) -> str:
+    """
+    Cheap signature of the static data.
+
+    The size and modification time of every tile file are part of the signature,
+    so added, removed and overwritten tiles are detected with a directory scan
+    on every run. The preprocess path only enters by name, the catalog holds
+    the paths of the preprocessed files only.
+
+    Args:
+        folders (list): tile folders, None entries are ignored
+        preprocess_data_path (str): folder which contains the preprocessed data
+
+    Returns:
+        hex digest of the signature
+    """
+    sha = hashlib.sha256(f"v{CATALOG_VERSION}|{preprocess_data_path}".encode())
+    for folder in folders:
+        if folder is None:
+            sha.update(b"|None")
+            continue
+        folder = os.path.normpath(folder)
+        sha.update(f"|{folder}".encode())
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            stats = sorted(
+                (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                for entry in entries
+                if entry.name.endswith(".tif")
+            )
+        sha.update(repr(stats).encode())
+    return sha.hexdigest()
+
+
+def build_catalog(
+    catalog_path: str,
+    data_path: str,
+    dsm_folder: str,
+    cdsm_folder: str,
+    dtm_folder: str = None,
+    lc_folder: str = None,
+    preprocess_data_path: str = None,
+) -> dict[str, TileRecord]:
+    """
+    Build the catalog from the static tile folders and save it.
+
+    Content hashes of unchanged tiles are taken over from an existing catalog.
+
+    Args:
+        catalog_path (str): path of the SQLite catalog to write
+        data_path (str): folder which contains the surface model folders
+        dsm_folder (str): folder of DSM files located within data_path
+        cdsm_folder (str): folder of CDSM files located within data_path
+        dtm_folder (str): folder of DTM files located within data_path
+        lc_folder (str): folder of land cover files located within data_path
+        preprocess_data_path (str): folder which contains the preprocessed data
+
+    Returns:
+        dict mapping tile id 'y_x' to its TileRecord
+
+    Raises:
+        RuntimeError: thrown if a DSM tile has no matching CDSM, DTM or LC tile
+    """
+    folders = _get_folders(data_path, dsm_folder, cdsm_folder, dtm_folder, lc_folder)
+    indices = {
+        name: index_folder(folder) if folder is not None else None
+        for name, folder in folders.items()
+    }
+
+    previous = {}
+    if os.path.exists(catalog_path):
+        previous = load_catalog(catalog_path)
+
+    records = {}
+    for tile_id, dsm_path in indices["dsm"].items():
+        paths = {"dsm": dsm_path}
+        for name in ["cdsm", "dtm", "lc"]:
+            if indices[name] is None:
+                paths[name] = None
+                continue
+            if tile_id not in indices[name]:
+                raise RuntimeError(f"No matching {name} tile found for tile {tile_id}.")
+            paths[name] = indices[name][tile_id]
+
+        record = TileRecord(tile_id=tile_id, **paths)
+        if preprocess_data_path is not None:
+            tile_dir = os.path.normpath(os.path.join(preprocess_data_path, tile_id))
+            record.svf = os.path.join(tile_dir, "svfs.zip")
+            record.wall_height = os.path.join(tile_dir, f"wall_height_{tile_id}.tif")
+            record.wall_aspect = os.path.join(tile_dir, f"wall_aspect_{tile_id}.tif")
+
+        dataset = gdal.Open(dsm_path, gdal.GA_ReadOnly)
+        ulx, xres, _, uly, _, yres = dataset.GetGeoTransform()
+        record.xsize, record.ysize = dataset.RasterXSize, dataset.RasterYSize
+        record.xmin, record.ymax = ulx, uly
+        record.xmax = ulx + record.xsize * xres
+        record.ymin = uly + record.ysize * yres
+        dataset = None
+
+        input_paths = [record.dsm, record.cdsm, record.dtm, record.lc]
+        record.stat_key = _file_stat_key(input_paths)
+        if (
+            tile_id in previous
+            and previous[tile_id].stat_key == record.stat_key
+            and previous[tile_id].is_empty is not None
+        ):
+            record.content_hash = previous[tile_id].content_hash
+            record.is_empty = bool(previous[tile_id].is_empty)
+            record.valid_fraction = previous[tile_id].valid_fraction
+        else:
+            record.content_hash = _content_hash(input_paths)
+            record.is_empty, record.valid_fraction = get_tile_coverage(
+                record.dsm, record.cdsm
+            )
+        records[tile_id] = record
+        # keep the resolution for the window calculation
+        resolution = (xres, -yres)
+
+    # pixel window of every tile within the grid spanned by all tiles
+    if records:
+        origin_x = min(r.xmin for r in records.values())
+        origin_y = max(r.ymax for r in records.values())
+        for record in records.values():
+            record.xoff = int(round((record.xmin - origin_x) / resolution[0]))
+            record.yoff = int(round((origin_y - record.ymax) / resolution[1]))
+
+    signature = get_signature(list(folders.values()), preprocess_data_path)
+    save_catalog(catalog_path, records, signature)
+    return records
+
+
+def _get_folders(
+    data_path: str,
+    dsm_folder: str,
+    cdsm_folder: str,
+    dtm_folder: str = None,
+    lc_folder: str = None,
+) -> dict[str, str]:
+    """Joins the tile folders with the data path, keeping missing folders as None."""
+    return {
+        name: (
+            os.path.normpath(os.path.join(data_path, folder))
+            if folder is not None
+            else None
+        )
+        for name, folder in {
+            "dsm": dsm_folder,
+            "cdsm": cdsm_folder,
+            "dtm": dtm_folder,
+            "lc": lc_folder,
+        }.items()
+    }
+
+
+def save_catalog(catalog_path: str, records: dict[str, TileRecord], signature: str):
+    """
+    Write the records to a new SQLite catalog, which replaces the previous one.
+
+    The catalog is written to a temporary file first, so readers (also on other
+    hosts) never see a partial catalog.
+
+    Args:
+        catalog_path (str): path of the SQLite catalog
+        records (dict): dict mapping tile id 'y_x' to its TileRecord
+        signature (str): signature of the static data
+    """
+    columns = [f.name for f in fields(TileRecord)]
+    tmp_path = f"{catalog_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with sqlite3.connect(tmp_path) as con:
+        con.execute(f"CREATE TABLE tiles ({', '.join(columns)}, PRIMARY KEY (tile_id))")
+        con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        con.executemany(
+            f"INSERT INTO tiles VALUES ({', '.join(['?'] * len(columns))})",
+            [astuple(record) for record in records.values()],
+        )
+        con.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+    con.close()
+    os.replace(tmp_path, catalog_path)
+
+
+def load_catalog(catalog_path: str) -> dict[str, TileRecord]:
+    """
+    Load all tiles of a catalog.
+
+    Args:
+        catalog_path (str): path of the SQLite catalog
+
+    Returns:
+        dict mapping tile id 'y_x' to its TileRecord, sorted by tile id
+    """
+    known = {f.name for f in fields(TileRecord)}
+    with sqlite3.connect(catalog_path) as con:
+        cursor = con.execute("SELECT * FROM tiles ORDER BY tile_id")
+        columns = [description[0] for description in cursor.description]
+        rows = cursor.fetchall()
+    con.close()
+
+    records = {}
+    for row in rows:
+        # ignore columns of other catalog versions, they are rebuilt on demand
+        values = {k: v for k, v in zip(columns, row) if k in known}
+        if values.get("is_empty") is not None:
+            values["is_empty"] = bool(values["is_empty"])
+        records[values["tile_id"]] = TileRecord(**values)
+    return records
+
+
+def load_signature(catalog_path: str) -> str | None:
+    """Returns the folder signature stored in a catalog or None if there is none."""
+    try:
+        with sqlite3.connect(catalog_path) as con:
+            row = con.execute(
+                "SELECT value FROM meta WHERE key = 'signature'"
+            ).fetchone()
+        con.close()
+    except sqlite3.DatabaseError:
+        return None
+    return None if row is None else row[0]
+
+
+def get_catalog(
+    args: dict[str, str], catalog_path: str = None, rebuild: bool = False
+) -> dict[str, TileRecord]:
+    """
+    Load the catalog for the given run arguments, (re)building it if necessary.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        catalog_path (str): path of the SQLite catalog, defaults to
+            get_catalog_path(args)
+        rebuild (bool): whether to rebuild the catalog in any case
+
+    Returns:
+        dict mapping tile id 'y_x' to its TileRecord
+    """
+    if catalog_path is None:
+        catalog_path = args.get("tile_catalog") or get_catalog_path(args)
+
+    folders = _get_folders(
+        args["data_path"],
+        args["dsm_folder"],
+        args["cdsm_folder"],
+        args.get("dtm_folder"),
+        args.get("lc_folder"),
+    )
+    signature = get_signature(list(folders.values()), args.get("preprocess_data_path"))
+
+    if not rebuild and os.path.exists(catalog_path):
+        if load_signature(catalog_path) == signature:
+            return load_catalog(catalog_path)
+        print(f"Static data changed, rebuilding tile catalog {catalog_path}")
+
+    return build_catalog(
+        catalog_path,
+        args["data_path"],
+        args["dsm_folder"],
+        args["cdsm_folder"],
+        args.get("dtm_folder"),
+        args.get("lc_folder"),
+        args.get("preprocess_data_path"),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the tile catalog of the static SOLWEIG input data."
+    )
+    parser.add_argument(
+        "--data_path", type=str, required=True, help="The path to the data folders"
+    )
+    parser.add_argument("--dsm_folder", type=str, required=True)
+    parser.add_argument("--cdsm_folder", type=str, required=True)
+    parser.add_argument("--dtm_folder", type=str, default=None)
+    parser.add_argument("--lc_folder", type=str, default=None)
+    parser.add_argument(
+        "--preprocess_data_path",
+        type=str,
+        default=None,
+        help="Path to the data folders containing preprocessed data (Wall aspect/height, SVF)",
+    )
+    parser.add_argument(
+        "--tile_catalog", type=str, default=None, help="Path of the catalog to write"
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Rebuild even if nothing changed"
+    )
+
+    args_dict = vars(parser.parse_args())
+    catalog = get_catalog(args_dict, rebuild=args_dict["rebuild"])
+    n_empty = sum(record.is_empty for record in catalog.values())
+    print(f"Tile catalog holds {len(catalog)} tiles, {n_empty} of them are empty.")
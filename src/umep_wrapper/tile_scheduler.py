@@ -0,0 +1,506 @@
+"""
+This file holds the scheduling of SOLWEIG tiles onto a process pool.
+
+The concurrency is derived from the cgroup CPU and memory limits of the container
+(see cronscript_template.sh) and adjusted at runtime: new tiles are only admitted
+when the memory headroom allows for the measured per-tile peak memory.
+
+Tiles are submitted longest job first. The expected runtime of a tile is an
+exponential moving average over the runtimes recorded by the runtime logger in
+previous runs, tiles without history are estimated from their valid pixel fraction.
+"""
+
+import json
+import os
+import resource
+import time
+from multiprocessing import Manager
+from multiprocessing.pool import Pool
+
+import psutil
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# share of the memory limit that is never handed out to tiles
+MEMORY_RESERVE = 0.1
+# weight of the latest runtime in the exponential moving average
+RUNTIME_EMA_ALPHA = 0.3
+RUNTIME_HISTORY_FILE = "runtime_history.json"
+
+
+def _read_first_line(path: str) -> str | None:
+    """Reads the first line of a (cgroup) file, returns None if it does not exist."""
+    try:
+        with open(path, "r") as file:
+            return file.readline().strip()
+    except OSError:
+        return None
+
+
+def get_cpu_limit(cgroup_root: str = CGROUP_ROOT) -> int:
+    """
+    Get the number of CPUs available to this process.
+
+    The cgroup quota (v2: cpu.max, v1: cpu.cfs_quota_us) is respected, since
+    docker's --cpus flag does not change the number of visible cores.
+
+    Args:
+        cgroup_root (str): mount point of the cgroup filesystem
+
+    Returns:
+        the number of usable CPUs, at least 1
+    """
+    cpus = len(os.sched_getaffinity(0))
+
+    quota, period = None, None
+    cpu_max = _read_first_line(os.path.join(cgroup_root, "cpu.max"))
+    if cpu_max is not None:
+        # format: '<quota> <period>' or 'max <period>'
+        fields = cpu_max.split()
+        if fields[0] != "max":
+            quota, period = int(fields[0]), int(fields[1])
+    else:
+        cfs_quota = _read_first_line(
+            os.path.join(cgroup_root, "cpu", "cpu.cfs_quota_us")
+        )
+        cfs_period = _read_first_line(
+            os.path.join(cgroup_root, "cpu", "cpu.cfs_period_us")
+        )
+        if cfs_quota is not None and cfs_period is not None and int(cfs_quota) > 0:
+            quota, period = int(cfs_quota), int(cfs_period)
+
+    if quota is not None:
+        cpus = min(cpus, quota // period)
+    return max(cpus, 1)
+
+
+def get_memory_limit(cgroup_root: str = CGROUP_ROOT) -> int:
+    """
+    Get the memory limit of this process in bytes.
+
+    Args:
+        cgroup_root (str): mount point of the cgroup filesystem
+
+    Returns:
+        the cgroup memory limit (v2: memory.max, v1: memory.limit_in_bytes) or the
+        total physical memory if no limit is set
+    """
+    total = psutil.virtual_memory().total
+    limit = _read_first_line(os.path.join(cgroup_root, "memory.max"))
+    if limit is None:
+        limit = _read_first_line(
+            os.path.join(cgroup_root, "memory", "memory.limit_in_bytes")
+        )
+    if limit is None or limit == "max":
+        return total
+    # cgroup v1 reports a huge number if no limit is set
+    return min(int(limit), total)
+
+
+def get_memory_usage(cgroup_root: str = CGROUP_ROOT) -> int | None:
+    """
+    Get the current memory usage of the cgroup in bytes.
+
+    Args:
+        cgroup_root (str): mount point of the cgroup filesystem
+
+    Returns:
+        the cgroup memory usage or None if it is not available
+    """
+    usage = _read_first_line(os.path.join(cgroup_root, "memory.current"))
+    if usage is None:
+        usage = _read_first_line(
+            os.path.join(cgroup_root, "memory", "memory.usage_in_bytes")
+        )
+    return None if usage is None else int(usage)
+
+
+def measure_peak_rss(func, item, started: dict = None, token=None):
+    """
+    Run func on the item and report the peak resident memory of the worker.
+
+    Note: ru_maxrss is the peak over the lifetime of the worker process, so for
+    reused pool workers this is a conservative (upper) estimate for the tile.
+
+    Args:
+        func: function to run
+        item: argument passed to func
+        started (dict): shared dict the start time is reported to (optional)
+        token: key of the start time in started, identifies the attempt
+
+    Returns:
+        tuple of the result of func and the peak resident memory in bytes
+    """
+    if started is not None:
+        started[token] = time.time()
+    result = func(item)
+    # ru_maxrss is given in kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result, peak_rss
+
+
+class AdaptiveTileScheduler:
+    """
+    Admit tiles to a process pool as long as CPU and memory headroom allow.
+    """
+
+    def __init__(
+        self,
+        max_processes: int = None,
+        tile_memory: int = None,
+        cgroup_root: str = CGROUP_ROOT,
+        poll_interval: float = 0.5,
+    ):
+        """
+        Args:
+            max_processes (int): upper bound of concurrent tiles, defaults to the
+                CPU limit of the cgroup
+            tile_memory (int): initial estimate of the peak memory per tile in
+                bytes, defaults to an even split of the memory limit
+            cgroup_root (str): mount point of the cgroup filesystem
+            poll_interval (float): seconds between checks for finished tiles
+        """
+        self.cgroup_root = cgroup_root
+        self.poll_interval = poll_interval
+        self.cpu_limit = get_cpu_limit(cgroup_root)
+        self.processes = (
+            self.cpu_limit if max_processes is None else max(max_processes, 1)
+        )
+        self.memory_limit = get_memory_limit(cgroup_root)
+        self.tile_memory = (
+            tile_memory
+            if tile_memory is not None
+            else int(self.memory_limit * (1 - MEMORY_RESERVE) / self.processes)
+        )
+        self._measured = False
+        # async results of timed out tasks, their workers may still hang
+        self.hung = []
+
+    def available_memory(self) -> int:
+        """Returns the memory in bytes which may still be handed out to tiles."""
+        available = psutil.virtual_memory().available
+        usage = get_memory_usage(self.cgroup_root)
+        if usage is not None:
+            available = min(available, self.memory_limit - usage)
+        return int(available - self.memory_limit * MEMORY_RESERVE)
+
+    def update_tile_memory(self, peak_rss: int) -> None:
+        """
+        Update the per-tile memory estimate with a measured peak.
+
+        The first measurement replaces the initial estimate, afterwards the maximum
+        of all measurements is kept to stay on the safe side.
+
+        Args:
+            peak_rss (int): measured peak resident memory of a tile in bytes
+        """
+        if not self._measured:
+            self.tile_memory = peak_rss
+            self._measured = True
+        else:
+            self.tile_memory = max(self.tile_memory, peak_rss)
+
+    def recycle(self) -> None:
+        """Forget the hung tasks, once the pool was terminated and replaced."""
+        self.hung = []
+
+    def can_admit(self, running: int) -> bool:
+        """
+        Check whether another tile may be started.
+
+        Args:
+            running (int): number of currently running tiles
+
+        Returns:
+            True if CPU and memory headroom allow for another tile
+        """
+        if running >= self.processes:
+            return False
+        # always make progress, even if other processes occupy the memory
+        if running == 0:
+            return True
+        # running tiles did not necessarily reach their peak memory yet,
+        # so keep their expected growth free as well
+        children_rss = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                children_rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+        growth = max(running * self.tile_memory - children_rss, 0)
+        return self.available_memory() - growth >= self.tile_memory
+
+    def map(
+        self,
+        pool: Pool,
+        func,
+        items,
+        retries: int = 0,
+        timeout: float = None,
+        on_result=None,
+        on_retry=None,
+    ) -> dict:
+        """
+        Run func for all items on the pool, admitting items one by one.
+
+        Failed items are resubmitted up to retries times. Items which do not finish
+        within timeout seconds after their worker started them count as failed,
+        this also covers tasks of workers that were killed (e.g. by the OOM
+        killer), whose results never arrive. Items which are not started within
+        timeout seconds after their submission count as failed as well.
+
+        The worker of a timed out item may still hang, so its pool slot stays busy
+        (see self.hung) until the item returns or the pool is recycled (see
+        recycle). Timed out items are not retried on the same pool, since their
+        hanging worker may still write the outputs of the item. If all slots
+        hang, the remaining items (also those not yet taken from items) count as
+        failed and the pool has to be terminated by the caller.
+
+        Args:
+            pool (Pool): process pool with (at least) self.processes workers
+            func: picklable function called with a single (key, value) item
+            items: iterable of (key, value) pairs, started in the given order and
+                only consumed when a pool slot is free (e.g. a work queue)
+            retries (int): number of retries per failed item
+            timeout (float): seconds after which a running item counts as failed
+            on_result: optional callback called with key and final result (or
+                exception) as soon as an item finished
+            on_retry: optional callback called with key when a failed item is
+                resubmitted (e.g. to renew the claim of a work queue)
+
+        Returns:
+            dict mapping the keys to the results of func or the raised exception
+        """
+        with Manager() as manager:
+            # start times reported by the workers, by key and attempt
+            started = manager.dict()
+            return self._map(
+                pool, func, items, retries, timeout, on_result, on_retry, started
+            )
+
+    def _map(
+        self,
+        pool: Pool,
+        func,
+        items,
+        retries: int,
+        timeout: float,
+        on_result,
+        on_retry,
+        started: dict,
+    ) -> dict:
+        """Runs the items on the pool, see map."""
+        items = iter(items)
+        # items to retry, before further items are taken
+        pending = []
+        exhausted = False
+        running = {}
+        attempts = {}
+        results = {}
+        while pending or running or not exhausted:
+            self.hung = [
+                async_result for async_result in self.hung if not async_result.ready()
+            ]
+            for key, (async_result, submit_time, value) in list(running.items()):
+                # not started tasks are measured from their submission
+                start_time = started.get((key, attempts[key]), submit_time)
+                if async_result.ready():
+                    del running[key]
+                    try:
+                        results[key], peak_rss = async_result.get()
+                        self.update_tile_memory(peak_rss)
+                    except Exception as e:
+                        results[key] = e
+                elif timeout is not None and time.time() - start_time > timeout:
+                    del running[key]
+                    self.hung.append(async_result)
+                    results[key] = TimeoutError(f"no result after {timeout} s")
+                else:
+                    continue
+
+                if isinstance(results[key], Exception):
+                    print(f"Failed tile {key} with {results[key]}")
+                    # the worker of a timed out tile may still write its outputs
+                    if attempts[key] <= retries and not isinstance(
+                        results[key], TimeoutError
+                    ):
+                        print(f"Retrying tile {key} (attempt {attempts[key] + 1})")
+                        pending.insert(0, (key, value))
+                        continue
+                if on_result is not None:
+                    on_result(key, results[key])
+
+            if len(self.hung) >= self.processes:
+                print("All workers hang, the pool has to be recycled")
+                not_started = RuntimeError("not started, all workers hang")
+                for key, _ in pending:
+                    if on_result is not None:
+                        on_result(key, results[key])
+                for key, _ in items:
+                    results[key] = not_started
+                    if on_result is not None:
+                        on_result(key, not_started)
+                break
+
+            busy = len(running) + len(self.hung)
+            while (pending or not exhausted) and self.can_admit(busy):
+                if pending:
+                    key, value = pending.pop(0)
+                    if on_retry is not None:
+                        on_retry(key)
+                elif (item := next(items, None)) is not None:
+                    key, value = item
+                else:
+                    exhausted = True
+                    break
+                attempts[key] = attempts.get(key, 0) + 1
+                running[key] = (
+                    pool.apply_async(
+                        measure_peak_rss,
+                        (func, (key, value), started, (key, attempts[key])),
+                    ),
+                    time.time(),
+                    value,
+                )
+                busy += 1
+
+            if running or self.hung:
+                time.sleep(self.poll_interval)
+        return results
+
+
+def read_runtime_log(log_file_path: str) -> dict[str, dict[str, float]]:
+    """
+    Read the tile runtimes of a run from the runtime logger output.
+
+    Expected line format: '<time>;<msecs>;<step>;<tile>;<runtime>;...', lines of
+    skipped tiles (runtime -1) and the header are ignored.
+
+    Args:
+        log_file_path (str): path to the log file of a run
+
+    Returns:
+        dict mapping step to a dict of tile id 'y_x' to runtime in seconds
+    """
+    runtimes = {}
+    if not os.path.exists(log_file_path):
+        return runtimes
+    with open(log_file_path, "r") as file:
+        for line in file:
+            fields = line.strip().split(";")
+            if len(fields) < 5:
+                continue
+            step, tile = fields[2], fields[3]
+            try:
+                runtime = float(fields[4])
+            except ValueError:
+                continue
+            if runtime < 0:
+                continue
+            runtimes.setdefault(step, {})[tile] = runtime
+    return runtimes
+
+
+def load_runtime_history(history_path: str) -> dict[str, dict[str, float]]:
+    """
+    Load the runtime history of previous runs.
+
+    Args:
+        history_path (str): path to the runtime history json file
+
+    Returns:
+        dict mapping step to a dict of tile id 'y_x' to the averaged runtime
+    """
+    if not os.path.exists(history_path):
+        return {}
+    with open(history_path, "r") as file:
+        return json.load(file)
+
+
+def update_runtime_history(
+    history_path: str, log_file_path: str, alpha: float = RUNTIME_EMA_ALPHA
+) -> dict[str, dict[str, float]]:
+    """
+    Update the runtime history with the runtimes of the latest run.
+
+    Args:
+        history_path (str): path to the runtime history json file
+        log_file_path (str): path to the log file of the latest run
+        alpha (float): weight of the latest runtime in the moving average
+
+    Returns:
+        the updated history
+    """
+    history = load_runtime_history(history_path)
+    for step, runtimes in read_runtime_log(log_file_path).items():
+        step_history = history.setdefault(step, {})
+        for tile, runtime in runtimes.items():
+            if tile in step_history:
+                runtime = alpha * runtime + (1 - alpha) * step_history[tile]
+            step_history[tile] = round(runtime, 4)
+
+    with open(history_path, "w") as file:
+        json.dump(history, file, indent=1, sort_keys=True)
+    return history
+
+
+def estimate_runtimes(
+    data_dict: dict[str, dict],
+    history: dict[str, dict[str, float]],
+    steps: list[str],
+) -> dict[str, float]:
+    """
+    Estimate the runtime of every tile as sum over the given steps.
+
+    Tiles without history are estimated from their valid pixel fraction
+    ('valid_fraction' in data_dict), scaled by the median runtime per valid
+    fraction of the tiles with history.
+
+    Args:
+        data_dict (dict): maps tile id 'y_x' to the respective surface model tiles
+        history (dict): runtime history, see load_runtime_history
+        steps (list): steps of the run, e.g. ['wall', 'svf', 'solweig']
+
+    Returns:
+        dict mapping tile id 'y_x' to the estimated runtime
+    """
+    estimates = {}
+    rates = []
+    for tile, entry in data_dict.items():
+        step_runtimes = [history.get(step, {}).get(tile) for step in steps]
+        if any(runtime is None for runtime in step_runtimes):
+            continue
+        estimates[tile] = sum(step_runtimes)
+        if entry.get("valid_fraction"):
+            rates.append(estimates[tile] / entry["valid_fraction"])
+
+    rate = sorted(rates)[len(rates) // 2] if rates else 1.0
+    for tile, entry in data_dict.items():
+        if tile not in estimates:
+            valid_fraction = entry.get("valid_fraction")
+            if valid_fraction is None:
+                valid_fraction = 1.0
+            estimates[tile] = rate * valid_fraction
+    return estimates
+
+
+def order_longest_first(
+    data_dict: dict[str, dict],
+    history: dict[str, dict[str, float]],
+    steps: list[str],
+) -> list[tuple[str, dict]]:
+    """
+    Order the tiles by their estimated runtime, longest first.
+
+    Submitting the longest tiles first (with one tile per task) keeps the slowest
+    tiles from ending up at the tail of the run and minimizes its makespan.
+
+    Args:
+        data_dict (dict): maps tile id 'y_x' to the respective surface model tiles
+        history (dict): runtime history, see load_runtime_history
+        steps (list): steps of the run, e.g. ['solweig']
+
+    Returns:
+        list of (tile id, value) pairs of data_dict
+    """
+    estimates = estimate_runtimes(data_dict, history, steps)
+    return sorted(data_dict.items(), key=lambda item: (-estimates[item[0]], item[0]))
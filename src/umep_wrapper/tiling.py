@@ -0,0 +1,202 @@
+"""
+This file holds the tiling metadata of the tile folders.
+
+The tiling (resolution, tile size and overlap in pixels) used to be encoded in the
+folder names, e.g. DTM+DSM_3m_tiles_1000+200. It is now read from a 'tiling.json'
+within the tile folder or, for folders without that file, derived from the
+georeferencing of the tiles themselves, so folders can be named freely. A derived
+tiling is stored as 'tiling.json' (if the folder is writable), so the tiles are
+only opened once; after retiling a folder in place, its tiling.json has to be
+rewritten (see --write).
+
+The tiling of a folder is printed with:
+    python umep_wrapper/tiling.py <tile folder> [--shell]
+"""
+
+import argparse
+import glob
+import json
+import os
+from dataclasses import asdict, dataclass
+
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+TILING_FILE = "tiling.json"
+
+
+@dataclass(frozen=True)
+class Tiling:
+    """Regular tiling of a raster mosaic."""
+
+    resolution: float
+    size: int
+    overlap: int
+
+    @property
+    def stride(self) -> int:
+        """Distance of the origins of neighbouring tiles in pixels."""
+        return self.size - self.overlap
+
+    @property
+    def resolution_label(self) -> str:
+        """Resolution as used in folder names, e.g. '3m'."""
+        return f"{self.resolution:g}m"
+
+    @property
+    def size_label(self) -> str:
+        """Tile size and overlap as used in folder names, e.g. '1000+200'."""
+        return f"{self.size}+{self.overlap}"
+
+
+def write_tiling(folder: str, tiling: Tiling) -> str:
+    """
+    Write the tiling metadata of a tile folder.
+
+    Args:
+        folder (str): tile folder
+        tiling (Tiling): tiling of the tiles within the folder
+
+    Returns:
+        path of the metadata file
+    """
+    tiling_path = os.path.join(folder, TILING_FILE)
+    # concurrent runs may derive the tiling of the same folder
+    tmp_path = f"{tiling_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(asdict(tiling), file, indent=1)
+    os.replace(tmp_path, tiling_path)
+    return tiling_path
+
+
+def derive_tiling(folder: str) -> Tiling:
+    """
+    Derive the tiling from the georeferencing of the tiles in a folder.
+
+    The tile size is the largest tile extent (tiles at the border of the mosaic may
+    be cut), the overlap follows from the smallest distance of two tile origins.
+
+    Args:
+        folder (str): tile folder
+
+    Returns:
+        the tiling of the folder, with overlap 0 for a single tile
+
+    Raises:
+        FileNotFoundError: thrown if the folder contains no tif files
+    """
+    file_paths = sorted(glob.glob(os.path.join(folder, "*.tif")))
+    if not file_paths:
+        raise FileNotFoundError(f"No tiles found in {folder}.")
+
+    size = 0
+    origins = set()
+    for file_path in file_paths:
+        # only the header is read
+        dataset = gdal.Open(file_path, gdal.GA_ReadOnly)
+        ulx, xres, _, uly, _, _ = dataset.GetGeoTransform()
+        size = max(size, dataset.RasterXSize, dataset.RasterYSize)
+        origins.add((ulx, uly))
+        dataset = None
+
+    strides = []
+    for axis in range(2):
+        positions = sorted({origin[axis] for origin in origins})
+        strides += [
+            round(abs(b - a) / xres) for a, b in zip(positions[:-1], positions[1:])
+        ]
+    overlap = size - min(strides) if strides else 0
+    return Tiling(resolution=round(abs(xres), 6), size=size, overlap=overlap)
+
+
+def read_tiling(folder: str) -> Tiling:
+    """
+    Read the tiling of a tile folder from its metadata file or its tiles.
+
+    A tiling derived from the tiles is stored as metadata file, unless the folder
+    is read-only.
+
+    Args:
+        folder (str): tile folder
+
+    Returns:
+        the tiling of the folder
+    """
+    tiling_path = os.path.join(folder, TILING_FILE)
+    if os.path.exists(tiling_path):
+        with open(tiling_path, "r") as file:
+            return Tiling(**json.load(file))
+    tiling = derive_tiling(folder)
+    try:
+        write_tiling(folder, tiling)
+    except OSError as e:
+        print(f"Tiling of {folder} is not stored: {e}")
+    return tiling
+
+
+def get_tiling(args: dict[str, str]) -> Tiling:
+    """Returns the tiling of the DSM folder of the given run arguments."""
+    return read_tiling(os.path.join(args["data_path"], args["dsm_folder"]))
+
+
+def check_tilings(data_path: str, folders: dict[str, str]) -> Tiling:
+    """
+    Check that the tile folders of a run share the same tiling.
+
+    Args:
+        data_path (str): folder which contains the tile folders
+        folders (dict): maps names (e.g. 'DSM') to tile folders, None is ignored
+
+    Returns:
+        the common tiling
+
+    Raises:
+        RuntimeError: thrown if resolution, size or overlap differ
+    """
+    tilings = {
+        name: read_tiling(os.path.join(data_path, folder))
+        for name, folder in folders.items()
+        if folder is not None
+    }
+    (first_name, first), *others = tilings.items()
+    for name, tiling in others:
+        if tiling.resolution != first.resolution:
+            raise RuntimeError(
+                f"Resolutions of {first_name} and {name} do not match: "
+                f"{first.resolution_label} ({first_name}) vs. "
+                f"{tiling.resolution_label} ({name})"
+            )
+        if tiling.size_label != first.size_label:
+            raise RuntimeError(
+                f"Sizes of {first_name} and {name} do not match: "
+                f"{first.size_label} ({first_name}) vs. {tiling.size_label} ({name})"
+            )
+    return first
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the tiling of a tile folder.")
+    parser.add_argument("folder", type=str, help="Tile folder")
+    parser.add_argument(
+        "--shell",
+        action="store_true",
+        help="Print 'resolution size overlap' for the use with read in shell scripts",
+    )
+    parser.add_argument(
+        "--write",
+        action="store_true",
+        help="Derive the tiling from the tiles and store it as metadata file within "
+        "the folder, e.g. after retiling",
+    )
+    args_dict = vars(parser.parse_args())
+
+    if args_dict["write"]:
+        folder_tiling = derive_tiling(args_dict["folder"])
+        write_tiling(args_dict["folder"], folder_tiling)
+    else:
+        folder_tiling = read_tiling(args_dict["folder"])
+    if args_dict["shell"]:
+        print(folder_tiling.resolution_label, folder_tiling.size, folder_tiling.overlap)
+    else:
+        print(json.dumps(asdict(folder_tiling)))
@@ -0,0 +1,419 @@
+"""
+This file holds the tuning of the tile size and overlap.
+
+Every candidate tiling is cut from the DSM/CDSM/DTM mosaics for a random sample of
+tiles, for which wall, SVF and SOLWEIG run as stages of the stage graph one after
+the other. The traced runtime and peak memory per tile (see tracing.py) give the
+cost of a tiling for the whole city: the number of non-empty tiles follows from
+the valid pixels of the DSM mosaic, the number of parallel tiles from the core
+count and the memory limit. The candidates are reported by their city-hour
+throughput, i.e. the number of hours of the city SOLWEIG can model per hour.
+
+Larger tiles waste less work on the overlap, but need more memory per tile and
+leave cores idle at the end of a run. The overlap has to cover the shadows of the
+highest buildings, so only overlaps which are known to be sufficient should be
+given as candidates.
+
+Run with:
+    python umep_wrapper/tiling_tuner.py --dsm=<mosaic> --cdsm=<mosaic> --dtm=<mosaic>
+        --met_file=<hourly metfile> --output_path=<scratch folder>
+"""
+
+import argparse
+import math
+import os
+import random
+import shutil
+
+import numpy as np
+from osgeo import gdal
+
+from umep_wrapper.solweig_multi_processing import TEMPLATE_PATH
+from umep_wrapper.stage_graph import (
+    SOLWEIG_STAGE,
+    SVF_STAGE,
+    WALL_STAGE,
+    get_stage_levels,
+    run_stage,
+)
+from umep_wrapper.tile_scheduler import (
+    MEMORY_RESERVE,
+    get_cpu_limit,
+    get_memory_limit,
+)
+from umep_wrapper.tiling import Tiling, write_tiling
+from umep_wrapper.tracing import read_trace, reset_trace
+
+gdal.UseExceptions()
+
+DEFAULT_SIZES = (500, 750, 1000, 1500)
+DEFAULT_OVERLAPS = (200,)
+# sample tiles need enough valid pixels to be representative for the city
+MIN_SAMPLE_VALID = 0.5
+MOSAICS = ("dsm", "cdsm", "dtm")
+
+
+def get_candidates(sizes: list[int], overlaps: list[int]) -> list[Tiling]:
+    """
+    Combine tile sizes and overlaps to candidate tilings.
+
+    Combinations where the overlap takes half of the tile or more are dropped,
+    since the mosaic keeps only the core window of every tile.
+
+    Args:
+        sizes (list): tile sizes in pixels
+        overlaps (list): tile overlaps in pixels
+
+    Returns:
+        list of the candidate tilings, without resolution
+    """
+    return [
+        Tiling(resolution=None, size=size, overlap=overlap)
+        for size in sorted(set(sizes))
+        for overlap in sorted(set(overlaps))
+        if 2 * overlap < size
+    ]
+
+
+def get_valid_mask(dsm_path: str) -> np.ndarray:
+    """
+    Read the valid pixels of a DSM mosaic.
+
+    Valid pixels are neither NoData nor masked (zero), as for the tile catalog.
+
+    Args:
+        dsm_path (str): path to the DSM mosaic
+
+    Returns:
+        boolean array of the valid pixels
+    """
+    band = gdal.Open(dsm_path, gdal.GA_ReadOnly).GetRasterBand(1)
+    values = band.ReadAsArray()
+    valid = np.isfinite(values) & (values != 0)
+    if band.GetNoDataValue() is not None:
+        valid &= values != band.GetNoDataValue()
+    return valid
+
+
+def get_tile_windows(valid: np.ndarray, tiling: Tiling) -> dict[str, tuple]:
+    """
+    Lay the tiling over the mosaic and keep the tiles with valid pixels.
+
+    Args:
+        valid (ndarray): valid pixels of the DSM mosaic, see get_valid_mask
+        tiling (Tiling): tiling to lay over the mosaic
+
+    Returns:
+        dict mapping tile id 'y_x' to (xoff, yoff, xsize, ysize, valid fraction)
+    """
+    height, width = valid.shape
+    # summed-area table, so the valid pixels of every window are counted in O(1)
+    table = np.zeros((height + 1, width + 1), dtype=np.int64)
+    table[1:, 1:] = valid.cumsum(axis=0).cumsum(axis=1)
+
+    windows = {}
+    # the last tile starts where the remaining pixels exceed the overlap
+    y_offsets = range(0, max(height - tiling.overlap, 1), tiling.stride)
+    x_offsets = range(0, max(width - tiling.overlap, 1), tiling.stride)
+    for y, yoff in enumerate(y_offsets, start=1):
+        for x, xoff in enumerate(x_offsets, start=1):
+            yend, xend = min(yoff + tiling.size, height), min(xoff + tiling.size, width)
+            count = (
+                table[yend, xend]
+                - table[yoff, xend]
+                - table[yend, xoff]
+                + table[yoff, xoff]
+            )
+            if count > 0:
+                windows[f"{y}_{x}"] = (
+                    xoff,
+                    yoff,
+                    xend - xoff,
+                    yend - yoff,
+                    count / ((xend - xoff) * (yend - yoff)),
+                )
+    return windows
+
+
+def cut_sample_tiles(
+    mosaics: dict[str, str],
+    tiling: Tiling,
+    windows: dict[str, tuple],
+    data_path: str,
+    samples: int,
+    seed: int = 0,
+) -> dict[str, dict]:
+    """
+    Cut a random sample of tiles from the mosaics.
+
+    The sample is drawn from the full-size tiles with at least MIN_SAMPLE_VALID
+    valid pixels. If there are none, from all full-size tiles or all tiles.
+
+    Args:
+        mosaics (dict): maps 'dsm', 'cdsm' and 'dtm' to the mosaic paths
+        tiling (Tiling): tiling of the sample
+        windows (dict): tile windows of the tiling, see get_tile_windows
+        data_path (str): folder to write the tile folders '<name>_tiles' to
+        samples (int): number of sample tiles
+        seed (int): seed of the sample
+
+    Returns:
+        dict mapping the sample tile ids to their tile file names per mosaic
+    """
+    full = [
+        tile_id
+        for tile_id, (_, _, xsize, ysize, _) in windows.items()
+        if xsize == ysize == tiling.size
+    ]
+    representative = [
+        tile_id for tile_id in full if windows[tile_id][4] >= MIN_SAMPLE_VALID
+    ]
+    population = sorted(representative or full or windows)
+    sample = random.Random(seed).sample(population, min(samples, len(population)))
+
+    data_dict = {}
+    for name, mosaic_path in mosaics.items():
+        folder = os.path.join(data_path, f"{name}_tiles")
+        os.makedirs(folder, exist_ok=True)
+        write_tiling(folder, tiling)
+        for tile_id in sample:
+            xoff, yoff, xsize, ysize, _ = windows[tile_id]
+            file_name = f"{name}_{tile_id}.tif"
+            gdal.Translate(
+                os.path.join(folder, file_name),
+                mosaic_path,
+                srcWin=[xoff, yoff, xsize, ysize],
+            )
+            data_dict.setdefault(tile_id, {})[name] = file_name
+    return data_dict
+
+
+def measure_tiling(args: dict, data_dict: dict[str, dict], process_path: str) -> dict:
+    """
+    Run wall, SVF and SOLWEIG for the sample tiles one after the other.
+
+    The tiles run sequentially in this process, so the traced runtimes and peak
+    memory are those of a single tile on a single core.
+
+    Args:
+        args (dict): dict with runtime variables, i.e. file paths for SOLWEIG inputs
+        data_dict (dict): maps the sample tile ids to their tile file names
+        process_path (str): location of the folder for the stage outputs
+
+    Returns:
+        dict mapping the stage names to their mean runtime and maximal peak memory
+    """
+    trace_path = reset_trace(process_path)
+    for level in get_stage_levels([WALL_STAGE, SVF_STAGE, SOLWEIG_STAGE]):
+        for stage in level:
+            for k, v in data_dict.items():
+                run_stage(
+                    args,
+                    TEMPLATE_PATH,
+                    os.path.basename(process_path),
+                    process_path,
+                    ((k, stage.name), (stage, v)),
+                )
+
+    costs = {}
+    for record in read_trace([trace_path]):
+        cost = costs.setdefault(
+            record["step"], {"count": 0, "duration": 0.0, "peak_rss": 0}
+        )
+        cost["count"] += 1
+        cost["duration"] += record["duration"]
+        cost["peak_rss"] = max(cost["peak_rss"], record["peak_rss"])
+    for cost in costs.values():
+        cost["duration"] /= cost["count"]
+    return costs
+
+
+def estimate_throughput(
+    tiling: Tiling, tiles: int, costs: dict, cores: int, memory_limit: int
+) -> dict:
+    """
+    Estimate the cost of a tiling for the whole city.
+
+    Tiles are processed in waves of as many tiles as fit onto the cores and into
+    the memory limit (less MEMORY_RESERVE), as by the AdaptiveTileScheduler.
+
+    Args:
+        tiling (Tiling): the candidate tiling
+        tiles (int): number of non-empty tiles of the city
+        costs (dict): runtime and peak memory per stage, see measure_tiling
+        cores (int): number of available cores
+        memory_limit (int): memory limit in bytes
+
+    Returns:
+        dict with the tiling, the parallel tiles, the seconds of the one-off
+        preprocessing (wall and SVF) and of a city-hour and the city-hour throughput
+    """
+    peak_rss = max(cost["peak_rss"] for cost in costs.values())
+    parallel = max(1, min(cores, int(memory_limit * (1 - MEMORY_RESERVE) // peak_rss)))
+    waves = math.ceil(tiles / parallel)
+    hour_seconds = waves * costs["solweig"]["duration"]
+    return {
+        "size": tiling.size,
+        "overlap": tiling.overlap,
+        "tiles": tiles,
+        "peak_rss": peak_rss,
+        "parallel": parallel,
+        "prepare_seconds": waves
+        * sum(costs[name]["duration"] for name in ["wall", "svf"] if name in costs),
+        "hour_seconds": hour_seconds,
+        "throughput": 3600 / hour_seconds if hour_seconds > 0 else math.inf,
+    }
+
+
+def tune_tiling(
+    args: dict,
+    candidates: list[Tiling],
+    cores: int,
+    memory_limit: int,
+    samples: int = 4,
+    measure=measure_tiling,
+) -> list[dict]:
+    """
+    Benchmark the candidate tilings and rank them by city-hour throughput.
+
+    Args:
+        args (dict): the mosaics 'dsm', 'cdsm' and 'dtm', 'met_file' and
+            'output_path', the folder for the sample tiles and stage outputs
+        candidates (list): candidate tilings, see get_candidates
+        cores (int): number of available cores
+        memory_limit (int): memory limit in bytes
+        samples (int): number of sample tiles per candidate
+        measure: function returning the stage costs of the sample tiles, called
+            with the stage arguments, the sample tiles and the process path
+
+    Returns:
+        list of the estimates (see estimate_throughput), best first
+    """
+    mosaics = {name: args[name] for name in MOSAICS}
+    resolution = gdal.Open(args["dsm"], gdal.GA_ReadOnly).GetGeoTransform()[1]
+    valid = get_valid_mask(args["dsm"])
+
+    results = []
+    for candidate in candidates:
+        tiling = Tiling(round(abs(resolution), 6), candidate.size, candidate.overlap)
+        windows = get_tile_windows(valid, tiling)
+        if not windows:
+            continue
+        run_path = os.path.join(
+            args["output_path"], f"{tiling.resolution_label}_{tiling.size_label}"
+        )
+        shutil.rmtree(run_path, ignore_errors=True)
+        data_dict = cut_sample_tiles(
+            mosaics, tiling, windows, run_path, samples, args.get("seed", 0)
+        )
+        process_path = os.path.join(run_path, "SOLWEIG")
+        os.makedirs(process_path, exist_ok=True)
+        stage_args = {
+            "data_path": run_path,
+            "dsm_folder": "dsm_tiles",
+            "cdsm_folder": "cdsm_tiles",
+            "dtm_folder": "dtm_tiles",
+            "output_path": run_path,
+            "met_file": args["met_file"],
+            "proj_lib": args.get("proj_lib"),
+        }
+        costs = measure(stage_args, data_dict, process_path)
+        estimate = estimate_throughput(tiling, len(windows), costs, cores, memory_limit)
+        print(
+            f"{tiling.size_label}: {estimate['tiles']} tiles, "
+            f"{estimate['parallel']} parallel, "
+            f"{estimate['hour_seconds']:.0f} s per city-hour"
+        )
+        results.append(estimate)
+
+    return sorted(results, key=lambda result: result["throughput"], reverse=True)
+
+
+def format_results(results: list[dict]) -> str:
+    """Returns the ranked estimates as printable table."""
+    lines = [
+        "size+overlap  tiles  parallel  peak RSS [MiB]  prepare [s]  "
+        "city-hour [s]  city-hours/h"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['size']:>6}+{result['overlap']:<6} {result['tiles']:>5}  "
+            f"{result['parallel']:>8}  {result['peak_rss'] / 1024**2:>14.0f}  "
+            f"{result['prepare_seconds']:>11.0f}  {result['hour_seconds']:>13.1f}  "
+            f"{result['throughput']:>12.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the tile size and overlap with the best city-hour throughput."
+    )
+    parser.add_argument("--dsm", type=str, required=True, help="DSM mosaic")
+    parser.add_argument("--cdsm", type=str, required=True, help="CDSM mosaic")
+    parser.add_argument("--dtm", type=str, required=True, help="DTM mosaic")
+    parser.add_argument(
+        "--met_file", type=str, required=True, help="Metfile of a single hour"
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="Folder for the sample tiles and their outputs",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Candidate tile sizes in pixels",
+    )
+    parser.add_argument(
+        "--overlaps",
+        type=int,
+        nargs="+",
+        default=DEFAULT_OVERLAPS,
+        help="Candidate tile overlaps in pixels, each has to cover the shadows",
+    )
+    parser.add_argument(
+        "--samples", type=int, default=4, help="Number of sample tiles per tiling"
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Number of cores, defaults to the cgroup limit",
+    )
+    parser.add_argument(
+        "--memory_limit",
+        type=float,
+        default=None,
+        help="Memory limit in GiB, defaults to the cgroup limit",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sample")
+    parser.add_argument(
+        "--proj_lib",
+        type=str,
+        required=False,
+        help="Path to folder that contains proj.db",
+    )
+    args_dict = vars(parser.parse_args())
+
+    ranked = tune_tiling(
+        args_dict,
+        get_candidates(args_dict["sizes"], args_dict["overlaps"]),
+        args_dict["cores"] or get_cpu_limit(),
+        (
+            int(args_dict["memory_limit"] * 1024**3)
+            if args_dict["memory_limit"]
+            else get_memory_limit()
+        ),
+        args_dict["samples"],
+    )
+    print(format_results(ranked))
+    if ranked:
+        print(
+            f"Best tiling: {ranked[0]['size']}+{ranked[0]['overlap']}, "
+            "retile the inputs and store the tiling with "
+            "'python umep_wrapper/tiling.py <tile folder> --write'"
+        )
@@ -0,0 +1,274 @@
+"""
+This file holds the structured tracing of the tile stages.
+
+Every stage of a tile (e.g. wall, svf, solweig, nocturnal) writes one JSON line to
+the trace file of its host within the process folder, with:
+    step, tile, host, pid
+    timestamp: wall clock start time (epoch seconds), sortable across hosts
+    start, end, duration: monotonic start/end time and difference in seconds
+    cpu_time: user + system CPU seconds of the worker process during the stage
+    peak_rss: peak resident set size of the worker process during the stage
+    read_bytes, write_bytes: storage I/O of the worker process during the stage
+    error: repr of the exception, if the stage failed
+
+The summary of a run (critical path, utilization of the workers, slowest tiles)
+is printed with:
+    python umep_wrapper/tracing.py <process folder>/trace_*.jsonl
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import time
+from contextlib import contextmanager
+
+import psutil
+
+TRACE_PREFIX = "trace_"
+
+
+def get_trace_path(process_path: str) -> str:
+    """Returns the trace file of this host within the given process folder."""
+    return os.path.join(process_path, f"{TRACE_PREFIX}{socket.gethostname()}.jsonl")
+
+
+def reset_trace(process_path: str) -> str:
+    """
+    Start an empty trace file of this host for a new run.
+
+    Args:
+        process_path (str): location of the process folder of the run
+
+    Returns:
+        path of the trace file
+    """
+    trace_path = get_trace_path(process_path)
+    open(trace_path, "w").close()
+    return trace_path
+
+
+def _reset_peak_rss() -> None:
+    """Resets the peak RSS (VmHWM) of this process, supported by Linux >= 4.0."""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def _read_peak_rss() -> int:
+    """Returns the peak RSS of this process since the last reset in bytes."""
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # lifetime peak, ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _io_counters(process: psutil.Process) -> tuple[int, int] | None:
+    """Returns the read and written bytes of a process, None if not supported."""
+    try:
+        counters = process.io_counters()
+    except (AttributeError, psutil.Error):
+        return None
+    return counters.read_bytes, counters.write_bytes
+
+
+@contextmanager
+def trace_stage(trace_path: str, step: str, tile_id: str):
+    """
+    Trace a stage of a tile and append the record to the trace file.
+
+    Args:
+        trace_path (str): path of the trace file, see get_trace_path
+        step (str): name of the stage
+        tile_id (str): tile id 'y_x'
+
+    Yields:
+        the record, callers may add fields (e.g. whether the stage was skipped)
+    """
+    process = psutil.Process()
+    record = {
+        "step": step,
+        "tile": tile_id,
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "timestamp": time.time(),
+    }
+    _reset_peak_rss()
+    cpu_start = process.cpu_times()
+    io_start = _io_counters(process)
+    start = time.monotonic()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        end = time.monotonic()
+        cpu_end = process.cpu_times()
+        io_end = _io_counters(process)
+        record.update(
+            start=start,
+            end=end,
+            duration=end - start,
+            cpu_time=(cpu_end.user - cpu_start.user)
+            + (cpu_end.system - cpu_start.system),
+            peak_rss=_read_peak_rss(),
+            read_bytes=io_end[0] - io_start[0] if io_start and io_end else None,
+            write_bytes=io_end[1] - io_start[1] if io_start and io_end else None,
+        )
+        # a single small append per record, so concurrent workers do not interleave
+        with open(trace_path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+
+def read_trace(trace_paths: list[str]) -> list[dict]:
+    """
+    Read the records of one or more trace files.
+
+    Args:
+        trace_paths (list): paths of the trace files, e.g. of all hosts of a run
+
+    Returns:
+        list of the records, sorted by their start time
+    """
+    records = []
+    for trace_path in trace_paths:
+        with open(trace_path, "r") as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    return sorted(records, key=lambda record: record["timestamp"])
+
+
+def get_critical_path(records: list[dict]) -> list[dict]:
+    """
+    Get the chain of stages which determined the end of the run.
+
+    Starting from the stage that finished last, the chain follows the latest
+    finished earlier stage of the same tile, since the stages of a tile run one
+    after the other.
+
+    Args:
+        records (list): trace records of the run
+
+    Returns:
+        list of the records on the critical path, in execution order
+    """
+    if not records:
+        return []
+    path = [max(records, key=lambda record: record["timestamp"] + record["duration"])]
+    while True:
+        current = path[-1]
+        earlier = [
+            record
+            for record in records
+            if record["tile"] == current["tile"]
+            and record["timestamp"] + record["duration"] <= current["timestamp"]
+        ]
+        if not earlier:
+            return path[::-1]
+        path.append(
+            max(earlier, key=lambda record: record["timestamp"] + record["duration"])
+        )
+
+
+def summarize_trace(records: list[dict], top: int = 10) -> dict:
+    """
+    Summarize the trace records of a run.
+
+    Args:
+        records (list): trace records of the run
+        top (int): number of slowest tiles to report
+
+    Returns:
+        dict with the span of the run, totals per step, utilization per worker,
+        the slowest tiles and the critical path
+    """
+    if not records:
+        return {"span": 0.0, "steps": {}, "workers": {}, "slowest": [], "path": []}
+    begin = min(record["timestamp"] for record in records)
+    finish = max(record["timestamp"] + record["duration"] for record in records)
+    span = finish - begin
+
+    steps = {}
+    for record in records:
+        step = steps.setdefault(
+            record["step"],
+            {"count": 0, "failed": 0, "duration": 0.0, "max": 0.0, "peak_rss": 0},
+        )
+        step["count"] += 1
+        step["failed"] += "error" in record
+        step["duration"] += record["duration"]
+        step["max"] = max(step["max"], record["duration"])
+        step["peak_rss"] = max(step["peak_rss"], record["peak_rss"])
+
+    # every worker process occupies one core while it runs a stage
+    workers = {}
+    for record in records:
+        worker = workers.setdefault(
+            f"{record['host']}:{record['pid']}", {"busy": 0.0, "cpu_time": 0.0}
+        )
+        worker["busy"] += record["duration"]
+        worker["cpu_time"] += record["cpu_time"]
+    for worker in workers.values():
+        worker["utilization"] = worker["cpu_time"] / span if span > 0 else 0.0
+
+    tiles = {}
+    for record in records:
+        tiles[record["tile"]] = tiles.get(record["tile"], 0.0) + record["duration"]
+    slowest = sorted(tiles.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        "span": span,
+        "steps": steps,
+        "workers": workers,
+        "slowest": slowest,
+        "path": get_critical_path(records),
+    }
+
+
+def format_summary(summary: dict) -> str:
+    """Returns the summary of a run as printable text."""
+    lines = [f"Run span: {summary['span']:.1f} s", "", "Steps:"]
+    for name, step in summary["steps"].items():
+        lines.append(
+            f"  {name}: {step['count']} stages ({step['failed']} failed), "
+            f"total {step['duration']:.1f} s, max {step['max']:.1f} s, "
+            f"peak RSS {step['peak_rss'] / 1024**2:.0f} MiB"
+        )
+    lines += ["", "Workers (utilization = CPU time / run span):"]
+    for name, worker in sorted(summary["workers"].items()):
+        lines.append(
+            f"  {name}: busy {worker['busy']:.1f} s, cpu {worker['cpu_time']:.1f} s, "
+            f"utilization {worker['utilization']:.0%}"
+        )
+    lines += ["", "Slowest tiles:"]
+    lines += [f"  {tile}: {duration:.1f} s" for tile, duration in summary["slowest"]]
+    lines += ["", "Critical path:"]
+    lines += [
+        f"  {record['tile']} {record['step']}: {record['duration']:.1f} s "
+        f"on {record['host']}:{record['pid']}"
+        for record in summary["path"]
+    ]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the trace of a run.")
+    parser.add_argument("trace_files", nargs="+", help="Trace files of the run")
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest tiles to list"
+    )
+    args_dict = vars(parser.parse_args())
+
+    print(
+        format_summary(
+            summarize_trace(read_trace(args_dict["trace_files"]), args_dict["top"])
+        )
+    )
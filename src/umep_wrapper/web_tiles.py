@@ -0,0 +1,327 @@
+"""
+This file holds the pre-rendering of the products as XYZ web map tiles.
+
+The dashboard serves the current hour as static, color-mapped PNG (or WebP)
+tiles of the Web Mercator tile scheme instead of rendering the COGs on request:
+
+    <tile_dir>/<product>/<z>/<x>/<y>.png
+    <tile_dir>/<product>/tiles.json     zoom levels and a digest per tile
+
+The tiles are rendered from the in-memory arrays of post-processing (see
+postprocess.py --tile_dir). Per zoom level, the product is warped to Web
+Mercator in strips of one tile row and mapped to the palette indices of its
+colormap. Only tiles whose palette indices differ from the previous render are
+encoded and written, by a process pool; tiles without any value are removed.
+Between two hours most tiles outside the city center usually stay unchanged,
+e.g. all tiles of the classes with no thermal stress at night.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+import numpy as np
+from osgeo import gdal, osr
+from PIL import Image
+
+gdal.UseExceptions()
+
+TILE_SIZE = 256
+# half of the extent of the Web Mercator tile scheme in meters
+ORIGIN_SHIFT = 20037508.342789244
+# zoom 16 is about 1.5 m per pixel at Dortmund, the products have 3 m
+DEFAULT_ZOOMS = list(range(10, 17))
+TILE_FORMATS = ("png", "webp")
+MANIFEST_FILE = "tiles.json"
+# palette index of pixels without value, transparent
+TRANSPARENT = 255
+# strips queued for encoding, bounds the memory of the queued tiles
+MAX_PENDING_STRIPS = 16
+
+
+@dataclass(frozen=True)
+class Colormap:
+    """Colors of a product, value = vmin + palette index * step."""
+
+    colors: tuple[tuple[int, int, int], ...]
+    vmin: float = 0.0
+    step: float = 1.0
+    # classes must not be averaged on the lower zoom levels
+    is_class: bool = False
+
+    @property
+    def palette(self) -> list[int]:
+        """The RGB palette of the colors, padded to 256 colors."""
+        colors = list(self.colors) + [(0, 0, 0)] * (256 - len(self.colors))
+        return [channel for color in colors for channel in color]
+
+    def quantize(self, values: np.ndarray) -> np.ndarray:
+        """
+        Map values to palette indices.
+
+        Args:
+            values (ndarray): physical values, NaN as NoData
+
+        Returns:
+            uint8 palette indices, TRANSPARENT as NoData
+        """
+        valid = np.isfinite(values)
+        indices = np.floor((np.where(valid, values, self.vmin) - self.vmin) / self.step)
+        indices = np.clip(indices, 0, len(self.colors) - 1)
+        return np.where(valid, indices, TRANSPARENT).astype(np.uint8)
+
+
+def _continuous(name: str, vmin: float, vmax: float) -> Colormap:
+    """Returns a colormap of 254 colors of a matplotlib colormap from vmin to vmax."""
+    from matplotlib import colormaps
+
+    rgba = colormaps[name](np.linspace(0.0, 1.0, 254))
+    colors = tuple(tuple(int(round(c * 255)) for c in color[:3]) for color in rgba)
+    return Colormap(colors, vmin, (vmax - vmin) / len(colors))
+
+
+# class colors of the UTCI assessment scale, from extreme cold to extreme heat
+UTCI_CLASS_COLORS = (
+    (0, 42, 128),
+    (0, 85, 204),
+    (0, 128, 255),
+    (102, 178, 255),
+    (179, 217, 255),
+    (0, 168, 84),
+    (255, 153, 0),
+    (255, 85, 0),
+    (204, 0, 0),
+    (128, 0, 0),
+)
+# class colors of the PET scale, see calculate_tc_indices.PET_MAP
+PET_CLASS_COLORS = (
+    (0, 42, 128),
+    (0, 85, 204),
+    (0, 128, 255),
+    (179, 217, 255),
+    (0, 168, 84),
+    (255, 204, 0),
+    (255, 153, 0),
+    (255, 85, 0),
+    (204, 0, 0),
+)
+
+
+def get_colormap(product: str) -> Colormap | None:
+    """Returns the colormap of a product, None if it is not rendered."""
+    if product == "UTCI-class":
+        return Colormap(UTCI_CLASS_COLORS, is_class=True)
+    if product == "PET-class":
+        return Colormap(PET_CLASS_COLORS, is_class=True)
+    ranges = {"UTCI": (-40.0, 50.0), "PET": (-10.0, 50.0), "MRT": (-10.0, 70.0)}
+    if product in ranges:
+        return _continuous("RdYlBu_r", *ranges[product])
+    return None
+
+
+def get_tile_range(
+    geotransform: tuple[float, ...],
+    width: int,
+    height: int,
+    projection: str,
+    zoom: int,
+) -> tuple[int, int, int, int]:
+    """
+    Get the XYZ tiles covering a raster.
+
+    Args:
+        geotransform (tuple): geotransform of the raster
+        width (int): width of the raster in pixels
+        height (int): height of the raster in pixels
+        projection (str): WKT of the raster CRS
+        zoom (int): zoom level
+
+    Returns:
+        first and last tile column, first and last tile row
+    """
+    source_srs = osr.SpatialReference(wkt=projection)
+    target_srs = osr.SpatialReference()
+    target_srs.ImportFromEPSG(3857)
+    source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source_srs, target_srs)
+
+    # the edges of the raster, densified since the projections are not parallel
+    ulx, xres, _, uly, _, yres = geotransform
+    steps = np.linspace(0.0, 1.0, 21)
+    edges = [(column * width, 0.0) for column in steps]
+    edges += [(column * width, height) for column in steps]
+    edges += [(0.0, row * height) for row in steps]
+    edges += [(width, row * height) for row in steps]
+    points = transform.TransformPoints(
+        [(ulx + column * xres, uly + row * yres) for column, row in edges]
+    )
+    xs, ys = [point[0] for point in points], [point[1] for point in points]
+
+    span = 2 * ORIGIN_SHIFT / 2**zoom
+    last = 2**zoom - 1
+    return (
+        max(int((min(xs) + ORIGIN_SHIFT) // span), 0),
+        min(int((max(xs) + ORIGIN_SHIFT) // span), last),
+        max(int((ORIGIN_SHIFT - max(ys)) // span), 0),
+        min(int((ORIGIN_SHIFT - min(ys)) // span), last),
+    )
+
+
+def _warp_strip(
+    source: gdal.Dataset, zoom: int, row: int, columns: tuple[int, int], is_class: bool
+) -> np.ndarray:
+    """Warps a row of tiles of a zoom level from the source, NaN as NoData."""
+    span = 2 * ORIGIN_SHIFT / 2**zoom
+    first, last = columns
+    strip = gdal.Warp(
+        "",
+        source,
+        format="MEM",
+        dstSRS="EPSG:3857",
+        outputBounds=(
+            -ORIGIN_SHIFT + first * span,
+            ORIGIN_SHIFT - (row + 1) * span,
+            -ORIGIN_SHIFT + (last + 1) * span,
+            ORIGIN_SHIFT - row * span,
+        ),
+        width=(last - first + 1) * TILE_SIZE,
+        height=TILE_SIZE,
+        resampleAlg="mode" if is_class else "average",
+        srcNodata=np.nan,
+        dstNodata=np.nan,
+        outputType=gdal.GDT_Float32,
+        multithread=True,
+    )
+    return strip.GetRasterBand(1).ReadAsArray()
+
+
+def _digest(tile: np.ndarray) -> str:
+    """Digest of the palette indices of a tile."""
+    return hashlib.blake2b(tile.tobytes(), digest_size=16).hexdigest()
+
+
+def _write_tile(
+    path: str, tile: np.ndarray, palette: list[int], tile_format: str
+) -> str:
+    """Encodes a tile and writes it, used by the process pool."""
+    image = Image.fromarray(tile)
+    image.putpalette(palette)  # mode L becomes P
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if tile_format == "png":
+        image.save(tmp_path, format="PNG", transparency=TRANSPARENT, optimize=False)
+    else:
+        image.info["transparency"] = TRANSPARENT
+        image.convert("RGBA").save(tmp_path, format="WEBP", lossless=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _load_manifest(path: str) -> dict:
+    """Returns the manifest of the previous render, empty if there is none."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def render_tiles(
+    product: str,
+    values: np.ndarray,
+    geotransform: tuple[float, ...],
+    projection: str,
+    tile_dir: str,
+    pool: Pool,
+    zooms: list[int] = None,
+    tile_format: str = "png",
+) -> dict[str, int]:
+    """
+    Render the XYZ tiles of a product, writing only the changed ones.
+
+    Args:
+        product (str): name of the product, e.g. 'UTCI-class'
+        values (ndarray): physical values of the product, NaN as NoData
+        geotransform (tuple): geotransform of the values
+        projection (str): WKT of the CRS of the values
+        tile_dir (str): folder of the tile pyramids, one subfolder per product
+        pool (Pool): process pool encoding the tiles
+        zooms (list): zoom levels, DEFAULT_ZOOMS if not given (optional)
+        tile_format (str): 'png' or 'webp' (optional)
+
+    Returns:
+        number of written, removed and unchanged tiles
+
+    Raises:
+        ValueError: thrown if the product has no colormap or the format is unknown
+    """
+    colormap = get_colormap(product)
+    if colormap is None:
+        raise ValueError(f"Product {product} has no colormap.")
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(
+            f"Unknown tile format {tile_format}, use one of {TILE_FORMATS}."
+        )
+    zooms = list(zooms or DEFAULT_ZOOMS)
+    product_dir = os.path.join(tile_dir, product)
+    manifest_path = os.path.join(product_dir, MANIFEST_FILE)
+    previous = _load_manifest(manifest_path)
+    if (previous.get("format"), previous.get("zooms")) != (tile_format, zooms):
+        previous = {}
+    previous_tiles = previous.get("tiles", {})
+
+    source = gdal.GetDriverByName("MEM").Create(
+        "", values.shape[1], values.shape[0], 1, gdal.GDT_Float32
+    )
+    source.SetGeoTransform(geotransform)
+    source.SetProjection(projection)
+    source.GetRasterBand(1).WriteArray(values.astype(np.float32))
+    source.GetRasterBand(1).SetNoDataValue(np.nan)
+
+    palette = colormap.palette
+    tiles = {}
+    pending = []
+    written = 0
+    for zoom in zooms:
+        x0, x1, y0, y1 = get_tile_range(
+            geotransform, values.shape[1], values.shape[0], projection, zoom
+        )
+        for y in range(y0, y1 + 1):
+            strip = colormap.quantize(
+                _warp_strip(source, zoom, y, (x0, x1), colormap.is_class)
+            )
+            tasks = []
+            for x in range(x0, x1 + 1):
+                tile = strip[:, (x - x0) * TILE_SIZE : (x - x0 + 1) * TILE_SIZE]
+                if np.all(tile == TRANSPARENT):
+                    continue
+                key = f"{zoom}/{x}/{y}"
+                tiles[key] = _digest(tile)
+                if previous_tiles.get(key) != tiles[key]:
+                    path = os.path.join(product_dir, key + "." + tile_format)
+                    tasks.append((path, tile, palette, tile_format))
+            # the strips are warped while the pool encodes the previous ones
+            pending.append(pool.starmap_async(_write_tile, tasks))
+            written += len(tasks)
+            if len(pending) > MAX_PENDING_STRIPS:
+                pending.pop(0).get()
+    for result in pending:
+        result.get()
+
+    removed = 0
+    for key in set(previous_tiles) - set(tiles):
+        path = os.path.join(product_dir, key + "." + tile_format)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+
+    os.makedirs(product_dir, exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"format": tile_format, "zooms": zooms, "tiles": tiles}, file)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"Rendered {written} of {len(tiles)} {product} tiles, removed {removed}")
+    return {"written": written, "removed": removed, "unchanged": len(tiles) - written}
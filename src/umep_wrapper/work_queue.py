@@ -0,0 +1,455 @@
+"""
+This file holds the work queues distributing the SOLWEIG tiles of a run.
+
+Every host of a run enqueues the pending tiles of the run (enqueueing is
+idempotent per run key, see run_state.get_run_key) and then pulls tiles until
+the queue is empty. All hosts write their results to the shared output path.
+Enqueueing again, e.g. when an hour is invoked again, re-queues the tiles which
+failed or whose claim expired; done tiles are not computed again.
+
+Backends, selected by the URL passed with --work_queue:
+    local://                    in-process queue, a single host (default)
+    sqlite:///<path>            SQLite database on a volume shared by the hosts
+    redis://<host>:<port>/<db>  Redis (or a compatible server), needs redis-py
+
+Claimed tiles carry a lease, which the claiming host renews when it retries a
+tile. Tiles of a host which died are claimed again by other hosts once the lease
+expired. Only the host holding the claim of a tile can complete it, the results
+of a host whose claim was taken over are not recorded in the queue.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# seconds after which a claimed tile may be claimed by another host, i.e. the
+# default --tile_timeout, after which the claiming host counts the tile as failed
+DEFAULT_LEASE = 3600
+# added to the tile timeout, a host reports a timed-out tile shortly after it
+LEASE_MARGIN = 60
+
+
+def get_worker_id() -> str:
+    """Returns an id of this host and process, used as owner of claimed tiles."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Queue of the tile ids of runs, implemented by the backends below.
+    """
+
+    def put(self, run_key: str, tile_ids: list[str]) -> int:
+        """
+        Enqueue the tiles of a run, in the given order.
+
+        Tiles which are already enqueued, claimed or done are not enqueued
+        again, tiles which failed or whose claim expired are re-queued.
+
+        Args:
+            run_key (str): key of the run
+            tile_ids (list): ids 'y_x' of the tiles to compute
+
+        Returns:
+            number of newly enqueued or re-queued tiles, 0 if the run is enqueued
+        """
+        raise NotImplementedError
+
+    def reset(self, run_key: str) -> None:
+        """
+        Drop all tiles of a run, also the done ones, e.g. after its outputs were lost.
+
+        Args:
+            run_key (str): key of the run
+        """
+        raise NotImplementedError
+
+    def claim(self, run_key: str, worker_id: str) -> str | None:
+        """
+        Claim the next tile of a run.
+
+        Args:
+            run_key (str): key of the run
+            worker_id (str): id of the claiming host, see get_worker_id
+
+        Returns:
+            the tile id or None if no tile is left
+        """
+        raise NotImplementedError
+
+    def renew(self, run_key: str, tile_id: str, worker_id: str) -> bool:
+        """
+        Restart the lease of a claimed tile, e.g. before it is retried.
+
+        Args:
+            run_key (str): key of the run
+            tile_id (str): id of the tile
+            worker_id (str): id of the claiming host
+
+        Returns:
+            whether the host still holds the claim
+        """
+        raise NotImplementedError
+
+    def complete(
+        self, run_key: str, tile_id: str, worker_id: str, failed: bool = False
+    ) -> bool:
+        """
+        Mark a claimed tile as done (or failed), so it is not claimed again.
+
+        Args:
+            run_key (str): key of the run
+            tile_id (str): id of the tile
+            worker_id (str): id of the claiming host
+            failed (bool): whether the tile failed after all retries
+
+        Returns:
+            whether the host still held the claim, otherwise nothing is changed
+        """
+        raise NotImplementedError
+
+    def iter_tiles(self, run_key: str, data_dict: dict, worker_id: str = None):
+        """
+        Yield the claimed tiles of a run as (tile id, tile data) until none is left.
+
+        Args:
+            run_key (str): key of the run
+            data_dict (dict): maps tile id 'y_x' to the respective surface model tiles
+            worker_id (str): id of the claiming host, defaults to get_worker_id()
+
+        Yields:
+            (tile id, tile data) pairs as expected by process_tile
+        """
+        worker_id = worker_id or get_worker_id()
+        while (tile_id := self.claim(run_key, worker_id)) is not None:
+            if tile_id not in data_dict:
+                print(f"Tile {tile_id} of the queue is unknown on this host")
+                self.complete(run_key, tile_id, worker_id, failed=True)
+                continue
+            yield tile_id, data_dict[tile_id]
+
+
+class LocalQueue(WorkQueue):
+    """
+    In-process queue, for runs on a single host.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs = {}
+
+    def put(self, run_key: str, tile_ids: list[str]) -> int:
+        with self._lock:
+            if run_key in self._runs:
+                return 0
+            self._runs[run_key] = list(tile_ids)
+            return len(tile_ids)
+
+    def reset(self, run_key: str) -> None:
+        with self._lock:
+            self._runs.pop(run_key, None)
+
+    def claim(self, run_key: str, worker_id: str) -> str | None:
+        with self._lock:
+            tiles = self._runs.get(run_key)
+            return tiles.pop(0) if tiles else None
+
+    def renew(self, run_key: str, tile_id: str, worker_id: str) -> bool:
+        return True
+
+    def complete(
+        self, run_key: str, tile_id: str, worker_id: str, failed: bool = False
+    ) -> bool:
+        return True
+
+
+class SQLiteQueue(WorkQueue):
+    """
+    Queue in a SQLite database, for hosts sharing a volume.
+
+    Claims run in an immediate transaction, so the file lock of the database
+    guarantees that every tile is handed to a single host.
+    """
+
+    def __init__(self, db_path: str, lease: float = DEFAULT_LEASE):
+        """
+        Args:
+            db_path (str): path of the database on the shared volume
+            lease (float): seconds after which a claimed tile may be claimed again
+        """
+        self.db_path = db_path
+        self.lease = lease
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue (run_key TEXT, tile_id TEXT, "
+                "position INTEGER, status TEXT, worker TEXT, claimed REAL, "
+                "PRIMARY KEY (run_key, tile_id))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns a connection waiting for the locks of other hosts."""
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def put(self, run_key: str, tile_ids: list[str]) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            requeued = conn.executemany(
+                "UPDATE queue SET status = 'pending', worker = NULL, claimed = NULL "
+                "WHERE run_key = ? AND tile_id = ? AND (status = 'failed' "
+                "OR (status = 'claimed' AND claimed < ?))",
+                [(run_key, tile_id, time.time() - self.lease) for tile_id in tile_ids],
+            ).rowcount
+            inserted = conn.executemany(
+                "INSERT OR IGNORE INTO queue VALUES (?, ?, ?, 'pending', NULL, NULL)",
+                [(run_key, tile_id, i) for i, tile_id in enumerate(tile_ids)],
+            ).rowcount
+            conn.execute("COMMIT")
+            return requeued + inserted
+        finally:
+            conn.close()
+
+    def reset(self, run_key: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM queue WHERE run_key = ?", (run_key,))
+        finally:
+            conn.close()
+
+    def claim(self, run_key: str, worker_id: str) -> str | None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tile_id FROM queue WHERE run_key = ? AND (status = 'pending' "
+                "OR (status = 'claimed' AND claimed < ?)) ORDER BY position LIMIT 1",
+                (run_key, time.time() - self.lease),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE queue SET status = 'claimed', worker = ?, claimed = ? "
+                    "WHERE run_key = ? AND tile_id = ?",
+                    (worker_id, time.time(), run_key, row[0]),
+                )
+            conn.execute("COMMIT")
+            return None if row is None else row[0]
+        finally:
+            conn.close()
+
+    def renew(self, run_key: str, tile_id: str, worker_id: str) -> bool:
+        conn = self._connect()
+        try:
+            return bool(
+                conn.execute(
+                    "UPDATE queue SET claimed = ? WHERE run_key = ? AND tile_id = ? "
+                    "AND status = 'claimed' AND worker = ?",
+                    (time.time(), run_key, tile_id, worker_id),
+                ).rowcount
+            )
+        finally:
+            conn.close()
+
+    def complete(
+        self, run_key: str, tile_id: str, worker_id: str, failed: bool = False
+    ) -> bool:
+        conn = self._connect()
+        try:
+            # a claim taken over by another host is completed by that host
+            return bool(
+                conn.execute(
+                    "UPDATE queue SET status = ? WHERE run_key = ? AND tile_id = ? "
+                    "AND status = 'claimed' AND worker = ?",
+                    ("failed" if failed else "done", run_key, tile_id, worker_id),
+                ).rowcount
+            )
+        finally:
+            conn.close()
+
+
+class RedisQueue(WorkQueue):
+    """
+    Queue on a Redis compatible server.
+
+    Only the commands rpush, lpop, hset, hsetnx, hget, hdel, hgetall and delete
+    are used, so a local stand-in client can replace the server in tests. Enqueueing
+    is not atomic, a tile may be pushed twice. Claims are decided by hsetnx,
+    which succeeds for a single host only: a pending tile by hsetnx on the
+    claimed hash, the takeover of an expired claim by hsetnx of that very claim
+    on the takeover hash, so hosts acting on an outdated read of the claim do not
+    take the tile from its new owner.
+    """
+
+    def __init__(self, client, prefix: str = "solweig", lease: float = DEFAULT_LEASE):
+        """
+        Args:
+            client: redis.Redis like client
+            prefix (str): prefix of the keys of the queue
+            lease (float): seconds after which a claimed tile may be claimed again
+        """
+        self.client = client
+        self.prefix = prefix
+        self.lease = lease
+
+    def _key(self, run_key: str, name: str) -> str:
+        return f"{self.prefix}:{run_key}:{name}"
+
+    def _is_expired(self, claim) -> bool:
+        """Whether a claim of the claimed hash expired."""
+        return json.loads(claim)["time"] < time.time() - self.lease
+
+    def _is_owner(self, run_key: str, tile_id: str, worker_id: str) -> bool:
+        """Whether the host holds the (not expired) claim of a tile."""
+        claim = self.client.hget(self._key(run_key, "claimed"), tile_id)
+        return (
+            claim is not None
+            and json.loads(claim)["worker"] == worker_id
+            and not self._is_expired(claim)
+        )
+
+    def _take_over(self, run_key: str, tile_id: str, claim, worker_id: str) -> bool:
+        """Whether the host is the single one to take over the given claim."""
+        return bool(
+            self.client.hsetnx(
+                self._key(run_key, "takeover"), f"{tile_id}:{_decode(claim)}", worker_id
+            )
+        )
+
+    def _acquire(
+        self, run_key: str, tile_id: str, worker_id: str, expired=None
+    ) -> bool:
+        """
+        Claim a pending tile or take over its expired claim.
+
+        Args:
+            run_key (str): key of the run
+            tile_id (str): id of the tile
+            worker_id (str): id of the claiming host
+            expired: the expired claim to take over, None for a pending tile
+
+        Returns:
+            whether the host claimed the tile
+        """
+        status_key = self._key(run_key, "status")
+        claimed_key = self._key(run_key, "claimed")
+        claim = json.dumps({"worker": worker_id, "time": time.time()})
+        if expired is None:
+            if not self.client.hsetnx(claimed_key, tile_id, claim):
+                return False
+        elif self._take_over(run_key, tile_id, expired, worker_id):
+            self.client.hset(claimed_key, tile_id, claim)
+        else:
+            return False
+        # the tile may have been completed since it was pushed or read, the claim
+        # is released again; 'claimed' without a claim is one being re-queued
+        if _decode(self.client.hget(status_key, tile_id)) not in ("pending", "claimed"):
+            self.client.hdel(claimed_key, tile_id)
+            return False
+        self.client.hset(status_key, tile_id, "claimed")
+        return True
+
+    def put(self, run_key: str, tile_ids: list[str]) -> int:
+        status_key = self._key(run_key, "status")
+        claimed_key = self._key(run_key, "claimed")
+        queued = []
+        for tile_id in tile_ids:
+            status = _decode(self.client.hget(status_key, tile_id))
+            if status is None:
+                # only the first host enqueues a new tile
+                if not self.client.hsetnx(status_key, tile_id, "pending"):
+                    continue
+            elif status == "failed":
+                self.client.hset(status_key, tile_id, "pending")
+            elif status == "claimed":
+                claim = self.client.hget(claimed_key, tile_id)
+                if claim is None or not self._is_expired(claim):
+                    continue
+                if not self._take_over(run_key, tile_id, claim, worker_id=""):
+                    continue
+                self.client.hdel(claimed_key, tile_id)
+                self.client.hset(status_key, tile_id, "pending")
+            else:
+                continue
+            queued.append(tile_id)
+        if queued:
+            self.client.rpush(self._key(run_key, "pending"), *queued)
+        return len(queued)
+
+    def reset(self, run_key: str) -> None:
+        self.client.delete(
+            *[
+                self._key(run_key, name)
+                for name in ("pending", "status", "claimed", "takeover")
+            ]
+        )
+
+    def claim(self, run_key: str, worker_id: str) -> str | None:
+        claimed_key = self._key(run_key, "claimed")
+        while tile_id := _decode(self.client.lpop(self._key(run_key, "pending"))):
+            # tiles pushed twice are claimed by the first host only
+            if self._acquire(run_key, tile_id, worker_id):
+                return tile_id
+        for tile_id, claim in self.client.hgetall(claimed_key).items():
+            tile_id = _decode(tile_id)
+            if self._is_expired(claim) and self._acquire(
+                run_key, tile_id, worker_id, expired=claim
+            ):
+                return tile_id
+        return None
+
+    def renew(self, run_key: str, tile_id: str, worker_id: str) -> bool:
+        # an expired claim may be taken over at any time, it is not renewed
+        if not self._is_owner(run_key, tile_id, worker_id):
+            return False
+        self.client.hset(
+            self._key(run_key, "claimed"),
+            tile_id,
+            json.dumps({"worker": worker_id, "time": time.time()}),
+        )
+        return True
+
+    def complete(
+        self, run_key: str, tile_id: str, worker_id: str, failed: bool = False
+    ) -> bool:
+        claim = self.client.hget(self._key(run_key, "claimed"), tile_id)
+        if claim is None or json.loads(claim)["worker"] != worker_id:
+            return False
+        self.client.hset(
+            self._key(run_key, "status"), tile_id, "failed" if failed else "done"
+        )
+        self.client.hdel(self._key(run_key, "claimed"), tile_id)
+        return True
+
+
+def _decode(value: bytes | str | None) -> str | None:
+    """Redis returns bytes, the stand-in clients of the tests str."""
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def get_work_queue(url: str = None, lease: float = DEFAULT_LEASE) -> WorkQueue:
+    """
+    Get the work queue of the given URL.
+
+    Args:
+        url (str): local://, sqlite:///<path> or redis://<host>:<port>/<db>,
+            defaults to the in-process queue
+        lease (float): seconds after which a claimed tile may be claimed again
+
+    Returns:
+        the work queue
+
+    Raises:
+        ValueError: if the scheme of the URL is not supported
+    """
+    if url is None or url.startswith("local://"):
+        return LocalQueue()
+    if url.startswith("sqlite://"):
+        return SQLiteQueue(url.removeprefix("sqlite://"), lease=lease)
+    if url.startswith("redis://"):
+        # optional dependency, only needed for this backend
+        import redis
+
+        return RedisQueue(redis.Redis.from_url(url), lease=lease)
+    raise ValueError(f"Unsupported work queue: {url}")
@@ -12,13 +12,20 @@ HEADER = "iy id it imin qn qh qe qs qf U RH Tair pres rain kdown snow ldown fcld
 
 
 def select_met_data(
-    input_file: str, utc_year: int, utc_doy: int, utc_hour: int, output_file: str
+    input_file: str,
+    utc_year: int,
+    utc_doy: int,
+    utc_hour: int,
+    output_file: str,
+    forecast_hours: int = 1,
 ):
     """
     Selects data from an input meteorological data file that holds hourly
     averaged values over the area of interest derived from ICON-D2 NWP for
     the given timestamp and the previous hour in UMEP-accepted format and
     writes it to a separate output file.
+    In forecast mode (forecast_hours > 1), the following hours of the ICON-D2
+    horizon are selected as well, so SOLWEIG models them in a single run.
     Note that the input file is given in UTC! The timestamp therefore also has
     to be in UTC, to get the correct meteo data.
     Note: If the given timestamp is not in the input_file or lays within the
@@ -30,6 +37,7 @@ def select_met_data(
         utc_doy (int): The day of the year (in UTC)
         utc_hour (int): The hour (in UTC)
         output_file (str): Output file name
+        forecast_hours (int): Number of hours to select, starting with the given one
     """
 
     df = pd.read_csv(input_file, sep=" ")
@@ -50,8 +58,12 @@ def select_met_data(
     assert (
         df["it"].values[entry] == utc_hour
     ), f'Hour of entry should be {utc_hour} and not {df["it"].values[entry]}.'
-    # select two hours, the requested and the one before it
-    new_df = df.iloc[[entry - 1, entry]]
+    available_hours = len(df) - entry
+    assert (
+        1 <= forecast_hours <= available_hours
+    ), f"Forecast of {forecast_hours} hours exceeds the {available_hours} available."
+    # select the hour before the requested one (warm-up) and the requested hours
+    new_df = df.iloc[entry - 1 : entry + forecast_hours]
 
     # set timestamp as index:
     new_df = new_df.astype(
@@ -61,6 +73,28 @@ def select_met_data(
     new_df.to_csv(output_file, sep=" ", index=False)
 
 
+def read_metfile_hours(met_file: str) -> list[tuple[int, int, int]]:
+    """
+    Read the model hours of a UMEP metfile.
+
+    Args:
+        met_file (str): path to the metfile
+
+    Returns:
+        list of (year, doy, hour) of all rows
+    """
+    hours = []
+    with open(met_file, "r") as file:
+        # skip header
+        next(file)
+        for line in file:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            hours.append((int(fields[0]), int(fields[1]), int(fields[2])))
+    return hours
+
+
 def write_metfile(file_name: str, save_dir: str, content: str):
     """Writes metfile data to files"""
 
@@ -90,6 +124,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--proc", help="Processing path that was used to create the met data"
     )
+    parser.add_argument(
+        "--forecast_hours",
+        type=int,
+        default=1,
+        help="Number of hours to select for a forecast run, starting with the given hour",
+    )
 
     args = vars(parser.parse_args())
     year = int(args["year"])
@@ -101,10 +141,13 @@ if __name__ == "__main__":
     # TODO: maybe add validation of parameters
 
     filename = f"{args['savedir']}/metfile_{args['proc']}_{year}-{month:02d}-{day:02d}_{hour:02d}00.txt"
+    if args["forecast_hours"] > 1:
+        filename = filename.replace(".txt", f"_forecast_{args['forecast_hours']}h.txt")
     select_met_data(
         input_file=args["input"],
         utc_year=year,
         utc_doy=doy,
         utc_hour=hour,
         output_file=filename,
+        forecast_hours=args["forecast_hours"],
     )
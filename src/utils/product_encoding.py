@@ -0,0 +1,159 @@
+"""
+Storage encodings of the published raster products.
+
+The products are stored as small integers instead of Float32: the classes as
+uint8, temperatures as int16 with a scale of 0.01 (i.e. in hundredths of a
+degree) and the relative humidity as uint16 with a scale of 0.01. Scale, offset
+and NoData are written into the rasters, so GDAL based readers (QGIS, titiler,
+rasterio with masked/unscaled reads) restore the physical values:
+
+    value = stored * scale + offset
+
+Within the pipeline, read_band decodes any raster, encoded or not, to Float32
+with NaN as NoData.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+# NumPy storage data types and their GDAL equivalents
+GDAL_DTYPES = {
+    "uint8": gdal.GDT_Byte,
+    "int16": gdal.GDT_Int16,
+    "uint16": gdal.GDT_UInt16,
+    "float32": gdal.GDT_Float32,
+    "float64": gdal.GDT_Float64,
+}
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """Storage data type, scale/offset and NoData of a product."""
+
+    dtype: str
+    scale: float = 1.0
+    offset: float = 0.0
+    nodata: float = None
+
+    @property
+    def gdal_dtype(self) -> int:
+        """Returns the GDAL data type of the storage data type."""
+        return GDAL_DTYPES[self.dtype]
+
+    def encode(self, values: np.ndarray, nodata: float = None) -> np.ndarray:
+        """
+        Encode physical values for storage.
+
+        Values beyond the range of the data type are clipped, NaN and the given
+        NoData value are stored as the NoData value of the encoding.
+
+        Args:
+            values (ndarray): physical values
+            nodata (float): NoData value of the physical values (optional)
+
+        Returns:
+            the stored values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        invalid = np.isnan(values)
+        if nodata is not None:
+            invalid |= values == nodata
+        stored = (np.where(invalid, self.offset, values) - self.offset) / self.scale
+        store_nodata = np.nan if self.nodata is None else self.nodata
+
+        if np.issubdtype(np.dtype(self.dtype), np.integer):
+            info = np.iinfo(np.dtype(self.dtype))
+            low, high = info.min, info.max
+            # the NoData value is reserved at one end of the range
+            if self.nodata == low:
+                low += 1
+            elif self.nodata == high:
+                high -= 1
+            stored = np.clip(np.round(stored), low, high)
+            if self.nodata is None:
+                store_nodata = low
+        return np.where(invalid, store_nodata, stored).astype(np.dtype(self.dtype))
+
+    def decode(self, stored: np.ndarray) -> np.ndarray:
+        """Decode stored values to Float32, NoData becomes NaN."""
+        values = stored.astype(np.float32) * np.float32(self.scale)
+        values += np.float32(self.offset)
+        if self.nodata is not None:
+            values[stored == self.nodata] = np.nan
+        return values
+
+
+TEMPERATURE_ENCODING = Encoding("int16", scale=0.01, nodata=-32768)
+CLASS_ENCODING = Encoding("uint8", nodata=255)
+
+PRODUCT_ENCODINGS = {
+    "MRT": TEMPERATURE_ENCODING,
+    "UTCI": TEMPERATURE_ENCODING,
+    "PET": TEMPERATURE_ENCODING,
+    "TA": TEMPERATURE_ENCODING,
+    "RH": Encoding("uint16", scale=0.01, nodata=65535),
+    "UTCI-class": CLASS_ENCODING,
+    "PET-class": CLASS_ENCODING,
+}
+
+
+def get_encoding(product: str) -> Encoding | None:
+    """Returns the encoding of a product, e.g. 'UTCI-class', None if unknown."""
+    return PRODUCT_ENCODINGS.get(product)
+
+
+def get_band_encoding(band: gdal.Band) -> Encoding:
+    """Returns the encoding of a raster band, as given by its metadata."""
+    dtype = gdal.GetDataTypeName(band.DataType).lower().replace("byte", "uint8")
+    return Encoding(
+        dtype,
+        band.GetScale() or 1.0,
+        band.GetOffset() or 0.0,
+        band.GetNoDataValue(),
+    )
+
+
+def read_band(band: gdal.Band, window: tuple[int, int, int, int] = None) -> np.ndarray:
+    """
+    Read a raster band as physical values.
+
+    Args:
+        band (Band): the raster band, encoded or not
+        window (tuple): xoff, yoff, xsize, ysize of the window to read (optional)
+
+    Returns:
+        Float32 array with NaN as NoData
+    """
+    stored = band.ReadAsArray() if window is None else band.ReadAsArray(*window)
+    return get_band_encoding(band).decode(stored)
+
+
+def write_band(
+    band: gdal.Band,
+    values: np.ndarray,
+    encoding: Encoding,
+    nodata: float = None,
+    xoff: int = 0,
+    yoff: int = 0,
+) -> None:
+    """
+    Encode physical values and write them into a band of the encoding's data type.
+
+    Args:
+        band (Band): the raster band
+        values (ndarray): physical values
+        encoding (Encoding): encoding of the band
+        nodata (float): NoData value of the physical values (optional)
+        xoff (int): column offset of the values within the band (optional)
+        yoff (int): row offset of the values within the band (optional)
+    """
+    band.WriteArray(encoding.encode(values, nodata), xoff, yoff)
+    if encoding.nodata is not None:
+        band.SetNoDataValue(encoding.nodata)
+    if encoding.scale != 1.0 or encoding.offset != 0.0:
+        band.SetScale(encoding.scale)
+        band.SetOffset(encoding.offset)
@@ -6,10 +6,14 @@ import argparse
 
 from osgeo import gdal
 
+from utils.product_encoding import write_band
+
 gdal.UseExceptions()
 
 
-def saveraster(reference_raster, output_location, data_array):
+def saveraster(
+    reference_raster, output_location, data_array, nodata=None, encoding=None
+):
     """
     Saves a data_array as geotiff with georeference from the given
     reference_raster at given output_location with lossless LZW compression
@@ -18,6 +22,10 @@ def saveraster(reference_raster, output_location, data_array):
         reference_raster (gdal Dataset): opened geotiff dataset
         output_location (str) : output file location
         data_array (numpy array): raster data
+        nodata (float): no data value of the output, with an encoding the no data
+            value of the data_array (optional)
+        encoding (Encoding): storage encoding of the product, see
+            product_encoding.py, Float32 if not given (optional)
     """
     driver = gdal.GetDriverByName("GTiff")
     size1, size2 = data_array.shape
@@ -26,12 +34,17 @@ def saveraster(reference_raster, output_location, data_array):
         xsize=size2,
         ysize=size1,
         bands=1,
-        eType=gdal.GDT_Float32,
+        eType=gdal.GDT_Float32 if encoding is None else encoding.gdal_dtype,
         options=["COMPRESS=LZW"],
     )
     dataset_output.SetGeoTransform(reference_raster.GetGeoTransform())
     dataset_output.SetProjection(reference_raster.GetProjection())
+    if encoding is not None:
+        write_band(dataset_output.GetRasterBand(1), data_array, encoding, nodata)
+        return
     dataset_output.GetRasterBand(1).WriteArray(data_array)
+    if nodata is not None:
+        dataset_output.GetRasterBand(1).SetNoDataValue(nodata)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,487 @@
+"""
+This script benchmarks the tile pipeline on a synthetic city.
+
+A synthetic city (DTM with a slope, rectangular buildings and round tree crowns of
+configurable density) is tiled like the static data of the pipeline, together
+with preprocessed wall and SVF rasters. process_tile, the UTCI calculation and
+the mosaicking are then timed at several worker counts, the throughput (tiles/s,
+pixels/s) and the scaling (speedup, parallel efficiency) are written to a JSON
+file. Results can be compared against the file of a previous pipeline version to
+catch performance regressions before deploying it.
+
+Usage (from the repository root, with PROJ_LIB set as for the tests):
+    python -m tests.benchmark_pipeline --output_dir=/tmp/benchmark --workers 1 2 4 \\
+        --baseline=<benchmark.json of the deployed version>
+
+Functions:
+- create_synthetic_city: Creates the tiled static inputs of a synthetic city.
+- benchmark_process_tile: Times process_tile for all tiles.
+- benchmark_indices: Times the UTCI calculation for all tiles.
+- benchmark_mosaic: Times the mosaicking of all tiles.
+- run_benchmarks: Runs the benchmarks at several worker counts.
+- compare_results: Lists the regressions against the results of a baseline.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+from osgeo import gdal, osr
+
+from src.umep_wrapper.calculate_tc_indices import calculate_index_for_file
+from src.umep_wrapper.mosaic import find_tile_files, mosaic_tiles
+from src.umep_wrapper.solweig_multi_processing import (
+    TEMPLATE_PATH,
+    collect_tiles,
+    get_process_folder,
+    process_tile,
+)
+
+from .test_utils import clear_tmp_dir, create_dummy_metfile
+
+gdal.UseExceptions()
+
+NODATA = -32768
+SVF_SUFFIXES = ["", "N", "S", "E", "W"]
+SVF_VEG_SUFFIXES = ["veg", "Nveg", "Sveg", "Eveg", "Wveg"]
+SVF_VEG_SUFFIXES += ["aveg", "Naveg", "Saveg", "Eaveg", "Waveg"]
+# relative throughput loss which counts as regression
+REGRESSION_TOLERANCE = 0.1
+
+
+def _write_tile(path: str, array: np.ndarray, xmin: float, ymax: float, res: float):
+    """Writes a tile as LZW compressed GeoTIFF in EPSG:25832."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    spatref = osr.SpatialReference()
+    spatref.ImportFromEPSG(25832)
+    ds = gdal.GetDriverByName("GTiff").Create(
+        path,
+        array.shape[1],
+        array.shape[0],
+        1,
+        gdal.GDT_Float32,
+        options=["COMPRESS=LZW", "TILED=YES"],
+    )
+    ds.SetProjection(spatref.ExportToWkt())
+    ds.SetGeoTransform([xmin, res, 0, ymax, 0, -res])
+    ds.GetRasterBand(1).WriteArray(array)
+    ds.GetRasterBand(1).SetNoDataValue(NODATA)
+    ds = None
+
+
+def _add_shapes(
+    mask_height: np.ndarray,
+    density: float,
+    size: tuple,
+    height: tuple,
+    rng,
+    round_shapes,
+):
+    """Adds random boxes or disks until the given share of pixels is covered."""
+    ny, nx = mask_height.shape
+    yy, xx = np.mgrid[0:ny, 0:nx]
+    while np.mean(mask_height != 0) < density:
+        extent = rng.integers(size[0], size[1], 2)
+        y, x = rng.integers(0, ny), rng.integers(0, nx)
+        if round_shapes:
+            shape = (yy - y) ** 2 + (xx - x) ** 2 <= (extent[0] / 2) ** 2
+        else:
+            shape = (abs(yy - y) <= extent[0] / 2) & (abs(xx - x) <= extent[1] / 2)
+        mask_height[shape & (mask_height == 0)] = rng.uniform(*height)
+    return mask_height
+
+
+def create_synthetic_city(
+    save_dir: str,
+    tiles: tuple[int, int] = (2, 2),
+    tile_size: int = 200,
+    overlap: int = 40,
+    resolution: float = 3.0,
+    building_density: float = 0.3,
+    tree_density: float = 0.1,
+    seed: int = 0,
+) -> dict:
+    """
+    Create the tiled static inputs of a synthetic city.
+
+    Args:
+        save_dir (str): folder to create the city in
+        tiles (tuple): number of tiles in y and x direction
+        tile_size (int): tile size in pixels, including the overlap
+        overlap (int): overlap of neighbouring tiles in pixels
+        resolution (float): pixel size in meters
+        building_density (float): share of pixels covered by buildings
+        tree_density (float): share of pixels covered by trees
+        seed (int): seed of the random layout
+
+    Returns:
+        dict with the run arguments of the pipeline for the city
+
+    Raises:
+        ValueError: thrown if buildings and trees would cover the whole city
+    """
+    if building_density + tree_density >= 1:
+        raise ValueError("Buildings and trees have to leave open space.")
+    rng = np.random.default_rng(seed)
+    step = tile_size - overlap
+    ny, nx = tiles[0] * step + overlap, tiles[1] * step + overlap
+    xmin, ymax = 392000.0, 5709400.0
+
+    dtm = 100.0 + np.add.outer(np.linspace(0, 5, ny), np.linspace(0, 10, nx))
+    buildings = _add_shapes(
+        np.zeros((ny, nx)), building_density, (5, 25), (5, 40), rng, False
+    )
+    trees = _add_shapes(
+        np.where(buildings > 0, -1.0, 0.0),
+        building_density + tree_density,
+        (3, 9),
+        (5, 20),
+        rng,
+        True,
+    )
+    trees[trees < 0] = 0
+    dsm = dtm + buildings
+    # walls at the building edges, cheap stand-in for the wall preprocessing
+    wall_height = np.maximum(
+        np.abs(np.diff(dsm, axis=0, prepend=dsm[:1])),
+        np.abs(np.diff(dsm, axis=1, prepend=dsm[:, :1])),
+    )
+    wall_height[wall_height < 2] = 0
+    svf = 1.0 - 0.5 * (buildings > 0) - 0.2 * (trees > 0)
+
+    res_name = f"{resolution:g}m"
+    folders = {
+        name: f"{name}_{res_name}_tiles_{tile_size}+{overlap}"
+        for name in ["DSM", "CDSM", "DTM"]
+    }
+    preprocess_path = os.path.join(save_dir, "preprocessed")
+    for ty in range(tiles[0]):
+        for tx in range(tiles[1]):
+            tile_id = f"{ty + 1}_{tx + 1}"
+            window = np.s_[
+                ty * step : ty * step + tile_size, tx * step : tx * step + tile_size
+            ]
+            tile_xmin = xmin + tx * step * resolution
+            tile_ymax = ymax - ty * step * resolution
+            for name, array in [("DSM", dsm), ("CDSM", trees), ("DTM", dtm)]:
+                _write_tile(
+                    os.path.join(
+                        save_dir, folders[name], f"{name}_{res_name}_{tile_id}.tif"
+                    ),
+                    array[window],
+                    tile_xmin,
+                    tile_ymax,
+                    resolution,
+                )
+
+            tile_dir = os.path.join(preprocess_path, tile_id)
+            _write_tile(
+                os.path.join(tile_dir, f"wall_height_{tile_id}.tif"),
+                wall_height[window],
+                tile_xmin,
+                tile_ymax,
+                resolution,
+            )
+            _write_tile(
+                os.path.join(tile_dir, f"wall_aspect_{tile_id}.tif"),
+                np.zeros((tile_size, tile_size)),
+                tile_xmin,
+                tile_ymax,
+                resolution,
+            )
+            with zipfile.ZipFile(os.path.join(tile_dir, "svfs.zip"), "w") as file:
+                for suffix in SVF_SUFFIXES + SVF_VEG_SUFFIXES:
+                    svf_path = os.path.join(tile_dir, f"svf{suffix}.tif")
+                    values = (
+                        svf[window]
+                        if suffix in SVF_SUFFIXES
+                        else np.ones_like(svf[window])
+                    )
+                    _write_tile(svf_path, values, tile_xmin, tile_ymax, resolution)
+                    file.write(svf_path, arcname=os.path.basename(svf_path))
+                    os.remove(svf_path)
+
+    output_path = os.path.join(save_dir, "results")
+    os.makedirs(output_path, exist_ok=True)
+    return {
+        "data_path": save_dir,
+        "dsm_folder": folders["DSM"],
+        "cdsm_folder": folders["CDSM"],
+        "dtm_folder": folders["DTM"],
+        "lc_folder": None,
+        "preprocess_data_path": preprocess_path,
+        "output_path": output_path,
+        "met_file": create_dummy_metfile(save_dir, "metfile.txt"),
+        "proj_lib": os.environ.get("PROJ_LIB"),
+        "tile_size": tile_size,
+        "overlap": overlap,
+    }
+
+
+def _result(stage: str, workers: int, tiles: int, pixels: int, seconds: float):
+    return {
+        "stage": stage,
+        "workers": workers,
+        "tiles": tiles,
+        "pixels": pixels,
+        "seconds": seconds,
+        "tiles_per_s": tiles / seconds,
+        "pixels_per_s": pixels / seconds,
+    }
+
+
+def benchmark_process_tile(city: dict, workers: int) -> dict:
+    """
+    Time process_tile for all tiles of the city.
+
+    Args:
+        city (dict): run arguments, see create_synthetic_city
+        workers (int): number of worker processes
+
+    Returns:
+        dict with the timing and throughput
+    """
+    data_dict = collect_tiles(city)
+    folder, process_path, _ = get_process_folder(city)
+    func = partial(
+        process_tile, city, TEMPLATE_PATH, city["met_file"], folder, process_path
+    )
+    start = time.perf_counter()
+    with Pool(processes=workers) as pool:
+        pool.map(func, data_dict.items(), chunksize=1)
+    seconds = time.perf_counter() - start
+    pixels = len(data_dict) * city["tile_size"] ** 2
+    return _result("process_tile", workers, len(data_dict), pixels, seconds)
+
+
+def _tmrt_tiles(city: dict) -> list[str]:
+    """
+    Create synthetic Tmrt, air temperature and humidity tiles of the city.
+
+    Every tile folder holds the inputs of the index calculation, named as expected
+    by calculate_tc_indices.
+    """
+    tmrt_dir = os.path.join(city["data_path"], "tmrt_tiles")
+    dsm_dir = os.path.join(city["data_path"], city["dsm_folder"])
+    if not os.path.isdir(tmrt_dir):
+        for name in sorted(os.listdir(dsm_dir)):
+            tile_id = "_".join(name[:-4].split("_")[-2:])
+            ds = gdal.Open(os.path.join(dsm_dir, name))
+            xmin, res, _, ymax, _, _ = ds.GetGeoTransform()
+            shape = (ds.RasterYSize, ds.RasterXSize)
+            tile_dir = os.path.join(tmrt_dir, tile_id)
+            for var, value in [("MRT", 40.0), ("TA", 25.0), ("RH", 50.0)]:
+                _write_tile(
+                    os.path.join(tile_dir, f"DO_{var}_2024_234_12_v0.0.0.tif"),
+                    np.full(shape, value),
+                    xmin,
+                    ymax,
+                    res,
+                )
+    return sorted(os.path.join(tmrt_dir, tile_id) for tile_id in os.listdir(tmrt_dir))
+
+
+def _utci_tile(metfile: str, tile_dir: str):
+    """Calculates the UTCI of a single synthetic tile."""
+    calculate_index_for_file(
+        index="UTCI",
+        input_tmrt=os.path.join(tile_dir, "DO_MRT_2024_234_12_v0.0.0.tif"),
+        input_tair=os.path.join(tile_dir, "DO_TA_2024_234_12_v0.0.0.tif"),
+        input_rh=os.path.join(tile_dir, "DO_RH_2024_234_12_v0.0.0.tif"),
+        metfile=metfile,
+        output_dir=tile_dir,
+    )
+
+
+def benchmark_indices(city: dict, workers: int) -> dict:
+    """
+    Time the UTCI calculation for all tiles of the city.
+
+    Args:
+        city (dict): run arguments, see create_synthetic_city
+        workers (int): number of worker processes
+
+    Returns:
+        dict with the timing and throughput
+    """
+    tile_dirs = _tmrt_tiles(city)
+    start = time.perf_counter()
+    with Pool(processes=workers) as pool:
+        pool.map(partial(_utci_tile, city["met_file"]), tile_dirs, chunksize=1)
+    seconds = time.perf_counter() - start
+    pixels = len(tile_dirs) * city["tile_size"] ** 2
+    return _result("indices", workers, len(tile_dirs), pixels, seconds)
+
+
+def benchmark_mosaic(city: dict, workers: int) -> dict:
+    """
+    Time the mosaicking of the Tmrt tiles of the city.
+
+    Args:
+        city (dict): run arguments, see create_synthetic_city
+        workers (int): number of threads reading the tiles
+
+    Returns:
+        dict with the timing and throughput
+    """
+    tile_dirs = _tmrt_tiles(city)
+    mosaic_path = os.path.join(city["output_path"], "mosaic", "DO_MRT_mosaic.tif")
+    start = time.perf_counter()
+    tile_files = find_tile_files(
+        os.path.dirname(tile_dirs[0]), "DO_MRT_2024_234_12_v0.0.0.tif"
+    )
+    mosaic_tiles(city, tile_files, mosaic_path, n_jobs=workers)
+    seconds = time.perf_counter() - start
+    pixels = len(tile_dirs) * city["tile_size"] ** 2
+    return _result("mosaic", workers, len(tile_dirs), pixels, seconds)
+
+
+BENCHMARKS = {
+    "process_tile": benchmark_process_tile,
+    "indices": benchmark_indices,
+    "mosaic": benchmark_mosaic,
+}
+
+
+def run_benchmarks(
+    city: dict, stages: list[str], workers: list[int], repeat: int = 1
+) -> list[dict]:
+    """
+    Run the benchmarks at several worker counts, keeping the fastest repetition.
+
+    Args:
+        city (dict): run arguments, see create_synthetic_city
+        stages (list): names of the benchmarks, see BENCHMARKS
+        workers (list): worker counts to run every benchmark with
+        repeat (int): repetitions per worker count
+
+    Returns:
+        list of results with speedup and efficiency relative to the fewest workers
+    """
+    results = []
+    for stage in stages:
+        stage_results = []
+        for n_workers in sorted(workers):
+            runs = [BENCHMARKS[stage](city, n_workers) for _ in range(repeat)]
+            runs = [run for run in runs if run is not None]
+            if runs:
+                stage_results.append(min(runs, key=lambda run: run["seconds"]))
+        for result in stage_results:
+            base = stage_results[0]
+            result["speedup"] = base["seconds"] / result["seconds"]
+            result["efficiency"] = (
+                result["speedup"] * base["workers"] / result["workers"]
+            )
+            print(
+                f"{stage} with {result['workers']} workers: {result['seconds']:.2f} s, "
+                f"{result['tiles_per_s']:.2f} tiles/s, "
+                f"{result['pixels_per_s'] / 1e6:.2f} Mpx/s, "
+                f"speedup {result['speedup']:.2f}, efficiency {result['efficiency']:.0%}"
+            )
+        results.extend(stage_results)
+    return results
+
+
+def compare_results(
+    results: list[dict], baseline: list[dict], tolerance: float = REGRESSION_TOLERANCE
+) -> list[str]:
+    """
+    List the benchmarks which lost more than the tolerated share of throughput.
+
+    Args:
+        results (list): results of the current version
+        baseline (list): results of the reference version
+        tolerance (float): tolerated relative loss of throughput
+
+    Returns:
+        list of messages, empty if there is no regression
+    """
+    reference = {(r["stage"], r["workers"]): r["pixels_per_s"] for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result["stage"], result["workers"])
+        if key in reference and result["pixels_per_s"] < reference[key] * (
+            1 - tolerance
+        ):
+            regressions.append(
+                f"{key[0]} with {key[1]} workers: "
+                f"{result['pixels_per_s'] / reference[key]:.0%} of the baseline"
+            )
+    return regressions
+
+
+def plot_scaling(results: list[dict], plot_path: str) -> None:
+    """Plots the speedup of every benchmark over the worker count."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    for stage in dict.fromkeys(result["stage"] for result in results):
+        stage_results = [result for result in results if result["stage"] == stage]
+        ax.plot(
+            [result["workers"] for result in stage_results],
+            [result["speedup"] for result in stage_results],
+            marker="o",
+            label=stage,
+        )
+    ax.set_xlabel("workers")
+    ax.set_ylabel("speedup")
+    ax.legend()
+    fig.savefig(plot_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tile pipeline.")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--tiles", type=int, nargs=2, default=[2, 2])
+    parser.add_argument("--tile_size", type=int, default=200)
+    parser.add_argument("--overlap", type=int, default=40)
+    parser.add_argument("--building_density", type=float, default=0.3)
+    parser.add_argument("--tree_density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--stages", type=str, nargs="+", default=list(BENCHMARKS), choices=BENCHMARKS
+    )
+    parser.add_argument(
+        "--baseline", type=str, default=None, help="Results of a previous version"
+    )
+    parser.add_argument("--plot", action="store_true", help="Plot the scaling curves")
+    args_dict = vars(parser.parse_args())
+
+    clear_tmp_dir(args_dict["output_dir"])
+    city_args = create_synthetic_city(
+        os.path.join(args_dict["output_dir"], "city"),
+        tiles=tuple(args_dict["tiles"]),
+        tile_size=args_dict["tile_size"],
+        overlap=args_dict["overlap"],
+        building_density=args_dict["building_density"],
+        tree_density=args_dict["tree_density"],
+        seed=args_dict["seed"],
+    )
+    benchmark_results = run_benchmarks(
+        city_args, args_dict["stages"], args_dict["workers"], args_dict["repeat"]
+    )
+
+    with open(os.path.join(args_dict["output_dir"], "benchmark.json"), "w") as f:
+        json.dump(benchmark_results, f, indent=1)
+    if args_dict["plot"]:
+        plot_scaling(
+            benchmark_results, os.path.join(args_dict["output_dir"], "scaling.png")
+        )
+    if args_dict["baseline"] is not None:
+        with open(args_dict["baseline"], "r") as f:
+            messages = compare_results(benchmark_results, json.load(f))
+        for message in messages:
+            print(f"Regression: {message}")
+        if messages:
+            sys.exit(1)
@@ -0,0 +1,57 @@
+"""
+This script tests the synthetic city and the regression check of the benchmarks.
+
+Functions:
+- test_synthetic_city: Tests that the synthetic city is tiled like the static data.
+- test_compare_results: Tests that throughput losses beyond the tolerance are reported.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from src.umep_wrapper.tile_catalog import get_catalog
+
+from .benchmark_pipeline import compare_results, create_synthetic_city
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "city")
+
+
+def test_synthetic_city():
+    """
+    Tests the tile layout and the building density of the synthetic city.
+    """
+    clear_tmp_dir(save_dir)
+    city = create_synthetic_city(
+        save_dir, tiles=(2, 3), tile_size=60, overlap=20, building_density=0.4
+    )
+
+    catalog = get_catalog(city)
+    assert sorted(catalog) == ["1_1", "1_2", "1_3", "2_1", "2_2", "2_3"]
+    assert catalog["1_2"].xoff == 40, "Tiles should overlap by 20 pixels."
+    assert os.path.exists(os.path.join(city["preprocess_data_path"], "2_3", "svfs.zip"))
+
+    dsm = gdal.Open(catalog["1_1"].dsm).ReadAsArray()
+    dtm = gdal.Open(catalog["1_1"].dtm).ReadAsArray()
+    assert dsm.shape == (60, 60)
+    assert 0.2 < np.mean(dsm - dtm > 0) < 0.7, "Buildings should match the density."
+
+
+def test_compare_results():
+    """
+    Tests the detection of regressions against a baseline.
+    """
+    baseline = [
+        {"stage": "indices", "workers": 1, "pixels_per_s": 100.0},
+        {"stage": "indices", "workers": 2, "pixels_per_s": 200.0},
+    ]
+    results = [
+        {"stage": "indices", "workers": 1, "pixels_per_s": 95.0},
+        {"stage": "indices", "workers": 2, "pixels_per_s": 150.0},
+        {"stage": "mosaic", "workers": 1, "pixels_per_s": 1.0},
+    ]
+    regressions = compare_results(results, baseline, tolerance=0.1)
+    assert len(regressions) == 1, "Only the loss beyond 10 % is a regression."
+    assert regressions[0].startswith("indices with 2 workers")
@@ -0,0 +1,79 @@
+"""
+This script tests the cache of the rasterized city boundary.
+
+Functions:
+- test_save_load_mask: Tests that a bit-packed mask is restored exactly.
+- test_get_city_mask: Tests the rasterized city boundary, its crop window and cache key.
+"""
+
+import os
+
+import numpy as np
+
+from src.umep_wrapper.city_mask import (
+    get_city_mask,
+    get_mask_key,
+    load_mask,
+    save_mask,
+)
+
+from .test_utils import (
+    ORIGIN,
+    RES,
+    clear_tmp_dir,
+    create_dummy_boundary,
+    get_projection,
+)
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "city_mask")
+
+# a triangular city boundary spanning pixels 10 to 30
+BOUNDARY = [(10, 10), (30, 10), (10, 30), (10, 10)]
+
+
+def test_save_load_mask():
+    """
+    Tests the round trip of a mask whose size is not a multiple of 8.
+    """
+    clear_tmp_dir(save_dir)
+    mask = np.random.default_rng(0).random((203, 97)) > 0.5
+    path = os.path.join(save_dir, "mask.npz")
+    save_mask(path, mask, (3, 4, 97, 203))
+
+    loaded, window = load_mask(path)
+    assert window == (3, 4, 97, 203)
+    assert loaded.dtype == bool
+    assert np.array_equal(loaded, mask)
+    assert os.path.getsize(path) < mask.size, "Stored bit-packed."
+
+
+def test_get_city_mask():
+    """
+    Tests that pixels are within the city if their center is and that the mask is
+    rasterized once per grid.
+    """
+    clear_tmp_dir(save_dir)
+    boundary = os.path.join(save_dir, "boundary.geojson")
+    create_dummy_boundary(boundary, BOUNDARY, ORIGIN, RES)
+    cache_dir = os.path.join(save_dir, "cache")
+
+    geotransform = (ORIGIN[0], RES, 0.0, ORIGIN[1], 0.0, -RES)
+    grid = (boundary, geotransform, 40, 40, get_projection())
+    mask, window = get_city_mask(*grid, cache_dir)
+    assert window == (10, 10, 20, 20), "Window of the boundary."
+    assert mask.shape == (20, 20)
+    assert mask[0, 0] and mask[0, 18] and mask[18, 0], "Corners of the triangle."
+    assert not mask[19, 19] and not mask[10, 10], "Outside of the triangle."
+    assert mask.sum() == 190, "Pixel centers within the triangle."
+    assert not mask.flags.writeable
+
+    cache_file = os.path.join(cache_dir, f"city_mask_{get_mask_key(*grid)}.npz")
+    assert os.listdir(cache_dir) == [os.path.basename(cache_file)]
+    cached, cached_window = load_mask(cache_file)
+    assert np.array_equal(cached, mask) and cached_window == window
+
+    # another grid or another boundary results in another mask
+    assert get_mask_key(*grid) != get_mask_key(boundary, geotransform, 40, 41, "")
+    with open(boundary, "a") as file:
+        file.write("\n")
+    assert get_mask_key(*grid) != os.path.basename(cache_file)[10:-4]
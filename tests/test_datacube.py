@@ -0,0 +1,153 @@
+"""
+This script tests the hourly datacube archive of the published products.
+
+Functions:
+- test_append_read: Tests appending hours and reading point and area time series.
+- test_daily_chunks: Tests that the hours of a day are appended to the same chunks.
+- test_concurrent_append: Tests that no hour is lost by appends of concurrent processes.
+- test_append_products: Tests appending the rasters of an hour, creating the datacube.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+import pytest
+from osgeo import gdal
+
+from src.umep_wrapper.datacube import LOCK_SUFFIX, Datacube, append_products
+
+from .test_utils import ORIGIN, RES, clear_tmp_dir, create_dummy_raster
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "datacube")
+
+START = datetime(2024, 5, 29, 22)
+
+
+def test_append_read():
+    """
+    Tests the time axis across chunks, gaps, overwritten hours and that chunks
+    without values are not written.
+    """
+    clear_tmp_dir(save_dir)
+    path = os.path.join(save_dir, "cube.zarr")
+    geotransform = (ORIGIN[0], RES, 0.0, ORIGIN[1], 0.0, -RES)
+    cube = Datacube.create(
+        path, START, geotransform, 300, 200, "WKT", ["UTCI", "RH"], (4, 128, 128)
+    )
+    values = np.full((200, 300), np.nan, dtype=np.float32)
+    values[10:20, 10:20] = 25.5
+    for hour in range(6):
+        cube.append(
+            START + timedelta(hours=hour), {"UTCI": values + hour, "RH": values}
+        )
+    assert cube.append(datetime(2024, 5, 30, 10), {"UTCI": values}) == 12
+    cube.append(datetime(2024, 5, 30, 0), {"UTCI": values})  # overwritten
+
+    with pytest.raises(ValueError):
+        cube.append(datetime(2024, 5, 29, 21), {"UTCI": values})
+    with pytest.raises(ValueError):
+        cube.append(datetime(2024, 5, 30, 11), {"PET": values})
+
+    cube = Datacube(path)
+    assert cube.n_times == 13
+    assert sorted(os.listdir(os.path.join(path, "UTCI")))[2:] == [
+        "0.0.0",
+        "1.0.0",
+        "3.0.0",
+    ], "Chunks with values only."
+    with open(os.path.join(path, "UTCI", ".zarray")) as file:
+        assert json.load(file)["shape"] == [13, 200, 300]
+
+    x, y = ORIGIN[0] + 15 * RES + 1, ORIGIN[1] - 15 * RES - 1
+    times, series = cube.point_series("UTCI", x, y)
+    assert times[0] == START and times[-1] == datetime(2024, 5, 30, 10)
+    assert np.allclose(series[:6], [25.5, 26.5, 25.5, 28.5, 29.5, 30.5])
+    assert np.isnan(series[6:12]).all(), "Gap between the hours."
+    assert series[12] == 25.5
+    assert np.isnan(cube.point_series("UTCI", ORIGIN[0] + 1, ORIGIN[1] - 1)[1]).all()
+
+    bbox = (ORIGIN[0] + 30, ORIGIN[1] - 60, ORIGIN[0] + 60, ORIGIN[1] - 30)
+    times, area = cube.area_series(
+        "UTCI", bbox, datetime(2024, 5, 30, 1), datetime(2024, 5, 30, 2)
+    )
+    assert times == [datetime(2024, 5, 30, 1), datetime(2024, 5, 30, 2)]
+    assert area.shape == (2, 10, 10), "Pixel centers within the area."
+    assert np.allclose(np.nanmean(area, axis=(1, 2)), [28.5, 29.5])
+    assert np.allclose(cube.point_series("RH", x, y)[1][:6], 25.5)
+
+
+def test_daily_chunks():
+    """
+    Tests that the hours of a day share their chunks, an hour appended again
+    replaces its values only and the time coordinate covers all hours.
+    """
+    clear_tmp_dir(save_dir)
+    path = os.path.join(save_dir, "cube.zarr")
+    geotransform = (ORIGIN[0], RES, 0.0, ORIGIN[1], 0.0, -RES)
+    cube = Datacube.create(path, START, geotransform, 300, 200, "WKT", ["UTCI"])
+    assert cube.chunks == (24, 128, 128), "A day per chunk."
+    values = np.full((200, 300), np.nan, dtype=np.float32)
+    values[10:20, 10:20] = 25.5
+    for hour in range(3):
+        cube.append(START + timedelta(hours=hour), {"UTCI": values + hour})
+    assert sorted(os.listdir(os.path.join(path, "UTCI")))[2:] == ["0.0.0"]
+
+    cube.append(START + timedelta(hours=1), {"UTCI": np.full_like(values, np.nan)})
+    x, y = ORIGIN[0] + 15 * RES + 1, ORIGIN[1] - 15 * RES - 1
+    series = Datacube(path).point_series("UTCI", x, y)[1]
+    assert series[0] == 25.5 and np.isnan(series[1]) and series[2] == 27.5
+    with open(os.path.join(path, "time", ".zarray")) as file:
+        assert json.load(file)["shape"] == [3]
+
+
+def _append_hour(args):
+    """Appends an hour to the datacube, used by the process pool."""
+    path, hour = args
+    values = np.full((200, 300), float(hour), dtype=np.float32)
+    return Datacube(path).append(START + timedelta(hours=hour), {"UTCI": values})
+
+
+@pytest.mark.parametrize("chunks", [(24, 128, 128), (4, 128, 128)])
+def test_concurrent_append(chunks):
+    """
+    Tests that appends of concurrent processes, also to the same chunks, keep all
+    hours.
+    """
+    clear_tmp_dir(save_dir)
+    path = os.path.join(save_dir, "cube.zarr")
+    geotransform = (ORIGIN[0], RES, 0.0, ORIGIN[1], 0.0, -RES)
+    Datacube.create(path, START, geotransform, 300, 200, "WKT", ["UTCI"], chunks)
+
+    with Pool(4) as pool:
+        pool.map(_append_hour, [(path, hour) for hour in range(12)])
+
+    cube = Datacube(path)
+    assert cube.n_times == 12
+    assert np.allclose(cube.read("UTCI", (0, 0, 1, 1))[1][:, 0, 0], range(12))
+    assert os.path.exists(path + LOCK_SUFFIX)
+
+
+def test_append_products():
+    """
+    Tests that the datacube is created on the grid of the rasters of the first hour.
+    """
+    clear_tmp_dir(save_dir)
+    raster = create_dummy_raster(save_dir, "DO_UTCI.tif", value=30.0)
+    dataset = gdal.Open(raster)
+    path = os.path.join(save_dir, "cube.zarr")
+
+    assert append_products(path, START, {"UTCI": raster, "TA": raster}) == 0
+    cube = Datacube(path)
+    assert cube.geotransform == dataset.GetGeoTransform()
+    assert (cube.width, cube.height) == (dataset.RasterXSize, dataset.RasterYSize)
+    _, values = cube.read("TA")
+    assert values.shape == (1, cube.height, cube.width)
+    assert np.allclose(values, 30.0)
+    assert np.isnan(cube.read("PET")[1]).all(), "Products missing for the hour."
+
+    before = START - timedelta(hours=1)
+    assert append_products(path, before, {"UTCI": raster}) is None, "Skipped."
+    assert Datacube(path).n_times == 1
@@ -6,19 +6,22 @@ Functions:
 - test_load_metfile_correct: Tests that the metfile is properly derived from the forecast.
 - test_load_metfile_correct_dayswitch: Tests that the metfile is properly derived even when extracted hours are affected by a day switch.
 - test_load_metfile_incorrect: Tests that the metfile derivation blocks as expected, when the extracted time is within the warm-up phase.
+- test_load_metfile_forecast: Tests that the forecast metfile holds the warm-up and all requested hours.
+- test_read_metfile_hours: Tests that the model hours of a metfile are read.
 """
 
 import os
 
 import pandas as pd
 
-from src.utils.load_metfile import select_met_data
+from src.utils.load_metfile import read_metfile_hours, select_met_data
 from src.umep_wrapper.icon2umep import citymeans2umep
 
 from .test_utils import (
     MET_HEADER,
     clear_tmp_dir,
     create_dummy_city_means,
+    create_dummy_metfile,
     create_dummy_metfile_48_hours,
     create_dummy_metfile_dayswitch,
 )
@@ -208,3 +211,54 @@ def test_load_metfile_incorrect():
         assert (
             True
         ), "The hour closest to the model start time + warmup of 6 hours is expected to use."
+
+
+def test_load_metfile_forecast():
+    """
+    Tests loading of a multi-hour metfile for a forecast run.
+    """
+    save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
+    clear_tmp_dir(save_dir)
+
+    create_dummy_metfile_48_hours(save_dir, "dummy_metfile.txt")
+    input_file = os.path.join(save_dir, "dummy_metfile.txt")
+    output_file = os.path.join(save_dir, "load_met_out.txt")
+
+    select_met_data(
+        input_file=input_file,
+        utc_year=2024,
+        utc_doy=233,
+        utc_hour=18,
+        output_file=output_file,
+        forecast_hours=24,
+    )
+
+    df = pd.read_csv(output_file, sep=" ")
+    assert len(df) == 25, "Metfile should hold the warm-up and 24 forecast hours."
+    assert df["it"].iloc[0] == 17, "Should start with the hour before the given hour."
+    assert df["it"].iloc[1] == 18, "Should be the given hour."
+    assert (df["id"].iloc[-1], df["it"].iloc[-1]) == (234, 17), "Last forecast hour"
+
+    try:
+        select_met_data(
+            input_file=input_file,
+            utc_year=2024,
+            utc_doy=233,
+            utc_hour=18,
+            output_file=output_file,
+            forecast_hours=48,
+        )
+        assert False, "Forecast beyond the ICON-D2 horizon should be blocked."
+    except AssertionError as e:
+        assert "exceeds" in str(e)
+
+
+def test_read_metfile_hours():
+    """
+    Tests that the year, day of year and hour of all rows are read.
+    """
+    save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "met")
+    clear_tmp_dir(save_dir)
+    met_file = create_dummy_metfile(save_dir, "metfile.txt")
+
+    assert read_metfile_hours(met_file) == [(2024, 234, 11), (2024, 234, 12)]
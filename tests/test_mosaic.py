@@ -0,0 +1,102 @@
+"""
+This script tests the mosaicking of finished tile outputs.
+
+Functions:
+- test_find_tile_files: Tests that the newest file of every tile folder is found.
+- test_mosaic_tiles: Tests that the mosaic reproduces the city from the tile files.
+"""
+
+import os
+import time
+
+import numpy as np
+from osgeo import gdal
+
+from src.umep_wrapper.mosaic import find_tile_files, mosaic_tiles
+from src.umep_wrapper.mosaic_writer import MOSAIC_NODATA
+
+from .test_mosaic_writer import OVERLAP, SIZE, _tile_windows
+from .test_utils import ORIGIN, RES, clear_tmp_dir, write_raster
+
+save_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tmp", "mosaic_tiles"
+)
+
+
+def _write_city(city):
+    """Writes the static tiles and a SOLWEIG Tmrt file per tile of the city."""
+    height, width = city.shape
+    tile_ids = []
+    for window in _tile_windows(width, height):
+        xoff, yoff, xsize, ysize = window
+        tile_id = f"{yoff // (SIZE - OVERLAP) + 1}_{xoff // (SIZE - OVERLAP) + 1}"
+        tile = city[yoff : yoff + ysize, xoff : xoff + xsize]
+        for name in ["dsm", "cdsm"]:
+            write_raster(
+                os.path.join(save_dir, name, f"{name}_3m_{tile_id}.tif"),
+                np.ones_like(tile),
+                xoff=xoff,
+                yoff=yoff,
+            )
+        # the neighbouring tiles disagree within the overlap
+        write_raster(
+            os.path.join(save_dir, "temp_tiles", tile_id, "Tmrt_2024_150_1200D.tif"),
+            np.where(tile == -9999, tile, tile + 0.25 * (xoff + yoff > 0)),
+            xoff=xoff,
+            yoff=yoff,
+        )
+        tile_ids.append(tile_id)
+    return tile_ids
+
+
+def test_find_tile_files():
+    """
+    Tests the tile folder layout of SOLWEIG with files of an earlier run.
+    """
+    clear_tmp_dir(save_dir)
+    for tile_id, suffix in [("1_1", "D"), ("1_1", "N"), ("1_2", "D")]:
+        path = os.path.join(
+            save_dir, "temp_tiles", tile_id, f"Tmrt_2024_150_1200{suffix}.tif"
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(suffix)
+        time.sleep(0.01)
+    os.makedirs(os.path.join(save_dir, "temp_tiles", "2_1"))
+
+    tile_files = find_tile_files(
+        os.path.join(save_dir, "temp_tiles"), "Tmrt_2024_150_1200*.tif"
+    )
+    assert sorted(tile_files) == ["1_1", "1_2"]
+    assert tile_files["1_1"].endswith("1200N.tif"), "Newest file of the tile."
+
+
+def test_mosaic_tiles():
+    """
+    Tests the mosaic of all tiles but one, read by several threads.
+    """
+    clear_tmp_dir(save_dir)
+    width, height = 260, 180
+    city = np.arange(width * height, dtype=np.float32).reshape(height, width)
+    city[:10, :10] = -9999
+    tile_ids = _write_city(city)
+
+    args = {"data_path": save_dir, "dsm_folder": "dsm", "cdsm_folder": "cdsm"}
+    tile_files = find_tile_files(os.path.join(save_dir, "temp_tiles"), "Tmrt_*.tif")
+    assert sorted(tile_files) == sorted(tile_ids)
+    del tile_files["2_3"]
+    output = os.path.join(save_dir, "mosaic", "Tmrt_2024_150_1200.tif")
+    assert mosaic_tiles(args, tile_files, output, n_jobs=4) == ["2_3"]
+
+    mosaic = gdal.Open(output)
+    assert (mosaic.RasterXSize, mosaic.RasterYSize) == (width, height)
+    assert mosaic.GetGeoTransform() == (ORIGIN[0], RES, 0, ORIGIN[1], 0, -RES)
+    band = mosaic.GetRasterBand(1)
+    assert band.GetNoDataValue() == MOSAIC_NODATA
+    values = band.ReadAsArray()
+    assert np.all(values[:10, :10] == MOSAIC_NODATA), "NoData is converted."
+    assert values[50, 50] == city[50, 50], "Core of the first tile."
+    assert values[50, 95] == city[50, 95] + 0.25, "Second half of the overlap."
+    assert values[50, 85] == city[50, 85], "First half of the overlap."
+    assert values[170, 250] == MOSAIC_NODATA, "Missing tile."
+    assert not os.path.exists(f"{output}.{os.getpid()}.tmp")
@@ -0,0 +1,103 @@
+"""
+This script tests the direct mosaicking of the SOLWEIG tiles.
+
+Functions:
+- test_core_windows: Tests that the core windows cover the grid exactly once.
+- test_write_core_windows: Tests that the tiles written into the mosaic reproduce the city.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from src.umep_wrapper.mosaic_writer import (
+    MOSAIC_NODATA,
+    MOSAIC_SUFFIX,
+    create_mosaics,
+    get_core_window,
+    get_mosaic_hours,
+    write_core_windows,
+)
+from src.umep_wrapper.tile_catalog import get_catalog
+
+from .test_utils import ORIGIN, RES, clear_tmp_dir, write_raster
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "mosaic")
+
+SIZE = 100
+OVERLAP = 20
+
+
+def _tile_windows(width, height):
+    """Returns the windows of the tiles of a grid."""
+    stride = SIZE - OVERLAP
+    return [
+        (xoff, yoff, min(SIZE, width - xoff), min(SIZE, height - yoff))
+        for yoff in range(0, height - OVERLAP, stride)
+        for xoff in range(0, width - OVERLAP, stride)
+    ]
+
+
+def test_core_windows():
+    """
+    Tests the core windows of a grid with a cut last column.
+    """
+    width, height = 290, 180
+    coverage = np.zeros((height, width), dtype=int)
+    for window in _tile_windows(width, height):
+        x0, y0, x1, y1 = get_core_window(window, OVERLAP, width, height)
+        assert window[0] <= x0 < x1 <= window[0] + window[2], "Within the tile."
+        coverage[y0:y1, x0:x1] += 1
+
+    assert np.all(coverage == 1), "Every pixel belongs to exactly one tile."
+    assert get_mosaic_hours([(2024, 150, 11), (2024, 150, 12)]) == [(2024, 150, 12)]
+
+
+def test_write_core_windows():
+    """
+    Tests that the mosaic equals the city after all tiles wrote their core window.
+    """
+    clear_tmp_dir(save_dir)
+    width, height = 260, 180
+    city = np.arange(width * height, dtype=np.float32).reshape(height, width)
+    city[:10, :10] = -9999
+
+    for window in _tile_windows(width, height):
+        xoff, yoff, xsize, ysize = window
+        tile_id = f"{yoff // (SIZE - OVERLAP) + 1}_{xoff // (SIZE - OVERLAP) + 1}"
+        tile = city[yoff : yoff + ysize, xoff : xoff + xsize]
+        for name in ["dsm", "cdsm"]:
+            write_raster(
+                os.path.join(save_dir, name, f"{name}_3m_{tile_id}.tif"),
+                np.ones_like(tile),
+                xoff=xoff,
+                yoff=yoff,
+            )
+        # the neighbouring tiles disagree within the overlap
+        write_raster(
+            os.path.join(save_dir, "temp_tiles", tile_id, "Tmrt_2024_150_1200D.tif"),
+            np.where(tile == -9999, tile, tile + 0.25 * (xoff + yoff > 0)),
+            xoff=xoff,
+            yoff=yoff,
+        )
+
+    args = {"data_path": save_dir, "dsm_folder": "dsm", "cdsm_folder": "cdsm"}
+    mosaic_path = os.path.join(save_dir, "mosaic")
+    names = create_mosaics(args, mosaic_path, [(2024, 150, 12)])
+    assert names == ["Tmrt_2024_150_1200"]
+    assert create_mosaics(args, mosaic_path, [(2024, 150, 12)]) == [], "Kept."
+
+    for tile_id, record in get_catalog(args).items():
+        window = (record.xoff, record.yoff, record.xsize, record.ysize)
+        output_dir = os.path.join(save_dir, "temp_tiles", tile_id)
+        assert write_core_windows(mosaic_path, window, output_dir) == names
+
+    mosaic = gdal.Open(os.path.join(mosaic_path, names[0] + MOSAIC_SUFFIX))
+    assert (mosaic.RasterXSize, mosaic.RasterYSize) == (width, height)
+    assert mosaic.GetGeoTransform() == (ORIGIN[0], RES, 0, ORIGIN[1], 0, -RES)
+    values = mosaic.GetRasterBand(1).ReadAsArray()
+    assert np.all(values[:10, :10] == MOSAIC_NODATA), "NoData is converted."
+    assert values[50, 50] == city[50, 50], "Core of the first tile."
+    assert values[50, 95] == city[50, 95] + 0.25, "Second half of the overlap."
+    assert values[50, 85] == city[50, 85], "First half of the overlap."
@@ -0,0 +1,94 @@
+"""
+This script tests the nocturnal fast path of the SOLWEIG tile runs.
+
+Functions:
+- test_night_detection: Tests that night hours are detected from the sun elevation.
+- test_night_tmrt: Tests the longwave-only Tmrt for open and enclosed places.
+- test_run_nocturnal: Tests that the fast path creates the SOLWEIG output files.
+"""
+
+import os
+
+import numpy as np
+
+from src.umep_wrapper.nocturnal import (
+    calculate_night_tmrt,
+    get_sun_elevation,
+    is_night,
+    read_met_rows,
+    run_nocturnal,
+)
+
+from .test_utils import (
+    clear_tmp_dir,
+    create_dummy_metfile,
+    create_dummy_raster,
+    create_preprocessed_folder,
+)
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "nocturnal")
+
+# Dortmund
+LAT, LON = 51.51, 7.47
+CONFIG = {"ABS_L": 0.95, "EMIS_WALLS": 0.9, "EMIS_GROUND": 0.95, "POSTURE": 0}
+
+
+def _uniform_svfs(value):
+    """Returns the SVFs of a tile without vegetation and uniform sky view."""
+    svfs = {}
+    for direction in ["", "N", "E", "S", "W"]:
+        svfs[f"svf{direction}"] = np.full((3, 3), value)
+        svfs[f"svf{direction}veg"] = np.ones((3, 3))
+        svfs[f"svf{direction}aveg"] = np.ones((3, 3))
+    return svfs
+
+
+def test_night_detection():
+    """
+    Tests the sun elevation at summer solstice and the night detection.
+    """
+    assert get_sun_elevation(LAT, LON, 2024, 172, 11.5) > 60, "Summer noon (UTC+2)"
+    assert get_sun_elevation(LAT, LON, 2024, 172, 23.5) < 0, "Summer midnight"
+
+    night = [{"iy": 2024, "id": 172, "it": h, "imin": 0} for h in [0, 1]]
+    day = [{"iy": 2024, "id": 172, "it": h, "imin": 0} for h in [11, 12]]
+    assert is_night(night, LAT, LON), "Hours after midnight are night."
+    assert not is_night(day, LAT, LON), "Hours around noon are day."
+    assert not is_night(night + day, LAT, LON), "All hours have to be night."
+
+
+def test_night_tmrt():
+    """
+    Tests that Tmrt is lower for open places, which radiate into the cold sky.
+    """
+    tmrt_open = calculate_night_tmrt(_uniform_svfs(1.0), 15.0, 70.0, CONFIG)
+    tmrt_canyon = calculate_night_tmrt(_uniform_svfs(0.3), 15.0, 70.0, CONFIG)
+
+    assert tmrt_open.shape == (3, 3)
+    assert np.all(tmrt_open < 15.0), "Open sky should cool below air temperature."
+    assert np.all(tmrt_canyon > tmrt_open), "Walls should shelter from the sky."
+
+
+def test_run_nocturnal():
+    """
+    Tests that the fast path writes a Tmrt raster per hour and the average.
+    """
+    clear_tmp_dir(save_dir)
+    create_dummy_raster(save_dir, "dsm.tif")
+    met_file = create_dummy_metfile(save_dir, "metfile.txt")
+    create_preprocessed_folder(save_dir, "1_1")
+
+    config = {
+        **CONFIG,
+        "INPUT_DSM": os.path.join(save_dir, "dsm.tif"),
+        "INPUT_SVF": os.path.join(save_dir, "1_1", "svfs.zip"),
+        "INPUTMET": met_file,
+        "OUTPUT_DIR": os.path.join(save_dir, "out"),
+    }
+    run_nocturnal(config)
+
+    hours = [int(row["it"]) for row in read_met_rows(met_file)]
+    expected = [f"Tmrt_2024_234_{hour:02d}00N.tif" for hour in hours]
+    assert sorted(os.listdir(config["OUTPUT_DIR"])) == sorted(
+        expected + ["Tmrt_average.tif"]
+    ), "Should output a Tmrt file per hour and the average."
@@ -0,0 +1,99 @@
+"""
+This script tests the single-pass post-processing of the published products.
+
+Functions:
+- test_postprocess_products: Tests that the products are masked, cropped and written as COG.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from src.umep_wrapper.postprocess import (
+    NO_DATA_VALUE,
+    Product,
+    postprocess_products,
+)
+from src.utils.product_encoding import read_band
+
+from .test_utils import (
+    ORIGIN,
+    RES,
+    clear_tmp_dir,
+    create_dummy_boundary,
+    write_raster,
+)
+
+save_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tmp", "postprocess"
+)
+
+
+# a triangular city boundary spanning pixels 10 to 30
+BOUNDARY = [(10, 10), (30, 10), (10, 30), (10, 10)]
+
+
+def test_postprocess_products():
+    """
+    Tests the concurrent post-processing of a value and a class product, which
+    are stored as int16 and uint8.
+    """
+    clear_tmp_dir(save_dir)
+    boundary = os.path.join(save_dir, "boundary.geojson")
+    create_dummy_boundary(boundary, BOUNDARY, ORIGIN, RES)
+
+    values = np.full((40, 40), 30.0, dtype=np.float32)
+    values[12, 12] = -9999
+    values_path = os.path.join(save_dir, "DO_UTCI.tif")
+    write_raster(values_path, values)
+    classes_path = os.path.join(save_dir, "DO_UTCI-class.tif")
+    write_raster(classes_path, np.full((40, 40), 6.0, dtype=np.float32), NO_DATA_VALUE)
+
+    products = [
+        Product(
+            "UTCI",
+            values_path,
+            os.path.join(save_dir, "DO_UTCI_cog.tif"),
+            values_path,
+        ),
+        Product(
+            "UTCI-class",
+            classes_path,
+            os.path.join(save_dir, "cog", "DO_UTCI-class_cog.tif"),
+        ),
+    ]
+    mask_cache = os.path.join(save_dir, "mask_cache")
+    assert postprocess_products(products, boundary, mask_cache=mask_cache) == products
+    assert len(os.listdir(mask_cache)) == 1, "One mask for the shared grid."
+    assert products[1].resampling == "NEAREST"
+
+    cropped = gdal.Open(values_path)
+    assert (cropped.RasterXSize, cropped.RasterYSize) == (20, 20), "Cropped in place."
+    assert cropped.GetGeoTransform() == (
+        ORIGIN[0] + 10 * RES,
+        RES,
+        0.0,
+        ORIGIN[1] - 10 * RES,
+        0.0,
+        -RES,
+    )
+    assert cropped.GetRasterBand(1).DataType == gdal.GDT_Int16, "Encoded in place."
+    for product in products:
+        cog = gdal.Open(product.cog)
+        assert cog.GetMetadataItem("LAYOUT", "IMAGE_STRUCTURE") == "COG"
+        band = cog.GetRasterBand(1)
+        assert band.GetNoDataValue() == product.encoding.nodata
+        array = read_band(band)
+        assert array.shape == (20, 20)
+        assert np.isnan(array[19, 19]), "Masked outside of the city."
+
+    band = gdal.Open(products[0].cog).GetRasterBand(1)
+    assert band.ReadAsArray()[0, 0] == 3000, "Stored in hundredths of a degree."
+    values = read_band(band)
+    assert values[0, 0] == 30.0
+    assert np.isnan(values[2, 2]), "NoData of the source is converted."
+    band = gdal.Open(products[1].cog).GetRasterBand(1)
+    assert band.DataType == gdal.GDT_Byte
+    assert band.ReadAsArray()[0, 0] == 6
+    assert not os.path.exists(products[1].cog + f".{os.getpid()}.tmp")
@@ -3,11 +3,19 @@ This script tests the successful tile-wise processing of the pipeline.
 
 Functions:
 - test_process_tile: Tests that the processing creates the expected files at the expected locations.
+- test_tile_config: Tests that the in-memory config equals the rendered template.
 """
 
 import os
 
-from src.umep_wrapper.solweig_multi_processing import process_tile
+import yaml
+from jinja2 import Environment, FileSystemLoader
+
+from src.umep_wrapper.solweig_multi_processing import (
+    build_tile_config,
+    get_base_config,
+    process_tile,
+)
 
 from .test_utils import (
     clear_tmp_dir,
@@ -49,6 +57,7 @@ def test_process_tile():
         "proj_lib": os.environ[
             "PROJ_LIB"
         ],  # IMPORTANT: set new env PROJ_LIB before running pytest
+        "write_config": True,
     }
     test_files = {
         "dsm": "dummy_raster.tif",
@@ -69,7 +78,7 @@ def test_process_tile():
     assert (
         len(os.listdir(save_dir)) == 2
     ), "Output should be saved in two output folders"
-    # these two folders are 1) for the filled template 2) for computational output
+    # these two folders are 1) for the written config 2) for computational output
 
     counter = 0
     for entry in os.listdir(
@@ -79,3 +88,53 @@ def test_process_tile():
             counter += 1
 
     assert counter == 3, "Should output exactly three Tmrt files (2 hours + average)."
+
+
+def test_tile_config():
+    """
+    Tests whether the config built from the cached base config matches the config
+    of the rendered template file.
+    """
+    data_dir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test_data",
+        "process_tile_test_data",
+    )
+    args = {
+        "data_path": "/data",
+        "dsm_folder": "dsm",
+        "cdsm_folder": "cdsm",
+        "dtm_folder": "dtm",
+        "preprocess_data_path": "/preprocessed",
+        "output_path": "/output",
+    }
+    tile = {"dsm": "dsm_1_1.tif", "cdsm": "cdsm_1_1.tif", "dtm": "dtm_1_1.tif"}
+
+    for lc_path in ["/data/lc/lc_1_1.tif", None]:
+        template = Environment(loader=FileSystemLoader(data_dir)).get_template(
+            "solweig_parameter_template.yaml"
+        )
+        rendered = yaml.safe_load(
+            template.render(
+                {
+                    **args,
+                    "dsm_file": tile["dsm"],
+                    "cdsm_file": tile["cdsm"],
+                    "dtm_file": tile["dtm"],
+                    "lc_path": lc_path,
+                    "y_x": "1_1",
+                    "met_file_path": "/data/metfile.txt",
+                    "solweig_process_folder": "solweig_out",
+                }
+            )
+        )
+
+        config = build_tile_config(
+            get_base_config(data_dir),
+            args,
+            "/data/metfile.txt",
+            "solweig_out",
+            ("1_1", {**tile, "lc_path": lc_path}),
+        )
+
+        assert config == rendered, "Config should not depend on the YAML round-trip."
@@ -0,0 +1,66 @@
+"""
+This script tests the storage encodings of the published raster products.
+
+Functions:
+- test_encode_decode: Tests that values survive the encoding within its precision.
+- test_saveraster_encoding: Tests that saved rasters are decoded to the original values.
+"""
+
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from src.utils.product_encoding import get_encoding, read_band
+from src.utils.save_raster import saveraster
+
+from .test_utils import clear_tmp_dir, create_dummy_raster
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "encoding")
+
+
+def test_encode_decode():
+    """
+    Tests precision, clipping and NoData of the temperature, humidity and class
+    encodings.
+    """
+    utci = get_encoding("UTCI")
+    stored = utci.encode(np.array([25.126, -32768.0, np.nan, 400.0]), nodata=-32768)
+    assert stored.dtype == np.int16
+    assert stored.tolist() == [2513, -32768, -32768, 32767], "Clipped to the range."
+    values = utci.decode(stored)
+    assert abs(values[0] - 25.13) < 1e-4
+    assert np.isnan(values[1]) and np.isnan(values[2]), "NoData is NaN."
+    assert values[3] > 327, "Clipping does not produce NoData."
+
+    rh = get_encoding("RH")
+    stored = rh.encode(np.array([0.0, 55.55, 100.0, np.nan]))
+    assert stored.dtype == np.uint16
+    assert stored.tolist() == [0, 5555, 10000, 65535]
+
+    classes = get_encoding("UTCI-class")
+    stored = classes.encode(np.array([0, 9, -32768]), nodata=-32768)
+    assert stored.dtype == np.uint8
+    assert stored.tolist() == [0, 9, 255]
+    assert get_encoding("unknown") is None
+
+
+def test_saveraster_encoding():
+    """
+    Tests that a raster saved with an encoding reads back as physical values.
+    """
+    clear_tmp_dir(save_dir)
+    reference_path = create_dummy_raster(save_dir, "reference.tif", value=30.0)
+    reference = gdal.Open(reference_path)
+    values = np.full((reference.RasterYSize, reference.RasterXSize), 21.37)
+    values[0, 0] = -32768
+
+    output_path = os.path.join(save_dir, "DO_TA.tif")
+    saveraster(reference, output_path, values, -32768, get_encoding("TA"))
+    band = gdal.Open(output_path).GetRasterBand(1)
+    assert band.DataType == gdal.GDT_Int16
+    assert band.GetScale() == 0.01
+    decoded = read_band(band)
+    assert np.isnan(decoded[0, 0])
+    assert np.allclose(decoded[1:, 1:], 21.37, atol=1e-4)
+    assert os.path.getsize(output_path) < os.path.getsize(reference_path)
@@ -0,0 +1,148 @@
+"""
+This script tests the partial recomputation of a region of interest.
+
+Functions:
+- test_select_roi_tiles: Tests that only tiles whose core intersects the ROI are selected.
+- test_patch_raster: Tests that only the ROI of the target raster is patched.
+- test_patch_polygon: Tests that pixels outside a polygon but within its bounding box are kept.
+"""
+
+import json
+import os
+
+import numpy as np
+from osgeo import gdal, osr
+
+from src.umep_wrapper.roi import patch_raster, read_roi, select_roi_tiles
+from src.umep_wrapper.tile_catalog import TileRecord
+
+from .test_utils import (
+    ORIGIN,
+    RES,
+    clear_tmp_dir,
+    create_dummy_boundary,
+    get_projection,
+    write_raster,
+)
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "roi")
+
+
+def _record(tile_id, xoff, yoff, size=100):
+    """Returns the catalog record of a tile at the given pixel offset."""
+    return TileRecord(
+        tile_id=tile_id,
+        dsm="",
+        cdsm="",
+        xoff=xoff,
+        yoff=yoff,
+        xsize=size,
+        ysize=size,
+        xmin=ORIGIN[0] + xoff * RES,
+        xmax=ORIGIN[0] + (xoff + size) * RES,
+        ymin=ORIGIN[1] - (yoff + size) * RES,
+        ymax=ORIGIN[1] - yoff * RES,
+    )
+
+
+def test_select_roi_tiles():
+    """
+    Tests the selection for a bounding box and a GeoJSON polygon in EPSG:4326.
+    """
+    clear_tmp_dir(save_dir)
+    records = {
+        f"{y + 1}_{x + 1}": _record(f"{y + 1}_{x + 1}", x * 80, y * 80)
+        for y in range(3)
+        for x in range(3)
+    }
+
+    # pixels 5-15 lie in the first tile only, pixel 92 in the overlap of 1_1 and 1_2,
+    # but within the core of 1_2
+    bbox = f"{ORIGIN[0] + 5 * RES},{ORIGIN[1] - 15 * RES},"
+    bbox += f"{ORIGIN[0] + 15 * RES},{ORIGIN[1] - 5 * RES}"
+    assert select_roi_tiles(records, read_roi(bbox, get_projection()), 20) == ["1_1"]
+    bbox = f"{ORIGIN[0] + 92 * RES},{ORIGIN[1] - 15 * RES},"
+    bbox += f"{ORIGIN[0] + 93 * RES},{ORIGIN[1] - 5 * RES}"
+    assert select_roi_tiles(records, read_roi(bbox, get_projection()), 20) == ["1_2"]
+
+    # a polygon in lon/lat around the center of the grid
+    transform = osr.CoordinateTransformation(
+        osr.SpatialReference(wkt=get_projection()),
+        osr.SpatialReference(osr.SRS_WKT_WGS84_LAT_LONG),
+    )
+    x, y = ORIGIN[0] + 150 * RES, ORIGIN[1] - 150 * RES
+    corners = [
+        transform.TransformPoint(x + dx, y + dy)[:2]
+        for dx, dy in [(-3, -3), (3, -3), (3, 3), (-3, 3), (-3, -3)]
+    ]
+    geojson_path = os.path.join(save_dir, "roi.geojson")
+    with open(geojson_path, "w") as file:
+        json.dump(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "properties": {},
+                        "geometry": {
+                            "type": "Polygon",
+                            "coordinates": [[[lon, lat] for lon, lat in corners]],
+                        },
+                    }
+                ],
+            },
+            file,
+        )
+    roi = read_roi(geojson_path, get_projection())
+    assert select_roi_tiles(records, roi, 20) == ["2_2"], "Center tile is selected."
+
+
+def test_patch_raster():
+    """
+    Tests that the target keeps its values outside the ROI and its NoData pixels.
+    """
+    clear_tmp_dir(save_dir)
+    source_path = os.path.join(save_dir, "mosaic.tif")
+    target_path = os.path.join(save_dir, "target.tif")
+    source = np.full((100, 100), 2.0, dtype=np.float32)
+    source[20, 20] = -32768
+    write_raster(source_path, source, -32768)
+    # the target was cropped, i.e. it starts 10 pixels later
+    target = np.ones((80, 80), dtype=np.float32)
+    target[15, 15] = -32768
+    write_raster(target_path, target, -32768, xoff=10, yoff=10)
+
+    bbox = f"{ORIGIN[0] + 15 * RES},{ORIGIN[1] - 30 * RES},"
+    bbox += f"{ORIGIN[0] + 30 * RES},{ORIGIN[1] - 15 * RES}"
+    assert patch_raster(bbox, source_path, target_path)
+
+    # target pixels are offset by 10 pixels, the ROI covers target pixels 5-19
+    values = gdal.Open(target_path).ReadAsArray()
+    assert values[6, 6] == values[19, 19] == 2.0, "Within the ROI."
+    assert values[6, 25] == values[4, 4] == 1.0, "Outside of the ROI."
+    assert values[15, 15] == -32768, "NoData of the target is kept."
+    assert values[10, 10] == 1.0, "NoData of the source is not written."
+
+
+def test_patch_polygon():
+    """
+    Tests that only pixels whose center lies within a triangular ROI are patched.
+    """
+    clear_tmp_dir(save_dir)
+    source_path = os.path.join(save_dir, "mosaic.tif")
+    target_path = os.path.join(save_dir, "target.tif")
+    write_raster(source_path, np.full((100, 100), 2.0, dtype=np.float32), -32768)
+    write_raster(
+        target_path, np.ones((80, 80), dtype=np.float32), -32768, xoff=10, yoff=10
+    )
+    roi_path = os.path.join(save_dir, "roi.geojson")
+    create_dummy_boundary(
+        roi_path, [(20, 20), (40, 20), (20, 40), (20, 20)], ORIGIN, RES
+    )
+    assert patch_raster(roi_path, source_path, target_path)
+
+    # target pixels are offset by 10 pixels, the triangle spans target pixels 10-29
+    values = gdal.Open(target_path).ReadAsArray()
+    assert values[12, 12] == values[10, 27] == values[27, 10] == 2.0, "Within."
+    assert values[28, 28] == values[25, 25] == 1.0, "Within the bounding box only."
+    assert values[5, 5] == 1.0, "Outside of the bounding box."
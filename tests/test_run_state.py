@@ -0,0 +1,89 @@
+"""
+This script tests the run-state database of the SOLWEIG tile runs.
+
+Functions:
+- test_run_state: Tests that completed and failed tiles are recorded per run.
+- test_run_key: Tests that the run key changes with the metfile and the arguments.
+"""
+
+import os
+
+from src.umep_wrapper.run_state import RunState, get_run_key
+
+from .test_utils import clear_tmp_dir, create_dummy_metfile
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "run_state")
+
+
+def test_run_state():
+    """
+    Tests the completion markers of a run, a retried tile and the pruning of runs.
+    """
+    clear_tmp_dir(save_dir)
+    db_path = os.path.join(save_dir, "run_state.sqlite")
+    run_state = RunState(db_path, "run_1")
+
+    run_state.update("1_1", ({"OUTPUT_DIR": "out"}, 1.0))
+    run_state.update("1_2", MemoryError("killed"))
+    assert run_state.get_completed() == {"1_1"}
+    assert list(run_state.get_failed()) == ["1_2"], "Failed tile should be recorded."
+
+    run_state.update("1_2", ({"OUTPUT_DIR": "out"}, 1.0))
+    assert run_state.get_completed() == {"1_1", "1_2"}, "Retried tile is completed."
+    assert run_state.get_failed() == {}
+
+    assert RunState(db_path, "run_2").get_completed() == set(), "Runs are separate."
+    RunState(db_path, "run_2").update("1_2", ({}, 1.0))
+    RunState(db_path, "run_2").reset()
+    assert RunState(db_path, "run_2").get_completed() == set()
+    assert run_state.get_completed() == {"1_1", "1_2"}, "Other runs are kept."
+    RunState(db_path, "run_2").update("1_1", ({}, 1.0))
+    assert RunState(db_path, "run_2", keep_runs=1).get_completed() == {"1_1"}
+    assert (
+        RunState(db_path, "run_1").get_completed() == set()
+    ), "Older runs should be pruned."
+
+
+def test_run_key():
+    """
+    Tests that the run key depends on the metfile content and the arguments which
+    change the results, not on host-local paths.
+    """
+    clear_tmp_dir(save_dir)
+    met_file = create_dummy_metfile(save_dir, "metfile.txt")
+    args = {
+        "met_file": met_file,
+        "dsm_folder": "3m/dsm_tiles",
+        "output_path": "/mnt/a/results",
+        "max_processes": 4,
+    }
+
+    key = get_run_key(met_file, args)
+    assert key == get_run_key(met_file, {**args, "max_processes": 8, "retries": 3})
+    host_b = {
+        **args,
+        "output_path": "/mnt/b/results",
+        "proj_lib": "/opt/proj",
+        "scratch_root": "/tmp",
+        "work_queue": "sqlite:///mnt/b/queue.sqlite",
+    }
+    assert key == get_run_key(met_file, host_b), "Host-local paths are ignored."
+    assert key != get_run_key(met_file, {**args, "dsm_folder": "1m/dsm_tiles"})
+    assert key != get_run_key(met_file, {**args, "night_mode": True})
+    mosaic_key = get_run_key(met_file, {**args, "mosaic_path": "/mnt/a/mosaic"})
+    assert mosaic_key != key, "Tiles of runs without mosaics lack their windows."
+    assert mosaic_key == get_run_key(met_file, {**args, "mosaic_path": "/mnt/b/m"})
+
+    # a GeoJSON ROI is identified by its content
+    roi_a = os.path.join(save_dir, "roi_a.geojson")
+    roi_b = os.path.join(save_dir, "roi_b.geojson")
+    for path in (roi_a, roi_b):
+        with open(path, "w") as file:
+            file.write('{"type": "FeatureCollection", "features": []}')
+    roi_key = get_run_key(met_file, {**args, "roi": roi_a})
+    assert roi_key != key
+    assert roi_key == get_run_key(met_file, {**args, "roi": roi_b})
+
+    with open(met_file, "a") as file:
+        file.write("\n")
+    assert key != get_run_key(met_file, args), "New metfile content is a new run."
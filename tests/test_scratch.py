@@ -0,0 +1,112 @@
+"""
+This script tests the private scratch directories of the SOLWEIG workers.
+
+Functions:
+- test_tile_scratch: Tests that temp files go to the tile scratch, which is removed.
+- test_worker_scratch: Tests that every worker has its own scratch, removed on exit.
+- test_remove_stale_scratch: Tests that the scratch of killed workers is removed.
+- test_remove_stale_scratch_shared: Tests that the scratch of other hosts is kept.
+"""
+
+import os
+import tempfile
+from multiprocessing import Pool, Process
+
+from src.umep_wrapper.scratch import (
+    SCRATCH_PREFIX,
+    get_scratch_prefix,
+    get_worker_scratch,
+    remove_stale_scratch,
+    tile_scratch,
+)
+
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "scratch")
+
+
+def _use_scratch(tile_id):
+    """Writes a file into the scratch of a tile, returns the used folders."""
+    with tile_scratch(tile_id, save_dir) as tile_dir:
+        with tempfile.NamedTemporaryFile() as file:
+            tmp_file = file.name
+        with open(os.path.join(tile_dir, "svf.tif"), "w") as file:
+            file.write("svf")
+    return os.getpid(), get_worker_scratch(save_dir), tile_dir, tmp_file
+
+
+def test_tile_scratch():
+    """
+    Tests the temp folder of Python and the cleanup after a tile.
+    """
+    clear_tmp_dir(save_dir)
+    with Pool(processes=1) as pool:
+        pid, worker_dir, tile_dir, tmp_file = pool.apply(_use_scratch, ("1_1",))
+
+    assert tmp_file.startswith(worker_dir), "Python temp files go to the scratch."
+    assert os.path.dirname(worker_dir) == save_dir
+    assert not os.path.exists(tile_dir), "Tile scratch should be removed."
+
+
+def test_worker_scratch():
+    """
+    Tests that concurrent workers use separate folders, which are removed on exit.
+    """
+    clear_tmp_dir(save_dir)
+    with Pool(processes=2, maxtasksperchild=1) as pool:
+        results = pool.map(_use_scratch, ["1_1", "1_2"])
+        pool.close()
+        pool.join()
+
+    worker_dirs = {worker_dir for _, worker_dir, _, _ in results}
+    assert len(worker_dirs) == 2, "Every worker should have its own scratch."
+    assert os.listdir(save_dir) == [], "Scratch should be removed on worker exit."
+
+
+def _exit_without_cleanup():
+    """Creates the scratch of the process and exits without finalizers."""
+    get_worker_scratch(save_dir)
+    os._exit(0)
+
+
+def test_remove_stale_scratch():
+    """
+    Tests that the scratch of workers which did not exit regularly is removed,
+    while the scratch of running processes and other folders are kept.
+    """
+    clear_tmp_dir(save_dir)
+    # like hanging workers of pool.terminate(), the finalizers do not run
+    workers = [Process(target=_exit_without_cleanup) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(os.listdir(save_dir)) == 2
+
+    running = f"{get_scratch_prefix()}{os.getpid()}_running"
+    os.makedirs(os.path.join(save_dir, running))
+    os.makedirs(os.path.join(save_dir, "other"))
+
+    assert remove_stale_scratch(save_dir) == 2
+    assert sorted(os.listdir(save_dir)) == ["other", running]
+
+
+def test_remove_stale_scratch_shared():
+    """
+    Tests that a shared scratch root keeps the directories of other hosts or
+    containers, whose pids do not exist in the current pid namespace.
+    """
+    clear_tmp_dir(save_dir)
+    worker = Process(target=_exit_without_cleanup)
+    worker.start()
+    worker.join()
+    assert os.listdir(save_dir)[0].startswith(get_scratch_prefix())
+
+    # pids far above pid_max, i.e. not running in the current pid namespace
+    other_host = f"{SCRATCH_PREFIX}otherhost-1_99999999_abc"
+    unmarked = f"{SCRATCH_PREFIX}99999999_abc"
+    for name in (other_host, unmarked):
+        os.makedirs(os.path.join(save_dir, name))
+
+    assert remove_stale_scratch(save_dir) == 1, "Only the dead local worker."
+    assert sorted(os.listdir(save_dir)) == sorted([other_host, unmarked])
@@ -0,0 +1,142 @@
+"""
+This script tests the resident SOLWEIG worker service over a temporary socket.
+
+Functions:
+- test_service_jobs: Tests job submission, failing jobs and the recycling of hung pools.
+- test_service_unavailable: Tests the exit code of submit without a running service.
+"""
+
+import os
+import stat
+import subprocess
+import sys
+import time
+from multiprocessing import Pool, get_context
+
+import pytest
+
+from src.umep_wrapper import solweig_service
+from src.umep_wrapper.solweig_service import (
+    AUTHKEY_SUFFIX,
+    SERVICE_UNAVAILABLE,
+    serve,
+    submit,
+)
+
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "service")
+src_dir = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+)
+
+
+def _job(mode):
+    """Returns a stand-in job, see _run_job."""
+    return {"args": {"met_file": "metfile.txt", "mode": mode}}
+
+
+def _run_job(pool, scheduler, q, job):
+    """Stands in for SOLWEIG: reports the worker pid, fails or leaves a hung worker."""
+    if job["args"]["mode"] == "fail":
+        raise RuntimeError("broken job")
+    pid = pool.apply(os.getpid)
+    if job["args"]["mode"] == "hang":
+        scheduler.hung.append(pool.apply_async(time.sleep, (30,)))
+    return {"status": "ok", "message": "", "pid": pid}
+
+
+def _start_pool(processes, q, proj_lib):
+    """Starts a pool without loading SOLWEIG."""
+    return Pool(processes=processes)
+
+
+def _serve(socket_path):
+    """Runs the service with a single worker and the stand-in jobs."""
+    solweig_service.run_job = _run_job
+    solweig_service._start_pool = _start_pool
+    serve(socket_path, processes=1)
+
+
+@pytest.fixture
+def socket_path():
+    """Starts the service on a temporary socket and shuts it down afterwards."""
+    clear_tmp_dir(save_dir)
+    path = os.path.join(save_dir, "solweig.sock")
+    service = get_context("fork").Process(target=_serve, args=(path,))
+    service.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.1)
+    yield path
+    if service.is_alive():
+        submit(path, {"command": "shutdown"})
+    service.join(timeout=30)
+    assert not os.path.exists(path), "The socket is removed on shutdown."
+    assert not os.path.exists(path + AUTHKEY_SUFFIX)
+
+
+def test_service_jobs(socket_path):
+    """
+    Tests that jobs run on the resident pool, that the service stays alive after a
+    failing job and that the pool is replaced once its workers hang.
+    """
+    first = submit(socket_path, _job("ok"))
+    assert first["status"] == "ok"
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600, "Owner only."
+    key_mode = os.stat(socket_path + AUTHKEY_SUFFIX).st_mode
+    assert stat.S_IMODE(key_mode) == 0o600, "The key is readable by the owner only."
+
+    assert submit(socket_path, _job("ok"))["pid"] == first["pid"]
+    failed = submit(socket_path, _job("fail"))
+    assert failed["status"] == "failed" and "broken job" in failed["message"]
+    assert submit(socket_path, {"args": {}})["status"] == "failed", "Malformed job."
+    assert submit(socket_path, _job("ok"))["pid"] == first["pid"]
+
+    assert submit(socket_path, _job("hang"))["pid"] == first["pid"]
+    recycled = submit(socket_path, _job("ok"))
+    assert recycled["status"] == "ok"
+    assert recycled["pid"] != first["pid"], "The hung pool should be recycled."
+
+
+def test_service_unavailable():
+    """
+    Tests that submit exits with SERVICE_UNAVAILABLE, so the caller falls back to
+    solweig_multi_processing.py, if no service listens on the socket.
+    """
+    clear_tmp_dir(save_dir)
+    # a socket left behind by a killed service
+    socket_path = os.path.join(save_dir, "stale.sock")
+    with open(socket_path, "w"):
+        pass
+    run_args = [
+        f"--{name}={save_dir}"
+        for name in [
+            "data_path",
+            "dsm_folder",
+            "cdsm_folder",
+            "dtm_folder",
+            "met_file",
+            "preprocess_data_path",
+            "output_path",
+        ]
+    ]
+    for path in (socket_path, os.path.join(save_dir, "missing.sock")):
+        process = subprocess.run(
+            [
+                sys.executable,
+                os.path.join(src_dir, "umep_wrapper", "solweig_service.py"),
+                "submit",
+                f"--socket={path}",
+                *run_args,
+            ],
+            env={
+                **os.environ,
+                "PYTHONPATH": os.pathsep.join(
+                    [src_dir, os.environ.get("PYTHONPATH", "")]
+                ),
+            },
+            capture_output=True,
+        )
+        assert process.returncode == SERVICE_UNAVAILABLE, process.stderr
@@ -0,0 +1,118 @@
+"""
+This script tests the stage graph engine of the tile processing.
+
+Functions:
+- test_stage_levels: Tests that stages are ordered by their dependencies.
+- test_stage_cache: Tests that stages with unchanged inputs are skipped.
+"""
+
+import os
+
+import pytest
+import yaml
+
+from src.umep_wrapper.stage_graph import (
+    SOLWEIG_STAGE,
+    SVF_STAGE,
+    WALL_STAGE,
+    Stage,
+    get_stage_levels,
+    run_stage,
+)
+
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "stages")
+template_path = os.path.join(save_dir, "templates")
+runs_file = os.path.join(save_dir, "runs.txt")
+
+COPY_STAGE = Stage(
+    name="copy",
+    template="copy_template.yaml",
+    runner="tests.test_stage_graph:copy_runner",
+    inputs=("{INPUT}",),
+    outputs=("{OUTPUT}",),
+)
+APPEND_STAGE = Stage(
+    name="append",
+    template="append_template.yaml",
+    runner="tests.test_stage_graph:copy_runner",
+    inputs=("{INPUT}",),
+    outputs=("{OUTPUT}",),
+    depends=("copy",),
+)
+
+
+def copy_runner(config_file):
+    """Copies the input to the output and records the run."""
+    with open(config_file, "r") as file:
+        config = yaml.safe_load(file)
+    with open(config["INPUT"], "r") as src, open(config["OUTPUT"], "w") as dst:
+        dst.write(src.read() + config["SUFFIX"])
+    with open(runs_file, "a") as file:
+        file.write(os.path.basename(config_file) + "\n")
+    return config["OUTPUT"], 0.1
+
+
+def _run(stage, args):
+    """Runs a stage for tile 1_1 and returns the stages that ran."""
+    open(runs_file, "w").close()
+    item = (("1_1", stage.name), (stage, {"dsm": "dsm.txt", "cdsm": "cdsm.txt"}))
+    run_stage(args, template_path, "stages", save_dir, item)
+    with open(runs_file, "r") as file:
+        return file.read().split()
+
+
+def test_stage_levels():
+    """
+    Tests the levels of the declared stages and the detection of cycles.
+    """
+    levels = get_stage_levels([SOLWEIG_STAGE, WALL_STAGE, SVF_STAGE])
+    assert [[stage.name for stage in level] for level in levels] == [
+        ["wall", "svf"],
+        ["solweig"],
+    ], "Wall and SVF should run in parallel before SOLWEIG."
+    assert get_stage_levels([SOLWEIG_STAGE]) == [[SOLWEIG_STAGE]], "Deps exist."
+
+    cyclic = Stage("cyclic", "", "", (), (), depends=("append",))
+    with pytest.raises(ValueError):
+        get_stage_levels([cyclic, Stage("append", "", "", (), (), ("cyclic",))])
+
+
+def test_stage_cache():
+    """
+    Tests that a stage reruns only when its inputs change, including dependents.
+    """
+    clear_tmp_dir(save_dir)
+    os.makedirs(template_path)
+    dsm_path = os.path.join(save_dir, "dsm.txt")
+    tile_path = os.path.join(save_dir, "1_1")
+    with open(os.path.join(template_path, "copy_template.yaml"), "w") as file:
+        file.write("INPUT: {{data_path}}/{{dsm_file}}\n")
+        file.write("OUTPUT: " + tile_path + "/copy_{{y_x}}.txt\nSUFFIX: a\n")
+    with open(os.path.join(template_path, "append_template.yaml"), "w") as file:
+        file.write("INPUT: " + tile_path + "/copy_{{y_x}}.txt\n")
+        file.write("OUTPUT: " + tile_path + "/append_{{y_x}}.txt\nSUFFIX: b\n")
+    with open(dsm_path, "w") as file:
+        file.write("dsm")
+    args = {
+        "data_path": save_dir,
+        "dsm_folder": "",
+        "cdsm_folder": "",
+        "output_path": save_dir,
+    }
+
+    assert _run(COPY_STAGE, args) == ["copy_parameter_1_1.yaml"]
+    assert _run(APPEND_STAGE, args) == ["append_parameter_1_1.yaml"]
+    assert _run(COPY_STAGE, args) == [], "Unchanged stage should be skipped."
+    assert _run(APPEND_STAGE, args) == []
+
+    with open(dsm_path, "w") as file:
+        file.write("new dsm")
+    assert _run(COPY_STAGE, args) == ["copy_parameter_1_1.yaml"], "Input changed."
+    assert _run(APPEND_STAGE, args) == ["append_parameter_1_1.yaml"], "Upstream."
+    with open(os.path.join(tile_path, "append_1_1.txt"), "r") as file:
+        assert file.read() == "new dsmab"
+
+    os.remove(os.path.join(tile_path, "append_1_1.txt"))
+    assert _run(APPEND_STAGE, args) == ["append_parameter_1_1.yaml"], "Output lost."
@@ -0,0 +1,78 @@
+"""
+This script tests the store of decoded static SOLWEIG inputs.
+
+Functions:
+- test_build_store: Tests that the stored inputs hold the values of the source rasters.
+- test_store_update: Tests that changed sources invalidate the stored inputs of a tile.
+"""
+
+import os
+import zipfile
+
+import numpy as np
+from osgeo import gdal
+
+from src.umep_wrapper.static_store import StaticStore, build_store
+
+from .test_utils import clear_tmp_dir, create_dummy_raster, create_static_data
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "store")
+
+
+def test_build_store():
+    """
+    Tests that GDAL reads the same values from the stored inputs as from the
+    compressed sources and that the SVF archive is repacked without compression.
+    """
+    clear_tmp_dir(save_dir)
+    args = create_static_data(save_dir, ["1_1"], preprocessed=True)
+    store_path = os.path.join(save_dir, "static_store")
+
+    assert build_store(args, store_path, processes=1) == ["1_1"]
+
+    store = StaticStore(store_path)
+    inputs = store.get_inputs("1_1")
+    assert set(inputs.keys()) == {
+        "INPUT_DSM",
+        "INPUT_CDSM",
+        "INPUT_DEM",
+        "INPUT_HEIGHT",
+        "INPUT_ASPECT",
+        "INPUT_SVF",
+    }, "All available inputs should be stored."
+
+    source = gdal.Open(os.path.join(save_dir, "dsm", "DO_DSM_3m_1_1.tif"))
+    stored = gdal.Open(inputs["INPUT_DSM"])
+    assert np.array_equal(stored.ReadAsArray(), source.ReadAsArray())
+    assert stored.GetGeoTransform() == source.GetGeoTransform()
+    assert (
+        stored.GetRasterBand(1).GetNoDataValue()
+        == source.GetRasterBand(1).GetNoDataValue()
+    )
+
+    arrays = store.load_arrays("1_1")
+    assert isinstance(arrays["dsm"], np.memmap), "Arrays should be memory-mapped."
+    assert np.array_equal(arrays["dsm"], source.ReadAsArray())
+
+    with zipfile.ZipFile(inputs["INPUT_SVF"], "r") as file:
+        assert len(file.namelist()) == 15, "All SVF rasters should be kept."
+        assert all(
+            info.compress_type == zipfile.ZIP_STORED for info in file.infolist()
+        ), "SVF archive should not be compressed."
+
+
+def test_store_update():
+    """
+    Tests that only tiles with changed sources are rebuilt.
+    """
+    clear_tmp_dir(save_dir)
+    args = create_static_data(save_dir, ["1_1", "1_2"], preprocessed=True)
+    store_path = os.path.join(save_dir, "static_store")
+
+    assert sorted(build_store(args, store_path, processes=1)) == ["1_1", "1_2"]
+    assert build_store(args, store_path, processes=1) == [], "Store is up to date."
+
+    create_dummy_raster(os.path.join(save_dir, "dsm"), "DO_DSM_3m_1_2.tif", value=7.0)
+    assert StaticStore(store_path).get_inputs("1_2") == {}, "Changed source"
+    assert build_store(args, store_path, processes=1) == ["1_2"]
+    assert StaticStore(store_path).load_arrays("1_2")["dsm"][0, 0] == 7.0
@@ -0,0 +1,110 @@
+"""
+This script tests the tile catalog of the static data.
+
+Functions:
+- test_build_catalog: Tests that tiles are matched by their exact tile id.
+- test_catalog_rebuild: Tests that the catalog is only rebuilt when the static data changes.
+- test_catalog_path: Tests that runs with other folders do not share a catalog.
+- test_empty_tile_index: Tests that fully masked tiles are flagged in the catalog.
+"""
+
+import os
+
+from src.umep_wrapper.tile_catalog import get_catalog, get_catalog_path
+
+from .test_utils import clear_tmp_dir, create_dummy_raster, create_static_data
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "catalog")
+
+
+def test_build_catalog():
+    """
+    Tests that ambiguous tile ids like '1_1' and '11_1' are matched correctly.
+    """
+    clear_tmp_dir(save_dir)
+    args = create_static_data(save_dir, ["1_1", "11_1", "1_11"])
+
+    catalog = get_catalog(args)
+
+    assert sorted(catalog.keys()) == ["11_1", "1_1", "1_11"], "All tiles expected."
+    record = catalog["1_1"]
+    assert os.path.basename(record.cdsm) == "DO_CDSM_3m_1_1.tif"
+    assert os.path.basename(record.dtm) == "DO_DTM_3m_1_1.tif"
+    assert record.lc is None, "Land cover is optional."
+    assert record.svf == os.path.join(save_dir, "preprocessed", "1_1", "svfs.zip")
+    assert (record.xsize, record.ysize) == (500, 500), "Window size of the tiles."
+    assert (record.xoff, record.yoff) == (0, 0), "Dummy tiles share their origin."
+    assert record.content_hash == catalog["11_1"].content_hash, "Same raster content."
+
+
+def test_catalog_rebuild():
+    """
+    Tests that the catalog is loaded as long as the static data does not change.
+    """
+    clear_tmp_dir(save_dir)
+    args = create_static_data(save_dir, ["1_1"])
+
+    get_catalog(args)
+    catalog_path = get_catalog_path(args)
+    assert os.path.exists(catalog_path), "Catalog should be saved next to the DSMs."
+    mtime = os.stat(catalog_path).st_mtime_ns
+
+    catalog = get_catalog(args)
+    assert os.stat(catalog_path).st_mtime_ns == mtime, "Catalog should be reused."
+    assert list(catalog.keys()) == ["1_1"]
+
+    create_static_data(save_dir, ["1_2"])
+    catalog = get_catalog(args)
+    assert sorted(catalog.keys()) == ["1_1", "1_2"], "New tiles should be found."
+
+    # overwrite a tile in place, the folder modification time does not change
+    cdsm_folder = os.path.join(save_dir, "cdsm")
+    folder_mtime = os.stat(cdsm_folder).st_mtime_ns
+    create_dummy_raster(cdsm_folder, "DO_CDSM_3m_1_2.tif", value=0.0)
+    os.utime(cdsm_folder, ns=(folder_mtime, folder_mtime))
+    catalog = get_catalog(args)
+    assert catalog["1_2"].is_empty, "Overwritten tiles should be detected."
+    assert not [name for name in os.listdir(save_dir) if name.endswith(".tmp")]
+
+
+def test_catalog_path():
+    """
+    Tests that SOLWEIG prepare runs without the DTM and another preprocess path
+    get their own catalog, so the catalogs of both are reused.
+    """
+    clear_tmp_dir(save_dir)
+    args = create_static_data(save_dir, ["1_1"])
+    prepare_args = {
+        **args,
+        "dtm_folder": None,
+        "preprocess_data_path": os.path.join(save_dir, "prepare"),
+    }
+
+    catalog_path = get_catalog_path(args)
+    prepare_path = get_catalog_path(prepare_args)
+    assert catalog_path != prepare_path
+    assert get_catalog_path(dict(args)) == catalog_path, "Stable across runs."
+
+    get_catalog(args)
+    get_catalog(prepare_args)
+    mtime = os.stat(catalog_path).st_mtime_ns
+    assert get_catalog(args)["1_1"].dtm is not None
+    assert get_catalog(prepare_args)["1_1"].dtm is None
+    assert os.stat(catalog_path).st_mtime_ns == mtime, "Catalog should be reused."
+
+
+def test_empty_tile_index():
+    """
+    Tests that tiles with a CDSM of zeros are flagged as empty.
+    """
+    clear_tmp_dir(save_dir)
+    args = create_static_data(save_dir, ["1_1", "1_2"])
+    # overwrite the CDSM of the second tile with a fully masked one
+    create_dummy_raster(os.path.join(save_dir, "cdsm"), "DO_CDSM_3m_1_2.tif", value=0.0)
+
+    catalog = get_catalog(args)
+
+    assert not catalog["1_1"].is_empty, "Tile with valid CDSM should be processed."
+    assert catalog["1_1"].valid_fraction == 1.0, "All DSM pixels of the tile are valid."
+    assert catalog["1_2"].is_empty, "Fully masked tile should be skipped."
+    assert catalog["1_2"].valid_fraction == 0.0
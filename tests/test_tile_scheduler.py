@@ -0,0 +1,230 @@
+"""
+This script tests the resource-aware scheduling of tiles.
+
+Functions:
+- test_cgroup_v2_limits: Tests that CPU and memory limits are read from cgroup v2 files.
+- test_cgroup_v1_limits: Tests that CPU and memory limits are read from cgroup v1 files.
+- test_memory_admission: Tests that tiles are only admitted when the memory headroom allows.
+- test_longest_first_order: Tests that tiles are ordered by their runtime history.
+- test_retries: Tests that failed tiles are retried and timed out tiles reported.
+- test_timeout_from_start: Tests that the time a tile waits for a worker does not count.
+- test_hung_workers: Tests that slots of timed out tiles stay busy and are not retried.
+"""
+
+import os
+import time
+from multiprocessing import Pool
+
+from src.umep_wrapper.tile_scheduler import (
+    AdaptiveTileScheduler,
+    get_cpu_limit,
+    get_memory_limit,
+    get_memory_usage,
+    order_longest_first,
+    update_runtime_history,
+)
+
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "cgroup")
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content + "\n")
+
+
+def _flaky_tile(k_v_pair):
+    """Fails on the first attempt of a tile, hangs for tile '1_3'."""
+    key, marker = k_v_pair
+    if key == "1_3":
+        time.sleep(30)
+    if not os.path.exists(marker):
+        _write(marker, key)
+        raise RuntimeError(f"first attempt of {key}")
+    return key
+
+
+def _slow_tile(k_v_pair):
+    """Sleeps for the given seconds."""
+    key, seconds = k_v_pair
+    time.sleep(seconds)
+    return key
+
+
+def test_cgroup_v2_limits():
+    """
+    Tests the parsing of cgroup v2 limits as set by docker --cpus and --memory.
+    """
+    clear_tmp_dir(save_dir)
+    _write(os.path.join(save_dir, "cpu.max"), "100000 100000")
+    _write(os.path.join(save_dir, "memory.max"), str(1024**2))
+    _write(os.path.join(save_dir, "memory.current"), str(512 * 1024))
+
+    assert get_cpu_limit(save_dir) == 1, "CPU quota of one period equals one CPU."
+    assert get_memory_limit(save_dir) == 1024**2, "Memory limit should be respected."
+    assert get_memory_usage(save_dir) == 512 * 1024, "Memory usage should be read."
+
+    _write(os.path.join(save_dir, "cpu.max"), "max 100000")
+    _write(os.path.join(save_dir, "memory.max"), "max")
+    assert get_cpu_limit(save_dir) == len(
+        os.sched_getaffinity(0)
+    ), "Without quota all visible CPUs should be used."
+    assert get_memory_limit(save_dir) > 1024**2, "Without limit, total memory is used."
+
+
+def test_cgroup_v1_limits():
+    """
+    Tests the parsing of cgroup v1 limits.
+    """
+    clear_tmp_dir(save_dir)
+    _write(os.path.join(save_dir, "cpu", "cpu.cfs_quota_us"), "100000")
+    _write(os.path.join(save_dir, "cpu", "cpu.cfs_period_us"), "100000")
+    _write(os.path.join(save_dir, "memory", "memory.limit_in_bytes"), str(2 * 1024**2))
+    _write(os.path.join(save_dir, "memory", "memory.usage_in_bytes"), "1024")
+
+    assert get_cpu_limit(save_dir) == 1
+    assert get_memory_limit(save_dir) == 2 * 1024**2
+    assert get_memory_usage(save_dir) == 1024
+
+
+def test_memory_admission():
+    """
+    Tests that the scheduler blocks further tiles when the memory is exhausted.
+    """
+    clear_tmp_dir(save_dir)
+    limit = 1024**3
+    _write(os.path.join(save_dir, "cpu.max"), "max 100000")
+    _write(os.path.join(save_dir, "memory.max"), str(limit))
+    _write(os.path.join(save_dir, "memory.current"), str(int(limit * 0.5)))
+
+    scheduler = AdaptiveTileScheduler(
+        max_processes=4, tile_memory=int(limit * 0.3), cgroup_root=save_dir
+    )
+    assert scheduler.can_admit(0), "A first tile should always be admitted."
+    assert not scheduler.can_admit(4), "No more tiles than processes."
+    assert not scheduler.can_admit(1), "Not enough memory headroom for another tile."
+
+    scheduler.update_tile_memory(int(limit * 0.01))
+    assert scheduler.tile_memory == int(
+        limit * 0.01
+    ), "First measurement should replace the initial estimate."
+    scheduler.update_tile_memory(int(limit * 0.005))
+    assert scheduler.tile_memory == int(limit * 0.01), "Maximum should be kept."
+
+
+def test_longest_first_order():
+    """
+    Tests the runtime history and the longest-job-first ordering of tiles.
+    """
+    clear_tmp_dir(save_dir)
+    log_file_path = os.path.join(save_dir, "solweig_log.log")
+    history_path = os.path.join(save_dir, "runtime_history.json")
+    with open(log_file_path, "w") as file:
+        file.write("12:00:00;1;step;tile;runtime;cpu;vmem;vmem_all;pid\n")
+        file.write("12:00:01;1;skip;1_3;-1;-1;-1;-1;42\n")
+        file.write("12:00:02;1;solweig;1_1;10.0;1;1;x;42\n")
+        file.write("12:00:03;1;solweig;1_2;100.0;1;1;x;42\n")
+
+    history = update_runtime_history(history_path, log_file_path, alpha=0.5)
+    assert history == {"solweig": {"1_1": 10.0, "1_2": 100.0}}, "Skips are ignored."
+
+    history = update_runtime_history(history_path, log_file_path, alpha=0.5)
+    assert history["solweig"]["1_1"] == 10.0, "Average of equal runtimes is unchanged."
+
+    data_dict = {
+        "1_1": {"valid_fraction": 1.0},
+        "1_2": {"valid_fraction": 1.0},
+        # no history: estimated from the valid fraction (median of 100 s per fraction)
+        "1_4": {"valid_fraction": 0.5},
+    }
+    order = [k for k, _ in order_longest_first(data_dict, history, ["solweig"])]
+    assert order == ["1_2", "1_4", "1_1"], "Longest tiles should be submitted first."
+
+
+def test_retries():
+    """
+    Tests the retries of failed tiles and the timeout of hanging tiles.
+    """
+    clear_tmp_dir(save_dir)
+    _write(os.path.join(save_dir, "cpu.max"), "max 100000")
+    _write(os.path.join(save_dir, "memory.max"), "max")
+    items = [(k, os.path.join(save_dir, f"marker_{k}")) for k in ["1_1", "1_2", "1_3"]]
+    finished = {}
+    retried = []
+
+    scheduler = AdaptiveTileScheduler(
+        max_processes=3, cgroup_root=save_dir, poll_interval=0.05
+    )
+    with Pool(processes=3) as pool:
+        results = scheduler.map(
+            pool,
+            _flaky_tile,
+            items,
+            retries=1,
+            timeout=2,
+            on_result=finished.__setitem__,
+            on_retry=retried.append,
+        )
+        pool.terminate()
+
+    assert results["1_1"] == "1_1", "Failed tile should succeed on retry."
+    assert results["1_2"] == "1_2"
+    assert isinstance(results["1_3"], TimeoutError), "Hanging tile should time out."
+    assert finished == results, "Callback should receive the final results."
+    assert sorted(retried) == ["1_1", "1_2"], "Retries renew the claims of the tiles."
+
+
+def test_timeout_from_start():
+    """
+    Tests that tiles queued behind a running tile of the single worker do not
+    time out, although their result arrives after the timeout.
+    """
+    clear_tmp_dir(save_dir)
+    _write(os.path.join(save_dir, "cpu.max"), "max 100000")
+    _write(os.path.join(save_dir, "memory.max"), "max")
+    items = [(k, 0.8) for k in ["1_1", "1_2", "1_3"]]
+
+    scheduler = AdaptiveTileScheduler(
+        max_processes=3, cgroup_root=save_dir, poll_interval=0.05
+    )
+    with Pool(processes=1) as pool:
+        results = scheduler.map(pool, _slow_tile, items, timeout=1.5)
+
+    assert results == {"1_1": "1_1", "1_2": "1_2", "1_3": "1_3"}
+    assert scheduler.hung == []
+
+
+def test_hung_workers():
+    """
+    Tests that a hanging tile keeps its slot busy, is not retried and that the
+    remaining tiles count as failed once all slots hang.
+    """
+    clear_tmp_dir(save_dir)
+    _write(os.path.join(save_dir, "cpu.max"), "max 100000")
+    _write(os.path.join(save_dir, "memory.max"), "max")
+    items = [("1_3", 30), ("1_1", 0), ("1_2", 0)]
+    finished = {}
+
+    scheduler = AdaptiveTileScheduler(
+        max_processes=1, cgroup_root=save_dir, poll_interval=0.05
+    )
+    with Pool(processes=1) as pool:
+        results = scheduler.map(
+            pool,
+            _slow_tile,
+            iter(items),
+            retries=1,
+            timeout=1,
+            on_result=finished.__setitem__,
+        )
+        assert len(scheduler.hung) == 1, "The worker of the tile still hangs."
+        pool.terminate()
+    scheduler.recycle()
+
+    assert isinstance(results["1_3"], TimeoutError), "Not retried on the same pool."
+    assert isinstance(results["1_1"], RuntimeError), "No worker is left for the tile."
+    assert isinstance(results["1_2"], RuntimeError), "Items not yet taken count too."
+    assert finished == results, "Callback should receive every tile."
+    assert scheduler.hung == []
@@ -0,0 +1,120 @@
+"""
+This script tests the tiling metadata and the tiling tuner.
+
+Functions:
+- test_read_tiling: Tests that the tiling is derived from the tiles, stored and read.
+- test_check_tilings: Tests that tile folders with different tilings are rejected.
+- test_tune_tiling: Tests the ranking of tilings under the memory limit.
+"""
+
+import os
+
+import numpy as np
+import pytest
+from osgeo import gdal
+
+from src.umep_wrapper.tiling import (
+    TILING_FILE,
+    Tiling,
+    check_tilings,
+    read_tiling,
+    write_tiling,
+)
+from src.umep_wrapper.tiling_tuner import (
+    get_candidates,
+    get_tile_windows,
+    tune_tiling,
+)
+
+from .test_utils import clear_tmp_dir, write_raster
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "tiling")
+
+
+def _write_tiles(folder, size, overlap, shape=(2, 3)):
+    """Writes a grid of tiles with the given tiling, the last column is cut."""
+    stride = size - overlap
+    for y in range(shape[0]):
+        for x in range(shape[1]):
+            xsize = size if x < shape[1] - 1 else size // 2
+            write_raster(
+                os.path.join(folder, f"DSM_3m_{y + 1}_{x + 1}.tif"),
+                np.ones((size, xsize), dtype=np.float32),
+                xoff=x * stride,
+                yoff=y * stride,
+            )
+
+
+def test_read_tiling():
+    """
+    Tests the tiling of a folder whose name does not follow the naming pattern.
+    """
+    clear_tmp_dir(save_dir)
+    folder = os.path.join(save_dir, "dsm")
+    _write_tiles(folder, 100, 20)
+
+    tiling = read_tiling(folder)
+    assert tiling == Tiling(resolution=3.0, size=100, overlap=20)
+    assert tiling.stride == 80
+    assert (tiling.resolution_label, tiling.size_label) == ("3m", "100+20")
+    assert os.path.exists(os.path.join(folder, TILING_FILE)), "Derived once."
+
+    write_tiling(folder, Tiling(resolution=3.0, size=100, overlap=30))
+    assert os.path.exists(os.path.join(folder, TILING_FILE))
+    assert read_tiling(folder).overlap == 30, "Metadata takes precedence."
+
+
+def test_check_tilings():
+    """
+    Tests that DSM and DTM folders have to share resolution, size and overlap.
+    """
+    clear_tmp_dir(save_dir)
+    _write_tiles(os.path.join(save_dir, "dsm"), 100, 20)
+    _write_tiles(os.path.join(save_dir, "dtm"), 100, 20)
+    _write_tiles(os.path.join(save_dir, "lc"), 100, 40)
+
+    tiling = check_tilings(save_dir, {"DSM": "dsm", "DTM": "dtm", "LC": None})
+    assert tiling.size_label == "100+20"
+    with pytest.raises(RuntimeError):
+        check_tilings(save_dir, {"DSM": "dsm", "LC": "lc"})
+
+
+def test_tune_tiling():
+    """
+    Tests the tile windows of a mosaic and the ranking of the candidate tilings.
+    """
+    clear_tmp_dir(save_dir)
+    valid = np.zeros((360, 360), dtype=bool)
+    valid[:200, :200] = True
+    windows = get_tile_windows(valid, Tiling(resolution=3.0, size=200, overlap=40))
+    assert sorted(windows) == ["1_1", "1_2", "2_1", "2_2"], "Empty tiles are dropped."
+    assert windows["1_2"][:4] == (160, 0, 200, 200)
+    assert windows["2_2"][4] == pytest.approx(40 * 40 / 200**2)
+
+    args = {"output_path": save_dir, "met_file": "metfile.txt"}
+    for name in ["dsm", "cdsm", "dtm"]:
+        args[name] = os.path.join(save_dir, f"{name}.tif")
+        write_raster(args[name], np.full((360, 360), 10.0, dtype=np.float32))
+
+    def measure(stage_args, data_dict, process_path):
+        """Runtime grows with the pixels of a tile, memory even faster."""
+        tile_dsm = os.path.join(
+            stage_args["data_path"], "dsm_tiles", next(iter(data_dict.values()))["dsm"]
+        )
+        size = gdal.Open(tile_dsm).RasterXSize
+        assert read_tiling(os.path.dirname(tile_dsm)).size == size, "Full tiles."
+        return {
+            "svf": {"duration": size**2 / 1e4, "peak_rss": size**2},
+            "solweig": {"duration": size**2 / 1e4 + 4, "peak_rss": size**3},
+        }
+
+    candidates = get_candidates([100, 200, 300], [40, 60])
+    assert Tiling(None, 100, 60) not in candidates, "Overlap has to be below half."
+
+    ranked = tune_tiling(args, candidates, 4, 300**3, samples=1, measure=measure)
+    assert [(r["size"], r["overlap"]) for r in ranked][:2] == [(200, 40), (200, 60)]
+    assert ranked[0]["hour_seconds"] == 16, "Two waves of three tiles."
+    small = next(r for r in ranked if r["size"] == 100)
+    assert small["parallel"] == 4 and small["tiles"] == 36
+    large = next(r for r in ranked if r["size"] == 300)
+    assert large["parallel"] == 1, "Only one large tile fits into the memory."
@@ -0,0 +1,85 @@
+"""
+This script tests the structured tracing of the tile stages.
+
+Functions:
+- test_trace_stage: Tests that a traced stage appends a complete record.
+- test_summarize_trace: Tests the summary of a run with its critical path.
+"""
+
+import os
+
+import pytest
+
+from src.umep_wrapper.tracing import (
+    format_summary,
+    read_trace,
+    reset_trace,
+    summarize_trace,
+    trace_stage,
+)
+
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "trace")
+
+
+def _record(tile, step, timestamp, duration, pid=1):
+    return {
+        "step": step,
+        "tile": tile,
+        "host": "host",
+        "pid": pid,
+        "timestamp": timestamp,
+        "duration": duration,
+        "cpu_time": duration / 2,
+        "peak_rss": 1024**2,
+    }
+
+
+def test_trace_stage():
+    """
+    Tests the fields of a traced stage, also for a failing stage.
+    """
+    clear_tmp_dir(save_dir)
+    trace_path = reset_trace(save_dir)
+
+    with trace_stage(trace_path, "solweig", "1_1") as record:
+        data = bytearray(16 * 1024**2)
+        record["skipped"] = False
+    with pytest.raises(RuntimeError):
+        with trace_stage(trace_path, "solweig", "1_2"):
+            raise RuntimeError("failed")
+
+    first, second = read_trace([trace_path])
+    assert first["tile"] == "1_1" and first["pid"] == os.getpid()
+    assert first["end"] >= first["start"], "Monotonic times should be recorded."
+    assert first["peak_rss"] >= len(data), "Peak RSS should cover the allocation."
+    assert first["cpu_time"] >= 0 and first["skipped"] is False
+    assert "error" not in first
+    assert second["error"] == "RuntimeError('failed')", "Failures are recorded."
+
+
+def test_summarize_trace():
+    """
+    Tests the totals, the slowest tiles and the critical path of a run.
+    """
+    records = [
+        _record("1_1", "wall", 0.0, 1.0, pid=1),
+        _record("1_2", "wall", 0.0, 2.0, pid=2),
+        _record("1_1", "svf", 1.0, 5.0, pid=1),
+        _record("1_2", "svf", 2.0, 2.0, pid=2),
+        _record("1_1", "solweig", 6.0, 4.0, pid=2),
+    ]
+    summary = summarize_trace(records, top=1)
+
+    assert summary["span"] == 10.0
+    assert summary["steps"]["svf"]["count"] == 2
+    assert summary["steps"]["svf"]["max"] == 5.0
+    assert summary["slowest"] == [("1_1", 10.0)], "Tiles are ranked by total time."
+    assert [(r["tile"], r["step"]) for r in summary["path"]] == [
+        ("1_1", "wall"),
+        ("1_1", "svf"),
+        ("1_1", "solweig"),
+    ], "Critical path follows the stages of the last tile."
+    assert summary["workers"]["host:1"]["utilization"] == pytest.approx(0.3)
+    assert "Critical path:" in format_summary(summary)
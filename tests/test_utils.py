@@ -8,7 +8,11 @@ Functions:
 - create_dummy_metfile_dayswitch
 - create_dummy_raster
 - create_preprocessed_folder
+- create_static_data
 - create_dummy_city_means
+- create_dummy_boundary
+- get_projection
+- write_raster
 """
 
 import json
@@ -22,8 +26,13 @@ MET_HEADER = "iy id it imin qn qh qe qs qf U RH Tair pres rain kdown snow ldown
 MET_DUMMY_OBS = "-999 -999 -999 -999 -999 10.0 10.0 10.0 -999 0.0 10.0 -999 -999 -999 -999 -999 -999 10.0 10.0 -999"
 
 
+# origin and resolution of the test grid in EPSG:25832
+ORIGIN = (390000.0, 5710000.0)
+RES = 3.0
+
 gdal.UseExceptions()
 
+
 def clear_tmp_dir(save_dir):
     """Clears all existing files from the given save_dir."""
     # Clear Output Dir
@@ -161,6 +170,28 @@ def create_preprocessed_folder(save_dir, tile_id):
     create_dummy_raster(tile_dir, f"wall_height_{tile_id}.tif")
 
 
+def create_static_data(save_dir, tile_ids, preprocessed=False):
+    """
+    Creates DSM, CDSM and DTM tiles (and optionally preprocessed tiles) with the
+    given tile ids, returns the matching run arguments.
+    """
+    for tile_id in tile_ids:
+        create_dummy_raster(os.path.join(save_dir, "dsm"), f"DO_DSM_3m_{tile_id}.tif")
+        create_dummy_raster(os.path.join(save_dir, "cdsm"), f"DO_CDSM_3m_{tile_id}.tif")
+        create_dummy_raster(os.path.join(save_dir, "dtm"), f"DO_DTM_3m_{tile_id}.tif")
+        if preprocessed:
+            create_preprocessed_folder(os.path.join(save_dir, "preprocessed"), tile_id)
+
+    return {
+        "data_path": save_dir,
+        "dsm_folder": "dsm",
+        "cdsm_folder": "cdsm",
+        "dtm_folder": "dtm",
+        "lc_folder": None,
+        "preprocess_data_path": os.path.join(save_dir, "preprocessed"),
+    }
+
+
 def create_dummy_city_means(save_dir, filename):
     """Creates a dummy city means file which could be a result from an ICON-D2 download."""
     header = "time,10u,10v,2r,2t,ASOB_S,ASWDIFD_S,ASWDIR_S,tp,wind_dir,wind_speed\n"
@@ -172,3 +203,49 @@ def create_dummy_city_means(save_dir, filename):
         for i, hour in enumerate(hours):
             row_dummy = f"2024-08-{day[i]} {hour}:00:00,1.0,1.0,1.0,1.0,1.0,1.0,1.0,1.0,1.0,1.0\n"
             file.write(row_dummy)
+
+
+def create_dummy_boundary(path, corners, origin, res=3.0):
+    """Creates a GeoJSON polygon in EPSG:25832 from corners given in pixels."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    coordinates = [[origin[0] + x * res, origin[1] - y * res] for x, y in corners]
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "type": "FeatureCollection",
+                "crs": {
+                    "type": "name",
+                    "properties": {"name": "urn:ogc:def:crs:EPSG::25832"},
+                },
+                "features": [
+                    {
+                        "type": "Feature",
+                        "properties": {},
+                        "geometry": {"type": "Polygon", "coordinates": [coordinates]},
+                    }
+                ],
+            },
+            f,
+        )
+
+
+def get_projection():
+    """Returns the WKT of EPSG:25832."""
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(25832)
+    return srs.ExportToWkt()
+
+
+def write_raster(path, array, nodata=-9999, xoff=0, yoff=0):
+    """Writes an array as raster on the test grid, offset by the given pixels."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ds = gdal.GetDriverByName("GTiff").Create(
+        path, array.shape[1], array.shape[0], 1, gdal.GDT_Float32
+    )
+    ds.SetProjection(get_projection())
+    ds.SetGeoTransform(
+        [ORIGIN[0] + xoff * RES, RES, 0, ORIGIN[1] - yoff * RES, 0, -RES]
+    )
+    ds.GetRasterBand(1).WriteArray(array)
+    ds.GetRasterBand(1).SetNoDataValue(nodata)
+    ds = None
@@ -0,0 +1,95 @@
+"""
+This script tests the pre-rendering of the XYZ web map tiles.
+
+Functions:
+- test_colormap: Tests the mapping of values and classes to palette indices.
+- test_render_tiles: Tests that only changed tiles are written and empty tiles are removed.
+"""
+
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+from src.umep_wrapper.web_tiles import (
+    MANIFEST_FILE,
+    TRANSPARENT,
+    get_colormap,
+    get_tile_range,
+    render_tiles,
+)
+
+from .test_utils import ORIGIN, RES, clear_tmp_dir, get_projection
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "web_tiles")
+
+ZOOMS = [13, 14]
+
+
+def test_colormap():
+    """
+    Tests that classes keep their index, values are clipped to the colormap and
+    NoData is transparent.
+    """
+    classes = get_colormap("UTCI-class")
+    assert classes.is_class
+    assert classes.quantize(np.array([0.0, 5.0, 9.0, np.nan])).tolist() == [
+        0,
+        5,
+        9,
+        TRANSPARENT,
+    ]
+    assert len(classes.palette) == 256 * 3
+
+    utci = get_colormap("UTCI")
+    assert not utci.is_class
+    indices = utci.quantize(np.array([-60.0, -40.0, 5.0, 60.0, np.nan]))
+    assert indices.tolist() == [0, 0, 127, 253, TRANSPARENT]
+    assert get_colormap("RH") is None
+
+
+def test_render_tiles():
+    """
+    Tests a second render of an hour, a change in the east and values removed in
+    the east.
+    """
+    clear_tmp_dir(save_dir)
+    geotransform = (ORIGIN[0], RES, 0.0, ORIGIN[1], 0.0, -RES)
+    values = np.full((2000, 2000), 6.0, dtype=np.float32)
+    values[:, :100] = np.nan
+
+    with Pool(2) as pool:
+        render = lambda values: render_tiles(
+            "UTCI-class", values, geotransform, get_projection(), save_dir, pool, ZOOMS
+        )
+        first = render(values)
+        assert first["written"] > 0 and first["removed"] == 0
+        assert render(values) == {
+            "written": 0,
+            "removed": 0,
+            "unchanged": first["written"],
+        }, "Nothing changed since the previous hour."
+
+        values[:, 1500:] = 8.0
+        changed = render(values)
+        assert 0 < changed["written"] < first["written"]
+
+        values[:, 1000:] = np.nan
+        removed = render(values)
+        assert removed["removed"] > 0
+
+    with open(os.path.join(save_dir, "UTCI-class", MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    assert manifest["zooms"] == ZOOMS
+    x0, x1, y0, y1 = get_tile_range(geotransform, 2000, 2000, get_projection(), 14)
+    for key in manifest["tiles"]:
+        assert os.path.exists(os.path.join(save_dir, "UTCI-class", key + ".png"))
+    zoom14 = [key for key in manifest["tiles"] if key.startswith("14/")]
+    assert 0 < len(zoom14) <= (x1 - x0 + 1) * (y1 - y0 + 1)
+
+    image = Image.open(os.path.join(save_dir, "UTCI-class", zoom14[0] + ".png"))
+    assert image.mode == "P" and image.size == (256, 256)
+    indices = np.array(image)
+    assert set(np.unique(indices)) <= {6, TRANSPARENT}
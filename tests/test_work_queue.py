@@ -0,0 +1,215 @@
+"""
+This script tests the work queues distributing the tiles of a run across hosts.
+
+Functions:
+- test_local_queue: Tests the in-process queue.
+- test_sqlite_queue: Tests that hosts sharing a SQLite queue claim every tile once.
+- test_sqlite_claim_owner: Tests the lease renewal and that only the owner completes.
+- test_redis_queue: Tests the Redis queue with a local stand-in client.
+- test_redis_claim_once: Tests that duplicates and expired claims go to one host.
+"""
+
+import os
+import time
+
+from src.umep_wrapper.work_queue import (
+    LocalQueue,
+    RedisQueue,
+    SQLiteQueue,
+    get_work_queue,
+)
+
+from .test_utils import clear_tmp_dir
+
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp", "queue")
+TILES = ["1_1", "1_2", "2_1"]
+
+
+class StandInRedis:
+    """Minimal in-memory stand-in for the Redis commands used by RedisQueue."""
+
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(key)
+
+    def hsetnx(self, name, key, value):
+        if key in self.data.get(name, {}):
+            return 0
+        self.hset(name, key, value)
+        return 1
+
+    def rpush(self, name, *values):
+        self.data.setdefault(name, []).extend(v.encode() for v in values)
+        return len(self.data[name])
+
+    def lpop(self, name):
+        values = self.data.get(name)
+        return values.pop(0) if values else None
+
+    def hset(self, name, key, value):
+        self.data.setdefault(name, {})[key] = value
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def hdel(self, name, key):
+        return int(self.data.get(name, {}).pop(key, None) is not None)
+
+    def delete(self, *names):
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+
+def _drain(queue, run_key, worker_id):
+    """Claims and completes all tiles of a run, returns the claimed tiles."""
+    claimed = []
+    while (tile_id := queue.claim(run_key, worker_id)) is not None:
+        claimed.append(tile_id)
+        queue.complete(run_key, tile_id, worker_id)
+    return claimed
+
+
+def test_local_queue():
+    """
+    Tests the order of the in-process queue and the tile data of the iterator.
+    """
+    queue = get_work_queue()
+    assert isinstance(queue, LocalQueue)
+    assert queue.put("run", TILES) == 3
+    assert queue.put("run", TILES) == 0, "A run is only enqueued once."
+
+    data_dict = {"1_1": "a", "1_2": "b"}
+    items = list(queue.iter_tiles("run", data_dict, "host_a"))
+    assert items == [("1_1", "a"), ("1_2", "b")], "Unknown tiles should be skipped."
+    queue.reset("run")
+    assert queue.put("run", TILES) == 3, "Reset runs are enqueued again."
+
+
+def test_sqlite_queue():
+    """
+    Tests that two hosts share the tiles of a run, that expired claims return and
+    that enqueueing again re-queues failed tiles and expired claims.
+    """
+    clear_tmp_dir(save_dir)
+    url = f"sqlite://{os.path.join(save_dir, 'queue.sqlite')}"
+    host_a = get_work_queue(url)
+    host_b = get_work_queue(url)
+    assert isinstance(host_a, SQLiteQueue)
+
+    assert host_a.put("run", TILES) == 3
+    assert host_b.put("run", TILES) == 0, "Second host should join the run."
+    assert host_a.claim("run", "host_a") == "1_1", "Tiles are claimed in order."
+    assert _drain(host_b, "run", "host_b") == ["1_2", "2_1"]
+    assert host_a.claim("run", "host_a") is None
+
+    # host_a died while computing 1_1
+    expired = SQLiteQueue(host_a.db_path, lease=0)
+    time.sleep(0.01)
+    assert expired.claim("run", "host_b") == "1_1", "Expired claims are taken over."
+    expired.complete("run", "1_1", "host_b")
+    assert expired.claim("run", "host_b") is None, "Done tiles are not claimed."
+
+    # the hour is invoked again, 1_1 failed and host_b died while computing 1_2
+    assert host_a.put("run2", TILES) == 3
+    host_a.complete("run2", host_a.claim("run2", "host_a"), "host_a", failed=True)
+    assert host_b.claim("run2", "host_b") == "1_2"
+    assert _drain(host_a, "run2", "host_a") == ["2_1"]
+    assert host_a.put("run2", TILES) == 1, "Only the failed tile is re-queued."
+    assert expired.put("run2", TILES) == 1, "The expired claim is re-queued."
+    assert _drain(host_a, "run2", "host_a") == ["1_1", "1_2"]
+    assert host_a.put("run2", TILES) == 0, "Done tiles are not re-queued."
+    host_a.reset("run2")
+    assert host_a.put("run2", TILES) == 3, "Reset runs are enqueued again."
+
+
+def test_sqlite_claim_owner():
+    """
+    Tests that a renewed claim is not taken over and that a host whose claim was
+    taken over cannot complete the tile.
+    """
+    clear_tmp_dir(save_dir)
+    db_path = os.path.join(save_dir, "queue.sqlite")
+    host_a = SQLiteQueue(db_path, lease=0.5)
+    host_b = SQLiteQueue(db_path, lease=0.5)
+    host_a.put("run", ["1_1"])
+
+    assert host_a.claim("run", "host_a") == "1_1"
+    time.sleep(0.3)
+    assert host_a.renew("run", "1_1", "host_a"), "The retry renews the lease."
+    time.sleep(0.3)
+    assert host_b.claim("run", "host_b") is None, "Renewed claim did not expire."
+    assert not host_b.renew("run", "1_1", "host_b")
+
+    time.sleep(0.6)
+    assert host_b.claim("run", "host_b") == "1_1", "Expired claims are taken over."
+    assert not host_a.complete("run", "1_1", "host_a", failed=True)
+    assert not host_a.renew("run", "1_1", "host_a")
+    assert host_b.complete("run", "1_1", "host_b")
+    assert host_a.put("run", ["1_1"]) == 0, "The late failure is not recorded."
+
+
+def test_redis_queue():
+    """
+    Tests the Redis queue against a stand-in client, also enqueueing again.
+    """
+    client = StandInRedis()
+    host_a = RedisQueue(client)
+    host_b = RedisQueue(client)
+
+    assert host_a.put("run", TILES) == 3
+    assert host_b.put("run", TILES) == 0, "Second host should join the run."
+    assert host_a.claim("run", "host_a") == "1_1"
+    assert _drain(host_b, "run", "host_b") == ["1_2", "2_1"]
+    assert host_b.claim("run", "host_b") is None, "Claim of 1_1 did not expire."
+
+    expired = RedisQueue(client, lease=-1)
+    assert expired.claim("run", "host_b") == "1_1", "Expired claims are taken over."
+    expired.complete("run", "1_1", "host_b")
+    assert expired.claim("run", "host_b") is None
+
+    # the hour is invoked again, 1_2 failed and host_b died while computing it
+    client.hset("solweig:run:status", "1_2", "failed")
+    assert host_a.put("run", TILES) == 1, "Only the failed tile is re-queued."
+    assert host_b.put("run", TILES) == 0
+    assert host_b.claim("run", "host_b") == "1_2"
+    assert host_a.put("run", TILES) == 0, "The claim of 1_2 did not expire."
+    assert expired.put("run", TILES) == 1, "The expired claim is re-queued."
+    assert host_b.put("run", ["1_2"]) == 0
+    assert _drain(host_a, "run", "host_a") == ["1_2"]
+    assert host_a.put("run", TILES) == 0, "Done tiles are not re-queued."
+    host_a.reset("run")
+    assert host_a.put("run", TILES) == 3, "Reset runs are enqueued again."
+
+
+def test_redis_claim_once():
+    """
+    Tests that a tile pushed twice, an expired claim taken over by two hosts and a
+    late completion of the previous owner hand the tile to a single host.
+    """
+    client = StandInRedis()
+    host_a = RedisQueue(client)
+    host_b = RedisQueue(client)
+    host_a.put("run", ["1_1"])
+    # both hosts enqueued the new tile at the same time
+    client.rpush("solweig:run:pending", "1_1")
+
+    assert host_a.claim("run", "host_a") == "1_1"
+    assert host_b.claim("run", "host_b") is None, "The duplicate is skipped."
+    assert host_a.renew("run", "1_1", "host_a")
+    assert not host_b.renew("run", "1_1", "host_b")
+
+    # host_a hangs, host_c read its expired claim before host_b took it over
+    outdated = client.hgetall("solweig:run:claimed")
+    assert RedisQueue(client, lease=-1).claim("run", "host_b") == "1_1"
+    stale_client = StandInRedis()
+    stale_client.data = client.data
+    stale_client.hgetall = lambda name: outdated
+    expired_c = RedisQueue(stale_client, lease=-1)
+    assert expired_c.claim("run", "host_c") is None, "Only one host takes over."
+    assert not host_a.complete("run", "1_1", "host_a", failed=True)
+    assert host_b.complete("run", "1_1", "host_b")
+
+    client.rpush("solweig:run:pending", "1_1")
+    assert host_a.claim("run", "host_a") is None, "Done tiles are not claimed."
+    assert client.hgetall("solweig:run:claimed") == {}